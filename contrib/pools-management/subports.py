@@ -15,6 +15,8 @@
 import argparse
 from http import client as httplib
 import socket
+import sys
+import time
 
 from oslo_serialization import jsonutils
 
@@ -36,30 +38,103 @@ class UnixDomainHttpConnection(httplib.HTTPConnection):
         self.sock = sock
 
 
-def create_subports(num_ports, trunk_ips, timeout=180):
-    method = 'POST'
-    body = jsonutils.dumps({"trunks": trunk_ips, "num_ports": num_ports})
-    headers = {'Content-Type': 'application/json', 'Connection': 'close'}
-    headers['Content-Length'] = len(body)
-    path = 'http://localhost{0}'.format(constants.VIF_POOL_POPULATE)
-    socket_path = constants.MANAGER_SOCKET_FILE
-    conn = UnixDomainHttpConnection(socket_path, timeout)
-    conn.request(method, path, body=body, headers=headers)
-    resp = conn.getresponse()
-    print(resp.read())
+JOB_FINISHED = ('done', 'failed', 'cancelled')
+JOB_POLL_INTERVAL = 2
 
 
-def delete_subports(trunk_ips, timeout=180):
-    method = 'POST'
-    body = jsonutils.dumps({"trunks": trunk_ips})
+def _request(method, endpoint, params, timeout):
+    body = jsonutils.dumps(params)
     headers = {'Content-Type': 'application/json', 'Connection': 'close'}
     headers['Content-Length'] = len(body)
-    path = 'http://localhost{0}'.format(constants.VIF_POOL_FREE)
+    path = 'http://localhost{0}'.format(endpoint)
     socket_path = constants.MANAGER_SOCKET_FILE
     conn = UnixDomainHttpConnection(socket_path, timeout)
     conn.request(method, path, body=body, headers=headers)
     resp = conn.getresponse()
-    print(resp.read())
+    return resp.read().decode()
+
+
+def _load_job(response):
+    try:
+        return jsonutils.loads(response)
+    except ValueError:
+        # Errors are returned as plain text
+        print(response)
+        sys.exit(1)
+
+
+def _print_job(job):
+    print('Job {0} ({1}): {2}'.format(job['id'], job['action'],
+                                      job['status']))
+    for trunk_ip, trunk in sorted(job['trunks'].items()):
+        line = '  {0}: {1}'.format(trunk_ip, trunk['status'])
+        if 'total' in trunk:
+            line += ', {0}/{1} ports freed'.format(
+                trunk['ports'], trunk['total'])
+        elif 'ports' in trunk:
+            line += ', {0} ports created'.format(trunk['ports'])
+        if 'error' in trunk:
+            line += ', {0}'.format(trunk['error'])
+        print(line)
+
+
+def _wait_job(job, timeout):
+    """Polls the status of the job until it finishes or the timeout expires.
+
+    Only the finished trunks are printed while the job runs, and the full
+    status of the job once it finished.
+    """
+    deadline = time.time() + timeout
+    reported = set()
+    while job['status'] not in JOB_FINISHED:
+        for trunk_ip, trunk in sorted(job['trunks'].items()):
+            if trunk_ip not in reported and trunk['status'] in JOB_FINISHED:
+                reported.add(trunk_ip)
+                print('{0}: {1}'.format(trunk_ip, trunk['status']))
+        if time.time() >= deadline:
+            print('Timed out waiting for job {0}, check its status with: '
+                  'subports.py status --job {0}'.format(job['id']))
+            return
+        time.sleep(JOB_POLL_INTERVAL)
+        job = _load_job(_request('GET', constants.VIF_POOL_JOBS,
+                                 {"job_id": job['id']}, timeout))
+    _print_job(job)
+
+
+def create_subports(num_ports, trunk_ips, timeout=180, wait=True):
+    job = _load_job(_request(
+        'POST', constants.VIF_POOL_JOBS,
+        {"action": "populate", "trunks": trunk_ips, "num_ports": num_ports},
+        timeout))
+    if wait:
+        _wait_job(job, timeout)
+    else:
+        _print_job(job)
+
+
+def delete_subports(trunk_ips, timeout=180, wait=True):
+    job = _load_job(_request('POST', constants.VIF_POOL_JOBS,
+                             {"action": "free", "trunks": trunk_ips},
+                             timeout))
+    if wait:
+        _wait_job(job, timeout)
+    else:
+        _print_job(job)
+
+
+def show_jobs(job_id=None, timeout=180):
+    params = {"job_id": job_id} if job_id else {}
+    jobs = _load_job(_request('GET', constants.VIF_POOL_JOBS, params,
+                              timeout))
+    if job_id:
+        jobs = [jobs]
+    for job in jobs:
+        _print_job(job)
+
+
+def cancel_job(job_id, timeout=180):
+    _print_job(_load_job(_request('POST', constants.VIF_POOL_CANCEL,
+                                  {"job_id": job_id}, timeout)))
 
 
 def list_pools(timeout=180):
@@ -114,6 +189,11 @@ def _get_parser():
         dest='timeout',
         default=180,
         type=int)
+    create_ports_parser.add_argument(
+        '--no-wait',
+        help='return once the job is started instead of waiting for it',
+        dest='wait',
+        action='store_false')
 
     delete_ports_parser = subparser.add_parser(
         'free',
@@ -129,6 +209,40 @@ def _get_parser():
         dest='timeout',
         default=180,
         type=int)
+    delete_ports_parser.add_argument(
+        '--no-wait',
+        help='return once the job is started instead of waiting for it',
+        dest='wait',
+        action='store_false')
+
+    status_parser = subparser.add_parser(
+        'status',
+        help='Show the status of the create and free jobs')
+    status_parser.add_argument(
+        '--job',
+        help='id of the job to show. All the jobs are shown if not set',
+        dest='job_id')
+    status_parser.add_argument(
+        '-t', '--timeout',
+        help='set timeout for operation. Default is 180 sec',
+        dest='timeout',
+        default=180,
+        type=int)
+
+    cancel_parser = subparser.add_parser(
+        'cancel',
+        help='Cancel a create or free job, skipping the trunks not started')
+    cancel_parser.add_argument(
+        '--job',
+        help='id of the job to cancel',
+        dest='job_id',
+        required=True)
+    cancel_parser.add_argument(
+        '-t', '--timeout',
+        help='set timeout for operation. Default is 180 sec',
+        dest='timeout',
+        default=180,
+        type=int)
 
     list_pools_parser = subparser.add_parser(
         'list',
@@ -174,9 +288,13 @@ def main():
     parser = _get_parser()
     args = parser.parse_args()
     if args.command == 'create':
-        create_subports(args.num, args.subports, args.timeout)
+        create_subports(args.num, args.subports, args.timeout, args.wait)
     elif args.command == 'free':
-        delete_subports(args.subports, args.timeout)
+        delete_subports(args.subports, args.timeout, args.wait)
+    elif args.command == 'status':
+        show_jobs(args.job_id, args.timeout)
+    elif args.command == 'cancel':
+        cancel_job(args.job_id, args.timeout)
     elif args.command == 'list':
         list_pools(args.timeout)
     elif args.command == 'show':
@@ -16,17 +16,20 @@
 from functools import partial
 import ipaddress
 import os
+import time
 
 from kuryr.lib import utils
 from openstack import connection
 from openstack import exceptions as os_exc
 from openstack.network.v2 import port as os_port
+from openstack.network.v2 import security_group_rule as os_sgr
 from openstack.network.v2 import trunk as os_trunk
 from openstack import resource as os_resource
 from openstack import utils as os_utils
 
 from kuryr_kubernetes import config
 from kuryr_kubernetes import k8s_client
+from kuryr_kubernetes import metrics
 from kuryr_kubernetes.pod_resources import client as pr_client
 
 _clients = {}
@@ -107,6 +110,14 @@ def _create_ports(self, payload):
     return (os_port.Port(**item) for item in response.json()['ports'])
 
 
+def _create_security_group_rules(self, payload):
+    """bulk create security group rules using openstacksdk module"""
+    response = self.post(os_sgr.SecurityGroupRule.base_path, json=payload)
+    os_exc.raise_from_response(response)
+    return (os_sgr.SecurityGroupRule(**item)
+            for item in response.json()['security_group_rules'])
+
+
 def _add_trunk_subports(self, trunk, subports):
     """Set sub_ports on trunk
 
@@ -135,6 +146,16 @@ def _delete_trunk_subports(self, trunk, subports):
     return trunk
 
 
+def _observe_request(self, request, url, method, *args, **kwargs):
+    """Records the duration of the requests of openstacksdk proxies"""
+    start = time.time()
+    try:
+        return request(url, method, *args, **kwargs)
+    finally:
+        metrics.observe_openstack_request(self.service_type, method, url,
+                                          time.time() - start)
+
+
 def handle_neutron_errors(method, *args, **kwargs):
     """Handle errors on openstacksdk router methods"""
     result = method(*args, **kwargs)
@@ -162,10 +183,14 @@ def setup_openstacksdk():
         session=session,
         region_name=getattr(config.CONF.neutron, 'region_name', None))
     conn.network.create_ports = partial(_create_ports, conn.network)
+    conn.network.create_security_group_rules = partial(
+        _create_security_group_rules, conn.network)
     conn.network.add_trunk_subports = partial(_add_trunk_subports,
                                               conn.network)
     conn.network.delete_trunk_subports = partial(_delete_trunk_subports,
                                                  conn.network)
+    for proxy in (conn.network, conn.load_balancer):
+        proxy.request = partial(_observe_request, proxy, proxy.request)
     _clients[_OPENSTACKSDK] = conn
 
 
@@ -168,6 +168,75 @@ k8s_opts = [
                       'too high, Kuryr will take longer to reconnect when K8s '
                       'API stream was being silently broken.'),
                default=60),
+    cfg.IntOpt('watch_resync_period',
+               help=_('Time (in seconds) after which the watched K8s '
+                      'resources are listed again, to handle the changes '
+                      'that might have been missed by the watch. Only the '
+                      'changed resources are processed again. Set to 0 to '
+                      'disable the periodic resync.'),
+               min=0,
+               default=600),
+    cfg.BoolOpt('use_http2',
+                help=_('Use HTTP/2 to communicate with K8s API, so that the '
+                       'concurrent requests share a few connections. '
+                       'Requires the httpx library with HTTP/2 support.'),
+                default=False),
+    cfg.StrOpt('json_backend',
+               help=_('Library used to decode the events streamed by the K8s '
+                      'API watches. "auto" picks the fastest one installed '
+                      'among orjson and ujson, falling back to the standard '
+                      'json module.'),
+               choices=['auto', 'orjson', 'ujson', 'json'],
+               default='auto'),
+    cfg.FloatOpt('annotation_batch_window',
+                 help=_('Time (in seconds) the annotation of a K8s resource '
+                        'is delayed to merge it with the other annotations '
+                        'of that resource into a single PATCH request. '
+                        'Annotations pushed while a PATCH of the resource is '
+                        'in progress are always merged.'),
+                 min=0,
+                 default=0),
+    cfg.BoolOpt('watch_cache',
+                help=_('Keep a local cache of the watched K8s resources. The '
+                       'cache is seeded with a LIST of each watched resource '
+                       'and updated with the watch events, and it is used '
+                       'to look up objects instead of querying K8s API.'),
+                default=True),
+    cfg.IntOpt('event_workers',
+               help=_('Maximum number of K8s events the controller handles '
+                      'concurrently. Events of the same K8s object are '
+                      'always handled one after another.'),
+               min=1,
+               default=100),
+    cfg.DictOpt('event_workers_per_kind',
+                help=_('Maximum number of events of a K8s resource kind '
+                       'handled concurrently, in a form of '
+                       '<Kind>:<number>, so that a burst of events of a kind '
+                       'cannot use all the event_workers. Kinds not listed '
+                       'are only limited by event_workers. The handlers of '
+                       'the kinds waiting for other resources, e.g. Pods '
+                       'for the network of their namespace, keep their '
+                       'workers while retrying, so the quotas of those '
+                       'should add up to less than event_workers.'),
+                default={'Pod': '30', 'Endpoints': '20',
+                         'EndpointSlice': '20', 'NetworkPolicy': '10'}),
+    cfg.FloatOpt('endpoints_quiet_period',
+                 help=_('Time in seconds an Endpoints or EndpointSlice '
+                        'object has to remain unchanged before a '
+                        'modification of it is handled, so that a burst of '
+                        'changes, e.g. during a rolling update, results in '
+                        'a single load balancer '
+                        'reconciliation. 0 handles the modifications right '
+                        'away.'),
+                 min=0,
+                 default=0),
+    cfg.FloatOpt('endpoints_max_delay',
+                 help=_('Maximum time in seconds a modification of an '
+                        'Endpoints or EndpointSlice object is delayed by '
+                        'endpoints_quiet_period while the object keeps '
+                        'changing.'),
+                 min=0,
+                 default=10),
     cfg.ListOpt('enabled_handlers',
                 help=_("The comma-separated handlers that should be "
                        "registered for watching in the pipeline."),
@@ -180,6 +249,27 @@ k8s_opts = [
     cfg.PortOpt('controller_ha_elector_port',
                 help=_('Port on which leader-elector pod is listening to.'),
                 default=16401),
+    cfg.BoolOpt('controller_sharding',
+                help=_('Run the kuryr-controller replicas active/active. '
+                       'The nodes are split among the replicas with a '
+                       'consistent hash ring of their names, and each '
+                       'replica handles the pods and the ports pools of its '
+                       'nodes, while the other resources are handled by a '
+                       'single replica. The replicas are tracked with a '
+                       'Lease object each. Cannot be combined with '
+                       'controller_ha.'),
+                default=False),
+    cfg.StrOpt('controller_sharding_namespace',
+               help=_('Namespace of the Lease objects of the sharded '
+                      'kuryr-controller replicas.'),
+               default='kube-system'),
+    cfg.IntOpt('controller_sharding_lease_duration',
+               help=_('Time (in seconds) after which a sharded '
+                      'kuryr-controller replica that did not renew its '
+                      'Lease is considered gone. Nodes moving to another '
+                      'replica are only taken over by it after that time.'),
+               min=10,
+               default=15),
     cfg.StrOpt('network_policy_driver',
                help=_("Driver for network policies"),
                default='default'),
@@ -223,6 +313,12 @@ neutron_defaults = [
                 help=_("A mapping of default subnets for certain driverType "
                        "in a form of <driverType>:<SUBNET-ID>"),
                 default={}),
+    cfg.IntOpt('sg_rule_workers',
+               help=_("Maximum number of security group rules deleted "
+                      "concurrently when reconciling the security group of "
+                      "a network policy."),
+               min=1,
+               default=10),
     cfg.ListOpt('resource_tags',
                 help=_("List of tags that will be applied to all OpenStack "
                        "(Neutron and Octavia) resources created by Kuryr. "
@@ -252,6 +348,23 @@ octavia_defaults = [
                       "to the pool members. The options are: ROUND_ROBIN, "
                       "LEAST_CONNECTIONS, SOURCE_IP and SOURCE_IP_PORT."),
                default='ROUND_ROBIN'),
+    cfg.BoolOpt('batch_member_updates',
+                help=_("Set the members of each pool with a single batch "
+                       "member update request to Octavia, waiting once for "
+                       "the load balancer to be ACTIVE, instead of creating "
+                       "and deleting the members one by one. Members of the "
+                       "pools that are not in the Endpoints are deleted by "
+                       "the batch request."),
+                default=False),
+    cfg.BoolOpt('fully_populated_create',
+                help=_("Create the load balancer of a new Service along with "
+                       "its listeners, pools and members with a single "
+                       "fully populated load balancer creation request to "
+                       "Octavia, instead of creating them one by one. The "
+                       "load balancers being updated, or the ones Octavia "
+                       "rejects the request for, are still synced "
+                       "incrementally."),
+                default=False),
 ]
 
 cache_defaults = [
@@ -21,19 +21,30 @@ K8S_API_CRD_KURYRNETS = K8S_API_CRD + '/kuryrnets'
 K8S_API_CRD_KURYRNETWORKS = K8S_API_CRD + '/kuryrnetworks'
 K8S_API_CRD_KURYRNETPOLICIES = K8S_API_CRD + '/kuryrnetpolicies'
 K8S_API_CRD_KURYRLOADBALANCERS = K8S_API_CRD + '/kuryrloadbalancers'
+K8S_API_CRD_KURYRPOOLS = K8S_API_CRD + '/kuryrpools'
 K8S_API_POLICIES = '/apis/networking.k8s.io/v1/networkpolicies'
+K8S_API_COORDINATION = '/apis/coordination.k8s.io/v1'
+K8S_API_DISCOVERY = '/apis/discovery.k8s.io/v1beta1'
 
 K8S_API_NPWG_CRD = '/apis/k8s.cni.cncf.io/v1'
 
 K8S_OBJ_NAMESPACE = 'Namespace'
+K8S_OBJ_NODE = 'Node'
 K8S_OBJ_POD = 'Pod'
 K8S_OBJ_SERVICE = 'Service'
 K8S_OBJ_ENDPOINTS = 'Endpoints'
+K8S_OBJ_ENDPOINTSLICE = 'EndpointSlice'
 K8S_OBJ_POLICY = 'NetworkPolicy'
 K8S_OBJ_KURYRNET = 'KuryrNet'
 K8S_OBJ_KURYRNETWORK = 'KuryrNetwork'
 K8S_OBJ_KURYRNETPOLICY = 'KuryrNetPolicy'
 K8S_OBJ_KURYRLOADBALANCER = 'KuryrLoadBalancer'
+K8S_OBJ_KURYRPOOL = 'KuryrPool'
+K8S_OBJ_LEASE = 'Lease'
+
+K8S_POD_FIELDS = ('metadata', 'spec.nodeName', 'spec.hostNetwork',
+                  'spec.containers', 'status.phase', 'status.hostIP',
+                  'status.podIP', 'status.podIPs', 'status.conditions')
 
 K8S_POD_STATUS_PENDING = 'Pending'
 K8S_POD_STATUS_SUCCEEDED = 'Succeeded'
@@ -48,6 +59,9 @@ K8S_ANNOTATION_LBAAS_STATE = K8S_ANNOTATION_PREFIX + '-lbaas-state'
 K8S_ANNOTATION_NET_CRD = K8S_ANNOTATION_PREFIX + '-net-crd'
 K8S_ANNOTATION_NETPOLICY_CRD = K8S_ANNOTATION_PREFIX + '-netpolicy-crd'
 
+K8S_LABEL_CONTROLLER_SHARD = 'kuryr.openstack.org/controller-shard'
+K8S_LABEL_SERVICE_NAME = 'kubernetes.io/service-name'
+
 K8S_ANNOTATION_NPWG_PREFIX = 'k8s.v1.cni.cncf.io'
 K8S_ANNOTATION_NPWG_NETWORK = K8S_ANNOTATION_NPWG_PREFIX + '/networks'
 K8S_ANNOTATION_NPWG_CRD_SUBNET_ID = 'subnetId'
@@ -59,6 +73,11 @@ K8S_ANNOTATION_OLD_DRIVER = 'old_driver'
 K8S_ANNOTATION_CURRENT_DRIVER = 'current_driver'
 K8S_ANNOTATION_NEUTRON_PORT = 'neutron_id'
 
+# How the events of a handler are split among sharded controllers
+SHARDING_LEADER = 'leader'
+SHARDING_BY_NODE = 'node'
+SHARDING_ALL = 'all'
+
 KURYRNETWORK_FINALIZER = 'kuryrnetwork.finalizers.kuryr.openstack.org'
 
 K8S_OS_VIF_NOOP_PLUGIN = "noop"
@@ -81,6 +100,8 @@ VIF_POOL_POPULATE = '/populatePool'
 VIF_POOL_FREE = '/freePool'
 VIF_POOL_LIST = '/listPools'
 VIF_POOL_SHOW = '/showPool'
+VIF_POOL_JOBS = '/poolJobs'
+VIF_POOL_CANCEL = '/cancelPoolJob'
 
 DEFAULT_IFNAME = 'eth0'
 
@@ -494,6 +494,29 @@ class LBaaSDriver(DriverBase):
         """
         raise NotImplementedError()
 
+    @abc.abstractmethod
+    def create_loadbalancer_graph(self, name, project_id, subnet_id, ip,
+                                  listeners, security_groups_ids,
+                                  service_type, provider):
+        """Create load balancer along with its listeners, pools and members.
+
+        :param name: LoadBlancer name
+        :param project_id: OpenStack project ID
+        :param subnet_id: Neutron subnet ID to host load balancer
+        :param ip: IP of the load balancer
+        :param listeners: list of dicts with the 'protocol' and 'port' of a
+                          listener and the 'members' of its pool, as dicts
+                          with the arguments of `ensure_member` but the load
+                          balancer, the pool and the listener port
+        :param security_groups_ids: security groups that should be allowed
+                                    access to the load balancer
+        :param service_type: K8s service type (ClusterIP or LoadBalancer)
+        :param provider: load balancer backend service
+        :return: `LBaaSState` object with the created resources or None if
+                 the load balancer can't be created that way
+        """
+        raise NotImplementedError()
+
     @abc.abstractmethod
     def release_loadbalancer(self, loadbalancer):
         """Release load balancer.
@@ -600,6 +623,21 @@ class LBaaSDriver(DriverBase):
         """
         raise NotImplementedError()
 
+    @abc.abstractmethod
+    def update_members(self, loadbalancer, pool, members, new_members):
+        """Set the members of the pool.
+
+        :param loadbalancer: `LBaaSLoadBalancer` object
+        :param pool: `LBaaSPool` object
+        :param members: `LBaaSMember` objects of the pool to keep, the other
+                        members of the pool being released
+        :param new_members: list of dicts with the arguments of
+                            `ensure_member`, but the load balancer and the
+                            pool, of the members to add
+        :return: list of the `LBaaSMember` objects of the pool
+        """
+        raise NotImplementedError()
+
     @abc.abstractmethod
     def update_lbaas_sg(self, service, sgs):
         """Update security group rules associated to the loadbalancer
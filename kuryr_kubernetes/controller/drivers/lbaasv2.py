@@ -13,10 +13,15 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import random
 import time
 
+import eventlet
+from eventlet import event as e_event
 from openstack import exceptions as os_exc
+from openstack.load_balancer.v2 import pool as os_pool
+from openstack import utils as os_utils
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import timeutils
@@ -47,6 +52,90 @@ _LB_STS_POLL_SLOW_INTERVAL = 3
 _OCTAVIA_TAGGING_VERSION = 2, 5
 _OCTAVIA_DL_VERSION = 2, 11
 _OCTAVIA_ACL_VERSION = 2, 12
+_LB_STS_DELETED = 'DELETED'
+
+
+def _get_member_name(target_ref_namespace, target_ref_name, port):
+    return "%s/%s:%s" % (target_ref_namespace, target_ref_name, port)
+
+
+class LBStatusMonitor(object):
+    """Polls the provisioning status of the load balancers being waited on.
+
+    Instead of every listener, pool or member operation polling its load
+    balancer on its own, the waiters register on the load balancer id, and
+    a single green thread gets the status of all the waited load balancers
+    every `interval` seconds, waking the waiters of the ones that are not
+    in a PENDING_* status anymore. With Octavia tagging, this is a single
+    listing of the load balancers tagged with `tags`, while the others are
+    got one by one. The thread stops once there is no waiter left.
+
+    A waiter is only woken by a status read after it registered, so an
+    operation done right before waiting is not mistaken as completed.
+    """
+
+    def __init__(self, tags=None, interval=_LB_STS_POLL_FAST_INTERVAL):
+        self._tags = tags
+        self._interval = interval
+        # Load balancer id -> events of its waiters
+        self._waiters = collections.defaultdict(list)
+        self._thread = None
+
+    def wait(self, lb_id, timeout):
+        """Waits for the load balancer to leave the PENDING_* statuses.
+
+        :return: the provisioning status of the load balancer, DELETED if it
+                 does not exist or None if the timeout expired
+        """
+        event = e_event.Event()
+        self._waiters[lb_id].append(event)
+        if self._thread is None:
+            self._thread = eventlet.spawn(self._run)
+        try:
+            with eventlet.Timeout(timeout, False):
+                return event.wait()
+            return None
+        finally:
+            waiters = self._waiters.get(lb_id)
+            if waiters and event in waiters:
+                waiters.remove(event)
+                if not waiters:
+                    del self._waiters[lb_id]
+
+    def _run(self):
+        try:
+            while self._waiters:
+                try:
+                    self._poll()
+                except Exception:
+                    LOG.exception("Error getting the provisioning status of "
+                                  "the load balancers.")
+                eventlet.sleep(self._interval)
+        finally:
+            self._thread = None
+
+    def _poll(self):
+        lbaas = clients.get_loadbalancer_client()
+        waiters = {lb_id: list(events)
+                   for lb_id, events in self._waiters.items()}
+        statuses = {}
+        if self._tags:
+            for lb in lbaas.load_balancers(tags=self._tags):
+                if lb.id in waiters:
+                    statuses[lb.id] = lb.provisioning_status
+        for lb_id in set(waiters).difference(statuses):
+            try:
+                statuses[lb_id] = lbaas.get_load_balancer(
+                    lb_id).provisioning_status
+            except os_exc.NotFoundException:
+                statuses[lb_id] = _LB_STS_DELETED
+
+        for lb_id, status in statuses.items():
+            if status.startswith('PENDING_'):
+                continue
+            for event in waiters[lb_id]:
+                if not event.ready():
+                    event.send(status)
 
 
 class LBaaSv2Driver(base.LBaaSDriver):
@@ -84,6 +173,9 @@ class LBaaSv2Driver(base.LBaaSDriver):
                         'API %s does not support resource tagging. Kuryr '
                         'will put requested tags in the description field of '
                         'Octavia resources.', v_str)
+        self._lb_monitor = LBStatusMonitor(
+            CONF.neutron_defaults.resource_tags if self._octavia_tags
+            else None)
 
     def double_listeners_supported(self):
         return self._octavia_double_listeners
@@ -143,6 +235,142 @@ class LBaaSv2Driver(base.LBaaSDriver):
 
         return response
 
+    def create_loadbalancer_graph(self, name, project_id, subnet_id, ip,
+                                  listeners, security_groups_ids=None,
+                                  service_type=None, provider=None):
+        """Creates a fully populated load balancer.
+
+        The load balancer is created along with its listeners, their default
+        pool and the pool members by a single request, and there is a single
+        wait for the load balancer to be ACTIVE. With Octavia ACLs, the
+        allowed CIDRs of the listeners are part of the request too. The IDs
+        of the created resources are then got with a listing of each kind.
+
+        :return: `LBaaSState` object with the created resources or None if
+                 Octavia rejected the request, e.g. as the provider does not
+                 support a listener protocol or as the load balancer exists
+                 already, and the incremental creation has to be used
+        """
+        loadbalancer = obj_lbaas.LBaaSLoadBalancer(
+            name=name, project_id=project_id, subnet_id=subnet_id, ip=ip,
+            security_groups=security_groups_ids, provider=provider)
+        request = [self._get_listener_graph_request(loadbalancer, listener)
+                   for listener in listeners]
+        try:
+            response = self._create_loadbalancer(loadbalancer, request)
+        except (os_exc.BadRequestException, os_exc.ConflictException):
+            LOG.warning("Fully populated creation of load balancer %s "
+                        "failed, creating it incrementally.", name,
+                        exc_info=True)
+            return None
+        if not response:
+            raise k_exc.ResourceNotReady(loadbalancer)
+        LOG.debug("Created %(obj)s", {'obj': loadbalancer})
+
+        self._wait_for_provisioning(loadbalancer, _ACTIVATION_TIMEOUT)
+        return self._get_loadbalancer_graph(loadbalancer, listeners)
+
+    def _get_listener_graph_request(self, loadbalancer, listener):
+        protocol = listener['protocol']
+        port = listener['port']
+        name = "%s:%s:%s" % (loadbalancer.name, protocol, port)
+        members = []
+        for member in listener['members']:
+            member_request = {
+                'name': _get_member_name(member['target_ref_namespace'],
+                                         member['target_ref_name'],
+                                         member['port']),
+                'subnet_id': member['subnet_id'],
+                'address': str(member['ip']),
+                'protocol_port': member['port'],
+            }
+            self.add_tags('member', member_request)
+            members.append(member_request)
+
+        pool_request = {
+            'name': name,
+            'protocol': protocol,
+            'lb_algorithm': CONF.octavia_defaults.lb_algorithm,
+            'members': members,
+        }
+        self.add_tags('pool', pool_request)
+        request = {
+            'name': name,
+            'protocol': protocol,
+            'protocol_port': port,
+            'default_pool': pool_request,
+        }
+        self.add_tags('listener', request)
+
+        if (self._octavia_acls and members and
+                self._enforce_member_sg_rules()):
+            allowed_cidrs = self._get_listener_allowed_cidrs(
+                loadbalancer.security_groups, None,
+                listener['members'][0]['port'], protocol)
+            if allowed_cidrs is not None:
+                request['allowed_cidrs'] = allowed_cidrs
+                # Prevent any traffic as no CIDR is allowed
+                request['admin_state_up'] = bool(allowed_cidrs)
+        return request
+
+    def _get_loadbalancer_graph(self, loadbalancer, listeners):
+        lbaas = clients.get_loadbalancer_client()
+        state = obj_lbaas.LBaaSState(loadbalancer=loadbalancer)
+        new_members = {(l['protocol'], l['port']): l['members']
+                       for l in listeners}
+
+        lsnr_by_id = {}
+        for os_listener in lbaas.listeners(load_balancer_id=loadbalancer.id):
+            listener = obj_lbaas.LBaaSListener(
+                id=os_listener.id,
+                name=os_listener.name,
+                project_id=loadbalancer.project_id,
+                loadbalancer_id=loadbalancer.id,
+                protocol=os_listener.protocol,
+                port=os_listener.protocol_port)
+            if CONF.octavia_defaults.sg_mode == 'create':
+                self._create_lb_security_group_rule(loadbalancer, listener)
+            lsnr_by_id[listener.id] = listener
+            state.listeners.append(listener)
+
+        for os_lb_pool in lbaas.pools(loadbalancer_id=loadbalancer.id):
+            listener = next((lsnr_by_id[l['id']] for l in os_lb_pool.listeners
+                             if l['id'] in lsnr_by_id), None)
+            if listener is None:
+                continue
+            pool = obj_lbaas.LBaaSPool(
+                id=os_lb_pool.id,
+                name=os_lb_pool.name,
+                project_id=loadbalancer.project_id,
+                loadbalancer_id=loadbalancer.id,
+                listener_id=listener.id,
+                protocol=os_lb_pool.protocol)
+            state.pools.append(pool)
+
+            pool_members = new_members.get((listener.protocol,
+                                            listener.port))
+            if not pool_members:
+                continue
+            member_ids = {(m.address, m.protocol_port): m.id
+                          for m in lbaas.members(pool.id)}
+            for member_args in pool_members:
+                member_id = member_ids.get((str(member_args['ip']),
+                                            member_args['port']))
+                if member_id is None:
+                    LOG.warning("Member %s:%s not found in pool %s after "
+                                "the load balancer creation.",
+                                member_args['ip'], member_args['port'],
+                                pool.id)
+                    continue
+                member = self._get_member(loadbalancer, pool, **member_args)
+                member.id = member_id
+                state.members.append(member)
+            if not self._octavia_acls:
+                self._apply_member_sg_rules(loadbalancer, pool,
+                                            pool_members[0]['port'],
+                                            listener.port)
+        return state
+
     def release_loadbalancer(self, loadbalancer):
         os_net = clients.get_network_client()
         lbaas = clients.get_loadbalancer_client()
@@ -191,24 +419,33 @@ class LBaaSv2Driver(base.LBaaSDriver):
 
     def _create_listeners_acls(self, loadbalancer, port, target_port,
                                protocol, lb_sg, new_sgs, listener_id):
-        all_pod_rules = []
-        add_default_rules = False
-        os_net = clients.get_network_client()
-
         if new_sgs:
             sgs = new_sgs
         else:
             sgs = loadbalancer.security_groups
 
+        allowed_cidrs = self._get_listener_allowed_cidrs(sgs, lb_sg,
+                                                         target_port,
+                                                         protocol)
+        self._update_listener_acls(loadbalancer, listener_id, allowed_cidrs)
+
+    def _get_listener_allowed_cidrs(self, sgs, lb_sg, target_port, protocol):
+        """Returns the CIDRs the pods security groups allow on a listener.
+
+        :return: list of the allowed CIDRs or None if the listener has to
+                 be accessible without restriction
+        """
+        all_pod_rules = []
+        os_net = clients.get_network_client()
+
         # Check if Network Policy allows listener on the pods
-        for sg in sgs:
+        for sg in sgs or []:
             if sg != lb_sg:
                 if sg in config.CONF.neutron_defaults.pod_security_groups:
                     # If default sg is set, this means there is no NP
                     # associated to the service, thus falling back to the
                     # default listener rules
-                    add_default_rules = True
-                    break
+                    return None
                 rules = os_net.security_group_rules(security_group_id=sg)
                 for rule in rules:
                     # NOTE(ltomasbo): NP sg can only have rules with
@@ -225,17 +462,12 @@ class LBaaSv2Driver(base.LBaaSDriver):
                         if (min_port and target_port not in range(min_port,
                                                                   max_port+1)):
                             continue
-                        if rule.remote_ip_prefix:
-                            all_pod_rules.append(rule.remote_ip_prefix)
-                        else:
-                            add_default_rules = True
+                        if not rule.remote_ip_prefix:
+                            # update the listener without allowed-cidr
+                            return None
+                        all_pod_rules.append(rule.remote_ip_prefix)
 
-        if add_default_rules:
-            # update the listener without allowed-cidr
-            self._update_listener_acls(loadbalancer, listener_id, None)
-        else:
-            self._update_listener_acls(loadbalancer, listener_id,
-                                       all_pod_rules)
+        return all_pod_rules
 
     def _apply_members_security_groups(self, loadbalancer, port, target_port,
                                        protocol, sg_rule_name, listener_id,
@@ -434,32 +666,105 @@ class LBaaSv2Driver(base.LBaaSDriver):
         lbaas = clients.get_loadbalancer_client()
         self._release(loadbalancer, pool, lbaas.delete_pool, pool.id)
 
-    def ensure_member(self, loadbalancer, pool,
-                      subnet_id, ip, port, target_ref_namespace,
-                      target_ref_name, listener_port=None):
-        name = ("%s/%s" % (target_ref_namespace, target_ref_name))
-        name += ":%s" % port
-        member = obj_lbaas.LBaaSMember(name=name,
-                                       project_id=loadbalancer.project_id,
-                                       pool_id=pool.id,
-                                       subnet_id=subnet_id,
-                                       ip=ip,
-                                       port=port)
-        result = self._ensure_provisioned(loadbalancer, member,
-                                          self._create_member,
-                                          self._find_member)
-
+    def _get_member(self, loadbalancer, pool, subnet_id, ip, port,
+                    target_ref_namespace, target_ref_name):
+        name = _get_member_name(target_ref_namespace, target_ref_name, port)
+        return obj_lbaas.LBaaSMember(name=name,
+                                     project_id=loadbalancer.project_id,
+                                     pool_id=pool.id,
+                                     subnet_id=subnet_id,
+                                     ip=ip,
+                                     port=port)
+
+    def _enforce_member_sg_rules(self):
         network_policy = (
             'policy' in CONF.kubernetes.enabled_handlers and
             CONF.kubernetes.service_security_groups_driver == 'policy')
-        if (network_policy and CONF.octavia_defaults.enforce_sg_rules and
-                listener_port):
+        return network_policy and CONF.octavia_defaults.enforce_sg_rules
+
+    def _apply_member_sg_rules(self, loadbalancer, pool, port,
+                               listener_port):
+        if self._enforce_member_sg_rules() and listener_port:
             protocol = pool.protocol
             sg_rule_name = pool.name
             listener_id = pool.listener_id
             self._apply_members_security_groups(loadbalancer, listener_port,
                                                 port, protocol, sg_rule_name,
                                                 listener_id)
+
+    def ensure_member(self, loadbalancer, pool,
+                      subnet_id, ip, port, target_ref_namespace,
+                      target_ref_name, listener_port=None):
+        member = self._get_member(loadbalancer, pool, subnet_id, ip, port,
+                                  target_ref_namespace, target_ref_name)
+        result = self._ensure_provisioned(loadbalancer, member,
+                                          self._create_member,
+                                          self._find_member)
+
+        self._apply_member_sg_rules(loadbalancer, pool, port, listener_port)
+        return result
+
+    def update_members(self, loadbalancer, pool, members, new_members):
+        """Sets the members of the pool with a batch member update.
+
+        A single request replaces the members of the pool with the given
+        ones, Octavia deleting the members of the pool not in the request,
+        and there is a single wait for the load balancer to be ACTIVE once
+        it is applied. The IDs of the new members are then got with a single
+        listing of the pool members.
+
+        :param members: `LBaaSMember` objects of the pool to keep
+        :param new_members: list of dicts with the `ensure_member` arguments,
+                            but the load balancer and the pool, of the
+                            members to add
+        :return: list of the `LBaaSMember` objects of the pool
+        """
+        added = [self._get_member(loadbalancer, pool, m['subnet_id'],
+                                  m['ip'], m['port'],
+                                  m['target_ref_namespace'],
+                                  m['target_ref_name'])
+                 for m in new_members]
+        request = []
+        for member in members + added:
+            member_request = {
+                'name': member.name,
+                'subnet_id': member.subnet_id,
+                'address': str(member.ip),
+                'protocol_port': member.port,
+            }
+            self.add_tags('member', member_request)
+            request.append(member_request)
+
+        lbaas = clients.get_loadbalancer_client()
+        url = os_utils.urljoin(os_pool.Pool.base_path, pool.id, 'members')
+        for remaining in self._provisioning_timer(_ACTIVATION_TIMEOUT):
+            self._wait_for_provisioning(loadbalancer, remaining)
+            try:
+                os_exc.raise_from_response(
+                    lbaas.put(url, json={'members': request}))
+                break
+            except os_exc.ConflictException:
+                # The load balancer got immutable again meanwhile
+                pass
+        else:
+            raise k_exc.ResourceNotReady(pool)
+        self._wait_for_provisioning(loadbalancer, _ACTIVATION_TIMEOUT)
+
+        result = list(members)
+        if added:
+            member_ids = {(m.address, m.protocol_port): m.id
+                          for m in lbaas.members(pool.id)}
+            for member in added:
+                member_id = member_ids.get((str(member.ip), member.port))
+                if member_id is None:
+                    LOG.warning("Member %s not found in pool %s after the "
+                                "batch update.", member.name, pool.id)
+                    continue
+                member.id = member_id
+                result.append(member)
+            listener_port = new_members[0].get('listener_port')
+            self._apply_member_sg_rules(loadbalancer, pool,
+                                        added[0].port, listener_port)
         return result
 
     def release_member(self, loadbalancer, member):
@@ -482,7 +787,7 @@ class LBaaSv2Driver(base.LBaaSDriver):
         except StopIteration:
             return None
 
-    def _create_loadbalancer(self, loadbalancer):
+    def _create_loadbalancer(self, loadbalancer, listeners=None):
         request = {
             'name': loadbalancer.name,
             'project_id': loadbalancer.project_id,
@@ -493,6 +798,9 @@ class LBaaSv2Driver(base.LBaaSDriver):
         if loadbalancer.provider is not None:
             request['provider'] = loadbalancer.provider
 
+        if listeners:
+            request['listeners'] = listeners
+
         self.add_tags('loadbalancer', request)
 
         lbaas = clients.get_loadbalancer_client()
@@ -558,8 +866,7 @@ class LBaaSv2Driver(base.LBaaSDriver):
         }
 
         # Wait for the loadbalancer to be ACTIVE
-        self._wait_for_provisioning(loadbalancer, _ACTIVATION_TIMEOUT,
-                                    _LB_STS_POLL_FAST_INTERVAL)
+        self._wait_for_provisioning(loadbalancer, _ACTIVATION_TIMEOUT)
 
         lbaas = clients.get_loadbalancer_client()
         try:
@@ -675,7 +982,7 @@ class LBaaSv2Driver(base.LBaaSDriver):
                             interval=_LB_STS_POLL_FAST_INTERVAL):
         for remaining in self._provisioning_timer(_ACTIVATION_TIMEOUT,
                                                   interval):
-            self._wait_for_provisioning(loadbalancer, remaining, interval)
+            self._wait_for_provisioning(loadbalancer, remaining)
             try:
                 result = self._ensure(obj, create, find)
                 if result:
@@ -700,27 +1007,21 @@ class LBaaSv2Driver(base.LBaaSDriver):
 
         raise k_exc.ResourceNotReady(obj)
 
-    def _wait_for_provisioning(self, loadbalancer, timeout,
-                               interval=_LB_STS_POLL_FAST_INTERVAL):
-        lbaas = clients.get_loadbalancer_client()
-
-        for remaining in self._provisioning_timer(timeout, interval):
-            response = lbaas.get_load_balancer(loadbalancer.id)
-            status = response.provisioning_status
-            if status == 'ACTIVE':
-                LOG.debug("Provisioning complete for %(lb)s", {
-                    'lb': loadbalancer})
-                return
-            elif status == 'ERROR':
-                LOG.debug("Releasing loadbalancer %s with error status",
-                          loadbalancer.id)
-                self.release_loadbalancer(loadbalancer)
-                break
-            else:
-                LOG.debug("Provisioning status %(status)s for %(lb)s, "
-                          "%(rem).3gs remaining until timeout",
-                          {'status': status, 'lb': loadbalancer,
-                           'rem': remaining})
+    def _wait_for_provisioning(self, loadbalancer, timeout):
+        status = self._lb_monitor.wait(loadbalancer.id, timeout)
+        if status == 'ACTIVE':
+            LOG.debug("Provisioning complete for %(lb)s", {
+                'lb': loadbalancer})
+            return
+        elif status == 'ERROR':
+            LOG.debug("Releasing loadbalancer %s with error status",
+                      loadbalancer.id)
+            self.release_loadbalancer(loadbalancer)
+        else:
+            LOG.debug("Provisioning status %(status)s for %(lb)s after "
+                      "%(timeout).3gs", {'status': status,
+                                         'lb': loadbalancer,
+                                         'timeout': timeout})
 
         raise k_exc.ResourceNotReady(loadbalancer)
 
@@ -793,6 +1094,11 @@ class LBaaSv2Driver(base.LBaaSDriver):
         endpoint = k8s.get(endpoints_link)
 
         lbaas = utils.get_lbaas_state(endpoint)
+        if not lbaas:
+            # NOTE: The load balancers of the EndpointSlice handler are
+            # tracked in the Service instead.
+            endpoint = k8s.get(service['metadata']['selfLink'])
+            lbaas = utils.get_lbaas_state(endpoint)
         if not lbaas:
             LOG.debug('Endpoint not yet annotated with lbaas state.')
             raise k_exc.ResourceNotReady(svc_name)
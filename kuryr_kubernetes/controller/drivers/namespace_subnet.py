@@ -52,11 +52,12 @@ class NamespacePodSubnetDriver(default_subnet.DefaultPodSubnetDriver):
         return {subnet_id: utils.get_subnet(subnet_id)}
 
     def _get_namespace_subnet_id(self, namespace):
-        kubernetes = clients.get_kubernetes_client()
         try:
             net_crd_path = (f"{constants.K8S_API_CRD_NAMESPACES}/"
                             f"{namespace}/kuryrnetworks/{namespace}")
-            net_crd = kubernetes.get(net_crd_path)
+            net_crd = c_utils.get_k8s_resource(
+                constants.K8S_OBJ_KURYRNETWORK, net_crd_path, namespace,
+                namespace)
         except exceptions.K8sResourceNotFound:
             LOG.debug("Kuryrnetwork resource not yet created, retrying...")
             raise exceptions.ResourceNotReady(namespace)
@@ -25,12 +25,52 @@ from kuryr_kubernetes.controller.drivers import neutron_vif
 
 LOG = logging.getLogger(__name__)
 
+# Name of the handler invalidating the cached parent ports on Node events
+NODE_HANDLER = 'node'
+
+
+class ParentPortCache(object):
+    """Parent ports of the nested nodes, indexed by the node IP.
+
+    The parent port of a node, and therefore its trunk, almost never change,
+    so they are cached to save a Neutron query on every VIF request. As the
+    `NodeHandler` is the one dropping the entries of deleted nodes and of
+    changed node addresses, ports are only cached while it is enabled.
+    """
+
+    def __init__(self):
+        self._ports = {}
+
+    def is_enabled(self):
+        return NODE_HANDLER in oslo_cfg.CONF.kubernetes.enabled_handlers
+
+    def get(self, node_ip):
+        return self._ports.get(node_ip)
+
+    def add(self, node_ip, port):
+        if self.is_enabled():
+            self._ports[node_ip] = port
+
+    def invalidate(self, node_ip):
+        if self._ports.pop(node_ip, None) is not None:
+            LOG.debug("Dropped cached parent port of node IP %s", node_ip)
+
+    def clear(self):
+        self._ports.clear()
+
+
+PARENT_PORTS = ParentPortCache()
+
 
 class NestedPodVIFDriver(neutron_vif.NeutronPodVIFDriver,
                          metaclass=abc.ABCMeta):
     """Skeletal handler driver for VIFs for Nested Pods."""
 
     def _get_parent_port_by_host_ip(self, node_fixed_ip):
+        port = PARENT_PORTS.get(node_fixed_ip)
+        if port is not None:
+            return port
+
         os_net = clients.get_network_client()
         node_subnet_id = oslo_cfg.CONF.pod_vif_nested.worker_nodes_subnet
         if not node_subnet_id:
@@ -47,12 +87,15 @@ class NestedPodVIFDriver(neutron_vif.NeutronPodVIFDriver,
             raise
 
         try:
-            return next(ports)
+            port = next(ports)
         except StopIteration:
             LOG.error("Neutron port for vm port with fixed ips %s not found!",
                       fixed_ips)
             raise kl_exc.NoResourceException
 
+        PARENT_PORTS.add(node_fixed_ip, port)
+        return port
+
     def _get_parent_port(self, pod):
         try:
             # REVISIT(vikasc): Assumption is being made that hostIP is the IP
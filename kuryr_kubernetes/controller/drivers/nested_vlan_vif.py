@@ -11,11 +11,9 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
-from time import sleep
-
+from kuryr.lib._i18n import _
 from kuryr.lib import constants as kl_const
 from kuryr.lib import exceptions as kl_exc
-from kuryr.lib import segmentation_type_drivers as seg_driver
 from openstack import exceptions as os_exc
 from oslo_log import log as logging
 
@@ -31,12 +29,55 @@ from kuryr_kubernetes import os_vif_util as ovu
 LOG = logging.getLogger(__name__)
 
 DEFAULT_MAX_RETRY_COUNT = 3
-DEFAULT_RETRY_INTERVAL = 1
+
+# Bits of the VLAN ids that can be allocated to the subports
+_VLAN_IDS_MASK = ((1 << (kl_const.MAX_VLAN_TAG + 1)) -
+                  (1 << kl_const.MIN_VLAN_TAG))
+
+
+class VlanIdAllocator(object):
+    """Allocates the VLAN ids of the subports of a trunk.
+
+    The VLAN ids in use on the trunk are kept in a bitmap, seeded from the
+    trunk subports and updated as VLAN ids are allocated and released, so
+    allocating a VLAN id does not need to get the trunk. The lowest free VLAN
+    id is allocated first.
+    """
+
+    def __init__(self, vlan_ids=()):
+        self._bitmap = 0
+        for vlan_id in vlan_ids:
+            self._bitmap |= 1 << int(vlan_id)
+
+    def __contains__(self, vlan_id):
+        return bool(self._bitmap & (1 << int(vlan_id)))
+
+    def allocate(self):
+        """Allocates the lowest free VLAN id.
+
+        :raises SegmentationIdAllocationFailure: if all the VLAN ids are in
+                                                 use
+        """
+        free = ~self._bitmap & _VLAN_IDS_MASK
+        if not free:
+            raise kl_exc.SegmentationIdAllocationFailure(
+                _('There are no vlan ids available.'))
+        vlan_id = (free & -free).bit_length() - 1
+        self._bitmap |= 1 << vlan_id
+        return vlan_id
+
+    def release(self, vlan_id):
+        self._bitmap &= ~(1 << int(vlan_id))
 
 
 class NestedVlanPodVIFDriver(nested_vif.NestedPodVIFDriver):
     """Manages ports for nested-containers using VLANs to provide VIFs."""
 
+    def __init__(self):
+        super(NestedVlanPodVIFDriver, self).__init__()
+        # trunk_id -> VlanIdAllocator
+        self._vlan_allocators = {}
+
     def request_vif(self, pod, project_id, subnets, security_groups):
         os_net = clients.get_network_client()
         parent_port = self._get_parent_port(pod)
@@ -84,6 +125,7 @@ class NestedVlanPodVIFDriver(nested_vif.NestedPodVIFDriver):
             ports = list(os_net.create_ports(bulk_port_rq))
         except os_exc.SDKException:
             LOG.exception("Error creating bulk ports: %s", bulk_port_rq)
+            self._release_vlan_ids(trunk_id, subports_info)
             raise
         utils.tag_neutron_resources(ports)
 
@@ -95,11 +137,15 @@ class NestedVlanPodVIFDriver(nested_vif.NestedPodVIFDriver):
                 os_net.add_trunk_subports(trunk_id, subports_info)
             except os_exc.ConflictException:
                 LOG.error("vlan ids already in use on trunk")
+                # The VLAN ids were allocated by someone else, so the ones
+                # in use are fetched again
+                self._resync_vlan_allocator(trunk_id)
                 for port in ports:
                     os_net.delete_port(port.id)
                 return []
         except os_exc.SDKException:
             LOG.exception("Error happened during subport addition to trunk")
+            self._release_vlan_ids(trunk_id, subports_info)
             for port in ports:
                 os_net.delete_port(port.id)
             return []
@@ -116,7 +162,7 @@ class NestedVlanPodVIFDriver(nested_vif.NestedPodVIFDriver):
         parent_port = self._get_parent_port(pod)
         trunk_id = self._get_trunk_id(parent_port)
         self._remove_subport(trunk_id, vif.id)
-        self._release_vlan_id(vif.vlan_id)
+        self._release_vlan_id(trunk_id, vif.vlan_id)
         os_net.delete_port(vif.id)
 
     def _get_port_request(self, pod, project_id, subnets, security_groups,
@@ -144,17 +190,16 @@ class NestedVlanPodVIFDriver(nested_vif.NestedPodVIFDriver):
                               unbound=False):
         subports_info = []
 
-        in_use_vlan_ids = self._get_in_use_vlan_ids_set(trunk_id)
+        vlan_allocator = self._get_vlan_allocator(trunk_id)
         port_rq = self._get_port_request(pod, project_id, subnets,
                                          security_groups, unbound)
         for i in range(num_ports):
             try:
-                vlan_id = seg_driver.allocate_segmentation_id(in_use_vlan_ids)
+                vlan_id = vlan_allocator.allocate()
             except kl_exc.SegmentationIdAllocationFailure:
                 LOG.warning("There is not enough vlan ids available to "
                             "create a batch of %d subports.", num_ports)
                 break
-            in_use_vlan_ids.add(vlan_id)
 
             subports_info.append({'segmentation_id': vlan_id,
                                   'port_id': '',
@@ -173,14 +218,13 @@ class NestedVlanPodVIFDriver(nested_vif.NestedPodVIFDriver):
     def _add_subport(self, trunk_id, subport):
         """Adds subport port to Neutron trunk
 
-        This method gets vlanid allocated from kuryr segmentation driver.
-        In active/active HA type deployment, possibility of vlanid conflict
-        is there. In such a case, vlanid will be requested again and subport
+        This method gets vlanid allocated from the VLAN allocator of the
+        trunk. In active/active HA type deployment, possibility of vlanid
+        conflict is there. In such a case, the VLAN ids in use on the trunk
+        are fetched again, vlanid will be requested again and subport
         addition is re-tried. This is tried DEFAULT_MAX_RETRY_COUNT times in
         case of vlanid conflict.
         """
-        # TODO(vikasc): Better approach for retrying in case of
-        # vlan-id conflict.
         os_net = clients.get_network_client()
         retry_count = 1
         while True:
@@ -190,17 +234,17 @@ class NestedVlanPodVIFDriver(nested_vif.NestedPodVIFDriver):
                 LOG.error("Getting VlanID for subport on "
                           "trunk %s failed!!", trunk_id)
                 raise
-            subport = [{'segmentation_id': vlan_id,
-                        'port_id': subport,
-                       'segmentation_type': 'vlan'}]
+            subports = [{'segmentation_id': vlan_id,
+                         'port_id': subport,
+                         'segmentation_type': 'vlan'}]
             try:
-                os_net.add_trunk_subports(trunk_id, subport)
+                os_net.add_trunk_subports(trunk_id, subports)
             except os_exc.ConflictException:
                 if retry_count < DEFAULT_MAX_RETRY_COUNT:
                     LOG.error("vlanid already in use on trunk, "
                               "%s. Retrying...", trunk_id)
                     retry_count += 1
-                    sleep(DEFAULT_RETRY_INTERVAL)
+                    self._resync_vlan_allocator(trunk_id)
                     continue
                 else:
                     LOG.error(
@@ -210,6 +254,7 @@ class NestedVlanPodVIFDriver(nested_vif.NestedPodVIFDriver):
             except os_exc.SDKException:
                 LOG.exception("Error happened during subport "
                               "addition to trunk %s", trunk_id)
+                self._release_vlan_id(trunk_id, vlan_id)
                 raise
             return vlan_id
 
@@ -228,12 +273,34 @@ class NestedVlanPodVIFDriver(nested_vif.NestedPodVIFDriver):
     def _remove_subport(self, trunk_id, subport_id):
         self._remove_subports(trunk_id, [subport_id])
 
-    def _get_vlan_id(self, trunk_id):
-        vlan_ids = self._get_in_use_vlan_ids_set(trunk_id)
-        return seg_driver.allocate_segmentation_id(vlan_ids)
+    def _get_vlan_allocator(self, trunk_id):
+        vlan_allocator = self._vlan_allocators.get(trunk_id)
+        if vlan_allocator is None:
+            vlan_allocator = self._resync_vlan_allocator(trunk_id)
+        return vlan_allocator
+
+    def _resync_vlan_allocator(self, trunk_id):
+        vlan_allocator = VlanIdAllocator(
+            self._get_in_use_vlan_ids_set(trunk_id))
+        self._vlan_allocators[trunk_id] = vlan_allocator
+        return vlan_allocator
 
-    def _release_vlan_id(self, id):
-        return seg_driver.release_segmentation_id(id)
+    def _get_vlan_id(self, trunk_id):
+        try:
+            return self._get_vlan_allocator(trunk_id).allocate()
+        except kl_exc.SegmentationIdAllocationFailure:
+            # VLAN ids may have been released without going through the
+            # allocator, e.g. by removing the subports from the trunk
+            return self._resync_vlan_allocator(trunk_id).allocate()
+
+    def _release_vlan_id(self, trunk_id, id):
+        vlan_allocator = self._vlan_allocators.get(trunk_id)
+        if vlan_allocator:
+            vlan_allocator.release(id)
+
+    def _release_vlan_ids(self, trunk_id, subports_info):
+        for subport in subports_info:
+            self._release_vlan_id(trunk_id, subport['segmentation_id'])
 
     def _get_in_use_vlan_ids_set(self, trunk_id):
         vlan_ids = set()
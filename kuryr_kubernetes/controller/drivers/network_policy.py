@@ -14,6 +14,7 @@
 
 import ipaddress
 import netaddr
+import time
 
 from openstack import exceptions as os_exc
 from oslo_log import log as logging
@@ -74,44 +75,14 @@ class NetworkPolicyDriver(base.NetworkPolicyDriver):
         crd_name = crd['metadata']['name']
         LOG.debug("Already existing CRD %s", crd_name)
         sg_id = crd['spec']['securityGroupId']
-        # Fetch existing SG rules from kuryrnetpolicy CRD
-        existing_sg_rules = []
-        existing_i_rules = crd['spec'].get('ingressSgRules')
-        existing_e_rules = crd['spec'].get('egressSgRules')
-        if existing_i_rules or existing_e_rules:
-            existing_sg_rules = existing_i_rules + existing_e_rules
         existing_pod_selector = crd['spec'].get('podSelector')
         # Parse network policy update and get new ruleset
         i_rules, e_rules = self.parse_network_policy_rules(policy, sg_id)
-        current_sg_rules = i_rules + e_rules
-        # Get existing security group rules ids
-        sgr_ids = [x['security_group_rule'].pop('id') for x in
-                   existing_sg_rules]
-        # SG rules that are meant to be kept get their id back
-        sg_rules_to_keep = [existing_sg_rules.index(rule) for rule in
-                            existing_sg_rules if rule in current_sg_rules]
-        for sg_rule in sg_rules_to_keep:
-            sgr_id = sgr_ids[sg_rule]
-            existing_sg_rules[sg_rule]['security_group_rule']['id'] = sgr_id
-        # Delete SG rules that are no longer in the updated policy
-        sg_rules_to_delete = [existing_sg_rules.index(rule) for rule in
-                              existing_sg_rules if rule not in
-                              current_sg_rules]
-        for sg_rule in sg_rules_to_delete:
-            driver_utils.delete_security_group_rule(sgr_ids[sg_rule])
-        # Create new rules that weren't already on the security group
-        sg_rules_to_add = [rule for rule in current_sg_rules if rule not in
-                           existing_sg_rules]
-        for sg_rule in sg_rules_to_add:
-            sgr_id = driver_utils.create_security_group_rule(sg_rule)
-            if sg_rule['security_group_rule'].get('direction') == 'ingress':
-                for i_rule in i_rules:
-                    if sg_rule == i_rule:
-                        i_rule["security_group_rule"]["id"] = sgr_id
-            else:
-                for e_rule in e_rules:
-                    if sg_rule == e_rule:
-                        e_rule["security_group_rule"]["id"] = sgr_id
+        # Make the SG rules match the new ruleset, which also sets the ids of
+        # the rules
+        default_rules = self._get_default_np_rules(sg_id)
+        self._reconcile_sg_rules(policy, sg_id,
+                                 i_rules + e_rules + default_rules)
         # Annotate kuryrnetpolicy CRD with current policy and ruleset
         pod_selector = policy['spec'].get('podSelector')
         driver_utils.patch_kuryrnetworkpolicy_crd(crd, i_rules, e_rules,
@@ -122,10 +93,10 @@ class NetworkPolicyDriver(base.NetworkPolicyDriver):
             return existing_pod_selector
         return False
 
-    def _add_default_np_rules(self, sg_id):
-        """Add extra SG rule to allow traffic from svcs and host.
+    def _get_default_np_rules(self, sg_id):
+        """Get extra SG rules to allow traffic from svcs and host.
 
-        This method adds the base security group rules for the NP security
+        This method returns the base security group rules for the NP security
         group:
         - Ensure traffic is allowed from the services subnet
         - Ensure traffic is allowed from the host
@@ -137,6 +108,7 @@ class NetworkPolicyDriver(base.NetworkPolicyDriver):
         worker_subnet_id = CONF.pod_vif_nested.worker_nodes_subnet
         if worker_subnet_id:
             default_cidrs.append(utils.get_subnet_cidr(worker_subnet_id))
+        default_rules = []
         for cidr in default_cidrs:
             default_rule = {
                 'security_group_rule': {
@@ -146,7 +118,73 @@ class NetworkPolicyDriver(base.NetworkPolicyDriver):
                     'description': 'Kuryr-Kubernetes NetPolicy SG rule',
                     'remote_ip_prefix': cidr
                 }}
-            driver_utils.create_security_group_rule(default_rule)
+            default_rules.append(default_rule)
+        return default_rules
+
+    def _reconcile_sg_rules(self, policy, sg_id, sg_rules,
+                            existing_sg_rules=None):
+        """Make the rules of the security group match the given ones
+
+        The rules currently on the security group are listed in a single
+        request (unless already known, e.g. right after the security group
+        creation) and compared with `sg_rules`. Missing rules are created
+        with a bulk request, extra rules are deleted concurrently and the
+        `sg_rules` get the ids of the Neutron rules they correspond to.
+
+        param policy: dict with the network policy the security group
+        belongs to
+        param sg_id: String with the Security Group ID
+        param sg_rules: list of SG rule bodies to enforce
+        param existing_sg_rules: optional list of the rules currently on the
+        security group
+        """
+        start = time.time()
+        if existing_sg_rules is None:
+            existing_sg_rules = self.os_net.security_group_rules(
+                security_group_id=sg_id)
+        existing = {}
+        for sgr in existing_sg_rules:
+            existing[driver_utils.get_security_group_rule_key(sgr)] = sgr['id']
+        listed = time.time()
+
+        to_create = {}
+        for sg_rule in sg_rules:
+            key = driver_utils.get_security_group_rule_key(
+                sg_rule['security_group_rule'])
+            if key in existing:
+                sg_rule['security_group_rule']['id'] = existing[key]
+            else:
+                # Several bodies may correspond to the same Neutron rule,
+                # e.g. when differing only in their description.
+                to_create.setdefault(key, []).append(sg_rule)
+        desired = {driver_utils.get_security_group_rule_key(
+            sg_rule['security_group_rule']) for sg_rule in sg_rules}
+        to_delete = [sgr_id for key, sgr_id in existing.items()
+                     if key not in desired]
+
+        sgr_ids = driver_utils.create_security_group_rules(
+            [rules[0] for rules in to_create.values()])
+        for rules, sgr_id in zip(to_create.values(), sgr_ids):
+            for sg_rule in rules:
+                sg_rule['security_group_rule']['id'] = sgr_id
+        created = time.time()
+
+        driver_utils.delete_security_group_rules(to_delete)
+        LOG.debug("Reconciled SG %(sg_id)s of network policy "
+                  "%(namespace)s/%(name)s in %(total).3fs: %(kept)d rules "
+                  "kept, %(created)d created in %(create_time).3fs, "
+                  "%(deleted)d deleted in %(delete_time).3fs, listing took "
+                  "%(list_time).3fs",
+                  {'sg_id': sg_id,
+                   'namespace': policy['metadata']['namespace'],
+                   'name': policy['metadata']['name'],
+                   'total': time.time() - start,
+                   'kept': len(existing) - len(to_delete),
+                   'created': len(to_create),
+                   'create_time': created - listed,
+                   'deleted': len(to_delete),
+                   'delete_time': time.time() - created,
+                   'list_time': listed - start})
 
     def create_security_group_rules_from_network_policy(self, policy,
                                                         project_id):
@@ -169,22 +207,15 @@ class NetworkPolicyDriver(base.NetworkPolicyDriver):
             #              allowing egress on IPv4 and IPv6. This collides with
             #              how network policies are supposed to work, because
             #              initially even egress traffic should be blocked.
-            #              To work around this we will delete those two SG
-            #              rules just after creation.
-            for sgr in sg.security_group_rules:
-                self.os_net.delete_security_group_rule(sgr['id'])
-
+            #              Those two SG rules are not part of the ruleset, so
+            #              they get deleted when reconciling the SG below.
             i_rules, e_rules = self.parse_network_policy_rules(policy, sg.id)
-            for i_rule in i_rules:
-                sgr_id = driver_utils.create_security_group_rule(i_rule)
-                i_rule['security_group_rule']['id'] = sgr_id
-
-            for e_rule in e_rules:
-                sgr_id = driver_utils.create_security_group_rule(e_rule)
-                e_rule['security_group_rule']['id'] = sgr_id
 
             # Add default rules to allow traffic from host and svc subnet
-            self._add_default_np_rules(sg.id)
+            self._reconcile_sg_rules(
+                policy, sg.id,
+                i_rules + e_rules + self._get_default_np_rules(sg.id),
+                existing_sg_rules=sg.security_group_rules)
         except (os_exc.SDKException, exceptions.ResourceNotReady):
             LOG.exception("Error creating security group for network policy "
                           " %s", policy['metadata']['name'])
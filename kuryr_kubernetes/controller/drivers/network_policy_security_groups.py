@@ -13,7 +13,6 @@
 # limitations under the License.
 
 
-from kuryr_kubernetes import clients
 from kuryr_kubernetes import config
 from kuryr_kubernetes import constants
 from kuryr_kubernetes.controller.drivers import base
@@ -27,13 +26,12 @@ LOG = logging.getLogger(__name__)
 
 
 def _get_namespace_labels(namespace):
-    kubernetes = clients.get_kubernetes_client()
-
     try:
         path = '{}/{}'.format(
             constants.K8S_API_NAMESPACES, namespace)
         LOG.debug("K8s API Query %s", path)
-        namespaces = kubernetes.get(path)
+        namespaces = driver_utils.get_k8s_resource(
+            constants.K8S_OBJ_NAMESPACE, path, namespace)
         LOG.debug("Return Namespace: %s", namespaces)
     except exceptions.K8sResourceNotFound:
         LOG.exception("Namespace not found")
@@ -15,6 +15,8 @@
 
 import urllib
 
+import eventlet
+import netaddr
 from openstack import exceptions as os_exc
 from oslo_config import cfg
 from oslo_log import log
@@ -23,6 +25,7 @@ from oslo_serialization import jsonutils
 from kuryr_kubernetes import clients
 from kuryr_kubernetes import constants
 from kuryr_kubernetes import exceptions as k_exc
+from kuryr_kubernetes import k8s_cache
 from kuryr_kubernetes import utils
 
 
@@ -86,17 +89,23 @@ def get_pods(selector, namespace=None):
     return: k8s list object containing all matching pods
 
     """
-    kubernetes = clients.get_kubernetes_client()
-
     svc_selector = selector.get('selector')
+    labels = selector.get('matchLabels', None)
+    if not svc_selector and labels:
+        # Removing pod-template-hash as pods will not have it and
+        # otherwise there will be no match
+        labels.pop('pod-template-hash', None)
+
+    cache = k8s_cache.get_cache(constants.K8S_OBJ_POD)
+    if cache:
+        return {'items': cache.select(
+            k8s_cache.LabelSelector.from_k8s(selector), namespace)}
+
+    kubernetes = clients.get_kubernetes_client()
     if svc_selector:
         labels = replace_encoded_characters(svc_selector)
     else:
-        labels = selector.get('matchLabels', None)
         if labels:
-            # Removing pod-template-hash as pods will not have it and
-            # otherwise there will be no match
-            labels.pop('pod-template-hash', None)
             labels = replace_encoded_characters(labels)
 
         exps = selector.get('matchExpressions', None)
@@ -126,6 +135,11 @@ def get_namespaces(selector):
     return: k8s list object containing all matching namespaces
 
     """
+    cache = k8s_cache.get_cache(constants.K8S_OBJ_NAMESPACE)
+    if cache:
+        return {'items': cache.select(
+            k8s_cache.LabelSelector.from_k8s(selector))}
+
     kubernetes = clients.get_kubernetes_client()
     labels = selector.get('matchLabels', None)
     if labels:
@@ -147,6 +161,49 @@ def get_namespaces(selector):
     return namespaces
 
 
+def get_label_filter(selector):
+    """Returns a function matching object labels against the selector.
+
+    The returned function follows the K8s API label selector semantics, i.e.
+    objects without labels only match selectors that do not require any.
+
+    param selector: k8s selector of types matchLabels or matchExpressions, or
+                    a dict with a service selector under the 'selector' key
+    return: function receiving the object labels and returning True if they
+            match the selector and False otherwise
+    """
+    labels = selector.get('selector') or selector.get('matchLabels') or {}
+    expressions = selector.get('matchExpressions') or []
+
+    def label_filter(obj_labels):
+        obj_labels = obj_labels or {}
+        return (match_labels(labels, obj_labels) and
+                match_expressions(expressions, obj_labels))
+
+    return label_filter
+
+
+def get_k8s_resource(kind, path, name, namespace=None):
+    """Returns the K8s object, preferably from the watch cache.
+
+    K8s API is queried if objects of the given kind are not cached or if the
+    object has not reached the cache (yet).
+
+    param kind: k8s object kind, e.g. 'Namespace'
+    param path: k8s API path of the object
+    param name: name of the object
+    param namespace: namespace of the object, None for cluster-wide objects
+    return: k8s object
+    """
+    cache = k8s_cache.get_cache(kind)
+    if cache:
+        obj = cache.get(name, namespace)
+        if obj:
+            return obj
+    kubernetes = clients.get_kubernetes_client()
+    return kubernetes.get(path)
+
+
 def format_expression(expression):
     key = expression['key']
     operator = expression['operator'].lower()
@@ -195,6 +252,91 @@ def create_security_group_rule(body):
         raise
 
 
+def create_security_group_rules(bodies):
+    """Creates the security group rules with a single bulk request.
+
+    If any of the rules already exists Neutron rejects the whole bulk
+    request, in which case the rules are created one by one.
+
+    param bodies: list of security group rule bodies, as returned by
+                  `create_security_group_rule_body`
+    return: list with the IDs of the rules, in the order of `bodies`
+    """
+    if not bodies:
+        return []
+
+    os_net = clients.get_network_client()
+    sg_rules = []
+    for body in bodies:
+        sg_rule = dict(body['security_group_rule'])
+        sg_rule.pop('id', None)
+        sg_rules.append(sg_rule)
+
+    try:
+        sgrs = os_net.create_security_group_rules(
+            {'security_group_rules': sg_rules})
+        return [sgr.id for sgr in sgrs]
+    except os_exc.ConflictException:
+        LOG.debug("Some of the security group rules already exist, "
+                  "creating them one by one.")
+    return [create_security_group_rule(body) for body in bodies]
+
+
+def delete_security_group_rules(security_group_rule_ids):
+    """Deletes the security group rules concurrently.
+
+    At most `[neutron_defaults]sg_rule_workers` rules are deleted at the
+    same time. The first error found is raised once all the deletions are
+    done.
+
+    param security_group_rule_ids: list of the rule IDs to delete
+    """
+    pool = eventlet.GreenPool(CONF.neutron_defaults.sg_rule_workers)
+    results = pool.imap(_delete_security_group_rule,
+                        security_group_rule_ids)
+    errors = [ex for ex in results if ex]
+    if errors:
+        raise errors[0]
+
+
+def _delete_security_group_rule(security_group_rule_id):
+    try:
+        delete_security_group_rule(security_group_rule_id)
+    except os_exc.SDKException as ex:
+        return ex
+
+
+def get_security_group_rule_key(sg_rule):
+    """Returns a tuple identifying the security group rule.
+
+    Two rules with the same key are considered duplicates by Neutron, no
+    matter their description.
+
+    param sg_rule: the 'security_group_rule' part of a security group rule
+                   body, or a security group rule as returned by Neutron
+    """
+    # Neutron returns 'ethertype' while openstacksdk objects name it
+    # 'ether_type'
+    ethertype = sg_rule.get('ethertype') or sg_rule.get('ether_type')
+    port_range = (sg_rule.get('port_range_min'),
+                  sg_rule.get('port_range_max'))
+    # Neutron may store the whole port range as no range at all and stores
+    # the remote IPs as CIDRs, so those need to be normalized to compare the
+    # rules we'd like to have with the ones Neutron returns.
+    if port_range == (1, 65535):
+        port_range = (None, None)
+    remote_ip_prefix = sg_rule.get('remote_ip_prefix')
+    if remote_ip_prefix:
+        try:
+            remote_ip_prefix = str(netaddr.IPNetwork(remote_ip_prefix).cidr)
+        except (netaddr.AddrFormatError, ValueError, TypeError):
+            pass
+    protocol = sg_rule.get('protocol')
+    return (sg_rule.get('direction'), ethertype or 'IPv4',
+            protocol.lower() if protocol else None) + port_range + (
+            remote_ip_prefix, sg_rule.get('remote_group_id'))
+
+
 def delete_security_group_rule(security_group_rule_id):
     os_net = clients.get_network_client()
     try:
@@ -364,12 +506,12 @@ def match_selector(selector, labels):
 
 
 def get_namespace_subnet_cidr(namespace):
-    kubernetes = clients.get_kubernetes_client()
+    ns_name = namespace['metadata']['name']
     try:
         net_crd_path = (f"{constants.K8S_API_CRD_NAMESPACES}/"
-                        f"{namespace['metadata']['name']}/kuryrnetworks/"
-                        f"{namespace['metadata']['name']}")
-        net_crd = kubernetes.get(net_crd_path)
+                        f"{ns_name}/kuryrnetworks/{ns_name}")
+        net_crd = get_k8s_resource(constants.K8S_OBJ_KURYRNETWORK,
+                                   net_crd_path, ns_name, ns_name)
     except k_exc.K8sResourceNotFound:
         LOG.exception('Namespace not yet ready')
         raise k_exc.ResourceNotReady(namespace)
@@ -403,6 +545,10 @@ def tag_neutron_resources(resources):
 
 
 def get_services(namespace=None):
+    cache = k8s_cache.get_cache(constants.K8S_OBJ_SERVICE)
+    if cache:
+        return {'items': cache.list(namespace)}
+
     kubernetes = clients.get_kubernetes_client()
     try:
         if namespace:
@@ -439,9 +585,14 @@ def service_matches_affected_pods(service, pod_selectors):
 
 
 def get_namespaced_pods(namespace=None):
-    kubernetes = clients.get_kubernetes_client()
     if namespace:
         namespace = namespace['metadata']['name']
+    cache = k8s_cache.get_cache(constants.K8S_OBJ_POD)
+    if cache:
+        return {'items': cache.list(namespace)}
+
+    kubernetes = clients.get_kubernetes_client()
+    if namespace:
         pods = kubernetes.get(
             '{}/namespaces/{}/pods'.format(
                 constants.K8S_API_BASE, namespace))
@@ -491,11 +642,11 @@ def get_ports(resource, port):
 
 
 def get_namespace(namespace_name):
-    kubernetes = clients.get_kubernetes_client()
     try:
-        return kubernetes.get(
-            '{}/namespaces/{}'.format(
-                constants.K8S_API_BASE, namespace_name))
+        return get_k8s_resource(
+            constants.K8S_OBJ_NAMESPACE,
+            '{}/namespaces/{}'.format(constants.K8S_API_BASE, namespace_name),
+            namespace_name)
     except k_exc.K8sResourceNotFound:
         LOG.debug("Namespace not found: %s",
                   namespace_name)
@@ -16,12 +16,17 @@
 import abc
 import collections
 import eventlet
+from eventlet import queue
+import functools
+import math
 import os
 import time
+import uuid
 
 from kuryr.lib._i18n import _
 from kuryr.lib import constants as kl_const
 from openstack import exceptions as os_exc
+from os_vif import objects
 from oslo_cache import core as cache
 from oslo_concurrency import lockutils
 from oslo_config import cfg as oslo_cfg
@@ -33,14 +38,23 @@ from kuryr_kubernetes import clients
 from kuryr_kubernetes import config
 from kuryr_kubernetes import constants
 from kuryr_kubernetes.controller.drivers import base
+from kuryr_kubernetes.controller.drivers import nested_vif
 from kuryr_kubernetes.controller.drivers import utils as c_utils
 from kuryr_kubernetes.controller.managers import pool
+from kuryr_kubernetes.controller import sharding
 from kuryr_kubernetes import exceptions
+from kuryr_kubernetes import metrics
 from kuryr_kubernetes import os_vif_util as ovu
 from kuryr_kubernetes import utils
 
 LOG = logging.getLogger(__name__)
 
+# Maximum number of port ids filtered on by a single ports query, keeping the
+# query string within the URL length limits
+PORTS_QUERY_BATCH = 100
+# Maximum number of subports detached from a trunk in a single request
+SUBPORTS_DETACH_BATCH = 100
+
 # Moved out from neutron_default group
 vif_pool_driver_opts = [
     oslo_cfg.IntOpt('ports_pool_max',
@@ -57,6 +71,52 @@ vif_pool_driver_opts = [
                     help=_("Minimum interval (in seconds) "
                            "between pool updates"),
                     default=20),
+    oslo_cfg.BoolOpt('ports_pool_autoscale',
+                     help=_("Size the pools after the rate at which their "
+                            "ports are requested. Pools are then refilled "
+                            "ahead of the requests to keep them above the "
+                            "forecasted demand, within ports_pool_min and "
+                            "ports_pool_max, and pools not requested for "
+                            "ports_pool_idle_timeout seconds are shrunk "
+                            "back to ports_pool_min"),
+                     default=False),
+    oslo_cfg.IntOpt('ports_pool_demand_window',
+                    help=_("Interval (in seconds) over which the rate of "
+                           "port requests of each pool is measured when "
+                           "ports_pool_autoscale is enabled"),
+                    min=1,
+                    default=300),
+    oslo_cfg.IntOpt('ports_pool_idle_timeout',
+                    help=_("Time (in seconds) without port requests after "
+                           "which the ports exceeding ports_pool_min are "
+                           "deleted from a pool when ports_pool_autoscale "
+                           "is enabled. 0 to disable"),
+                    min=0,
+                    default=1800),
+    oslo_cfg.IntOpt('ports_pool_sg_buffer',
+                    help=_("Number of ports of each pool to keep with every "
+                           "security groups set requested from the pool "
+                           "within the last ports_pool_demand_window "
+                           "seconds, so that pods get ports without updating "
+                           "their security groups. The buffers are refilled "
+                           "in the background with the ports of the pool "
+                           "having security groups not in demand. 0 to "
+                           "disable"),
+                    min=0,
+                    default=0),
+    oslo_cfg.IntOpt('ports_pool_delete_workers',
+                    help=_("Maximum number of ports deleted concurrently "
+                           "when the ports of a pool are removed"),
+                    min=1,
+                    default=10),
+    oslo_cfg.BoolOpt('ports_pool_checkpoint',
+                     help=_("Checkpoint the ports pools in KuryrPool CRDs, "
+                            "so that a restarted or newly elected "
+                            "kuryr-controller loads its pools from them "
+                            "instead of listing the ports, trunks and pods, "
+                            "and checks them against Neutron in the "
+                            "background"),
+                     default=False),
     oslo_cfg.DictOpt('pools_vif_drivers',
                      help=_("Dict with the pool driver and pod driver to be "
                             "used. If not set, it will take them from the "
@@ -104,6 +164,306 @@ VIF_TYPE_TO_DRIVER_MAPPING = {
 }
 
 
+class PortsPool(object):
+    """Ports available in a pool, grouped by their security groups.
+
+    The ports of each security groups set are kept in a dict preserving the
+    order they were added in, and each port is indexed by its id, so ports
+    are added, popped (the last added first) and removed in O(1). The number
+    of ports of the pool is kept up to date, and the security groups sets are
+    kept in the order they were last updated, to reuse the ports of the
+    least recently updated one when there are no ports with the requested
+    security groups. Security groups sets without ports are dropped.
+    """
+
+    def __init__(self):
+        # security groups -> {port_id: None}
+        self._groups = collections.OrderedDict()
+        # port_id -> security groups
+        self._ports = {}
+
+    def __len__(self):
+        return len(self._ports)
+
+    def __iter__(self):
+        return iter(list(self._ports))
+
+    def __contains__(self, port_id):
+        return port_id in self._ports
+
+    def __repr__(self):
+        return 'PortsPool(%r)' % dict(self.items())
+
+    def items(self):
+        """Returns the (security groups, port ids) of the pool.
+
+        The security groups are listed from the least recently updated.
+        """
+        return [(sgs, list(ports)) for sgs, ports in self._groups.items()]
+
+    def ports(self, security_groups):
+        return list(self._groups.get(security_groups, ()))
+
+    def count(self, security_groups):
+        return len(self._groups.get(security_groups, ()))
+
+    def add(self, port_id, security_groups, last=True):
+        """Adds a port to the pool.
+
+        :param last: whether the security groups set becomes the most
+                     recently updated one, or the least recently updated one
+                     so that its ports are reused first
+        """
+        if port_id in self._ports:
+            self.remove(port_id)
+        ports = self._groups.get(security_groups)
+        if ports is None:
+            ports = self._groups[security_groups] = {}
+        self._groups.move_to_end(security_groups, last=last)
+        ports[port_id] = None
+        self._ports[port_id] = security_groups
+
+    def pop(self, security_groups):
+        """Pops a port with the given security groups.
+
+        :raises KeyError: if there is no port with those security groups
+        """
+        ports = self._groups[security_groups]
+        port_id, _ = ports.popitem()
+        self._discard_group(security_groups, ports)
+        del self._ports[port_id]
+        return port_id
+
+    def pop_lru(self, exclude=()):
+        """Pops a port of the least recently updated security groups.
+
+        :param exclude: security groups sets whose ports are not popped
+        :return: the port id and its security groups
+        :raises KeyError: if the pool has no port to pop
+        """
+        for security_groups in self._groups:
+            if security_groups not in exclude:
+                return self.pop(security_groups), security_groups
+        raise KeyError(_('The pool is empty'))
+
+    def pop_group(self, security_groups):
+        """Removes the ports with the given security groups.
+
+        :return: list of the removed port ids
+        """
+        ports = self._groups.pop(security_groups, {})
+        for port_id in ports:
+            del self._ports[port_id]
+        return list(ports)
+
+    def remove(self, port_id):
+        """Removes a port from the pool.
+
+        :raises KeyError: if the port is not in the pool
+        """
+        security_groups = self._ports.pop(port_id)
+        ports = self._groups[security_groups]
+        del ports[port_id]
+        self._discard_group(security_groups, ports)
+
+    def _discard_group(self, security_groups, ports):
+        if not ports:
+            del self._groups[security_groups]
+
+
+class PoolDemand(object):
+    """Tracks the port requests of a pool to forecast its demand.
+
+    The request rate is measured over two sliding windows: the configured
+    `window`, and the forecast `horizon` capturing the bursts, e.g. the
+    rollout of a deployment. The demand is forecasted with the highest of
+    both rates. The arguments of the last request are kept to create the
+    ports of the pool ahead of the next ones.
+    """
+
+    def __init__(self, window, now):
+        self._window = window
+        self._requests = collections.deque()
+        self.last_request = now
+        self.request_args = None
+
+    def add(self, now, pod, subnets, security_groups):
+        self._requests.append(now)
+        self.last_request = now
+        self.request_args = (pod, subnets, security_groups)
+
+    def forecast(self, now, horizon):
+        """Returns the number of ports requested in the next `horizon`."""
+        while self._requests and self._requests[0] <= now - self._window:
+            self._requests.popleft()
+        if not self._requests:
+            return 0
+
+        long_rate = len(self._requests) / max(self._window, horizon)
+        recent = sum(1 for t in reversed(self._requests) if t > now - horizon)
+        short_rate = recent / horizon
+        return int(math.ceil(max(long_rate, short_rate) * horizon))
+
+    def is_idle(self, now, timeout):
+        return bool(timeout) and now - self.last_request >= timeout
+
+
+def _get_sgs(port):
+    security_groups = port.get('securityGroups')
+    if security_groups is None:
+        return None
+    return tuple(security_groups)
+
+
+def _delete_port(port_id):
+    """Deletes the port, returning its id if the deletion failed."""
+    os_net = clients.get_network_client()
+    try:
+        os_net.delete_port(port_id)
+    except os_exc.SDKException:
+        LOG.warning("Error removing the port %s", port_id)
+        return port_id
+    return None
+
+
+class PoolCheckpoint(object):
+    """Persists the ports pools of a driver in KuryrPool CRDs.
+
+    Each pool is checkpointed in a KuryrPool object with the ports available
+    in the pool, along with their security groups and VIF, and the ports
+    waiting to be recycled into it. Only the pools that changed since they
+    were last written are written again, and the objects of the pools left
+    without ports are deleted.
+    """
+
+    def __init__(self, driver_name):
+        self.driver_name = driver_name
+        # pool_key -> checkpointed ports, see _get_state
+        self._written = {}
+
+    def get_name(self, pool_key):
+        key = '/'.join([self.driver_name] + [str(k) for k in pool_key])
+        return '%s-%s' % (self.driver_name.lower(),
+                          uuid.uuid5(uuid.NAMESPACE_URL, key))
+
+    def load(self, is_owned_host=None):
+        """Returns the checkpointed pools of the driver.
+
+        :param is_owned_host: callable returning whether the pools of a host
+                              belong to this controller. The pools of the
+                              other hosts are neither loaded nor written.
+        :return: dict with the pool keys as keys and the KuryrPool spec as
+                 values
+        """
+        k8s = clients.get_kubernetes_client()
+        crds = k8s.get(constants.K8S_API_CRD_KURYRPOOLS)
+        pools = {}
+        self._written = {}
+        for crd in crds.get('items', []):
+            spec = crd['spec']
+            if spec.get('driver') != self.driver_name:
+                continue
+            if is_owned_host and not is_owned_host(spec['host']):
+                continue
+            pool_key = (spec['host'], spec['projectId'], spec['networkId'])
+            pools[pool_key] = spec
+            self._written[pool_key] = (
+                tuple((p['id'], _get_sgs(p)) for p in spec['availablePorts']),
+                tuple(p['id'] for p in spec['recyclablePorts']))
+        return pools
+
+    def write(self, pools, recyclable_ports, vifs):
+        """Writes the pools that changed since they were last written.
+
+        :param pools: dict with the pool keys as keys and the PortsPool as
+                      values
+        :param recyclable_ports: dict with the port ids to be recycled as keys
+                                 and their pool keys as values
+        :param vifs: dict with the port ids as keys and their VIF as values
+        """
+        recyclable = collections.defaultdict(list)
+        for port_id, pool_key in list(recyclable_ports.items()):
+            recyclable[pool_key].append(port_id)
+
+        # NOTE: the specs are built before writing any of them, as the pools
+        # may change while the requests are in flight
+        changed = {}
+        for pool_key in set(pools) | set(recyclable) | set(self._written):
+            state = self._get_state(pools.get(pool_key),
+                                    recyclable.get(pool_key, []), vifs)
+            if state != self._written.get(pool_key, ((), ())):
+                changed[pool_key] = (state,
+                                     self._get_spec(pool_key, state, vifs))
+
+        for pool_key, (state, spec) in changed.items():
+            if spec['availablePorts'] or spec['recyclablePorts']:
+                self._write_pool(pool_key, spec)
+                self._written[pool_key] = state
+            else:
+                self._delete_pool(pool_key)
+                self._written.pop(pool_key, None)
+
+    def forget(self, pool_key):
+        """Stops writing the pool, leaving its KuryrPool as it is.
+
+        The pools handed over to another controller are written by it from
+        then on.
+        """
+        self._written.pop(pool_key, None)
+
+    def _get_state(self, pool_ports, recyclable, vifs):
+        available = []
+        for security_groups, ports in (pool_ports.items() if pool_ports
+                                       else []):
+            available.extend((port_id, security_groups) for port_id in ports
+                             if port_id in vifs)
+        return (tuple(available),
+                tuple(port_id for port_id in recyclable if port_id in vifs))
+
+    def _get_spec(self, pool_key, state, vifs):
+        available, recyclable = state
+        spec = {
+            'driver': self.driver_name,
+            'host': pool_key[0],
+            'projectId': pool_key[1],
+            'networkId': pool_key[2],
+            'availablePorts': [],
+            'recyclablePorts': [{'id': port_id,
+                                 'vif': vifs[port_id].obj_to_primitive()}
+                                for port_id in recyclable],
+        }
+        for port_id, security_groups in available:
+            port = {'id': port_id, 'vif': vifs[port_id].obj_to_primitive()}
+            if security_groups is not None:
+                port['securityGroups'] = list(security_groups)
+            spec['availablePorts'].append(port)
+        return spec
+
+    def _write_pool(self, pool_key, spec):
+        k8s = clients.get_kubernetes_client()
+        name = self.get_name(pool_key)
+        try:
+            k8s.patch_crd('spec', '%s/%s' % (
+                constants.K8S_API_CRD_KURYRPOOLS, name), {
+                    'availablePorts': spec['availablePorts'],
+                    'recyclablePorts': spec['recyclablePorts']})
+        except exceptions.K8sResourceNotFound:
+            k8s.post(constants.K8S_API_CRD_KURYRPOOLS, {
+                'apiVersion': 'openstack.org/v1',
+                'kind': constants.K8S_OBJ_KURYRPOOL,
+                'metadata': {'name': name},
+                'spec': spec,
+            })
+
+    def _delete_pool(self, pool_key):
+        k8s = clients.get_kubernetes_client()
+        try:
+            k8s.delete('%s/%s' % (constants.K8S_API_CRD_KURYRPOOLS,
+                                  self.get_name(pool_key)))
+        except exceptions.K8sResourceNotFound:
+            LOG.debug("KuryrPool of pool %s already deleted", pool_key)
+
+
 class NoopVIFPool(base.VIFPoolDriver):
     """No pool VIFs for Kubernetes Pods"""
 
@@ -129,20 +489,35 @@ class NoopVIFPool(base.VIFPoolDriver):
     def sync_pools(self):
         pass
 
+    def handoff_pools(self, previous_ring):
+        pass
+
 
 class BaseVIFPool(base.VIFPoolDriver, metaclass=abc.ABCMeta):
     """Skeletal pool driver.
 
     In order to handle the pools of ports, a few dicts are used:
     _available_ports_pool is a dictionary with the ready to use Neutron ports
-    information. The keys are the 'pool_key' and the values the 'port_id's.
+    information. The keys are the 'pool_key' and the values the PortsPool
+    with the 'port_id's.
     _existing_vifs is a dictionary containing the port vif objects. The keys
     are the 'port_id' and the values are the vif objects.
     _recyclable_ports is a dictionary with the Neutron ports to be
     recycled. The keys are the 'port_id' and their values are the 'pool_key'.
-    _last_update is a dictionary with the timestamp of the last population
-    action for each pool. The keys are the pool_keys and the values are the
-    timestamps.
+    _port_sgs is a dictionary with the security groups applied by Kuryr to
+    the ports in use by the pods. The keys are the 'port_id' and the values
+    the sorted tuple of security groups. It spares listing the ports to know
+    the security groups of the recycled ones.
+    _last_update is a dictionary with the timestamps of the last population
+    actions of each pool. The keys are the pool_keys and the values dicts
+    with the timestamp of the last population with each security groups
+    tuple.
+
+    _pool_demand is a dictionary with the PoolDemand tracking the port
+    requests of each pool. The keys are the pool_keys.
+    _sg_demand is a dictionary with the security groups requested from each
+    pool. The keys are the pool_keys and the values dicts with the timestamp
+    of the last request of each security groups tuple.
 
     The following driver configuration options exist:
     - ports_pool_max: it specifies how many ports can be kept at each pool.
@@ -154,14 +529,31 @@ class BaseVIFPool(base.VIFPoolDriver, metaclass=abc.ABCMeta):
     - ports_pool_batch: target number of ports to be created in bulk requests
     when populating pools.
     - ports_pool_update_frequency: interval in seconds between ports pool
-    updates, both for populating pools as well as for recycling ports.
+    updates, both for populating pools as well as for recycling ports. The
+    released ports are recycled as soon as they are queued in between.
+    - ports_pool_autoscale: keep the pools above the demand forecasted from
+    the rate of port requests over ports_pool_demand_window seconds, and
+    shrink the pools not requested for ports_pool_idle_timeout seconds.
+    - ports_pool_sg_buffer: number of ports kept with each security groups
+    set requested from a pool within ports_pool_demand_window seconds. The
+    ports of the pool with other security groups are updated in the
+    background to refill the buffers, so that pods are not delayed by a port
+    update.
+    - ports_pool_checkpoint: write the pools to KuryrPool CRDs after every
+    update, and load them from there on sync instead of recovering them from
+    Neutron, which is then done in the background.
     """
 
     def __init__(self):
         # Note(ltomasbo) Execute the port recycling periodic actions in a
         # background thread
         self._recovered_pools = False
+        self._released_ports = queue.LightQueue()
+        # Ports taken out of the pools whose deletion is to be retried
+        self._ports_to_delete = set()
+        self._checkpoint = PoolCheckpoint(type(self).__name__)
         eventlet.spawn(self._return_ports_to_pool)
+        metrics.VIF_POOLS.add(self)
 
     def set_vif_driver(self, driver):
         self._drv_vif = driver
@@ -170,14 +562,23 @@ class BaseVIFPool(base.VIFPoolDriver, metaclass=abc.ABCMeta):
         self._drv_vif.activate_vif(pod, vif)
 
     def update_vif_sgs(self, pod, sgs):
+        pod_state = c_utils.get_pod_state(pod)
+        if not pod_state:
+            self._drv_vif.update_vif_sgs(pod, sgs)
+            return
+        # The VIF driver only updates the default VIF. Its security groups
+        # are unknown until the update succeeds.
+        port_id = pod_state.vifs[constants.DEFAULT_IFNAME].id
+        self._port_sgs.pop(port_id, None)
         self._drv_vif.update_vif_sgs(pod, sgs)
+        self._port_sgs[port_id] = tuple(sorted(sgs))
 
     def _get_pool_size(self, pool_key):
-        pool = self._available_ports_pools.get(pool_key, {})
-        pool_members = []
-        for port_list in pool.values():
-            pool_members.extend(port_list)
-        return len(pool_members)
+        return len(self._available_ports_pools.get(pool_key, ()))
+
+    def get_pool_sizes(self):
+        return {pool_key: self._get_pool_size(pool_key)
+                for pool_key in list(self._available_ports_pools)}
 
     def _get_host_addr(self, pod):
         return pod['status']['hostIP']
@@ -192,6 +593,23 @@ class BaseVIFPool(base.VIFPoolDriver, metaclass=abc.ABCMeta):
     def _get_pool_key_net(self, pool_key):
         return pool_key[2]
 
+    def _get_host_shard_key(self, host):
+        return host
+
+    def _is_owned_host(self, host):
+        """Returns whether the pools of the host belong to this controller.
+
+        All the pools belong to the controller unless it is sharded.
+        """
+        shard_manager = sharding.get_shard_manager()
+        return shard_manager is None or shard_manager.is_owner(
+            self._get_host_shard_key(host))
+
+    def _is_gained_host(self, host, previous_ring):
+        """Returns whether the pools of the host were handed over to us."""
+        return sharding.get_shard_manager().is_gained_key(
+            self._get_host_shard_key(host), previous_ring)
+
     def request_vif(self, pod, project_id, subnets, security_groups):
         try:
             host_addr = self._get_host_addr(pod)
@@ -199,6 +617,12 @@ class BaseVIFPool(base.VIFPoolDriver, metaclass=abc.ABCMeta):
             return None
 
         pool_key = self._get_pool_key(host_addr, project_id, None, subnets)
+        if oslo_cfg.CONF.vif_pool.ports_pool_autoscale:
+            self._record_request(pool_key, pod, subnets,
+                                 tuple(sorted(security_groups)))
+        if oslo_cfg.CONF.vif_pool.ports_pool_sg_buffer:
+            self._sg_demand[pool_key][tuple(sorted(security_groups))] = (
+                time.time())
 
         try:
             return self._get_port_from_pool(pool_key, pod, subnets,
@@ -233,25 +657,207 @@ class BaseVIFPool(base.VIFPoolDriver, metaclass=abc.ABCMeta):
             except AttributeError:
                 LOG.info("Kuryr-controller not yet ready to populate pools")
                 return
-        self._last_update[pool_key] = {security_groups: now}
+        self._last_update.setdefault(pool_key, {})[security_groups] = now
 
         pool_size = self._get_pool_size(pool_key)
-        if pool_size < oslo_cfg.CONF.vif_pool.ports_pool_min:
+        pool_target = oslo_cfg.CONF.vif_pool.ports_pool_min
+        if oslo_cfg.CONF.vif_pool.ports_pool_autoscale:
+            pool_target = self._get_pool_target(pool_key)
+        if pool_size < pool_target:
             num_ports = max(oslo_cfg.CONF.vif_pool.ports_pool_batch,
-                            oslo_cfg.CONF.vif_pool.ports_pool_min - pool_size)
-            vifs = self._drv_vif.request_vifs(
-                pod=pod,
-                project_id=pool_key[1],
-                subnets=subnets,
-                security_groups=security_groups,
-                num_ports=num_ports)
-            for vif in vifs:
-                self._existing_vifs[vif.id] = vif
-                self._available_ports_pools.setdefault(
-                    pool_key, {}).setdefault(
-                        security_groups, []).append(vif.id)
+                            pool_target - pool_size)
+            vifs = self._create_pool_ports(pool_key, pod, subnets,
+                                           security_groups, num_ports)
             if not vifs:
-                self._last_update[pool_key] = {security_groups: last_update}
+                self._last_update[pool_key][security_groups] = last_update
+
+    def _create_pool_ports(self, pool_key, pod, subnets, security_groups,
+                           num_ports):
+        vifs = self._drv_vif.request_vifs(
+            pod=pod,
+            project_id=pool_key[1],
+            subnets=subnets,
+            security_groups=security_groups,
+            num_ports=num_ports)
+        for vif in vifs:
+            self._existing_vifs[vif.id] = vif
+            self._available_ports_pools[pool_key].add(vif.id, security_groups)
+        return vifs
+
+    def _delete_pool_ports(self, pool_key, port_ids):
+        """Deletes ports taken out of a pool.
+
+        :return: list of the ports that could not be deleted
+        """
+        raise NotImplementedError()
+
+    def _delete_ports(self, port_ids):
+        """Deletes the ports concurrently.
+
+        At most `[vif_pool]ports_pool_delete_workers` ports are deleted at
+        the same time.
+
+        :return: list of the ports that could not be deleted
+        """
+        pool = eventlet.GreenPool(
+            oslo_cfg.CONF.vif_pool.ports_pool_delete_workers)
+        return [port_id for port_id in pool.imap(_delete_port, port_ids)
+                if port_id]
+
+    def _retry_ports_deletion(self):
+        """Deletes again the ports whose deletion failed."""
+        if not self._ports_to_delete:
+            return
+        port_ids = list(self._ports_to_delete)
+        failed = self._delete_ports(port_ids)
+        self._ports_to_delete.difference_update(port_ids)
+        self._ports_to_delete.update(failed)
+
+    def _record_request(self, pool_key, pod, subnets, security_groups):
+        now = time.time()
+        demand = self._pool_demand.get(pool_key)
+        if demand is None:
+            demand = self._pool_demand[pool_key] = PoolDemand(
+                oslo_cfg.CONF.vif_pool.ports_pool_demand_window, now)
+        demand.add(now, pod, subnets, security_groups)
+
+    def _get_pool_target(self, pool_key, now=None):
+        """Returns the number of ports the pool should have available."""
+        pool_min = oslo_cfg.CONF.vif_pool.ports_pool_min
+        demand = self._pool_demand.get(pool_key)
+        if not demand:
+            return pool_min
+
+        forecast = demand.forecast(
+            now or time.time(),
+            oslo_cfg.CONF.vif_pool.ports_pool_update_frequency)
+        target = max(pool_min, forecast)
+        if oslo_cfg.CONF.vif_pool.ports_pool_max:
+            target = min(target, oslo_cfg.CONF.vif_pool.ports_pool_max)
+        return target
+
+    def _scale_pools(self):
+        """Sizes the pools after their forecasted demand.
+
+        Pools below their target size are refilled, using the arguments of
+        their last port request, and the pools that were not requested for
+        ports_pool_idle_timeout seconds are shrunk back to ports_pool_min.
+        """
+        if not self._recovered_pools:
+            return
+        now = time.time()
+        for pool_key in list(self._available_ports_pools):
+            if pool_key not in self._pool_demand:
+                # Pools recovered or populated on request start idling now
+                self._pool_demand[pool_key] = PoolDemand(
+                    oslo_cfg.CONF.vif_pool.ports_pool_demand_window, now)
+
+        for pool_key, demand in list(self._pool_demand.items()):
+            pool_size = self._get_pool_size(pool_key)
+            pool_target = self._get_pool_target(pool_key, now)
+            if pool_size < pool_target and demand.request_args:
+                pod, subnets, security_groups = demand.request_args
+                LOG.debug("Scaling up pool %s from %d to %d ports",
+                          pool_key, pool_size, pool_target)
+                self._last_update.setdefault(pool_key, {})[
+                    security_groups] = now
+                try:
+                    self._create_pool_ports(pool_key, pod, subnets,
+                                            security_groups,
+                                            pool_target - pool_size)
+                except (os_exc.SDKException, exceptions.K8sClientException):
+                    LOG.warning("Error populating pool %s", pool_key)
+            elif (pool_size > oslo_cfg.CONF.vif_pool.ports_pool_min and
+                    demand.is_idle(
+                        now, oslo_cfg.CONF.vif_pool.ports_pool_idle_timeout)):
+                LOG.debug("Scaling down idle pool %s from %d to %d ports",
+                          pool_key, pool_size,
+                          oslo_cfg.CONF.vif_pool.ports_pool_min)
+                self._shrink_pool(
+                    pool_key,
+                    pool_size - oslo_cfg.CONF.vif_pool.ports_pool_min)
+            elif not pool_size and demand.is_idle(
+                    now, oslo_cfg.CONF.vif_pool.ports_pool_idle_timeout):
+                del self._pool_demand[pool_key]
+
+    def _get_demanded_sgs(self, pool_key, now):
+        """Returns the security groups requested from the pool recently.
+
+        Security groups not requested within ports_pool_demand_window
+        seconds are forgotten.
+
+        :return: list of the security groups tuples, from the most recently
+                 requested
+        """
+        demand = self._sg_demand.get(pool_key)
+        if not demand:
+            return []
+        window = oslo_cfg.CONF.vif_pool.ports_pool_demand_window
+        for security_groups, last_request in list(demand.items()):
+            if last_request <= now - window:
+                del demand[security_groups]
+        if not demand:
+            del self._sg_demand[pool_key]
+        return sorted(demand, key=demand.get, reverse=True)
+
+    def _check_sg_buffer(self, pool_key, security_groups):
+        """Refills in the background the buffer a port was taken from."""
+        buffer_size = oslo_cfg.CONF.vif_pool.ports_pool_sg_buffer
+        if not buffer_size or pool_key in self._refilling_pools:
+            return
+        pool_ports = self._available_ports_pools.get(pool_key)
+        if pool_ports and pool_ports.count(security_groups) < buffer_size:
+            eventlet.spawn(self._refill_sg_buffers, pool_key)
+
+    def _refill_sg_buffers(self, pool_key):
+        """Updates idle ports of the pool to the security groups in demand.
+
+        The buffer of each security groups set requested recently is filled
+        up to ports_pool_sg_buffer ports with the ports of the security
+        groups not in demand, the least recently updated first.
+        """
+        buffer_size = oslo_cfg.CONF.vif_pool.ports_pool_sg_buffer
+        pool_ports = self._available_ports_pools.get(pool_key)
+        if (not buffer_size or not pool_ports or
+                pool_key in self._refilling_pools):
+            return
+
+        self._refilling_pools.add(pool_key)
+        try:
+            demanded = self._get_demanded_sgs(pool_key, time.time())
+            os_net = clients.get_network_client()
+            for security_groups in demanded:
+                while pool_ports.count(security_groups) < buffer_size:
+                    try:
+                        port_id, idle_sgs = pool_ports.pop_lru(
+                            exclude=demanded)
+                    except KeyError:
+                        return
+                    try:
+                        os_net.update_port(
+                            port_id, security_groups=list(security_groups))
+                    except os_exc.SDKException:
+                        LOG.warning("Error updating the security groups of "
+                                    "port %s of pool %s", port_id, pool_key)
+                        pool_ports.add(port_id, idle_sgs, last=False)
+                        return
+                    LOG.debug("Moved port %s of pool %s to security groups "
+                              "%s", port_id, pool_key, security_groups)
+                    pool_ports.add(port_id, security_groups)
+        finally:
+            self._refilling_pools.discard(pool_key)
+
+    def _shrink_pool(self, pool_key, num_ports):
+        pool_ports = self._available_ports_pools.get(pool_key)
+        removed = {}
+        # Ports of the least recently updated security groups go first
+        while pool_ports and len(removed) < num_ports:
+            port_id, security_groups = pool_ports.pop_lru()
+            removed[port_id] = security_groups
+        if not removed:
+            return
+        for port_id in self._delete_pool_ports(pool_key, list(removed)):
+            pool_ports.add(port_id, removed[port_id], last=False)
 
     def release_vif(self, pod, vif, project_id, security_groups,
                     host_addr=None):
@@ -268,11 +874,175 @@ class BaseVIFPool(base.VIFPoolDriver, metaclass=abc.ABCMeta):
         except AttributeError:
             LOG.info("Kuryr-controller is not ready to handle the pools yet.")
             raise exceptions.ResourceNotReady(pod)
+        self._released_ports.put(vif.id)
 
     def _return_ports_to_pool(self):
+        """Recycle ports to be reused by future pods.
+
+        For each port in the recyclable_ports dict it reapplies
+        security group if they have been changed and it changes the port
+        name to available_port if the port_debug option is enabled.
+        Then the port_id is included in the dict with the available_ports.
+
+        If a maximum number of ports per pool is set, the port will be
+        deleted if the maximum has been already reached.
+
+        Ports are recycled as soon as they are released, while the pools are
+        scaled every ports_pool_update_frequency seconds. The security groups
+        buffers are refilled and the failed port deletions retried after
+        every pass.
+        """
+        last_scale = time.time()
+        while True:
+            self._wait_for_released_ports()
+            self._trigger_return_to_pool()
+            self._retry_ports_deletion()
+            now = time.time()
+            if (oslo_cfg.CONF.vif_pool.ports_pool_autoscale and
+                    now - last_scale >=
+                    oslo_cfg.CONF.vif_pool.ports_pool_update_frequency):
+                self._scale_pools()
+                last_scale = now
+            if oslo_cfg.CONF.vif_pool.ports_pool_sg_buffer:
+                for pool_key in list(self._sg_demand):
+                    self._refill_sg_buffers(pool_key)
+            if oslo_cfg.CONF.vif_pool.ports_pool_checkpoint:
+                self._checkpoint_pools()
+
+    def _wait_for_released_ports(self):
+        """Blocks until ports are released or the update period elapses."""
+        try:
+            self._released_ports.get(
+                timeout=oslo_cfg.CONF.vif_pool.ports_pool_update_frequency)
+        except queue.Empty:
+            return
+        # The ports released meanwhile are recycled in the same pass
+        while True:
+            try:
+                self._released_ports.get_nowait()
+            except queue.Empty:
+                return
+
+    def _trigger_return_to_pool(self):
         raise NotImplementedError()
 
-    def _recover_precreated_ports(self):
+    def _checkpoint_pools(self):
+        if not self._recovered_pools:
+            return
+        try:
+            self._checkpoint.write(self._available_ports_pools,
+                                   self._recyclable_ports,
+                                   self._existing_vifs)
+        except exceptions.K8sClientException:
+            LOG.exception("Error checkpointing the ports pools.")
+
+    def _load_checkpoint(self):
+        """Loads the pools from their checkpoint.
+
+        The ports used by the pods since the pools were last checkpointed are
+        left out of the pools.
+
+        :return: whether the pools were loaded
+        """
+        if not oslo_cfg.CONF.vif_pool.ports_pool_checkpoint:
+            return False
+        try:
+            pools = self._checkpoint.load(self._is_owned_host)
+            if not pools:
+                return False
+            in_use_ports = set(self._get_in_use_ports())
+        except exceptions.K8sClientException:
+            LOG.exception("Error loading the ports pools checkpoint. "
+                          "Recovering the pools from Neutron.")
+            return False
+
+        for pool_key, spec in pools.items():
+            for port in spec['availablePorts']:
+                if port['id'] in in_use_ports:
+                    continue
+                self._existing_vifs[port['id']] = (
+                    objects.base.VersionedObject.obj_from_primitive(
+                        port['vif']))
+                self._available_ports_pools[pool_key].add(port['id'],
+                                                          _get_sgs(port))
+            for port in spec['recyclablePorts']:
+                if port['id'] in in_use_ports:
+                    continue
+                self._existing_vifs[port['id']] = (
+                    objects.base.VersionedObject.obj_from_primitive(
+                        port['vif']))
+                self._recyclable_ports[port['id']] = pool_key
+        LOG.info("PORTS POOL: pools loaded from their checkpoint")
+        self._create_healthcheck_file()
+        return True
+
+    @lockutils.synchronized('return_to_pool_baremetal')
+    @lockutils.synchronized('return_to_pool_nested')
+    def _validate_checkpoint(self):
+        """Checks the pools loaded from the checkpoint against Neutron.
+
+        The ports deleted since the checkpoint are removed from the pools,
+        and the ones not checkpointed yet are recovered into them.
+        """
+        os_net = clients.get_network_client()
+        port_ids = [port_id for pool_ports in
+                    list(self._available_ports_pools.values())
+                    for port_id in pool_ports]
+        found = set()
+        for i in range(0, len(port_ids), PORTS_QUERY_BATCH):
+            found.update(port.id for port in os_net.ports(
+                id=port_ids[i:i + PORTS_QUERY_BATCH]))
+        for pool_ports in list(self._available_ports_pools.values()):
+            for port_id in pool_ports:
+                if port_id in found:
+                    continue
+                LOG.debug("Removing port %s deleted since the pools were "
+                          "checkpointed", port_id)
+                pool_ports.remove(port_id)
+                self._existing_vifs.pop(port_id, None)
+        self._recover_precreated_ports()
+
+    def _get_recyclable_sgs(self, device_owner):
+        """Returns the current security groups of the recyclable ports.
+
+        Security groups applied by Kuryr are known locally, so only the ports
+        missing from _port_sgs, e.g. the ones in use before a restart, are
+        queried to Neutron, filtering on their ids. When the controller is
+        sharded, the security groups may be updated by another controller,
+        so all the ports are queried.
+        """
+        sg_current = {}
+        unknown = []
+        port_sgs = self._port_sgs
+        if sharding.get_shard_manager() is not None:
+            port_sgs = {}
+        for port_id in self._recyclable_ports:
+            security_groups = port_sgs.get(port_id)
+            if security_groups is None:
+                unknown.append(port_id)
+            else:
+                sg_current[port_id] = security_groups
+        if not unknown or config.CONF.kubernetes.port_debug:
+            return sg_current
+
+        os_net = clients.get_network_client()
+        attrs = {'device_owner': device_owner}
+        tags = config.CONF.neutron_defaults.resource_tags
+        if tags:
+            attrs['tags'] = tags
+        for i in range(0, len(unknown), PORTS_QUERY_BATCH):
+            for port in os_net.ports(id=unknown[i:i + PORTS_QUERY_BATCH],
+                                     **attrs):
+                sg_current[port.id] = tuple(sorted(port.security_group_ids))
+        return sg_current
+
+    def _recover_precreated_ports(self, host_filter=None):
+        """Recovers the available ports into their pools.
+
+        :param host_filter: callable returning whether the ports of a host
+                            are recovered. By default, the ones of the owned
+                            hosts are.
+        """
         raise NotImplementedError()
 
     def _get_in_use_ports(self):
@@ -306,13 +1076,14 @@ class BaseVIFPool(base.VIFPoolDriver, metaclass=abc.ABCMeta):
         for pool_key, pool_ports in list(self._available_ports_pools.items()):
             if self._get_pool_key_net(pool_key) != net_id:
                 continue
-            for sg_key, ports in list(pool_ports.items()):
+            for sg_key in list(self._sg_demand.get(pool_key, ())):
+                if sg_id in sg_key:
+                    del self._sg_demand[pool_key][sg_key]
+            for sg_key, ports in pool_ports.items():
                 if sg_id not in sg_key:
                     continue
                 # remove the pool associated to that SG
-                try:
-                    del self._available_ports_pools[pool_key][sg_key]
-                except KeyError:
+                if not pool_ports.pop_group(sg_key):
                     LOG.debug("SG already removed from the pool. Ports "
                               "already re-used, no need to change their "
                               "associated SGs.")
@@ -320,13 +1091,33 @@ class BaseVIFPool(base.VIFPoolDriver, metaclass=abc.ABCMeta):
                 for port_id in ports:
                     # remove all SGs from the port to be reused
                     os_net.update_port(port_id, security_groups=None)
-                    # add the port to the default pool
-                    self._available_ports_pools[pool_key].setdefault(
-                        tuple([]), []).append(port_id)
-                # NOTE(ltomasbo): as this ports were not created for this
-                # pool, ensuring they are used first, marking them as the
-                # most outdated
-                self._last_update[pool_key] = {tuple([]): 0}
+                    # NOTE(ltomasbo): as this ports were not created for this
+                    # pool, ensuring they are used first, marking them as the
+                    # most outdated, in the default pool
+                    pool_ports.add(port_id, tuple([]), last=False)
+        if sharding.get_shard_manager() is not None:
+            self._remove_sg_from_unowned_ports(sg_id, net_id)
+
+    def _remove_sg_from_unowned_ports(self, sg_id, net_id):
+        """Removes the SG from the pool ports of the other controllers.
+
+        Only the pools of the nodes owned by this controller are known, so
+        the SG is removed from the rest of the available pool ports of the
+        network in Neutron. They are used first when their pool is requested
+        for other security groups, as they are not in demand anymore.
+        """
+        os_net = clients.get_network_client()
+        known = self._existing_vifs
+        for port in os_net.ports(network_id=net_id, status='DOWN',
+                                 security_group_ids=[sg_id]):
+            if (port.id in known or port.device_owner not in (
+                    kl_const.DEVICE_OWNER, 'trunk:subport')):
+                continue
+            try:
+                os_net.update_port(port.id, security_groups=None)
+            except os_exc.SDKException:
+                LOG.warning("Error removing the security group %s from "
+                            "port %s", sg_id, port.id)
 
     def _create_healthcheck_file(self):
         # Note(ltomasbo): Create a health check file when the pre-created
@@ -350,10 +1141,60 @@ class BaseVIFPool(base.VIFPoolDriver, metaclass=abc.ABCMeta):
         except OSError:
             pass
 
-        self._available_ports_pools = collections.defaultdict()
+        self._available_ports_pools = collections.defaultdict(PortsPool)
         self._existing_vifs = collections.defaultdict()
         self._recyclable_ports = collections.defaultdict()
+        self._port_sgs = {}
         self._last_update = collections.defaultdict()
+        self._pool_demand = {}
+        self._sg_demand = collections.defaultdict(dict)
+        self._refilling_pools = set()
+
+    def handoff_pools(self, previous_ring):
+        """Hands the pools over along with the nodes of the controller.
+
+        Unlike `sync_pools`, the pools of the nodes kept are left as they
+        are, as ports keep being taken out of them meanwhile. The pools of
+        the nodes lost are dropped, without deleting their ports, for their
+        new owner to recover them, and the ports of the nodes gained are
+        recovered into pools.
+
+        :param previous_ring: the ring owning the keys before the handoff
+        """
+        if not self._recovered_pools:
+            # The pools being synced are only recovered for the owned nodes
+            return
+        # The ports released on the nodes lost are recycled before their
+        # pools are dropped
+        self._trigger_return_to_pool()
+        self._handoff_pools(previous_ring)
+
+    @lockutils.synchronized('return_to_pool_baremetal')
+    @lockutils.synchronized('return_to_pool_nested')
+    def _handoff_pools(self, previous_ring):
+        pool_keys = (set(self._available_ports_pools) |
+                     set(self._recyclable_ports.values()) |
+                     set(self._last_update) | set(self._pool_demand) |
+                     set(self._sg_demand))
+        lost = {pool_key for pool_key in pool_keys
+                if not self._is_owned_host(pool_key[0])}
+        for pool_key in lost:
+            LOG.debug("Dropping the pool %s handed over", pool_key)
+            for port_id in self._available_ports_pools.pop(pool_key, ()):
+                self._existing_vifs.pop(port_id, None)
+            self._last_update.pop(pool_key, None)
+            self._pool_demand.pop(pool_key, None)
+            self._sg_demand.pop(pool_key, None)
+            self._checkpoint.forget(pool_key)
+        for port_id, pool_key in list(self._recyclable_ports.items()):
+            if pool_key in lost:
+                del self._recyclable_ports[port_id]
+                self._existing_vifs.pop(port_id, None)
+
+        # The ports known are skipped, so the ones taken out of the pools
+        # and not in use yet are not put back into them
+        self._recover_precreated_ports(functools.partial(
+            self._is_gained_host, previous_ring=previous_ring))
 
     def _get_trunks_info(self):
         """Returns information about trunks and their subports.
@@ -464,37 +1305,22 @@ class NeutronVIFPool(BaseVIFPool):
 
     def _get_port_from_pool(self, pool_key, pod, subnets, security_groups):
         try:
-            pool_ports = self._available_ports_pools[pool_key]
-        except (KeyError, AttributeError):
+            pool_ports = self._available_ports_pools.get(pool_key)
+        except AttributeError:
+            raise exceptions.ResourceNotReady(pod)
+        if not pool_ports:
             raise exceptions.ResourceNotReady(pod)
         try:
-            port_id = pool_ports[security_groups].pop()
-        except (KeyError, IndexError):
+            port_id = pool_ports.pop(security_groups)
+        except KeyError:
             # Get another port from the pool and update the SG to the
             # appropriate one. It uses a port from the group that was updated
             # longer ago
-            pool_updates = self._last_update.get(pool_key, {})
-            if not pool_updates:
-                # No pools update info. Selecting a random one
-                for sg_group, ports in list(pool_ports.items()):
-                    if len(ports) > 0:
-                        port_id = pool_ports[sg_group].pop()
-                        break
-                else:
-                    raise exceptions.ResourceNotReady(pod)
-            else:
-                min_date = -1
-                for sg_group, date in list(pool_updates.items()):
-                    if pool_ports.get(sg_group):
-                        if min_date == -1 or date < min_date:
-                            min_date = date
-                            min_sg_group = sg_group
-                if min_date == -1:
-                    # pool is empty, no port to reuse
-                    raise exceptions.ResourceNotReady(pod)
-                port_id = pool_ports[min_sg_group].pop()
+            port_id = pool_ports.pop_lru()[0]
             os_net = clients.get_network_client()
             os_net.update_port(port_id, security_groups=list(security_groups))
+        self._port_sgs[port_id] = security_groups
+        self._check_sg_buffer(pool_key, security_groups)
         if config.CONF.kubernetes.port_debug:
             os_net = clients.get_network_client()
             os_net.update_port(port_id, name=c_utils.get_port_name(pod),
@@ -506,21 +1332,6 @@ class NeutronVIFPool(BaseVIFPool):
                            security_groups)
         return self._existing_vifs[port_id]
 
-    def _return_ports_to_pool(self):
-        """Recycle ports to be reused by future pods.
-
-        For each port in the recyclable_ports dict it reapplies
-        security group if they have been changed and it changes the port
-        name to available_port if the port_debug option is enabled.
-        Then the port_id is included in the dict with the available_ports.
-
-        If a maximum number of ports per pool is set, the port will be
-        deleted if the maximum has been already reached.
-        """
-        while True:
-            eventlet.sleep(oslo_cfg.CONF.vif_pool.ports_pool_update_frequency)
-            self._trigger_return_to_pool()
-
     @lockutils.synchronized('return_to_pool_baremetal')
     def _trigger_return_to_pool(self):
         if not hasattr(self, '_recyclable_ports'):
@@ -528,17 +1339,7 @@ class NeutronVIFPool(BaseVIFPool):
                      "pools.")
             return
         os_net = clients.get_network_client()
-        sg_current = {}
-        if not config.CONF.kubernetes.port_debug:
-            attrs = {'device_owner': kl_const.DEVICE_OWNER}
-            tags = config.CONF.neutron_defaults.resource_tags
-            if tags:
-                attrs['tags'] = tags
-
-            for port in os_net.ports(**attrs):
-                if port.id in self._recyclable_ports:
-                    sg_current[port.id] = tuple(sorted(
-                        port.security_group_ids))
+        sg_current = self._get_recyclable_sgs(kl_const.DEVICE_OWNER)
 
         for port_id, pool_key in list(self._recyclable_ports.items()):
             if (not oslo_cfg.CONF.vif_pool.ports_pool_max or
@@ -556,9 +1357,8 @@ class NeutronVIFPool(BaseVIFPool):
                                     "reused, put back on the cleanable "
                                     "pool.", port_id)
                         continue
-                self._available_ports_pools.setdefault(
-                    pool_key, {}).setdefault(
-                        sg_current.get(port_id), []).append(port_id)
+                self._available_ports_pools[pool_key].add(
+                    port_id, sg_current.get(port_id))
             else:
                 try:
                     del self._existing_vifs[port_id]
@@ -569,16 +1369,29 @@ class NeutronVIFPool(BaseVIFPool):
                 del self._recyclable_ports[port_id]
             except KeyError:
                 LOG.debug('Port already recycled: %s', port_id)
+            self._port_sgs.pop(port_id, None)
+
+    def _delete_pool_ports(self, pool_key, port_ids):
+        failed = self._delete_ports(port_ids)
+        for port_id in set(port_ids).difference(failed):
+            self._existing_vifs.pop(port_id, None)
+        return failed
 
     def sync_pools(self):
         super(NeutronVIFPool, self).sync_pools()
+        if self._load_checkpoint():
+            self._recovered_pools = True
+            eventlet.spawn(self._validate_checkpoint)
+            eventlet.spawn(self._cleanup_leftover_ports)
+            return
         # NOTE(ltomasbo): Ensure previously created ports are recovered into
         # their respective pools
         self._cleanup_leftover_ports()
         self._recover_precreated_ports()
         self._recovered_pools = True
 
-    def _recover_precreated_ports(self):
+    def _recover_precreated_ports(self, host_filter=None):
+        host_filter = host_filter or self._is_owned_host
         os_net = clients.get_network_client()
         attrs = {'device_owner': kl_const.DEVICE_OWNER}
         tags = config.CONF.neutron_defaults.resource_tags
@@ -600,6 +1413,9 @@ class NeutronVIFPool(BaseVIFPool):
             # recovering in the case of multi pools
             if available_subports.get(port.id):
                 continue
+            # Ports loaded from the pools checkpoint are already known
+            if port.id in self._existing_vifs:
+                continue
             if not port.binding_vif_type or not port.binding_host_id:
                 # NOTE(ltomasbo): kuryr-controller is running without the
                 # rights to get the needed information to recover the ports.
@@ -607,6 +1423,9 @@ class NeutronVIFPool(BaseVIFPool):
                 os_net = clients.get_network_client()
                 os_net.delete_port(port.id)
                 continue
+            # The ports of the nodes of other controllers are left to them
+            if not host_filter(port.binding_host_id):
+                continue
             subnet_id = port.fixed_ips[0]['subnet_id']
             subnet = {
                 subnet_id: utils.get_subnet(subnet_id)}
@@ -617,9 +1436,8 @@ class NeutronVIFPool(BaseVIFPool):
                                           net_obj.id, None)
 
             self._existing_vifs[port.id] = vif
-            self._available_ports_pools.setdefault(
-                pool_key, {}).setdefault(
-                    tuple(sorted(port.security_group_ids)), []).append(port.id)
+            self._available_ports_pools[pool_key].add(
+                port.id, tuple(sorted(port.security_group_ids)))
 
         LOG.info("PORTS POOL: pools updated with pre-created ports")
         self._create_healthcheck_file()
@@ -639,10 +1457,7 @@ class NeutronVIFPool(BaseVIFPool):
         for pool_key, ports in list(self._available_ports_pools.items()):
             if self._get_pool_key_net(pool_key) != net_id:
                 continue
-            ports_id = []
-            for sg_ports in ports.values():
-                ports_id.extend(sg_ports)
-            for port_id in ports_id:
+            for port_id in ports:
                 try:
                     del self._existing_vifs[port_id]
                 except KeyError:
@@ -651,7 +1466,7 @@ class NeutronVIFPool(BaseVIFPool):
                 # the port deos not exists
                 os_net.delete_port(port_id)
 
-            self._available_ports_pools[pool_key] = {}
+            self._available_ports_pools[pool_key] = PortsPool()
 
 
 class NestedVIFPool(BaseVIFPool):
@@ -714,39 +1529,24 @@ class NestedVIFPool(BaseVIFPool):
 
     def _get_port_from_pool(self, pool_key, pod, subnets, security_groups):
         try:
-            pool_ports = self._available_ports_pools[pool_key]
-        except (KeyError, AttributeError):
+            pool_ports = self._available_ports_pools.get(pool_key)
+        except AttributeError:
+            raise exceptions.ResourceNotReady(pod)
+        if not pool_ports:
             raise exceptions.ResourceNotReady(pod)
 
         os_net = clients.get_network_client()
 
         try:
-            port_id = pool_ports[security_groups].pop()
-        except (KeyError, IndexError):
+            port_id = pool_ports.pop(security_groups)
+        except KeyError:
             # Get another port from the pool and update the SG to the
             # appropriate one. It uses a port from the group that was updated
             # longer ago
-            pool_updates = self._last_update.get(pool_key, {})
-            if not pool_updates:
-                # No pools update info. Selecting a random one
-                for sg_group, ports in list(pool_ports.items()):
-                    if len(ports) > 0:
-                        port_id = pool_ports[sg_group].pop()
-                        break
-                else:
-                    raise exceptions.ResourceNotReady(pod)
-            else:
-                min_date = -1
-                for sg_group, date in list(pool_updates.items()):
-                    if pool_ports.get(sg_group):
-                        if min_date == -1 or date < min_date:
-                            min_date = date
-                            min_sg_group = sg_group
-                if min_date == -1:
-                    # pool is empty, no port to reuse
-                    raise exceptions.ResourceNotReady(pod)
-                port_id = pool_ports[min_sg_group].pop()
+            port_id = pool_ports.pop_lru()[0]
             os_net.update_port(port_id, security_groups=list(security_groups))
+        self._port_sgs[port_id] = security_groups
+        self._check_sg_buffer(pool_key, security_groups)
         if config.CONF.kubernetes.port_debug:
             os_net.update_port(port_id, name=c_utils.get_port_name(pod))
         # check if the pool needs to be populated
@@ -756,21 +1556,6 @@ class NestedVIFPool(BaseVIFPool):
                            security_groups)
         return self._existing_vifs[port_id]
 
-    def _return_ports_to_pool(self):
-        """Recycle ports to be reused by future pods.
-
-        For each port in the recyclable_ports dict it reapplies
-        security group if they have been changed and it changes the port
-        name to available_port if the port_debug option is enabled.
-        Then the port_id is included in the dict with the available_ports.
-
-        If a maximum number of ports per pool is set, the port will be
-        deleted if the maximum has been already reached.
-        """
-        while True:
-            eventlet.sleep(oslo_cfg.CONF.vif_pool.ports_pool_update_frequency)
-            self._trigger_return_to_pool()
-
     @lockutils.synchronized('return_to_pool_nested')
     def _trigger_return_to_pool(self):
         if not hasattr(self, '_recyclable_ports'):
@@ -778,17 +1563,10 @@ class NestedVIFPool(BaseVIFPool):
                      "pools.")
             return
         os_net = clients.get_network_client()
-        sg_current = {}
-        if not config.CONF.kubernetes.port_debug:
-            attrs = {'device_owner': ['trunk:subport', kl_const.DEVICE_OWNER]}
-            tags = config.CONF.neutron_defaults.resource_tags
-            if tags:
-                attrs['tags'] = tags
-            kuryr_subports = os_net.ports(**attrs)
-            for subport in kuryr_subports:
-                if subport.id in self._recyclable_ports:
-                    sg_current[subport.id] = tuple(sorted(
-                        subport.security_group_ids))
+        sg_current = self._get_recyclable_sgs(
+            ['trunk:subport', kl_const.DEVICE_OWNER])
+        # The ports exceeding ports_pool_max are removed in bulk per pool
+        to_delete = collections.defaultdict(list)
 
         for port_id, pool_key in list(self._recyclable_ports.items()):
             if (not oslo_cfg.CONF.vif_pool.ports_pool_max or
@@ -805,28 +1583,76 @@ class NestedVIFPool(BaseVIFPool):
                                     "reused, put back on the cleanable "
                                     "pool.", port_id)
                         continue
-                self._available_ports_pools.setdefault(
-                    pool_key, {}).setdefault(
-                        sg_current.get(port_id), []).append(port_id)
+                self._available_ports_pools[pool_key].add(
+                    port_id, sg_current.get(port_id))
             else:
-                trunk_id = self._get_trunk_id(pool_key)
-                try:
-                    self._drv_vif._remove_subport(trunk_id, port_id)
-                    self._drv_vif._release_vlan_id(
-                        self._existing_vifs[port_id].vlan_id)
-                    del self._existing_vifs[port_id]
-                    os_net.delete_port(port_id)
-                except KeyError:
-                    LOG.debug('Port %s is not in the ports list.', port_id)
-                except (os_exc.SDKException, os_exc.HttpException):
-                    LOG.warning('Error removing the subport %s', port_id)
-                    continue
+                to_delete[pool_key].append(port_id)
+                continue
             try:
                 del self._recyclable_ports[port_id]
             except KeyError:
                 LOG.debug('Port already recycled: %s', port_id)
+            self._port_sgs.pop(port_id, None)
+
+        for pool_key, port_ids in to_delete.items():
+            # The ports that could not be detached are retried on next pass
+            failed = self._delete_pool_ports(pool_key, port_ids)
+            for port_id in set(port_ids).difference(failed):
+                self._recyclable_ports.pop(port_id, None)
+                self._port_sgs.pop(port_id, None)
+
+    def _delete_pool_ports(self, pool_key, port_ids):
+        try:
+            trunk_id = self._get_trunk_id(pool_key)
+        except (os_exc.SDKException, os_exc.HttpException):
+            LOG.warning("Error getting the trunk of pool %s", pool_key)
+            return port_ids
+        subports = {}
+        for port_id in port_ids:
+            vif = self._existing_vifs.get(port_id)
+            subports[port_id] = vif.vlan_id if vif else None
+        return self._delete_subports(trunk_id, subports)
+
+    def _delete_subports(self, trunk_id, subports):
+        """Detaches the subports from the trunk and deletes them.
+
+        The subports are detached in batches of SUBPORTS_DETACH_BATCH and
+        the detached ones are deleted concurrently. The ports failing to be
+        deleted are retried in the background, as they are not usable by the
+        pools anymore.
+
+        :param subports: dict with the VLAN ids of the subports, or None if
+                         unknown, keyed by port id
+        :return: list of the subports that could not be detached
+        """
+        port_ids = list(subports)
+        detached = []
+        failed = []
+        for i in range(0, len(port_ids), SUBPORTS_DETACH_BATCH):
+            batch = port_ids[i:i + SUBPORTS_DETACH_BATCH]
+            try:
+                self._drv_vif._remove_subports(trunk_id, batch)
+            except (os_exc.SDKException, os_exc.HttpException):
+                LOG.warning("Error removing the subports %s from trunk %s",
+                            batch, trunk_id)
+                failed.extend(batch)
+                continue
+            detached.extend(batch)
+
+        for port_id in detached:
+            if subports[port_id] is not None:
+                self._drv_vif._release_vlan_id(trunk_id, subports[port_id])
+            self._existing_vifs.pop(port_id, None)
+        self._ports_to_delete.update(self._delete_ports(detached))
+        return failed
 
     def _get_trunk_id(self, pool_key):
+        if nested_vif.PARENT_PORTS.is_enabled():
+            # The parent ports cache is kept up to date with the nodes, so it
+            # takes precedence over the never invalidated _known_trunk_ids.
+            p_port = self._drv_vif._get_parent_port_by_host_ip(pool_key[0])
+            return self._drv_vif._get_trunk_id(p_port)
+
         trunk_id = self._known_trunk_ids.get(pool_key, None)
         if not trunk_id:
             p_port = self._drv_vif._get_parent_port_by_host_ip(pool_key[0])
@@ -834,6 +1660,10 @@ class NestedVIFPool(BaseVIFPool):
             self._known_trunk_ids[pool_key] = trunk_id
         return trunk_id
 
+    def _get_host_shard_key(self, host):
+        # The nested pools are keyed by the IP of the node
+        return sharding.get_shard_manager().get_node_name(host)
+
     def _get_parent_port_ip(self, port_id):
         os_net = clients.get_network_client()
         parent_port = os_net.get_port(port_id)
@@ -841,30 +1671,44 @@ class NestedVIFPool(BaseVIFPool):
 
     def sync_pools(self):
         super(NestedVIFPool, self).sync_pools()
-        # NOTE(ltomasbo): Ensure previously created ports are recovered into
-        # their respective pools
-        self._recover_precreated_ports()
-        self._recovered_pools = True
+        if self._load_checkpoint():
+            self._recovered_pools = True
+            eventlet.spawn(self._validate_checkpoint)
+        else:
+            # NOTE(ltomasbo): Ensure previously created ports are recovered
+            # into their respective pools
+            self._recover_precreated_ports()
+            self._recovered_pools = True
         eventlet.spawn(self._cleanup_leftover_ports)
 
-    def _recover_precreated_ports(self):
-        self._precreated_ports(action='recover')
+    def _recover_precreated_ports(self, host_filter=None):
+        self._precreated_ports(action='recover', host_filter=host_filter)
         LOG.info("PORTS POOL: pools updated with pre-created ports")
         self._create_healthcheck_file()
 
-    def _remove_precreated_ports(self, trunk_ips=None):
-        self._precreated_ports(action='free', trunk_ips=trunk_ips)
+    def _remove_precreated_ports(self, trunk_ips=None, progress=None):
+        return self._precreated_ports(action='free', trunk_ips=trunk_ips,
+                                      progress=progress)
 
-    def _precreated_ports(self, action, trunk_ips=None):
+    def _precreated_ports(self, action, trunk_ips=None, progress=None,
+                          host_filter=None):
         """Removes or recovers pre-created subports at given pools
 
         This function handles the pre-created ports based on the given action:
         - If action is `free` it will remove all the subport from the given
         trunk ports, or from all the trunk ports if no trunk_ips are passed.
+        The subports of each trunk are detached in bulk and deleted
+        concurrently, and the number of subports freed out of the ones
+        found is returned for each trunk IP. If a `progress` callable is
+        passed, it is called with those numbers after each trunk, and the
+        remaining trunks are skipped if it returns False.
         - If action is `recover` it will discover the existing subports in the
         given trunk ports (or in all of them if none are passed) and will add
         them (and the needed information) to the respective pools.
+        Only the trunks of the hosts accepted by `host_filter`, by default the
+        owned ones, are handled.
         """
+        host_filter = host_filter or self._is_owned_host
         os_net = clients.get_network_client()
         # Note(ltomasbo): ML2/OVS changes the device_owner to trunk:subport
         # when a port is attached to a trunk. However, that is not the case
@@ -872,9 +1716,10 @@ class NestedVIFPool(BaseVIFPool):
         # compute:kuryr
 
         parent_ports, available_subports, subnets = self._get_trunks_info()
+        freed = {}
 
         if not available_subports:
-            return
+            return freed
 
         # FIXME(ltomasbo): Workaround for ports already detached from trunks
         # whose status is ACTIVE
@@ -894,7 +1739,12 @@ class NestedVIFPool(BaseVIFPool):
             host_addr = parent_port.get('ip')
             if trunk_ips and host_addr not in trunk_ips:
                 continue
+            if not host_filter(host_addr):
+                continue
 
+            # VLAN ids and pool keys of the subports to free
+            to_free = {}
+            to_free_pools = {}
             for subport in parent_port.get('subports'):
                 kuryr_subport = available_subports.get(subport['port_id'])
                 if not kuryr_subport:
@@ -908,41 +1758,48 @@ class NestedVIFPool(BaseVIFPool):
                                               net_obj.id, None)
 
                 if action == 'recover':
+                    # Ports loaded from the pools checkpoint are already known
+                    if kuryr_subport.id in self._existing_vifs:
+                        continue
                     vif = ovu.neutron_to_osvif_vif_nested_vlan(
                         kuryr_subport, subnet, subport['segmentation_id'])
 
                     self._existing_vifs[kuryr_subport.id] = vif
-                    self._available_ports_pools.setdefault(
-                        pool_key, {}).setdefault(tuple(sorted(
-                            kuryr_subport.security_group_ids)),
-                            []).append(kuryr_subport.id)
+                    self._available_ports_pools[pool_key].add(
+                        kuryr_subport.id,
+                        tuple(sorted(kuryr_subport.security_group_ids)))
 
                 elif action == 'free':
+                    to_free[kuryr_subport.id] = subport['segmentation_id']
+                    to_free_pools[kuryr_subport.id] = pool_key
+
+            if to_free:
+                failed = self._delete_subports(trunk_id, to_free)
+                for port_id, pool_key in to_free_pools.items():
+                    if port_id in failed:
+                        continue
                     try:
-                        self._drv_vif._remove_subport(trunk_id,
-                                                      kuryr_subport.id)
-                        os_net.delete_port(kuryr_subport.id)
-                        self._drv_vif._release_vlan_id(
-                            subport['segmentation_id'])
-                        del self._existing_vifs[kuryr_subport.id]
-                        self._available_ports_pools[pool_key][
-                            tuple(sorted(kuryr_subport.security_group_ids
-                                         ))].remove(kuryr_subport.id)
+                        self._available_ports_pools[pool_key].remove(port_id)
                     except KeyError:
                         LOG.debug('Port %s is not in the ports list.',
-                                  kuryr_subport.id)
-                    except (os_exc.SDKException, os_exc.HttpException):
-                        LOG.warning('Error removing the subport %s',
-                                    kuryr_subport.id)
-                    except ValueError:
-                        LOG.debug('Port %s is not in the available ports '
-                                  'pool.', kuryr_subport.id)
+                                  port_id)
+                freed[host_addr] = (len(to_free) - len(failed), len(to_free))
+                LOG.info("Freed %d out of %d subports of trunk %s",
+                         len(to_free) - len(failed), len(to_free), trunk_id)
+                if progress and not progress(host_addr, *freed[host_addr]):
+                    LOG.info("Stopped freeing the pools of the trunks.")
+                    break
+        return freed
 
     @lockutils.synchronized('return_to_pool_nested')
     def populate_pool(self, trunk_ip, project_id, subnets, security_groups):
         if not self._recovered_pools:
             LOG.info("Kuryr-controller not yet ready to populate pools.")
             raise exceptions.ResourceNotReady(trunk_ip)
+        if not self._is_owned_host(trunk_ip):
+            LOG.debug("Not populating the pool of node %s, owned by another "
+                      "controller.", trunk_ip)
+            return
         pool_key = self._get_pool_key(trunk_ip, project_id, None, subnets)
         pools = self._available_ports_pools.get(pool_key)
         if not pools:
@@ -975,24 +1832,29 @@ class NestedVIFPool(BaseVIFPool):
         pool_key = self._get_pool_key(trunk_ip, project_id, None, subnets)
         for vif in vifs:
             self._existing_vifs[vif.id] = vif
-            self._available_ports_pools.setdefault(pool_key, {}).setdefault(
-                tuple(sorted(security_groups)), []).append(vif.id)
+            self._available_ports_pools[pool_key].add(
+                vif.id, tuple(sorted(security_groups)))
 
-    def free_pool(self, trunk_ips=None):
+    def free_pool(self, trunk_ips=None, progress=None):
         """Removes subports from the pool and deletes neutron port resource.
 
         This function empties the pool of available subports and removes the
         neutron port resources of the specified trunk port (or all of them if
         no trunk is specified).
+
+        :param progress: callable called with the trunk IP and the number of
+                         subports freed and found after each trunk, returning
+                         whether to continue with the next trunks
+        :return: dict with the trunk IPs as keys and the number of subports
+                 freed and found as values
         """
-        self._remove_precreated_ports(trunk_ips)
+        return self._remove_precreated_ports(trunk_ips, progress)
 
     def delete_network_pools(self, net_id):
         if not self._recovered_pools:
             LOG.info("Kuryr-controller not yet ready to delete network "
                      "pools.")
             raise exceptions.ResourceNotReady(net_id)
-        os_net = clients.get_network_client()
         # NOTE(ltomasbo): Note the pods should already be deleted, but their
         # associated ports may not have been recycled yet, therefore not being
         # on the available_ports_pools dict. The next call forces it to be on
@@ -1001,26 +1863,16 @@ class NestedVIFPool(BaseVIFPool):
         for pool_key, ports in list(self._available_ports_pools.items()):
             if self._get_pool_key_net(pool_key) != net_id:
                 continue
-            trunk_id = self._get_trunk_id(pool_key)
-            ports_id = [p_id for sg_ports in ports.values()
-                        for p_id in sg_ports]
-            try:
-                self._drv_vif._remove_subports(trunk_id, ports_id)
-            except (os_exc.SDKException, os_exc.HttpException):
-                LOG.exception('Error removing subports from trunk: %s',
-                              trunk_id)
+            ports_id = list(ports)
+            failed = self._delete_pool_ports(pool_key, ports_id)
+            if failed:
+                LOG.error('Error removing subports %s of pool %s', failed,
+                          pool_key)
+                for port_id in set(ports_id).difference(failed):
+                    ports.remove(port_id)
                 continue
 
-            for port_id in ports_id:
-                try:
-                    self._drv_vif._release_vlan_id(
-                        self._existing_vifs[port_id].vlan_id)
-                    del self._existing_vifs[port_id]
-                except KeyError:
-                    LOG.debug('Port %s is not in the ports list.', port_id)
-                os_net.delete_port(port_id)
-
-            self._available_ports_pools[pool_key] = {}
+            self._available_ports_pools[pool_key] = PortsPool()
 
 
 class MultiVIFPool(base.VIFPoolDriver):
@@ -1092,6 +1944,10 @@ class MultiVIFPool(base.VIFPoolDriver):
         for vif_drv in self._vif_drvs.values():
             vif_drv.sync_pools()
 
+    def handoff_pools(self, previous_ring):
+        for vif_drv in self._vif_drvs.values():
+            vif_drv.handoff_pools(previous_ring)
+
     def _get_pod_vif_type(self, pod):
         node_name = pod['spec']['nodeName']
         return self._get_node_vif_driver(node_name)
@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import eventlet
 import time
 
@@ -156,6 +157,7 @@ class LoadBalancerHandler(k8s_base.ResourceEventHandler):
 
     OBJECT_KIND = k_const.K8S_OBJ_ENDPOINTS
     OBJECT_WATCH_PATH = "%s/%s" % (k_const.K8S_API_BASE, "endpoints")
+    OBJECT_FIELDS = ('metadata', 'subsets')
 
     def __init__(self):
         super(LoadBalancerHandler, self).__init__()
@@ -188,22 +190,7 @@ class LoadBalancerHandler(k8s_base.ResourceEventHandler):
             lbaas_state = obj_lbaas.LBaaSState()
 
         if self._sync_lbaas_members(endpoints, lbaas_state, lbaas_spec):
-            # Note(yboaron) For LoadBalancer services, we should allocate FIP,
-            # associate it to LB VIP and update K8S service status
-            if lbaas_state.service_pub_ip_info is None:
-                service_pub_ip_info = (
-                    self._drv_service_pub_ip.acquire_service_pub_ip_info(
-                        lbaas_spec.type,
-                        lbaas_spec.lb_ip,
-                        lbaas_spec.project_id,
-                        lbaas_state.loadbalancer.port_id))
-                if service_pub_ip_info:
-                    self._drv_service_pub_ip.associate_pub_ip(
-                        service_pub_ip_info, lbaas_state.loadbalancer.port_id)
-                    lbaas_state.service_pub_ip_info = service_pub_ip_info
-                    self._update_lb_status(
-                        endpoints,
-                        lbaas_state.service_pub_ip_info.ip_addr)
+            self._sync_lbaas_pub_ip(endpoints, lbaas_state, lbaas_spec)
             # REVISIT(ivc): since _sync_lbaas_members is responsible for
             # creating all lbaas components (i.e. load balancer, listeners,
             # pools, members), it is currently possible for it to fail (due
@@ -236,6 +223,30 @@ class LoadBalancerHandler(k8s_base.ResourceEventHandler):
             self._drv_service_pub_ip.release_pub_ip(
                 lbaas_state.service_pub_ip_info)
 
+    def _sync_lbaas_pub_ip(self, endpoints, lbaas_state, lbaas_spec):
+        """Allocates the public IP of the load balancer if it needs one.
+
+        :return: whether a public IP was allocated
+        """
+        if lbaas_state.service_pub_ip_info is not None:
+            return False
+        # Note(yboaron) For LoadBalancer services, we should allocate FIP,
+        # associate it to LB VIP and update K8S service status
+        service_pub_ip_info = (
+            self._drv_service_pub_ip.acquire_service_pub_ip_info(
+                lbaas_spec.type,
+                lbaas_spec.lb_ip,
+                lbaas_spec.project_id,
+                lbaas_state.loadbalancer.port_id))
+        if not service_pub_ip_info:
+            return False
+        self._drv_service_pub_ip.associate_pub_ip(
+            service_pub_ip_info, lbaas_state.loadbalancer.port_id)
+        lbaas_state.service_pub_ip_info = service_pub_ip_info
+        self._update_lb_status(endpoints,
+                               lbaas_state.service_pub_ip_info.ip_addr)
+        return True
+
     def _should_ignore(self, endpoints, lbaas_spec):
         # NOTE(ltomasbo): we must wait until service handler has annotated the
         # endpoints to process them. Thus, if annotations are not updated to
@@ -267,6 +278,15 @@ class LoadBalancerHandler(k8s_base.ResourceEventHandler):
                    if address.get('targetRef', {}).get('kind') == 'Pod')
 
     def _sync_lbaas_members(self, endpoints, lbaas_state, lbaas_spec):
+        if (not lbaas_state.loadbalancer and lbaas_spec.ip and
+                config.CONF.octavia_defaults.fully_populated_create and
+                self._create_lbaas_graph(endpoints, lbaas_state, lbaas_spec)):
+            return True
+
+        if config.CONF.octavia_defaults.batch_member_updates:
+            return self._sync_lbaas_members_batch(endpoints, lbaas_state,
+                                                  lbaas_spec)
+
         changed = False
 
         if (self._has_pods(endpoints) and
@@ -283,29 +303,190 @@ class LoadBalancerHandler(k8s_base.ResourceEventHandler):
 
         return changed
 
+    def _sync_lbaas_members_batch(self, endpoints, lbaas_state, lbaas_spec):
+        """Syncs the members with a batch member update per changed pool.
+
+        The members to remove and to add are computed as in
+        `_remove_unused_members` and `_add_new_members`, but the resulting
+        members of each pool are set by the driver with a single request.
+        """
+        changed = self._sync_lbaas_pools(endpoints, lbaas_state, lbaas_spec)
+        if not self._has_pods(endpoints):
+            return changed
+
+        self._try_sync_lbaas_sgs(endpoints, lbaas_state)
+        unused = self._get_unused_members(endpoints, lbaas_state,
+                                          lbaas_spec)
+        unused_ids = {m.id for m in unused}
+        # The new members are computed without the unused ones, so that a
+        # target replacing an unused member with the same IP and port is
+        # added back, as when removing the members first
+        lbaas_state.members = [m for m in lbaas_state.members
+                               if m.id not in unused_ids]
+        new_members = collections.defaultdict(list)
+        for pool, member_args in self._get_new_members(
+                endpoints, lbaas_state, lbaas_spec):
+            new_members[pool.id].append(member_args)
+
+        changed_pool_ids = {m.pool_id for m in unused}.union(new_members)
+        for pool in lbaas_state.pools:
+            if pool.id not in changed_pool_ids:
+                continue
+            kept = [m for m in lbaas_state.members if m.pool_id == pool.id]
+            members = self._drv_lbaas.update_members(
+                lbaas_state.loadbalancer, pool, kept,
+                new_members.get(pool.id, []))
+            lbaas_state.members = [m for m in lbaas_state.members
+                                   if m.pool_id != pool.id] + members
+            changed = True
+
+        return changed
+
+    def _create_lbaas_graph(self, endpoints, lbaas_state, lbaas_spec):
+        """Creates the load balancer of a new Service fully populated.
+
+        The listeners, pools and members matching the Service ports and the
+        Endpoints targets are created along with the load balancer by a
+        single request, instead of one by one.
+
+        :return: whether the load balancer was created, False meaning that
+                 the incremental path has to be used instead
+        """
+        try:
+            security_groups_ids = self._get_lbaas_sgs(endpoints)
+        except k_exc.K8sResourceNotFound:
+            LOG.debug("The svc has been deleted while processing the endpoints"
+                      " update. Using the security groups of the spec.")
+            security_groups_ids = lbaas_spec.security_groups_ids
+
+        lb_name = self._drv_lbaas.get_service_loadbalancer_name(
+            endpoints['metadata']['namespace'],
+            endpoints['metadata']['name'])
+        listeners = self._get_new_listeners_graph(lb_name, endpoints,
+                                                  lbaas_spec)
+        state = self._drv_lbaas.create_loadbalancer_graph(
+            name=lb_name,
+            project_id=lbaas_spec.project_id,
+            subnet_id=lbaas_spec.subnet_id,
+            ip=lbaas_spec.ip,
+            listeners=listeners,
+            security_groups_ids=security_groups_ids,
+            service_type=lbaas_spec.type,
+            provider=self._lb_provider)
+        if state is None:
+            return False
+
+        lbaas_state.loadbalancer = state.loadbalancer
+        lbaas_state.listeners = state.listeners
+        lbaas_state.pools = state.pools
+        lbaas_state.members = state.members
+        return True
+
+    def _get_new_listeners_graph(self, lb_name, endpoints, lbaas_spec):
+        """Returns the listeners of a new load balancer with their members.
+
+        The listeners are skipped as in `_add_new_listeners` and the members
+        are the Endpoints targets, as in `_get_new_members`.
+
+        :return: list of dicts with the 'protocol' and 'port' of a listener
+                 and the 'members' of its pool, as dicts with the
+                 `ensure_member` arguments but the load balancer, the pool
+                 and the listener port
+        """
+        listeners = []
+        listener_by_tgt_name = {}
+        for port_spec in sorted(lbaas_spec.ports, key=lambda x: x.protocol):
+            protocol = port_spec.protocol
+            port = port_spec.port
+            same_port = [l for l in listeners if l['port'] == port]
+            listener = next((l for l in same_port
+                             if l['protocol'] == protocol), None)
+            if listener is None:
+                # As in _add_new_listeners, listeners with the same port
+                # but different protocols can't co-exist without double
+                # listeners support.
+                if (same_port and
+                        not self._drv_lbaas.double_listeners_supported()):
+                    LOG.warning("Skipping listener creation for %s:%s as "
+                                "another one already exists with port %s",
+                                lb_name, protocol, port)
+                    continue
+                listener = {'protocol': protocol, 'port': port,
+                            'members': []}
+                listeners.append(listener)
+            listener_by_tgt_name[port_spec.name] = listener
+
+        targets = set()
+        for target_ip, target_ref, port_name, target_port in (
+                self._get_pod_targets(endpoints)):
+            listener = listener_by_tgt_name.get(port_name)
+            if listener is None:
+                LOG.debug("No listener found for port: %r", port_name)
+                continue
+            target = (target_ip, target_port, listener['protocol'],
+                      listener['port'])
+            if target in targets:
+                continue
+            member_subnet_id = self._get_member_subnet(
+                target_ref, target_ip, lbaas_spec.subnet_id)
+            if member_subnet_id is None:
+                continue
+            targets.add(target)
+            listener['members'].append({
+                'subnet_id': member_subnet_id,
+                'ip': target_ip,
+                'port': target_port,
+                'target_ref_namespace': target_ref['namespace'],
+                'target_ref_name': target_ref['name'],
+            })
+        return listeners
+
+    def _try_sync_lbaas_sgs(self, endpoints, lbaas_state):
+        try:
+            self._sync_lbaas_sgs(endpoints, lbaas_state)
+        except k_exc.K8sResourceNotFound:
+            LOG.debug("The svc has been deleted while processing the endpoints"
+                      " update. No need to add new members.")
+
     def _sync_lbaas_sgs(self, endpoints, lbaas_state):
+        lb = lbaas_state.loadbalancer
+        lb.security_groups = self._get_lbaas_sgs(endpoints)
+
+    def _get_lbaas_sgs(self, endpoints):
         svc_link = self._get_service_link(endpoints)
         k8s = clients.get_kubernetes_client()
         service = k8s.get(svc_link)
 
-        lb = lbaas_state.loadbalancer
         # NOTE(maysams) It's possible that while the service annotation
         # is added the backend pods on that service are not yet created
         # resulting in no security groups retrieved for the service.
         # Let's retrieve again to ensure is updated.
         project_id = self._drv_project.get_project(service)
-        lb_sgs = self._drv_sg.get_security_groups(service, project_id)
-        lb.security_groups = lb_sgs
+        return self._drv_sg.get_security_groups(service, project_id)
 
     def _add_new_members(self, endpoints, lbaas_state, lbaas_spec):
         changed = False
 
-        try:
-            self._sync_lbaas_sgs(endpoints, lbaas_state)
-        except k_exc.K8sResourceNotFound:
-            LOG.debug("The svc has been deleted while processing the endpoints"
-                      " update. No need to add new members.")
+        self._try_sync_lbaas_sgs(endpoints, lbaas_state)
 
+        for pool, member_args in self._get_new_members(endpoints, lbaas_state,
+                                                       lbaas_spec):
+            member = self._drv_lbaas.ensure_member(
+                loadbalancer=lbaas_state.loadbalancer,
+                pool=pool,
+                **member_args)
+            lbaas_state.members.append(member)
+            changed = True
+
+        return changed
+
+    def _get_new_members(self, endpoints, lbaas_state, lbaas_spec):
+        """Yields the Endpoints targets that are not members of their pool.
+
+        :return: generator of (pool, member arguments) tuples, the member
+                 arguments being the `ensure_member` ones but the load
+                 balancer and the pool
+        """
         lsnr_by_id = {l.id: l for l in lbaas_state.listeners}
         pool_by_lsnr_port = {(lsnr_by_id[p.listener_id].protocol,
                               lsnr_by_id[p.listener_id].port): p
@@ -325,7 +506,44 @@ class LoadBalancerHandler(k8s_base.ResourceEventHandler):
                 continue
         current_targets = {(str(m.ip), m.port, m.pool_id)
                            for m in lbaas_state.members}
+        if not pool_by_tgt_name:
+            return
 
+        for target_ip, target_ref, port_name, target_port in (
+                self._get_pod_targets(endpoints)):
+            try:
+                pool = pool_by_tgt_name[port_name]
+            except KeyError:
+                LOG.debug("No pool found for port: %r", port_name)
+                continue
+
+            if (target_ip, target_port, pool.id) in current_targets:
+                continue
+            member_subnet_id = self._get_member_subnet(
+                target_ref, target_ip, lbaas_state.loadbalancer.subnet_id)
+            if member_subnet_id is None:
+                continue
+            first_member_of_the_pool = True
+            for member in lbaas_state.members:
+                if pool.id == member.pool_id:
+                    first_member_of_the_pool = False
+                    break
+            if first_member_of_the_pool:
+                listener_port = lsnr_by_id[pool.listener_id].port
+            else:
+                listener_port = None
+
+            yield pool, {
+                'subnet_id': member_subnet_id,
+                'ip': target_ip,
+                'port': target_port,
+                'target_ref_namespace': target_ref['namespace'],
+                'target_ref_name': target_ref['name'],
+                'listener_port': listener_port,
+            }
+
+    def _get_pod_targets(self, endpoints):
+        """Yields the (IP, targetRef, port name, port) of the Pod targets."""
         for subset in endpoints.get('subsets', []):
             subset_ports = subset.get('ports', [])
             for subset_address in subset.get('addresses', []):
@@ -336,60 +554,28 @@ class LoadBalancerHandler(k8s_base.ResourceEventHandler):
                         continue
                 except KeyError:
                     continue
-                if not pool_by_tgt_name:
-                    continue
                 for subset_port in subset_ports:
-                    target_port = subset_port['port']
-                    port_name = subset_port.get('name')
-                    try:
-                        pool = pool_by_tgt_name[port_name]
-                    except KeyError:
-                        LOG.debug("No pool found for port: %r", port_name)
-                        continue
-
-                    if (target_ip, target_port, pool.id) in current_targets:
-                        continue
-                    # TODO(apuimedo): Do not pass subnet_id at all when in
-                    # L3 mode once old neutron-lbaasv2 is not supported, as
-                    # octavia does not require it
-                    if (config.CONF.octavia_defaults.member_mode ==
-                            k_const.OCTAVIA_L2_MEMBER_MODE):
-                        try:
-                            member_subnet_id = self._get_pod_subnet(target_ref,
-                                                                    target_ip)
-                        except k_exc.K8sResourceNotFound:
-                            LOG.debug("Member namespace has been deleted. No "
-                                      "need to add the members as it is "
-                                      "going to be deleted")
-                            continue
-                    else:
-                        # We use the service subnet id so that the connectivity
-                        # from VIP to pods happens in layer 3 mode, i.e.,
-                        # routed.
-                        member_subnet_id = lbaas_state.loadbalancer.subnet_id
-                    first_member_of_the_pool = True
-                    for member in lbaas_state.members:
-                        if pool.id == member.pool_id:
-                            first_member_of_the_pool = False
-                            break
-                    if first_member_of_the_pool:
-                        listener_port = lsnr_by_id[pool.listener_id].port
-                    else:
-                        listener_port = None
-
-                    member = self._drv_lbaas.ensure_member(
-                        loadbalancer=lbaas_state.loadbalancer,
-                        pool=pool,
-                        subnet_id=member_subnet_id,
-                        ip=target_ip,
-                        port=target_port,
-                        target_ref_namespace=target_ref['namespace'],
-                        target_ref_name=target_ref['name'],
-                        listener_port=listener_port)
-                    lbaas_state.members.append(member)
-                    changed = True
-
-        return changed
+                    yield (target_ip, target_ref, subset_port.get('name'),
+                           subset_port['port'])
+
+    def _get_member_subnet(self, target_ref, target_ip, lb_subnet_id):
+        """Returns the subnet of a member or None if it must be skipped."""
+        # TODO(apuimedo): Do not pass subnet_id at all when in
+        # L3 mode once old neutron-lbaasv2 is not supported, as
+        # octavia does not require it
+        if (config.CONF.octavia_defaults.member_mode ==
+                k_const.OCTAVIA_L2_MEMBER_MODE):
+            try:
+                return self._get_pod_subnet(target_ref, target_ip)
+            except k_exc.K8sResourceNotFound:
+                LOG.debug("Member namespace has been deleted. No "
+                          "need to add the members as it is "
+                          "going to be deleted")
+                return None
+        # We use the service subnet id so that the connectivity
+        # from VIP to pods happens in layer 3 mode, i.e.,
+        # routed.
+        return lb_subnet_id
 
     def _get_pod_subnet(self, target_ref, ip):
         # REVISIT(ivc): consider using true pod object instead
@@ -419,20 +605,33 @@ class LoadBalancerHandler(k8s_base.ResourceEventHandler):
         return None
 
     def _remove_unused_members(self, endpoints, lbaas_state, lbaas_spec):
+        removed_ids = set()
+        for member in self._get_unused_members(endpoints, lbaas_state,
+                                               lbaas_spec):
+            self._drv_lbaas.release_member(lbaas_state.loadbalancer,
+                                           member)
+            removed_ids.add(member.id)
+
+        if removed_ids:
+            lbaas_state.members = [m for m in lbaas_state.members
+                                   if m.id not in removed_ids]
+        return bool(removed_ids)
+
+    def _get_unused_members(self, endpoints, lbaas_state, lbaas_spec):
+        """Returns the members that are not targets of the Endpoints."""
         spec_ports = {}
         for pool in lbaas_state.pools:
             port = self._get_port_in_pool(pool, lbaas_state, lbaas_spec)
             if port:
                 spec_ports[port.name] = pool.id
 
-        current_targets = {(a['ip'], a.get('targetRef', {}).get('name', ''),
-                            p['port'], spec_ports.get(p.get('name')))
-                           for s in endpoints['subsets']
-                           for a in s['addresses']
-                           for p in s['ports']
-                           if p.get('name') in spec_ports}
+        current_targets = {(target_ip, target_ref.get('name', ''),
+                            target_port, spec_ports[port_name])
+                           for target_ip, target_ref, port_name, target_port
+                           in self._get_pod_targets(endpoints)
+                           if port_name in spec_ports}
 
-        removed_ids = set()
+        unused = []
         for member in lbaas_state.members:
             try:
                 member_name = member.name
@@ -444,14 +643,8 @@ class LoadBalancerHandler(k8s_base.ResourceEventHandler):
             if ((str(member.ip), pod_name, member.port, member.pool_id) in
                     current_targets):
                 continue
-            self._drv_lbaas.release_member(lbaas_state.loadbalancer,
-                                           member)
-            removed_ids.add(member.id)
-
-        if removed_ids:
-            lbaas_state.members = [m for m in lbaas_state.members
-                                   if m.id not in removed_ids]
-        return bool(removed_ids)
+            unused.append(member)
+        return unused
 
     def _sync_lbaas_pools(self, endpoints, lbaas_state, lbaas_spec):
         changed = False
@@ -673,3 +866,223 @@ class LoadBalancerHandler(k8s_base.ResourceEventHandler):
                           " A retry will be triggered.", attempts, lb_obj.name)
                 attempts += 1
                 retry = True
+
+
+class EndpointSliceHandler(LoadBalancerHandler):
+    """EndpointSliceHandler handles K8s EndpointSlice events.
+
+    EndpointSliceHandler is an alternative to LoadBalancerHandler for
+    Services with many endpoints, whose Endpoints object is rewritten in full
+    on every change of one of them. The load balancer, its listeners and
+    pools are tracked in the LBaaSState annotation of the Service, while the
+    members are tracked in the LBaaSState annotation of the EndpointSlice
+    they are targets of, so that an event only diffs the slice that changed.
+    The events of the slices of a Service are expected to be handled one at
+    a time, as they share its load balancer, which `ControllerPipeline`
+    ensures.
+    """
+
+    OBJECT_KIND = k_const.K8S_OBJ_ENDPOINTSLICE
+    OBJECT_WATCH_PATH = "%s/%s" % (k_const.K8S_API_DISCOVERY,
+                                   "endpointslices")
+    OBJECT_FIELDS = ('metadata', 'addressType', 'endpoints', 'ports')
+
+    def on_present(self, endpoint_slice):
+        if not self._get_service_name(endpoint_slice):
+            LOG.debug("Ignoring Kubernetes endpoint slice %s of no service",
+                      endpoint_slice['metadata']['name'])
+            return
+
+        self._sync_endpoint_slice(endpoint_slice)
+
+    def on_deleted(self, endpoint_slice):
+        slice_state = utils.get_lbaas_state(endpoint_slice)
+        if not slice_state or not slice_state.loadbalancer:
+            return
+
+        try:
+            lbaas_state = utils.get_lbaas_state(
+                self._get_service(endpoint_slice))
+        except k_exc.K8sResourceNotFound:
+            lbaas_state = None
+        if (lbaas_state and lbaas_state.loadbalancer and
+                lbaas_state.loadbalancer.id == slice_state.loadbalancer.id):
+            self._release_members(slice_state.loadbalancer,
+                                  slice_state.members)
+            return
+        # The service is gone or has another load balancer by now, so every
+        # slice of it releases the load balancer it knew about
+        super(EndpointSliceHandler, self).on_deleted(endpoint_slice,
+                                                     slice_state)
+
+    def _sync_endpoint_slice(self, endpoint_slice):
+        try:
+            service = self._get_service(endpoint_slice)
+        except k_exc.K8sResourceNotFound:
+            LOG.debug("Ignoring Kubernetes endpoint slice %s of a deleted "
+                      "service", endpoint_slice['metadata']['name'])
+            return
+        if self._should_ignore_service(service):
+            return
+        lbaas_spec = utils.get_lbaas_spec(service)
+        if not lbaas_spec or utils.has_port_changes(service, lbaas_spec):
+            # NOTE: The service handler annotates the slices with the spec
+            # once it annotated the service, so their event is handled then,
+            # unless the service is not up to date in the cache yet.
+            if (self._get_spec_annotation(endpoint_slice) ==
+                    self._get_spec_annotation(service)):
+                LOG.debug("Waiting for the service handler to annotate the "
+                          "Kubernetes endpoint slice %s",
+                          endpoint_slice['metadata']['name'])
+                return
+            raise k_exc.ResourceNotReady(endpoint_slice['metadata']['name'])
+
+        lbaas_state = utils.get_lbaas_state(service)
+        if not lbaas_state:
+            lbaas_state = obj_lbaas.LBaaSState()
+        if not lbaas_state.loadbalancer and not self._has_pods(
+                endpoint_slice):
+            LOG.debug("Ignoring Kubernetes endpoint slice %s without pods",
+                      endpoint_slice['metadata']['name'])
+            return
+
+        changed = self._sync_lbaas_pools(service, lbaas_state, lbaas_spec)
+        if lbaas_state.loadbalancer:
+            if self._sync_slice_lbaas_sgs(service, lbaas_state):
+                changed = True
+            if self._sync_lbaas_pub_ip(endpoint_slice, lbaas_state,
+                                       lbaas_spec):
+                changed = True
+        if not changed:
+            self._sync_slice_members(endpoint_slice, lbaas_state, lbaas_spec)
+            return
+
+        try:
+            utils.set_lbaas_state(service, lbaas_state)
+        except k_exc.K8sResourceNotFound:
+            LOG.debug("EndpointSliceHandler failed to store Openstack "
+                      "resources in K8S object (not found)")
+            super(EndpointSliceHandler, self).on_deleted(endpoint_slice,
+                                                         lbaas_state)
+            return
+        if not lbaas_state.loadbalancer:
+            return
+        # NOTE: The load balancer changes are rare, e.g. its creation, while
+        # they can affect the members of all the slices, e.g. if it was
+        # recreated, and all the slices keep a copy of it to release it on
+        # the service deletion, so all the slices are synced in that case.
+        for other_slice in self._get_endpoint_slices(endpoint_slice):
+            self._sync_slice_members(other_slice, lbaas_state, lbaas_spec,
+                                     force_update=True)
+
+    def _sync_slice_lbaas_sgs(self, service, lbaas_state):
+        lb = lbaas_state.loadbalancer
+        project_id = self._drv_project.get_project(service)
+        security_groups = self._drv_sg.get_security_groups(service,
+                                                           project_id)
+        if (lb.obj_attr_is_set('security_groups') and
+                lb.security_groups == security_groups):
+            return False
+        lb.security_groups = security_groups
+        return True
+
+    def _sync_slice_members(self, endpoint_slice, lbaas_state, lbaas_spec,
+                            force_update=False):
+        """Syncs the members of the targets of a slice.
+
+        The members are synced on a copy of the state of the service holding
+        only the members of the slice, which is stored in the slice along
+        with the load balancer.
+        """
+        lb = lbaas_state.loadbalancer
+        slice_state = utils.get_lbaas_state(endpoint_slice)
+        members = []
+        if (slice_state and slice_state.loadbalancer and
+                slice_state.loadbalancer.id == lb.id):
+            # NOTE: Releasing a pool releases its members
+            pool_ids = {p.id for p in lbaas_state.pools}
+            members = [m for m in slice_state.members
+                       if m.pool_id in pool_ids]
+        else:
+            force_update = True
+        state = obj_lbaas.LBaaSState(loadbalancer=lb,
+                                     listeners=lbaas_state.listeners,
+                                     pools=lbaas_state.pools,
+                                     members=members)
+
+        changed = self._remove_unused_members(endpoint_slice, state,
+                                              lbaas_spec)
+        for pool, member_args in self._get_new_members(
+                endpoint_slice, state, lbaas_spec):
+            state.members.append(self._drv_lbaas.ensure_member(
+                loadbalancer=lb, pool=pool, **member_args))
+            changed = True
+        if not (changed or force_update):
+            return
+
+        slice_state = obj_lbaas.LBaaSState(
+            loadbalancer=lb,
+            members=state.members,
+            service_pub_ip_info=lbaas_state.service_pub_ip_info)
+        try:
+            utils.set_lbaas_state(endpoint_slice, slice_state)
+        except k_exc.K8sResourceNotFound:
+            LOG.debug("EndpointSliceHandler failed to store the members of "
+                      "deleted endpoint slice %s",
+                      endpoint_slice['metadata']['name'])
+            self._release_members(lb, slice_state.members)
+
+    def _release_members(self, loadbalancer, members):
+        for member in members:
+            self._drv_lbaas.release_member(loadbalancer, member)
+
+    def _should_ignore_service(self, service):
+        # NOTE: These are the services LBaaSSpecHandler never annotates
+        spec = service['spec']
+        return (not spec.get('selector') or
+                spec.get('clusterIP') == 'None' or
+                spec.get('type') not in SUPPORTED_SERVICE_TYPES)
+
+    def _get_spec_annotation(self, k8s_object):
+        annotations = k8s_object['metadata'].get('annotations') or {}
+        return annotations.get(k_const.K8S_ANNOTATION_LBAAS_SPEC)
+
+    def _has_pods(self, endpoint_slice):
+        return next(self._get_pod_targets(endpoint_slice), None) is not None
+
+    def _get_pod_targets(self, endpoint_slice):
+        """Yields the (IP, targetRef, port name, port) of the Pod targets."""
+        if endpoint_slice.get('addressType') not in ('IPv4', 'IPv6'):
+            return
+        ports = endpoint_slice.get('ports') or []
+        for endpoint in endpoint_slice.get('endpoints') or []:
+            # NOTE: As in the Endpoints, only the ready endpoints are
+            # targets, a missing condition meaning ready.
+            if endpoint.get('conditions', {}).get('ready') is False:
+                continue
+            target_ref = endpoint.get('targetRef')
+            if not target_ref or target_ref.get('kind') != k_const.K8S_OBJ_POD:
+                continue
+            for target_ip in endpoint.get('addresses', []):
+                for port in ports:
+                    # Unnamed ports are named '' in the slices
+                    yield target_ip, target_ref, port.get('name') or None, (
+                        port['port'])
+
+    def _get_service_name(self, endpoint_slice):
+        labels = endpoint_slice['metadata'].get('labels') or {}
+        return labels.get(k_const.K8S_LABEL_SERVICE_NAME)
+
+    def _get_service_link(self, endpoint_slice):
+        return "%s/namespaces/%s/services/%s" % (
+            k_const.K8S_API_BASE, endpoint_slice['metadata']['namespace'],
+            self._get_service_name(endpoint_slice))
+
+    def _get_service(self, endpoint_slice):
+        k8s = clients.get_kubernetes_client()
+        return k8s.get(self._get_service_link(endpoint_slice))
+
+    def _get_endpoint_slices(self, endpoint_slice):
+        return utils.get_endpoint_slices(
+            endpoint_slice['metadata']['namespace'],
+            self._get_service_name(endpoint_slice))
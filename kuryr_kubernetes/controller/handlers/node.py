@@ -0,0 +1,63 @@
+# Copyright 2020 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from oslo_log import log as logging
+
+from kuryr_kubernetes import constants
+from kuryr_kubernetes.controller.drivers import nested_vif
+from kuryr_kubernetes.handlers import k8s_base
+
+LOG = logging.getLogger(__name__)
+
+
+def _get_node_ips(node):
+    addresses = node.get('status', {}).get('addresses') or []
+    return {address['address'] for address in addresses
+            if address.get('address')}
+
+
+class NodeHandler(k8s_base.ResourceEventHandler):
+    """Controller side of the Node events.
+
+    `NodeHandler` runs on the Kuryr-Kubernetes controller and drops the
+    parent ports cached by the nested VIF drivers for a node IP whenever the
+    node owning it is deleted or its addresses change, including when an IP
+    is first seen on a node, e.g. after being reused by a new VM.
+    """
+
+    OBJECT_KIND = constants.K8S_OBJ_NODE
+    OBJECT_WATCH_PATH = "%s/%s" % (constants.K8S_API_BASE, "nodes")
+    SHARDING = constants.SHARDING_ALL
+
+    def __init__(self):
+        super(NodeHandler, self).__init__()
+        # Node name -> set of the node IPs known to the handler
+        self._node_ips = {}
+
+    def on_present(self, node):
+        name = node['metadata']['name']
+        node_ips = _get_node_ips(node)
+        known_ips = self._node_ips.get(name, set())
+        for node_ip in node_ips ^ known_ips:
+            nested_vif.PARENT_PORTS.invalidate(node_ip)
+        if node_ips != known_ips:
+            LOG.debug("Addresses of node %s changed from %s to %s", name,
+                      sorted(known_ips), sorted(node_ips))
+        self._node_ips[name] = node_ips
+
+    def on_deleted(self, node):
+        name = node['metadata']['name']
+        node_ips = self._node_ips.pop(name, set()) | _get_node_ips(node)
+        for node_ip in node_ips:
+            nested_vif.PARENT_PORTS.invalidate(node_ip)
@@ -13,10 +13,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from oslo_config import cfg
+from oslo_log import log as logging
 from requests import exceptions as requests_exc
 
 from keystoneauth1 import exceptions as key_exc
 
+from kuryr_kubernetes import constants
+from kuryr_kubernetes.controller import sharding
 from kuryr_kubernetes import exceptions
 from kuryr_kubernetes.handlers import asynchronous as h_async
 from kuryr_kubernetes.handlers import dispatch as h_dis
@@ -24,6 +28,39 @@ from kuryr_kubernetes.handlers import k8s_base as h_k8s
 from kuryr_kubernetes.handlers import logging as h_log
 from kuryr_kubernetes.handlers import retry as h_retry
 
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+
+def _get_event_priority(event):
+    # Handle new objects (e.g. pods waiting for their VIFs) first
+    return 0 if event.get('type') == 'ADDED' else 1
+
+
+def _get_event_debounce(event):
+    # Collapse the bursts of Endpoints changes, e.g. during rolling updates,
+    # into a single load balancer reconciliation
+    quiet_period = CONF.kubernetes.endpoints_quiet_period
+    if (quiet_period and event.get('type') == 'MODIFIED' and
+            h_k8s.object_kind(event) in (constants.K8S_OBJ_ENDPOINTS,
+                                         constants.K8S_OBJ_ENDPOINTSLICE)):
+        return quiet_period, CONF.kubernetes.endpoints_max_delay
+    return None
+
+
+def _get_event_serial_group(event):
+    # The slices of a Service share its load balancer, so rather than
+    # having a worker per slice waiting for the others, its slices are
+    # handled one after another
+    if h_k8s.object_kind(event) == constants.K8S_OBJ_ENDPOINTSLICE:
+        metadata = event['object']['metadata']
+        service = (metadata.get('labels') or {}).get(
+            constants.K8S_LABEL_SERVICE_NAME)
+        if service:
+            return (constants.K8S_OBJ_SERVICE, metadata['namespace'],
+                    service)
+    return h_k8s.object_uid(event)
+
 
 class ControllerPipeline(h_dis.EventPipeline):
     """Serves as an entry point for controller Kubernetes events.
@@ -46,17 +83,40 @@ class ControllerPipeline(h_dis.EventPipeline):
         handler fails, other handlers will still be called regardless; and the
         order in which such handlers are called is not determined)
 
-      - events for different Kubernetes objects can be handled concurrently
+      - events for different Kubernetes objects can be handled concurrently,
+        by at most `[kubernetes]event_workers` workers and
+        `[kubernetes]event_workers_per_kind` workers for each resource type,
+        ADDED events being handled first
 
       - events for the same Kubernetes object are handled sequentially in
-        the order of arrival
+        the order of arrival, skipping the events superseded by newer ones
+        or preceding the object's last annotation by Kuryr
+
+      - events of the EndpointSlices of the same Service are handled
+        sequentially as well
+
+      - modifications of an Endpoints or EndpointSlice object are handled
+        once it did not change for `[kubernetes]endpoints_quiet_period`
+        seconds, or at most `[kubernetes]endpoints_max_delay` seconds after
+        the first one
+
+      - when the controller is sharded, the events of the objects owned by
+        other controllers are dropped, according to the `SHARDING` of the
+        handler
     """
 
-    def __init__(self, thread_group):
+    def __init__(self, thread_group, shard_manager=None):
         self._tg = thread_group
+        self._shard_manager = shard_manager
         super(ControllerPipeline, self).__init__()
 
     def _wrap_consumer(self, consumer):
+        sharding_mode = getattr(consumer, 'SHARDING',
+                                constants.SHARDING_LEADER)
+        if (self._shard_manager is not None and
+                sharding_mode != constants.SHARDING_ALL):
+            consumer = sharding.ShardFilter(consumer, self._shard_manager,
+                                            sharding_mode)
         # TODO(ivc): tune retry interval/timeout
         return h_log.LogExceptions(h_retry.Retry(
             consumer, exceptions=(
@@ -65,5 +125,19 @@ class ControllerPipeline(h_dis.EventPipeline):
                 requests_exc.ConnectionError)))
 
     def _wrap_dispatcher(self, dispatcher):
-        return h_log.LogExceptions(h_async.Async(dispatcher, self._tg,
-                                                 h_k8s.object_uid))
+        quotas = {kind: int(quota) for kind, quota in
+                  CONF.kubernetes.event_workers_per_kind.items()}
+        if sum(quotas.values()) >= CONF.kubernetes.event_workers:
+            # Retried handlers keep their workers, e.g. pods waiting for the
+            # network of their namespace could then starve the namespace
+            LOG.warning("The event_workers_per_kind quotas add up to at "
+                        "least event_workers (%d), the events of the "
+                        "kinds they wait for might not be handled.",
+                        CONF.kubernetes.event_workers)
+        return h_log.LogExceptions(h_async.Async(
+            dispatcher, self._tg, h_k8s.object_uid,
+            workers=CONF.kubernetes.event_workers,
+            quota_by=h_k8s.object_kind, quotas=quotas,
+            prioritize=_get_event_priority,
+            debounce_by=_get_event_debounce,
+            serialize_by=_get_event_serial_group))
@@ -35,6 +35,8 @@ class PodLabelHandler(k8s_base.ResourceEventHandler):
 
     OBJECT_KIND = constants.K8S_OBJ_POD
     OBJECT_WATCH_PATH = "%s/%s" % (constants.K8S_API_BASE, "pods")
+    OBJECT_FIELDS = constants.K8S_POD_FIELDS
+    SHARDING = constants.SHARDING_BY_NODE
 
     def __init__(self):
         super(PodLabelHandler, self).__init__()
@@ -16,7 +16,6 @@ from openstack import exceptions as os_exc
 from oslo_config import cfg as oslo_cfg
 from oslo_log import log as logging
 
-from kuryr_kubernetes import clients
 from kuryr_kubernetes import constants as k_const
 from kuryr_kubernetes.controller.drivers import base as drivers
 from kuryr_kubernetes.controller.drivers import utils as driver_utils
@@ -139,18 +138,20 @@ class NetworkPolicyHandler(k8s_base.ResourceEventHandler):
     def _is_service_affected(self, service, affected_pods):
         svc_namespace = service['metadata']['namespace']
         svc_selector = service['spec'].get('selector')
-        svc_pods = driver_utils.get_pods({'selector': svc_selector},
-                                         svc_namespace).get('items')
-        return any(pod in svc_pods for pod in affected_pods)
+        label_filter = driver_utils.get_label_filter(
+            {'selector': svc_selector})
+        return any(pod['metadata']['namespace'] == svc_namespace and
+                   label_filter(pod['metadata'].get('labels'))
+                   for pod in affected_pods)
 
     def _get_policy_net_id(self, policy):
         policy_ns = policy['metadata']['namespace']
 
-        kubernetes = clients.get_kubernetes_client()
         try:
             path = (f'{k_const.K8S_API_CRD_NAMESPACES}/{policy_ns}/'
                     f'kuryrnetworks/{policy_ns}')
-            net_crd = kubernetes.get(path)
+            net_crd = driver_utils.get_k8s_resource(
+                k_const.K8S_OBJ_KURYRNETWORK, path, policy_ns, policy_ns)
         except exceptions.K8sClientException:
             LOG.exception("Kubernetes Client Exception.")
             raise
@@ -26,6 +26,7 @@ from kuryr_kubernetes import clients
 from kuryr_kubernetes import config
 from kuryr_kubernetes import exceptions as exc
 from kuryr_kubernetes.handlers import health as h_health
+from kuryr_kubernetes import metrics
 
 LOG = logging.getLogger(__name__)
 CONF = cfg.CONF
@@ -45,7 +46,8 @@ class HealthServer(object):
     Allows to verify connectivity with Kubernetes API, Keystone and Neutron.
     If pool ports functionality is enabled it is verified whether
     the precreated ports are loaded into the pools. Also, checks handlers
-    states.
+    states. The controller metrics are exposed in the Prometheus format on
+    the /metrics endpoint.
     """
 
     def __init__(self):
@@ -56,6 +58,8 @@ class HealthServer(object):
             '/ready', methods=['GET'], view_func=self.readiness_status)
         self.application.add_url_rule(
             '/alive', methods=['GET'], view_func=self.liveness_status)
+        self.application.add_url_rule(
+            '/metrics', methods=['GET'], view_func=self.metrics_status)
         self.headers = {'Connection': 'close'}
 
     def _components_ready(self):
@@ -111,6 +115,11 @@ class HealthServer(object):
         LOG.debug('Kuryr Controller Liveness verified.')
         return data, httplib.OK, self.headers
 
+    def metrics_status(self):
+        headers = dict(self.headers)
+        headers['Content-Type'] = metrics.CONTENT_TYPE
+        return metrics.generate_latest(), httplib.OK, headers
+
     def run(self):
         address = '::'
         try:
@@ -12,16 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 from http import server
 import os
 import socketserver
 import threading
 
-
+import eventlet
 from openstack import exceptions as os_exc
 from oslo_config import cfg as oslo_cfg
 from oslo_log import log as logging
 from oslo_serialization import jsonutils
+from oslo_utils import uuidutils
 
 from kuryr.lib._i18n import _
 
@@ -36,10 +38,194 @@ pool_manager_opts = [
                            "will be used for communication with "
                            "the Pool Manager daemon"),
                     default='/run/kuryr/kuryr_manage.sock'),
+    oslo_cfg.IntOpt('job_workers',
+                    help=_("Maximum number of trunks populated in parallel "
+                           "by a pool management job."),
+                    min=1,
+                    default=10),
 ]
 
 oslo_cfg.CONF.register_opts(pool_manager_opts, "pool_manager")
 
+JOB_POPULATE = 'populate'
+JOB_FREE = 'free'
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+# Number of finished jobs whose status is kept
+MAX_FINISHED_JOBS = 50
+
+_jobs = collections.OrderedDict()
+
+
+def _get_vif_pool_driver():
+    try:
+        drv_vif = drivers.PodVIFDriver.get_instance()
+        drv_vif_pool = drivers.VIFPoolDriver.get_instance()
+        drv_vif_pool.set_vif_driver(drv_vif)
+    except TypeError:
+        LOG.error("Invalid driver type")
+        raise
+    return drv_vif_pool
+
+
+def _get_populate_args():
+    """Returns the pool driver and the pool key data of the default pods."""
+    try:
+        drv_project = drivers.PodProjectDriver.get_instance()
+        drv_subnets = drivers.PodSubnetsDriver.get_instance()
+        drv_sg = drivers.PodSecurityGroupsDriver.get_instance()
+        drv_vif_pool = _get_vif_pool_driver()
+        project_id = drv_project.get_project({})
+        security_groups = drv_sg.get_security_groups({}, project_id)
+        subnets = drv_subnets.get_subnets([], project_id)
+    except TypeError:
+        LOG.error("Invalid driver type")
+        raise
+    return drv_vif_pool, project_id, subnets, security_groups
+
+
+def _populate_trunk(drv_vif_pool, trunk_ip, project_id, subnets,
+                    security_groups, num_ports):
+    try:
+        drv_vif_pool.force_populate_pool(
+            trunk_ip, project_id, subnets, security_groups, num_ports)
+    except os_exc.ConflictException:
+        LOG.error("VLAN Id conflict (already in use) at trunk %s",
+                  trunk_ip)
+        raise
+    except os_exc.SDKException:
+        LOG.exception("Error happened during subports addition at "
+                      "trunk: %s", trunk_ip)
+        raise
+
+
+class PoolJob(object):
+    """Population or freeing of the pools of some trunks run in background.
+
+    Populate jobs handle their trunks in parallel, up to
+    `[pool_manager]job_workers` at a time, while free jobs go through the
+    trunks one after another, the ports of each trunk being detached in bulk
+    and deleted concurrently by the pool driver. The status of the job and
+    of each of its trunks is updated as they progress, so it can be polled
+    by the clients. Cancelling a job skips the trunks it did not start yet.
+    """
+
+    def __init__(self, action, trunk_ips=None, num_ports=1):
+        self.id = uuidutils.generate_uuid()
+        self.action = action
+        self.num_ports = num_ports
+        self.status = JOB_PENDING
+        self.trunks = {trunk_ip: {'status': JOB_PENDING}
+                       for trunk_ip in trunk_ips or ()}
+        self._trunk_ips = trunk_ips
+        self._cancelled = False
+
+    def is_finished(self):
+        return self.status in (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+    def to_dict(self):
+        return {'id': self.id, 'action': self.action,
+                'num_ports': self.num_ports, 'status': self.status,
+                'trunks': self.trunks}
+
+    def start(self):
+        eventlet.spawn(self.run)
+
+    def cancel(self):
+        if not self.is_finished():
+            self._cancelled = True
+
+    def run(self):
+        self.status = JOB_RUNNING
+        try:
+            if self.action == JOB_POPULATE:
+                self._populate()
+            else:
+                self._free()
+        except Exception:
+            LOG.exception("Error running pool %s job %s.", self.action,
+                          self.id)
+            self.status = JOB_FAILED
+            return
+
+        if any(trunk['status'] == JOB_FAILED
+               for trunk in self.trunks.values()):
+            self.status = JOB_FAILED
+        elif self._cancelled:
+            self.status = JOB_CANCELLED
+        else:
+            self.status = JOB_DONE
+        LOG.info("Pool %s job %s finished as %s.", self.action, self.id,
+                 self.status)
+
+    def _populate(self):
+        drv_vif_pool, project_id, subnets, security_groups = (
+            _get_populate_args())
+        pool = eventlet.GreenPool(oslo_cfg.CONF.pool_manager.job_workers)
+        for trunk_ip in self._trunk_ips:
+            pool.spawn_n(self._populate_trunk, drv_vif_pool, trunk_ip,
+                         project_id, subnets, security_groups)
+        pool.waitall()
+
+    def _populate_trunk(self, drv_vif_pool, trunk_ip, project_id, subnets,
+                        security_groups):
+        trunk = self.trunks[trunk_ip]
+        if self._cancelled:
+            trunk['status'] = JOB_CANCELLED
+            return
+        trunk['status'] = JOB_RUNNING
+        try:
+            _populate_trunk(drv_vif_pool, trunk_ip, project_id, subnets,
+                            security_groups, self.num_ports)
+        except Exception as ex:
+            trunk['status'] = JOB_FAILED
+            trunk['error'] = str(ex) or type(ex).__name__
+        else:
+            trunk['status'] = JOB_DONE
+            trunk['ports'] = self.num_ports
+
+    def _free(self):
+        for trunk in self.trunks.values():
+            trunk['status'] = JOB_RUNNING
+        _get_vif_pool_driver().free_pool(self._trunk_ips,
+                                         progress=self._free_progress)
+        for trunk in self.trunks.values():
+            if trunk['status'] == JOB_RUNNING:
+                # Trunks without pool ports or skipped after a cancel
+                trunk['status'] = (JOB_CANCELLED if self._cancelled
+                                   else JOB_DONE)
+
+    def _free_progress(self, trunk_ip, freed, total):
+        self.trunks[trunk_ip] = {
+            'status': JOB_DONE if freed == total else JOB_FAILED,
+            'ports': freed, 'total': total}
+        return not self._cancelled
+
+
+def start_job(action, trunk_ips=None, num_ports=1):
+    """Starts a pool job and registers it to be queried by its id."""
+    job = PoolJob(action, trunk_ips, num_ports)
+    _jobs[job.id] = job
+    finished = [job_id for job_id, old_job in _jobs.items()
+                if old_job.is_finished()]
+    for job_id in finished[:len(finished) - MAX_FINISHED_JOBS]:
+        del _jobs[job_id]
+    job.start()
+    return job
+
+
+def get_job(job_id):
+    return _jobs.get(job_id)
+
+
+def list_jobs():
+    return list(_jobs.values())
+
 
 class UnixDomainHttpServer(socketserver.ThreadingUnixStreamServer):
     pass
@@ -84,12 +270,39 @@ class RequestHandler(server.BaseHTTPRequestHandler):
                 pool = trunk_ips
 
             try:
-                self._delete_subports(trunk_ips)
+                freed = self._delete_subports(trunk_ips)
             except Exception:
                 response = 'Error freeing ports pool: {0}.'.format(pool)
             else:
-                response = 'Ports pool belonging to {0} was freed.'.format(
-                    pool)
+                response = self._get_free_progress(pool, freed)
+
+            self.send_header('Content-Length', len(response))
+            self.end_headers()
+            self.wfile.write(response.encode())
+
+        elif self.path.endswith(constants.VIF_POOL_JOBS):
+            action = params.get('action')
+            trunk_ips = params.get('trunks', None)
+            if action not in (JOB_POPULATE, JOB_FREE):
+                response = 'Invalid job action: {0}.'.format(action)
+            elif action == JOB_POPULATE and not trunk_ips:
+                response = 'Trunk port IP(s) missing.'
+            else:
+                job = start_job(action, trunk_ips,
+                                params.get('num_ports', 1))
+                response = jsonutils.dumps(job.to_dict())
+
+            self.send_header('Content-Length', len(response))
+            self.end_headers()
+            self.wfile.write(response.encode())
+
+        elif self.path.endswith(constants.VIF_POOL_CANCEL):
+            job = get_job(params.get('job_id'))
+            if job is None:
+                response = 'Job not found: {0}.'.format(params.get('job_id'))
+            else:
+                job.cancel()
+                response = jsonutils.dumps(job.to_dict())
 
             self.send_header('Content-Length', len(response))
             self.end_headers()
@@ -139,6 +352,22 @@ class RequestHandler(server.BaseHTTPRequestHandler):
             self.end_headers()
             self.wfile.write(response.encode())
 
+        elif self.path.endswith(constants.VIF_POOL_JOBS):
+            job_id = params.get('job_id')
+            if job_id is None:
+                response = jsonutils.dumps(
+                    [job.to_dict() for job in list_jobs()])
+            else:
+                job = get_job(job_id)
+                if job is None:
+                    response = 'Job not found: {0}.'.format(job_id)
+                else:
+                    response = jsonutils.dumps(job.to_dict())
+
+            self.send_header('Content-Length', len(response))
+            self.end_headers()
+            self.wfile.write(response.encode())
+
         else:
             response = 'Method not allowed.'
             self.send_header('Content-Length', len(response))
@@ -146,54 +375,30 @@ class RequestHandler(server.BaseHTTPRequestHandler):
             self.wfile.write(response.encode())
 
     def _create_subports(self, num_ports, trunk_ips):
-        try:
-            drv_project = drivers.PodProjectDriver.get_instance()
-            drv_subnets = drivers.PodSubnetsDriver.get_instance()
-            drv_sg = drivers.PodSecurityGroupsDriver.get_instance()
-            drv_vif = drivers.PodVIFDriver.get_instance()
-            drv_vif_pool = drivers.VIFPoolDriver.get_instance()
-            drv_vif_pool.set_vif_driver(drv_vif)
-            project_id = drv_project.get_project({})
-            security_groups = drv_sg.get_security_groups({}, project_id)
-            subnets = drv_subnets.get_subnets([], project_id)
-        except TypeError:
-            LOG.error("Invalid driver type")
-            raise
-
+        drv_vif_pool, project_id, subnets, security_groups = (
+            _get_populate_args())
         for trunk_ip in trunk_ips:
-            try:
-                drv_vif_pool.force_populate_pool(
-                    trunk_ip, project_id, subnets, security_groups, num_ports)
-            except os_exc.ConflictException:
-                LOG.error("VLAN Id conflict (already in use) at trunk %s",
-                          trunk_ip)
-                raise
-            except os_exc.SDKException:
-                LOG.exception("Error happened during subports addition at "
-                              "trunk: %s", trunk_ip)
-                raise
+            _populate_trunk(drv_vif_pool, trunk_ip, project_id, subnets,
+                            security_groups, num_ports)
 
     def _delete_subports(self, trunk_ips):
-        try:
-            drv_vif = drivers.PodVIFDriver.get_instance()
-            drv_vif_pool = drivers.VIFPoolDriver.get_instance()
-            drv_vif_pool.set_vif_driver(drv_vif)
+        return _get_vif_pool_driver().free_pool(trunk_ips)
 
-            drv_vif_pool.free_pool(trunk_ips)
-        except TypeError:
-            LOG.error("Invalid driver type")
-            raise
+    def _get_free_progress(self, pool, freed):
+        if not freed:
+            return 'Ports pool belonging to {0} was freed.'.format(pool)
+        if all(done == total for done, total in freed.values()):
+            response = 'Ports pool belonging to {0} was freed:'.format(pool)
+        else:
+            response = ('Ports pool belonging to {0} was partially '
+                        'freed:'.format(pool))
+        for trunk_ip, (done, total) in sorted(freed.items()):
+            response += '\n{0}: {1}/{2} ports freed'.format(
+                trunk_ip, done, total)
+        return response
 
     def _list_pools(self):
-        try:
-            drv_vif = drivers.PodVIFDriver.get_instance()
-            drv_vif_pool = drivers.VIFPoolDriver.get_instance()
-            drv_vif_pool.set_vif_driver(drv_vif)
-
-            available_pools = drv_vif_pool.list_pools()
-        except TypeError:
-            LOG.error("Invalid driver type")
-            raise
+        available_pools = _get_vif_pool_driver().list_pools()
 
         pools_info = ""
         for pool_key, pool_items in available_pools.items():
@@ -204,15 +409,7 @@ class RequestHandler(server.BaseHTTPRequestHandler):
         return "There are no pools"
 
     def _show_pool(self, pool_key):
-        try:
-            drv_vif = drivers.PodVIFDriver.get_instance()
-            drv_vif_pool = drivers.VIFPoolDriver.get_instance()
-            drv_vif_pool.set_vif_driver(drv_vif)
-
-            pool = drv_vif_pool.show_pool(pool_key)
-        except TypeError:
-            LOG.error("Invalid driver type")
-            raise
+        pool = _get_vif_pool_driver().show_pool(pool_key)
 
         if pool:
             pool_info = ""
@@ -229,7 +426,9 @@ class PoolManager(object):
     `PoolManager` runs on the Kuryr-kubernetes controller and allows  to
     populate specific pools with a given amount of ports. In addition, it also
     allows to remove all the (unused) ports in the given pool(s), or from all
-    of the pool if none of them is specified.
+    of the pool if none of them is specified. Both actions can also be run as
+    background `PoolJob`, whose progress can be polled and that can be
+    cancelled.
     """
 
     def __init__(self):
@@ -30,6 +30,8 @@ from kuryr_kubernetes import config
 from kuryr_kubernetes.controller.drivers import base as drivers
 from kuryr_kubernetes.controller.handlers import pipeline as h_pipeline
 from kuryr_kubernetes.controller.managers import health
+from kuryr_kubernetes.controller import sharding
+from kuryr_kubernetes import k8s_cache
 from kuryr_kubernetes import objects
 from kuryr_kubernetes import utils
 from kuryr_kubernetes import watcher
@@ -82,16 +84,24 @@ class KuryrK8sService(service.Service, periodic_task.PeriodicTasks,
         periodic_task.PeriodicTasks.__init__(self, CONF)
 
         objects.register_locally_defined_vifs()
-        pipeline = h_pipeline.ControllerPipeline(self.tg)
-        self.watcher = watcher.Watcher(pipeline, self.tg)
+        self.shard_manager = None
+        if CONF.kubernetes.controller_sharding:
+            self.shard_manager = sharding.setup_shard_manager()
+        self.pipeline = h_pipeline.ControllerPipeline(self.tg,
+                                                      self.shard_manager)
+        self.watcher = watcher.Watcher(self.pipeline, self.tg)
         self.health_manager = health.HealthServer()
         self.current_leader = None
         self.node_name = utils.get_node_name()
 
         handlers = _load_kuryr_ctrlr_handlers()
         for handler in handlers:
-            self.watcher.add(handler.get_watch_path())
-            pipeline.register(handler)
+            self.watcher.add(handler.get_watch_path(),
+                             handler.get_watch_fields())
+            self.pipeline.register(handler)
+            if CONF.kubernetes.watch_cache:
+                k8s_cache.register(handler.OBJECT_KIND,
+                                   handler.get_watch_path())
         self.pool_driver = drivers.VIFPoolDriver.get_instance(
             specific_driver='multi_pool')
         self.pool_driver.set_vif_driver()
@@ -103,7 +113,18 @@ class KuryrK8sService(service.Service, periodic_task.PeriodicTasks,
         LOG.info("Service '%s' starting", self.__class__.__name__)
         super(KuryrK8sService, self).start()
 
-        if not CONF.kubernetes.controller_ha:
+        if CONF.kubernetes.controller_sharding:
+            if CONF.kubernetes.controller_ha:
+                LOG.critical('Options controller_ha and controller_sharding '
+                             'cannot be enabled together.')
+                raise SystemExit()
+            LOG.info('Running in sharded mode, starting watcher immediately.')
+            self.shard_manager.refresh()
+            self.watcher.start()
+            self.pool_driver.sync_pools()
+            f = functools.partial(self.run_periodic_tasks, None)
+            self.tg.add_timer(1, f)
+        elif not CONF.kubernetes.controller_ha:
             LOG.info('Running in non-HA mode, starting watcher immediately.')
             self.watcher.start()
             self.pool_driver.sync_pools()
@@ -117,6 +138,8 @@ class KuryrK8sService(service.Service, periodic_task.PeriodicTasks,
 
     @periodic_task.periodic_task(spacing=5, run_immediately=True)
     def monitor_leader(self, context):
+        if not CONF.kubernetes.controller_ha:
+            return
         leader = utils.get_leader_name()
         if leader is None:
             # Error when fetching current leader. We're paranoid, so just to
@@ -153,6 +176,27 @@ class KuryrK8sService(service.Service, periodic_task.PeriodicTasks,
                         'stopped. Restarting it.', self.node_name)
             self.watcher.start()
 
+    @periodic_task.periodic_task(spacing=5)
+    def monitor_shards(self, context):
+        if not CONF.kubernetes.controller_sharding:
+            return
+        self.shard_manager.refresh()
+        previous_ring = self.shard_manager.complete_handoff()
+        if previous_ring is not None:
+            self.on_shards_handoff(previous_ring)
+
+    def on_shards_handoff(self, previous_ring):
+        LOG.info('Controller %s takes over its shards, handing the pools '
+                 'over.', self.node_name)
+        # The pools of the nodes lost are dropped and the ones of the nodes
+        # gained are recovered, whose objects are then handled again.
+        self.pool_driver.handoff_pools(previous_ring)
+        self.watcher.replay(functools.partial(self.shard_manager.is_gained,
+                                              previous_ring=previous_ring))
+        # The objects deleted meanwhile are not replayed
+        for event in self.shard_manager.pop_deferred_deletions():
+            self.pipeline(event)
+
     def wait(self):
         super(KuryrK8sService, self).wait()
         LOG.info("Service '%s' stopped", self.__class__.__name__)
@@ -160,6 +204,8 @@ class KuryrK8sService(service.Service, periodic_task.PeriodicTasks,
     def stop(self, graceful=False):
         LOG.info("Service '%s' stopping", self.__class__.__name__)
         self.watcher.stop()
+        if self.shard_manager is not None:
+            self.shard_manager.release()
         super(KuryrK8sService, self).stop(graceful)
 
 
@@ -0,0 +1,338 @@
+# Copyright 2020 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import bisect
+import datetime
+import hashlib
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import timeutils
+
+from kuryr_kubernetes import clients
+from kuryr_kubernetes import constants
+from kuryr_kubernetes import exceptions
+from kuryr_kubernetes.handlers import base
+from kuryr_kubernetes import k8s_cache
+from kuryr_kubernetes import utils
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+# Key whose owner handles the events not sharded by node
+LEADER_KEY = 'kuryr-controller-leader'
+# Number of points of each member on the hash ring
+RING_POINTS = 64
+# Minimum seconds between two LISTs of the nodes to resolve unknown IPs
+NODE_NAMES_REFRESH_INTERVAL = 30
+
+_shard_manager = None
+
+
+def _hash(key):
+    return int(hashlib.sha256(key.encode('utf-8')).hexdigest()[:16], 16)
+
+
+def _format_time(timestamp):
+    return datetime.datetime.fromtimestamp(
+        timestamp, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def get_node_key(obj):
+    """Returns the name of the node a Pod runs on or None if unscheduled."""
+    return obj.get('spec', {}).get('nodeName')
+
+
+class HashRing(object):
+    """Consistent hash ring of the controller replicas.
+
+    Each member is placed at `RING_POINTS` points of the ring, and a key
+    belongs to the member of the first point following the hash of the key,
+    so that a membership change only moves the keys of the points the
+    members gained or lost.
+    """
+
+    def __init__(self, members=()):
+        self.members = frozenset(members)
+        points = sorted((_hash('%s-%d' % (member, i)), member)
+                        for member in self.members
+                        for i in range(RING_POINTS))
+        self._hashes = [point for point, _ in points]
+        self._members = [member for _, member in points]
+
+    def get_member(self, key):
+        if not self._hashes:
+            return None
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._members[i]
+
+
+class ShardManager(object):
+    """Tracks the sharded controllers and the keys they own.
+
+    Every controller holds a Lease object labeled as a controller shard,
+    which it renews on each `refresh`. The controllers whose Lease did not
+    expire form the `HashRing` splitting the node names among them, and the
+    owner of `LEADER_KEY` handles the events not sharded by node.
+
+    When the ring changes, the keys moving to another controller are
+    released right away, but they are only taken over after a Lease
+    duration, once the previous owner has seen the change too. Meanwhile,
+    only the keys owned in both the new ring and the previous one are owned,
+    and the deletions of the objects of the keys being taken over are kept
+    to be handled once they are. A starting controller takes over the keys
+    from the other controllers, if any. A controller that can't renew its
+    Lease for a Lease duration owns no key.
+    """
+
+    def __init__(self, member=None):
+        self.member = member or utils.get_node_name()
+        self._ring = HashRing()
+        # Ring owning the keys until the handoff deadline
+        self._previous_ring = None
+        self._handoff_deadline = 0
+        # uid -> DELETED event of the objects of the keys being taken over
+        self._deferred_deletions = {}
+        self._last_renew = 0
+        # Node IP -> node name
+        self._node_names = {}
+        # Resource version of the Node cache or time of the LIST the node
+        # names were last read from
+        self._node_names_version = None
+        self._node_names_time = 0
+
+    def _get_leases_path(self):
+        return '%s/namespaces/%s/leases' % (
+            constants.K8S_API_COORDINATION,
+            CONF.kubernetes.controller_sharding_namespace)
+
+    def _renew(self, now):
+        k8s = clients.get_kubernetes_client()
+        spec = {
+            'holderIdentity': self.member,
+            'leaseDurationSeconds':
+                CONF.kubernetes.controller_sharding_lease_duration,
+            'renewTime': _format_time(now),
+        }
+        try:
+            k8s.patch('spec', '%s/%s' % (self._get_leases_path(),
+                                         self.member), spec)
+        except exceptions.K8sResourceNotFound:
+            k8s.post(self._get_leases_path(), {
+                'apiVersion': 'coordination.k8s.io/v1',
+                'kind': constants.K8S_OBJ_LEASE,
+                'metadata': {
+                    'name': self.member,
+                    'labels': {constants.K8S_LABEL_CONTROLLER_SHARD: 'true'},
+                },
+                'spec': spec,
+            })
+
+    def _get_members(self, now):
+        k8s = clients.get_kubernetes_client()
+        leases = k8s.get('%s?labelSelector=%s' % (
+            self._get_leases_path(), constants.K8S_LABEL_CONTROLLER_SHARD))
+        members = {self.member}
+        for lease in leases.get('items', []):
+            spec = lease.get('spec', {})
+            try:
+                renew_time = timeutils.parse_isotime(
+                    spec['renewTime']).timestamp()
+                expiry = renew_time + spec['leaseDurationSeconds']
+            except (KeyError, ValueError):
+                LOG.debug("Skipping invalid controller Lease %s",
+                          lease['metadata']['name'])
+                continue
+            if expiry > now:
+                members.add(spec.get('holderIdentity') or
+                            lease['metadata']['name'])
+        return members
+
+    def refresh(self, now=None):
+        """Renews the Lease of the controller and updates the ring.
+
+        :return: whether the ring changed
+        """
+        now = now or time.time()
+        try:
+            self._renew(now)
+            self._last_renew = now
+            members = self._get_members(now)
+        except exceptions.K8sClientException:
+            LOG.exception("Error refreshing the controller shards.")
+            if (now - self._last_renew <
+                    CONF.kubernetes.controller_sharding_lease_duration):
+                return False
+            # Other controllers may have taken over our keys by now
+            members = set()
+
+        if members == self._ring.members:
+            return False
+        LOG.info("Controller shards changed from %s to %s",
+                 sorted(self._ring.members), sorted(members))
+        if self.member not in self._ring.members:
+            # On start or once the Lease is renewed again, the keys are
+            # owned by the other controllers, if any, until they see this one
+            others = members - {self.member}
+            self._previous_ring = HashRing(others) if others else None
+        elif self._previous_ring is None:
+            self._previous_ring = self._ring
+        self._ring = HashRing(members)
+        self._handoff_deadline = (
+            now + CONF.kubernetes.controller_sharding_lease_duration)
+        return True
+
+    def complete_handoff(self, now=None):
+        """Takes over the keys gained once the handoff deadline passed.
+
+        :return: the ring that owned the keys until now, or None if there is
+                 no handoff due
+        """
+        if self._previous_ring is None:
+            return None
+        if (now or time.time()) < self._handoff_deadline:
+            return None
+        previous_ring, self._previous_ring = self._previous_ring, None
+        return previous_ring
+
+    def is_owner(self, key):
+        if key is None or self._ring.get_member(key) != self.member:
+            return False
+        return (self._previous_ring is None or
+                self._previous_ring.get_member(key) == self.member)
+
+    def is_taking_over(self, key):
+        """Returns whether the key is handed over to this controller."""
+        return (key is not None and self._previous_ring is not None and
+                self._ring.get_member(key) == self.member and
+                self._previous_ring.get_member(key) != self.member)
+
+    def defer_deletion(self, event):
+        """Keeps the DELETED event of an object of a key taken over.
+
+        Once the keys are taken over, the objects gained are handled again
+        from the cache, which the deleted ones are not part of anymore.
+        """
+        self._deferred_deletions[event['object']['metadata']['uid']] = event
+
+    def pop_deferred_deletions(self):
+        """Returns the DELETED events kept until the handoff completed."""
+        events = list(self._deferred_deletions.values())
+        self._deferred_deletions = {}
+        return events
+
+    def is_gained(self, obj, previous_ring):
+        """Returns whether the object was owned by another controller.
+
+        :param previous_ring: the ring owning the keys before the handoff
+        """
+        return any(self.is_gained_key(key, previous_ring)
+                   for key in (LEADER_KEY, get_node_key(obj)))
+
+    def is_gained_key(self, key, previous_ring):
+        """Returns whether the key was owned by another controller.
+
+        :param previous_ring: the ring owning the keys before the handoff
+        """
+        return (key is not None and self.is_owner(key) and
+                previous_ring.get_member(key) != self.member)
+
+    def get_node_name(self, node_ip, now=None):
+        """Returns the name of the node with the given IP or None.
+
+        The names are read from the Node cache when the nodes are watched.
+        Otherwise the nodes are listed again on an unknown IP, e.g. of a VM
+        not part of the cluster, at most every NODE_NAMES_REFRESH_INTERVAL
+        seconds.
+        """
+        cache = k8s_cache.get_cache(constants.K8S_OBJ_NODE)
+        if cache is not None:
+            if cache.resource_version != self._node_names_version:
+                self._set_node_names(cache.list())
+                self._node_names_version = cache.resource_version
+            return self._node_names.get(node_ip)
+
+        node_name = self._node_names.get(node_ip)
+        now = now or time.time()
+        if (node_name is None and now - self._node_names_time >=
+                NODE_NAMES_REFRESH_INTERVAL):
+            k8s = clients.get_kubernetes_client()
+            nodes = k8s.get('%s/nodes' % constants.K8S_API_BASE)
+            self._set_node_names(nodes.get('items', []))
+            self._node_names_version = None
+            self._node_names_time = now
+            node_name = self._node_names.get(node_ip)
+        return node_name
+
+    def _set_node_names(self, nodes):
+        self._node_names = {
+            address['address']: node['metadata']['name']
+            for node in nodes
+            for address in node.get('status', {}).get('addresses', [])}
+
+    def release(self):
+        """Deletes the Lease of the controller to hand its keys over."""
+        k8s = clients.get_kubernetes_client()
+        try:
+            k8s.delete('%s/%s' % (self._get_leases_path(), self.member))
+        except exceptions.K8sResourceNotFound:
+            pass
+        except exceptions.K8sClientException:
+            LOG.exception("Error deleting the Lease of controller %s.",
+                          self.member)
+        self._ring = HashRing()
+        self._previous_ring = None
+        self._deferred_deletions = {}
+
+
+class ShardFilter(base.EventHandler):
+    """Drops the events of the K8s objects owned by other controllers.
+
+    Events of the handlers sharded by node belong to the owner of the node
+    their Pod runs on, while the events of the other handlers belong to the
+    owner of `LEADER_KEY`. The ownership is checked on every call, so an
+    event retried after its key moved to another controller is dropped. The
+    DELETED events of the keys being taken over are deferred until they are.
+    """
+
+    def __init__(self, handler, shard_manager, sharding):
+        self._handler = handler
+        self._shard_manager = shard_manager
+        self._sharding = sharding
+
+    def __getattr__(self, name):
+        return getattr(self._handler, name)
+
+    def __call__(self, event):
+        if self._sharding == constants.SHARDING_BY_NODE:
+            key = get_node_key(event.get('object', {}))
+        else:
+            key = LEADER_KEY
+        if self._shard_manager.is_owner(key):
+            self._handler(event)
+        elif (event.get('type') == 'DELETED' and
+                self._shard_manager.is_taking_over(key)):
+            self._shard_manager.defer_deletion(event)
+
+
+def setup_shard_manager(member=None):
+    global _shard_manager
+    _shard_manager = ShardManager(member)
+    return _shard_manager
+
+
+def get_shard_manager():
+    """Returns the `ShardManager` or None if the controller isn't sharded."""
+    return _shard_manager
@@ -34,6 +34,14 @@ class K8sResourceNotFound(K8sClientException):
                                                   "found: %r" % resource)
 
 
+class K8sResourceExpired(K8sClientException):
+    """The requested resourceVersion is too old (HTTP 410 Gone)"""
+
+    def __init__(self, resource):
+        super(K8sResourceExpired, self).__init__("Resource version "
+                                                 "expired: %r" % resource)
+
+
 class InvalidKuryrNetworkAnnotation(Exception):
     pass
 
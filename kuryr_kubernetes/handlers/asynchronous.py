@@ -13,99 +13,270 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import heapq
 import itertools
-import queue as py_queue
+import threading
 import time
 
 from oslo_log import log as logging
 
-
+from kuryr_kubernetes import clients
 from kuryr_kubernetes.handlers import base
+from kuryr_kubernetes import k8s_client
+from kuryr_kubernetes import metrics
 
 LOG = logging.getLogger(__name__)
 
-DEFAULT_QUEUE_DEPTH = 100
-DEFAULT_GRACE_PERIOD = 5
-STALE_PERIOD = 0.5
+DEFAULT_WORKERS = 100
+
+
+def _get_kind(event):
+    try:
+        return event['object']['kind']
+    except (KeyError, TypeError):
+        return ''
 
 
 class Async(base.EventHandler):
     """Handles events asynchronously.
 
     `Async` can be used to decorate another `handler` to be run asynchronously
-    using the specified `thread_group`. `Async` distinguishes *related* and
-    *unrelated* events (based on the result of `group_by`(`event`) function)
-    and handles *unrelated* events concurrently while *related* events are
-    handled serially and in the same order they arrived to `Async`.
+    by a pool of at most `workers` threads of the specified `thread_group`.
+    `Async` distinguishes *related* and *unrelated* events (based on the
+    result of `group_by`(`event`) function) and handles *unrelated* events
+    concurrently while *related* events are handled serially and in the same
+    order they arrived to `Async`.
+
+    *Related* events are expected to be the events of the same K8s object:
+    an event waiting to be handled is superseded by a newer one, and events
+    older than the last annotation written by `K8sClient` to the object are
+    skipped, as the handler would otherwise process the object without the
+    annotation it has already set.
+
+    Events waiting to be handled are picked by the workers in the order of
+    their `prioritize`(`event`) value, lower first, and then in the order of
+    arrival. When `quotas` are set, at most `quotas[quota_by(event)]` events
+    with the same `quota_by` result are handled concurrently.
+
+    When `debounce_by`(`event`) returns a (quiet period, max delay) tuple,
+    the event is only handled once no newer event of its group arrived for
+    the quiet period, or once the max delay passed since the first event of
+    the group waiting to be handled, so that a burst of related events is
+    handled once. An event for which `debounce_by` returns None is handled
+    without delay, along with the events of its group it supersedes.
+
+    Events of *unrelated* objects with the same `serialize_by`(`event`)
+    result, e.g. of objects sharing another one, are handled one after
+    another in the order they arrived too, by one worker at a time instead
+    of concurrently, without superseding each other. Quotas, priorities and
+    debouncing then apply to them together. All the events of a group are
+    expected to have the same `serialize_by` result.
     """
 
     def __init__(self, handler, thread_group, group_by,
-                 queue_depth=DEFAULT_QUEUE_DEPTH,
-                 grace_period=DEFAULT_GRACE_PERIOD):
+                 workers=DEFAULT_WORKERS, quota_by=None, quotas=None,
+                 prioritize=None, debounce_by=None, serialize_by=None):
         self._handler = handler
         self._thread_group = thread_group
         self._group_by = group_by
-        self._queue_depth = queue_depth
-        self._grace_period = grace_period
-        self._queues = {}
+        self._serialize_by = serialize_by or group_by
+        self._workers = workers
+        self._quota_by = quota_by
+        self._quotas = quotas or {}
+        self._prioritize = prioritize
+        self._debounce_by = debounce_by
+        self._k8s = clients.get_kubernetes_client()
+        self._started = False
+        self._cond = threading.Condition()
+        self._seq = 0
+        # group -> newest event of the group not handled yet
+        self._pending = {}
+        # serial group -> deque of its groups with a pending event, in the
+        # order of arrival
+        self._queued = {}
+        # serial groups having an event handled by a worker
+        self._busy = set()
+        # (priority, quota key) -> deque of (seq, serial group) ready to be
+        # handled
+        self._ready = {}
+        # quota key -> number of events being handled
+        self._running = collections.Counter()
+        # serial group -> (arrival of its first pending event, time it is
+        # due) of the serial groups whose pending events are debounced
+        self._deferred = {}
+        # heap of the (due time, seq, serial group) of the deferred ones
+        self._deadlines = []
 
     def __call__(self, event):
         group = self._group_by(event)
-        try:
-            queue = self._queues[group]
-        except KeyError:
-            queue = py_queue.Queue(self._queue_depth)
-            self._queues[group] = queue
-            thread = self._thread_group.add_thread(self._run, group, queue)
-            thread.link(self._done, group)
-        queue.put(event)
-
-    def _run(self, group, queue):
-        LOG.debug("Asynchronous handler started processing %s", group)
+        serial = self._serialize_by(event)
+        debounce = self._debounce_by(event) if self._debounce_by else None
+        now = time.monotonic()
+        with self._cond:
+            if serial in self._queued:
+                if serial in self._deferred:
+                    if debounce:
+                        self._defer(serial, debounce, now)
+                    else:
+                        del self._deferred[serial]
+                        if serial not in self._busy:
+                            self._add_ready(serial, event)
+            else:
+                if debounce:
+                    self._defer(serial, debounce, now)
+                elif serial not in self._busy:
+                    self._add_ready(serial, event)
+                self._queued[serial] = collections.deque()
+            if group in self._pending:
+                LOG.debug("Superseded an event of %s not handled yet", group)
+            else:
+                metrics.EVENT_QUEUE_DEPTH.labels(_get_kind(event)).inc()
+                self._queued[serial].append(group)
+            self._pending[group] = event
+            self._cond.notify()
+        if not self._started:
+            self._start()
+
+    def _start(self):
+        self._started = True
+        LOG.debug("Starting %d asynchronous handler workers", self._workers)
+        for _ in range(self._workers):
+            self._thread_group.add_thread(self._run)
+
+    def _add_ready(self, group, event):
+        priority = self._prioritize(event) if self._prioritize else 0
+        quota_key = self._quota_by(event) if self._quota_by else None
+        ready = self._ready.setdefault((priority, quota_key),
+                                       collections.deque())
+        self._seq += 1
+        ready.append((self._seq, group))
+
+    def _defer(self, group, debounce, now):
+        quiet_period, max_delay = debounce
+        first_arrival = self._deferred.get(group, (now, None))[0]
+        due = min(now + quiet_period, first_arrival + max_delay)
+        self._deferred[group] = (first_arrival, due)
+        self._seq += 1
+        heapq.heappush(self._deadlines, (due, self._seq, group))
+
+    def _release_deferred(self, now):
+        """Makes the deferred groups that are due ready to be handled."""
+        while self._deadlines and self._deadlines[0][0] <= now:
+            due, seq, group = heapq.heappop(self._deadlines)
+            deferred = self._deferred.get(group)
+            if deferred is None or deferred[1] != due:
+                # The group was deferred further or is not deferred anymore
+                continue
+            del self._deferred[group]
+            if group not in self._busy:
+                self._add_ready(group, self._get_next_pending(group))
+
+    def _get_wait_timeout(self):
+        if not self._deadlines:
+            return None
+        return max(0, self._deadlines[0][0] - time.monotonic())
+
+    def _get_next_pending(self, serial):
+        return self._pending[self._queued[serial][0]]
+
+    def _pop_ready(self):
+        """Returns the next (quota key, serial group) to handle or None."""
+        if self._deadlines:
+            self._release_deferred(time.monotonic())
+
+        best = None
+        for key, ready in self._ready.items():
+            quota = self._quotas.get(key[1])
+            if quota is not None and self._running[key[1]] >= quota:
+                continue
+            candidate = (key[0], ready[0][0])
+            if best is None or candidate < best[0]:
+                best = (candidate, key)
+        if best is None:
+            return None
+
+        key = best[1]
+        ready = self._ready[key]
+        _, group = ready.popleft()
+        if not ready:
+            del self._ready[key]
+        return key[1], group
+
+    def _run(self):
         for _ in itertools.count():
             # NOTE(ivc): this is a mock-friendly replacement for 'while True'
             # to allow more controlled environment for unit-tests (e.g. to
             # avoid tests getting stuck in infinite loops)
+            with self._cond:
+                next_ready = self._pop_ready()
+                while next_ready is None:
+                    self._cond.wait(self._get_wait_timeout())
+                    next_ready = self._pop_ready()
+                quota_key, serial = next_ready
+                queued = self._queued[serial]
+                group = queued.popleft()
+                if not queued:
+                    del self._queued[serial]
+                event = self._pending.pop(group)
+                metrics.EVENT_QUEUE_DEPTH.labels(_get_kind(event)).dec()
+                self._busy.add(serial)
+                self._running[quota_key] += 1
+
             try:
-                event = queue.get(timeout=self._grace_period)
-            except py_queue.Empty:
-                break
-            # FIXME(ivc): temporary workaround to skip stale events
-            # If K8s updates resource while the handler is processing it,
-            # when the handler finishes its work it can fail to update an
-            # annotation due to the 'resourceVersion' conflict. K8sClient
-            # was updated to allow *new* annotations to be set ignoring
-            # 'resourceVersion', but it leads to another problem as the
-            # Handler will receive old events (i.e. before annotation is set)
-            # and will start processing the event 'from scratch'.
-            # It has negative effect on handlers' performance (VIFHandler
-            # creates ports only to later delete them and LBaaS handler also
-            # produces some excess requests to Neutron, although with lesser
-            # impact).
-            # Possible solutions (can be combined):
-            #  - use K8s ThirdPartyResources to store data/annotations instead
-            #    of native K8s resources (assuming Kuryr-K8s will own those
-            #    resources and no one else would update them)
-            #  - use the resulting 'resourceVersion' received from K8sClient's
-            #    'annotate' to provide feedback to Async to skip all events
-            #    until that version
-            #  - stick to the 'get-or-create' behaviour in handlers and
-            #    also introduce cache for long operations
-            time.sleep(STALE_PERIOD)
-            while not queue.empty():
-                event = queue.get()
-                if queue.empty():
-                    time.sleep(STALE_PERIOD)
-            self._handler(event)
-
-    def _done(self, thread, group):
-        LOG.debug("Asynchronous handler stopped processing group %s", group)
-        queue = self._queues.pop(group)
-
-        if not queue.empty():
-            LOG.critical("Asynchronous handler terminated abnormally; "
-                         "%(count)s events dropped for %(group)s",
-                         {'count': queue.qsize(), 'group': group})
-
-        if not self._queues:
-            LOG.debug("Asynchronous handler is idle")
+                if not self._is_stale(event):
+                    self._handler(event)
+            except Exception:
+                LOG.exception("Asynchronous handler failed to handle an "
+                              "event of %s", group)
+            finally:
+                with self._cond:
+                    self._busy.discard(serial)
+                    quota = self._quotas.get(quota_key)
+                    if quota is not None and (
+                            self._running[quota_key] >= quota):
+                        # Workers might be waiting for this quota to free up
+                        self._cond.notify_all()
+                    self._running[quota_key] -= 1
+                    if (serial in self._queued and
+                            serial not in self._deferred):
+                        self._add_ready(serial,
+                                        self._get_next_pending(serial))
+                        self._cond.notify()
+
+    def _is_stale(self, event):
+        try:
+            metadata = event['object']['metadata']
+            uid = metadata['uid']
+            resource_version = metadata['resourceVersion']
+        except (KeyError, TypeError):
+            return False
+
+        if event.get('type') == 'DELETED':
+            self._k8s.forget_annotated_resource_version(uid)
+            return False
+
+        # If K8s updates a resource while the handler is processing it, the
+        # handler would then receive the events preceding its own annotation
+        # and start processing the event 'from scratch' (e.g. VIFHandler
+        # creating ports only to later delete them). The event resulting from
+        # the annotation is always delivered after those, so they can be
+        # safely skipped.
+        annotated_version = self._k8s.get_annotated_resource_version(uid)
+        if annotated_version is None:
+            return False
+        # resourceVersions that can't be ordered are newer than each other
+        # and never make an event stale
+        if (k8s_client._is_newer(annotated_version, resource_version) and
+                not k8s_client._is_newer(resource_version,
+                                         annotated_version)):
+            LOG.debug("Skipping %(type)s event of %(uid)s with "
+                      "resourceVersion %(rv)s preceding its annotation at "
+                      "%(annotated)s",
+                      {'type': event.get('type'), 'uid': uid,
+                       'rv': resource_version,
+                       'annotated': annotated_version})
+            return True
+        # No event preceding the annotation is delivered after this one
+        self._k8s.forget_annotated_resource_version(uid, resource_version)
+        return False
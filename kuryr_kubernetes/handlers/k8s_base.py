@@ -13,8 +13,10 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from kuryr_kubernetes import constants
 from kuryr_kubernetes.handlers import dispatch
 from kuryr_kubernetes.handlers import health
+from kuryr_kubernetes import metrics
 
 
 def object_kind(event):
@@ -42,6 +44,18 @@ class ResourceEventHandler(dispatch.EventConsumer, health.HealthHandler):
     The `OBJECT_WATCH_PATH` should point to object's watched path,
     (e.g. for the 'Pod' case the OBJECT_WATCH_PATH should be '/api/v1/pods').
 
+    Implementing classes may set `OBJECT_FIELDS` to the fields of the object
+    they use, as dotted paths (e.g. ('metadata', 'status.podIP')). Unless
+    other handlers watching the same path need the whole object, the
+    `Watcher` then drops the other fields of the objects. The 'kind' and
+    'apiVersion' fields are always kept.
+
+    When the controllers are sharded, the events of the handlers are only
+    handled by the controller owning them, which depends on the `SHARDING`
+    of the handler: the owner of the node of the Pod for `SHARDING_BY_NODE`,
+    every controller for `SHARDING_ALL`, and a single controller for
+    `SHARDING_LEADER`, the default.
+
     Implementing classes are expected to override any or all of the
     `on_added`, `on_present`, `on_modified`, `on_deleted` methods that would
     be called depending on the type of the event (with K8s object as a single
@@ -53,6 +67,8 @@ class ResourceEventHandler(dispatch.EventConsumer, health.HealthHandler):
 
     OBJECT_KIND = None
     OBJECT_WATCH_PATH = None
+    OBJECT_FIELDS = None
+    SHARDING = constants.SHARDING_LEADER
 
     def __init__(self):
         super(ResourceEventHandler, self).__init__()
@@ -60,6 +76,9 @@ class ResourceEventHandler(dispatch.EventConsumer, health.HealthHandler):
     def get_watch_path(self):
         return self.OBJECT_WATCH_PATH
 
+    def get_watch_fields(self):
+        return self.OBJECT_FIELDS
+
     @property
     def consumes(self):
         return {object_kind: self.OBJECT_KIND}
@@ -75,7 +94,11 @@ class ResourceEventHandler(dispatch.EventConsumer, health.HealthHandler):
 
     def __call__(self, event):
         event_type = event.get('type')
-        obj = event.get('object')
+        with metrics.HANDLER_DURATION.labels(type(self).__name__,
+                                             event_type).time():
+            self._handle(event_type, event.get('object'))
+
+    def _handle(self, event_type, obj):
         if 'MODIFIED' == event_type:
             if self._check_finalize(obj):
                 self.on_finalize(obj)
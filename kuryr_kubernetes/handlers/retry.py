@@ -23,6 +23,8 @@ from oslo_utils import excutils
 from kuryr_kubernetes import clients
 from kuryr_kubernetes import exceptions
 from kuryr_kubernetes.handlers import base
+from kuryr_kubernetes import k8s_cache
+from kuryr_kubernetes import metrics
 from kuryr_kubernetes import utils
 
 LOG = logging.getLogger(__name__)
@@ -56,24 +58,8 @@ class Retry(base.EventHandler):
         for attempt in itertools.count(1):
             if event.get('type') in ['MODIFIED', 'ADDED']:
                 obj = event.get('object')
-                if obj:
-                    try:
-                        obj_link = obj['metadata']['selfLink']
-                    except KeyError:
-                        LOG.debug("Skipping object check as it does not have "
-                                  "selfLink: %s", obj)
-                    else:
-                        try:
-                            self._k8s.get(obj_link)
-                        except exceptions.K8sResourceNotFound:
-                            LOG.debug("There is no need to process the "
-                                      "retry as the object %s has already "
-                                      "been deleted.", obj_link)
-                            return
-                        except exceptions.K8sClientException:
-                            LOG.debug("Kubernetes client error getting the "
-                                      "object. Continuing with handler "
-                                      "execution.")
+                if obj and self._is_deleted(obj):
+                    return
             try:
                 self._handler(event)
                 break
@@ -96,6 +82,35 @@ class Retry(base.EventHandler):
                 self._handler.set_liveness(alive=False)
                 raise
 
+    def _is_deleted(self, obj):
+        cache = k8s_cache.get_cache(obj.get('kind'))
+        if cache:
+            metadata = obj['metadata']
+            if cache.get(metadata['name'], metadata.get('namespace')):
+                return False
+            LOG.debug("There is no need to process the retry as the object "
+                      "%s/%s has already been deleted.",
+                      metadata.get('namespace'), metadata['name'])
+            return True
+
+        try:
+            obj_link = obj['metadata']['selfLink']
+        except KeyError:
+            LOG.debug("Skipping object check as it does not have "
+                      "selfLink: %s", obj)
+            return False
+
+        try:
+            self._k8s.get(obj_link)
+        except exceptions.K8sResourceNotFound:
+            LOG.debug("There is no need to process the retry as the "
+                      "object %s has already been deleted.", obj_link)
+            return True
+        except exceptions.K8sClientException:
+            LOG.debug("Kubernetes client error getting the object. "
+                      "Continuing with handler execution.")
+        return False
+
     def _sleep(self, deadline, attempt, exception):
         LOG.debug("Handler %s failed (attempt %s; %s)",
                   self._handler, attempt, exceptions.format_msg(exception))
@@ -108,6 +123,8 @@ class Retry(base.EventHandler):
                       self._timeout)
             return 0
 
+        metrics.HANDLER_RETRIES.labels(type(self._handler).__name__,
+                                       type(exception).__name__).inc()
         LOG.debug("Resumed after %s seconds. Retry handler %s", interval,
                   self._handler)
         return interval
@@ -0,0 +1,363 @@
+# Copyright 2020 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+
+from oslo_log import log as logging
+
+from kuryr_kubernetes import constants
+
+LOG = logging.getLogger(__name__)
+
+_caches = {}
+
+
+class ResourceCache(object):
+    """Local, watch-fed store of the K8s objects of a single kind.
+
+    The `ResourceCache` is seeded with a LIST of its `path` and then kept
+    up to date by the `Watcher` with every event observed on that path, so
+    drivers and handlers can query objects without a round-trip to the K8s
+    API. Objects are indexed by namespace and name, by uid, and by their
+    labels, so label selectors are evaluated with set operations by
+    `select`.
+
+    The cache only answers queries once it has synced, i.e. after the first
+    LIST was loaded. Objects returned by the cache are shared with the
+    handlers and must not be modified.
+    """
+
+    def __init__(self, kind, path):
+        self.kind = kind
+        self.path = path
+        self.resource_version = None
+        self._objects = {}
+        self._uids = {}
+        self._namespaces = collections.defaultdict(set)
+        self._labels = collections.defaultdict(set)
+        self._label_keys = collections.defaultdict(set)
+        self._synced = False
+
+    def has_synced(self):
+        return self._synced
+
+    def invalidate(self):
+        self._synced = False
+
+    def replace(self, objects, resource_version=None):
+        """Replaces the cache content with the result of a LIST."""
+        self._objects = {}
+        self._uids = {}
+        self._namespaces = collections.defaultdict(set)
+        self._labels = collections.defaultdict(set)
+        self._label_keys = collections.defaultdict(set)
+        for obj in objects:
+            self._add(obj)
+        self.resource_version = resource_version
+        self._synced = True
+        LOG.debug("Synced %d %s object(s) from %s", len(self._objects),
+                  self.kind, self.path)
+
+    def resync(self, objects, resource_version=None):
+        """Replaces the cache content with the result of a new LIST.
+
+        :return: list of the synthetic watch events turning the previous
+                 content of the cache into the listed one. Objects that were
+                 recreated under the same name get a 'DELETED' event for the
+                 old object followed by an 'ADDED' one.
+        """
+        events = []
+        previous = self._objects
+        for obj in objects:
+            old_obj = previous.pop(_get_key(obj), None)
+            if old_obj is None:
+                events.append({'type': 'ADDED', 'object': obj})
+                continue
+            old_meta = old_obj['metadata']
+            meta = obj['metadata']
+            if old_meta.get('uid') != meta.get('uid'):
+                events.append({'type': 'DELETED', 'object': old_obj})
+                events.append({'type': 'ADDED', 'object': obj})
+            elif old_meta.get('resourceVersion') != meta.get(
+                    'resourceVersion'):
+                events.append({'type': 'MODIFIED', 'object': obj})
+        for old_obj in previous.values():
+            events.append({'type': 'DELETED', 'object': old_obj})
+
+        self.replace(objects, resource_version)
+        return events
+
+    def update(self, event):
+        """Applies a watch event to the cache."""
+        obj = event.get('object')
+        if not obj:
+            return
+
+        event_type = event.get('type')
+        if event_type in ('ADDED', 'MODIFIED'):
+            self._add(obj)
+        elif event_type == 'DELETED':
+            self._remove(obj)
+        else:
+            return
+
+        self.resource_version = obj['metadata'].get('resourceVersion')
+
+    def get(self, name, namespace=None):
+        return self._objects.get((namespace, name))
+
+    def get_by_uid(self, uid):
+        key = self._uids.get(uid)
+        if key is None:
+            return None
+        return self._objects.get(key)
+
+    def list(self, namespace=None, label_filter=None):
+        """Returns the cached objects.
+
+        :param namespace: namespace name to limit the result to. If None,
+                          objects in all namespaces are returned.
+        :param label_filter: callable receiving the object labels and
+                             returning whether the object should be included
+                             in the result.
+        :return: list of matching objects
+        """
+        if namespace:
+            keys = [(namespace, name) for name in
+                    self._namespaces.get(namespace, ())]
+        else:
+            keys = list(self._objects)
+
+        objects = []
+        for key in keys:
+            obj = self._objects[key]
+            if label_filter and not label_filter(
+                    obj['metadata'].get('labels')):
+                continue
+            objects.append(obj)
+        return objects
+
+    def select(self, selector, namespace=None):
+        """Returns the cached objects matching the label selector.
+
+        :param selector: `LabelSelector` to evaluate
+        :param namespace: namespace name to limit the result to. If None,
+                          objects in all namespaces are returned.
+        :return: list of matching objects
+        """
+        keys = selector.evaluate(self)
+        if keys is None:
+            if namespace:
+                return self.list(namespace)
+            return list(self._objects.values())
+        if namespace:
+            return [self._objects[key] for key in keys if key[0] == namespace]
+        return [self._objects[key] for key in keys]
+
+    def get_labeled(self, label, value):
+        return self._labels.get((label, value), frozenset())
+
+    def get_with_label(self, label):
+        return self._label_keys.get(label, frozenset())
+
+    def keys(self):
+        return self._objects.keys()
+
+    def _add(self, obj):
+        obj.setdefault('kind', self.kind)
+        key = _get_key(obj)
+        old_obj = self._objects.get(key)
+        if old_obj is not None:
+            self._unindex_labels(key, old_obj)
+            self._uids.pop(old_obj['metadata'].get('uid'), None)
+        self._objects[key] = obj
+        uid = obj['metadata'].get('uid')
+        if uid:
+            self._uids[uid] = key
+        self._namespaces[key[0]].add(key[1])
+        for label, value in (obj['metadata'].get('labels') or {}).items():
+            self._labels[(label, value)].add(key)
+            self._label_keys[label].add(key)
+
+    def _remove(self, obj):
+        key = _get_key(obj)
+        old_obj = self._objects.pop(key, None)
+        if old_obj is None:
+            return
+        self._unindex_labels(key, old_obj)
+        self._uids.pop(old_obj['metadata'].get('uid'), None)
+        names = self._namespaces.get(key[0])
+        if names is not None:
+            names.discard(key[1])
+            if not names:
+                del self._namespaces[key[0]]
+
+    def _unindex_labels(self, key, obj):
+        for label, value in (obj['metadata'].get('labels') or {}).items():
+            _discard(self._labels, (label, value), key)
+            _discard(self._label_keys, label, key)
+
+
+class LabelSelector(object):
+    """Compiled K8s label selector.
+
+    The selector is split into requirements that are evaluated against the
+    label index of a `ResourceCache`: the sets of objects satisfying each
+    positive requirement (matchLabels, 'In' and 'Exists') are intersected,
+    starting from the smallest one, and the objects hitting a negative one
+    ('NotIn' and 'DoesNotExist') are removed from the result. The semantics
+    follow `controller.drivers.utils.match_selector`, except that objects
+    without labels only match selectors that do not require any.
+    """
+
+    def __init__(self, match_labels=None, match_expressions=None):
+        # Every requirement is a (label, values) tuple, values being None for
+        # the ones checking only the presence of the label.
+        self._required = []
+        self._excluded = []
+        for label, value in (match_labels or {}).items():
+            self._required.append((label, (value,)))
+        for exp in match_expressions or []:
+            operator = exp['operator'].lower()
+            label = str(exp['key'])
+            if operator == constants.K8S_OPERATOR_IN:
+                self._required.append((label, tuple(exp['values'])))
+            elif operator == constants.K8S_OPERATOR_NOT_IN:
+                self._excluded.append((label, tuple(exp['values'])))
+            elif operator == constants.K8S_OPERATOR_EXISTS:
+                self._required.append((label, None))
+            elif operator == constants.K8S_OPERATOR_DOES_NOT_EXIST:
+                self._excluded.append((label, None))
+
+    @classmethod
+    def from_k8s(cls, selector):
+        """Compiles a K8s selector.
+
+        :param selector: k8s selector of types matchLabels or
+                         matchExpressions, or a dict with a service selector
+                         under the 'selector' key
+        """
+        svc_selector = selector.get('selector')
+        if svc_selector:
+            return cls(svc_selector)
+        return cls(selector.get('matchLabels'),
+                   selector.get('matchExpressions'))
+
+    def evaluate(self, cache):
+        """Returns the keys of the objects in `cache` matching the selector.
+
+        :return: set of object keys or None if the selector matches all the
+                 objects
+        """
+        if not self._required and not self._excluded:
+            return None
+
+        required = sorted((self._lookup(cache, label, values)
+                           for label, values in self._required), key=len)
+        if required:
+            keys = set(required[0])
+            for matching in required[1:]:
+                keys.intersection_update(matching)
+                if not keys:
+                    return keys
+        else:
+            keys = set(cache.keys())
+
+        for label, values in self._excluded:
+            keys.difference_update(self._lookup(cache, label, values))
+        return keys
+
+    @staticmethod
+    def _lookup(cache, label, values):
+        if values is None:
+            return cache.get_with_label(label)
+        if len(values) == 1:
+            return cache.get_labeled(label, values[0])
+        matching = set()
+        for value in values:
+            matching.update(cache.get_labeled(label, value))
+        return matching
+
+
+def _get_key(obj):
+    metadata = obj['metadata']
+    return metadata.get('namespace'), metadata['name']
+
+
+def _discard(index, index_key, key):
+    keys = index.get(index_key)
+    if keys is not None:
+        keys.discard(key)
+        if not keys:
+            del index[index_key]
+
+
+def register(kind, path):
+    """Registers a cache for the objects of `kind` watched on `path`.
+
+    Only unfiltered watch paths are cached, as the objects streamed on a
+    filtered one (e.g. with a fieldSelector) are not all the objects of that
+    kind. Registering an already cached kind returns the existing cache.
+
+    :return: the `ResourceCache` for `kind` or None if `path` can't be cached
+    """
+    if not path or '?' in path:
+        LOG.debug("Not caching %s objects from filtered path %s", kind, path)
+        return None
+
+    cache = _caches.get(kind)
+    if cache is None:
+        cache = _caches[kind] = ResourceCache(kind, path)
+    return cache
+
+
+def get_cache(kind):
+    """Returns the synced cache for `kind` or None if there is none."""
+    cache = _caches.get(kind)
+    if cache and cache.has_synced():
+        return cache
+    return None
+
+
+def get_cache_for_path(path):
+    for cache in _caches.values():
+        if cache.path == path:
+            return cache
+    return None
+
+
+def get_for_link(link):
+    """Returns the cached object with the given selfLink or None.
+
+    Objects are looked up in the synced cache of their K8s resource
+    across all namespaces, e.g. the cache of '/api/v1/pods' for
+    '/api/v1/namespaces/default/pods/pod1'.
+    """
+    parts = link.rstrip('/').split('/')
+    if len(parts) < 4:
+        return None
+    name, plural = parts[-1], parts[-2]
+    if len(parts) >= 6 and parts[-4] == 'namespaces':
+        namespace, prefix = parts[-3], parts[:-4]
+    else:
+        namespace, prefix = None, parts[:-2]
+
+    cache = get_cache_for_path('/'.join(prefix + [plural]))
+    if cache and cache.has_synced():
+        return cache.get(name, namespace)
+    return None
+
+
+def reset():
+    _caches.clear()
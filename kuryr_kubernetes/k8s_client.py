@@ -12,14 +12,18 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
+import collections
 import contextlib
 import itertools
 import os
 import ssl
+import threading
+import time
 from urllib import parse
 
 from oslo_log import log as logging
 from oslo_serialization import jsonutils
+from oslo_utils import importutils
 import requests
 from requests import adapters
 
@@ -27,10 +31,192 @@ from kuryr.lib._i18n import _
 from kuryr_kubernetes import config
 from kuryr_kubernetes import constants
 from kuryr_kubernetes import exceptions as exc
+from kuryr_kubernetes import k8s_cache
+from kuryr_kubernetes import metrics
 
 CONF = config.CONF
 LOG = logging.getLogger(__name__)
 
+httpx = importutils.try_import('httpx')
+orjson = importutils.try_import('orjson')
+ujson = importutils.try_import('ujson')
+
+# Maximum number of resourceVersions resulting from annotations kept, the
+# least recently annotated resources being forgotten first
+ANNOTATED_VERSIONS_MAX = 4096
+
+
+def _is_newer(resource_version, other):
+    try:
+        return int(resource_version) > int(other)
+    except (TypeError, ValueError):
+        return resource_version != other
+
+
+class _AnnotationBatch(object):
+    """Annotations of an object to be written with a single PATCH"""
+
+    def __init__(self):
+        self.annotations = {}
+        self.resource_version = None
+        self.sent = False
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def add(self, annotations, resource_version):
+        self.annotations.update(annotations)
+        if resource_version and (
+                not self.resource_version or
+                _is_newer(resource_version, self.resource_version)):
+            self.resource_version = resource_version
+
+    def finish(self, result=None, error=None):
+        self._result = result
+        self._error = error
+        self._done.set()
+
+    def wait_done(self):
+        self._done.wait()
+
+    def wait(self):
+        self.wait_done()
+        if self._error:
+            raise self._error
+        return self._result
+
+
+def _observe_response(response, *args, **kwargs):
+    metrics.observe_k8s_request(response.request.method, response.url,
+                                response.elapsed.total_seconds())
+
+
+def _get_json_loads(backend):
+    """Returns the function decoding JSON for the selected backend
+
+    All the returned functions accept both bytes and str.
+    """
+    if backend in ('auto', 'orjson') and orjson:
+        return orjson.loads
+    if backend in ('auto', 'ujson') and ujson:
+        return ujson.loads
+    if backend in ('orjson', 'ujson'):
+        LOG.warning("JSON backend %s is not installed, falling back to the "
+                    "json module.", backend)
+    return jsonutils.loads
+
+
+@contextlib.contextmanager
+def _translate_http2_errors():
+    # K8sClient users handle the exceptions raised by requests, so the httpx
+    # ones are translated into their requests counterparts.
+    try:
+        yield
+    except httpx.ConnectTimeout as ex:
+        raise requests.ConnectTimeout(str(ex)) from ex
+    except httpx.TimeoutException as ex:
+        raise requests.ReadTimeout(str(ex)) from ex
+    except httpx.RemoteProtocolError as ex:
+        raise requests.exceptions.ChunkedEncodingError(str(ex)) from ex
+    except httpx.TransportError as ex:
+        raise requests.ConnectionError(str(ex)) from ex
+
+
+class HTTP2Response(object):
+    """Exposes a `httpx.Response` like a `requests.Response`"""
+
+    def __init__(self, response):
+        self._response = response
+
+    @property
+    def ok(self):
+        return self._response.status_code < 400
+
+    @property
+    def status_code(self):
+        return self._response.status_code
+
+    @property
+    def headers(self):
+        return self._response.headers
+
+    @property
+    def content(self):
+        self._read()
+        return self._response.content
+
+    @property
+    def text(self):
+        self._read()
+        return self._response.text
+
+    def json(self):
+        self._read()
+        return self._response.json()
+
+    def _read(self):
+        # The body of a streamed response, e.g. of a watch, has to be read
+        # before it is accessed, unlike with requests
+        with _translate_http2_errors():
+            self._response.read()
+
+    def iter_lines(self):
+        pending = b''
+        with _translate_http2_errors():
+            for chunk in self._response.iter_bytes():
+                lines = (pending + chunk).split(b'\n')
+                pending = lines.pop()
+                for line in lines:
+                    yield line
+        if pending:
+            yield pending
+
+    def close(self):
+        self._response.close()
+
+
+class HTTP2Session(object):
+    """HTTP/2 replacement of the `requests.Session` used by `K8sClient`
+
+    Requests are multiplexed as streams of a few HTTP/2 connections, so the
+    concurrent green threads share the connections to the K8s API instead of
+    each using its own. The session accepts the subset of the
+    `requests.Session` API used by `K8sClient`. The client certificate and
+    server verification are set for the whole session.
+    """
+
+    def __init__(self, cert, verify):
+        self._client = httpx.Client(
+            http2=True, cert=cert if cert[0] else None, verify=verify,
+            timeout=None)
+
+    def request(self, method, url, params=None, data=None, json=None,
+                headers=None, stream=False, timeout=None, **kwargs):
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(None, connect=timeout[0],
+                                    read=timeout[1])
+        with _translate_http2_errors():
+            request = self._client.build_request(
+                method, url, params=params, content=data, json=json,
+                headers=headers, timeout=timeout)
+            start = time.time()
+            response = self._client.send(request, stream=stream)
+            metrics.observe_k8s_request(method, str(request.url),
+                                        time.time() - start)
+            return HTTP2Response(response)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
 
 class K8sClient(object):
     # REVISIT(ivc): replace with python-k8sclient if it could be extended
@@ -46,11 +232,6 @@ class K8sClient(object):
         self.token = None
         self.cert = (None, None)
 
-        # Setting higher numbers regarding connection pools as we're running
-        # with max of 1000 green threads.
-        self.session = requests.Session()
-        prefix = '%s://' % parse.urlparse(base_url).scheme
-        self.session.mount(prefix, adapters.HTTPAdapter(pool_maxsize=1000))
         if token_file:
             if os.path.exists(token_file):
                 with open(token_file, 'r') as f:
@@ -75,6 +256,29 @@ class K8sClient(object):
                     _("Unable to find ca cert_file  : %s") % ca_crt_file)
             else:
                 self.verify_server = ca_crt_file
+        if config.CONF.kubernetes.use_http2:
+            if not httpx:
+                raise RuntimeError(
+                    _("use_http2 requires the httpx library with HTTP/2 "
+                      "support (httpx[http2]) to be installed"))
+            self.session = HTTP2Session(self.cert, self.verify_server)
+        else:
+            # Setting higher numbers regarding connection pools as we're
+            # running with max of 1000 green threads.
+            self.session = requests.Session()
+            prefix = '%s://' % parse.urlparse(base_url).scheme
+            self.session.mount(prefix,
+                               adapters.HTTPAdapter(pool_maxsize=1000))
+            self.session.hooks['response'].append(_observe_response)
+        self._json_loads = _get_json_loads(
+            config.CONF.kubernetes.json_backend)
+        # Path -> annotation batches of the object, the first one possibly
+        # being written and the last one accepting new annotations
+        self._annotation_batches = {}
+        self._annotation_lock = threading.Lock()
+        # resourceVersions resulting from the annotations set by this client,
+        # indexed by the uid of the annotated resource
+        self._annotated_versions = collections.OrderedDict()
 
     def _raise_from_response(self, response):
         if response.status_code == requests.codes.not_found:
@@ -82,6 +286,12 @@ class K8sClient(object):
         if not response.ok:
             raise exc.K8sClientException(response.text)
 
+    def _raise_from_watch_error(self, event):
+        status = event.get('object', {})
+        if status.get('code') == requests.codes.gone:
+            raise exc.K8sResourceExpired(status.get('message'))
+        raise exc.K8sClientException(status.get('message', event))
+
     def get(self, path, json=True, headers=None):
         LOG.debug("Get %(path)s", {'path': path})
         url = self._base_url + path
@@ -216,7 +426,62 @@ class K8sClient(object):
         application/merge-patch+json as described in:
 
         https://github.com/kubernetes/community/blob/master/contributors/devel/sig-architecture/api-conventions.md#patch-operations  # noqa
+
+        Annotations of the same resource pushed concurrently, while another
+        PATCH of the resource is in progress or within
+        `[kubernetes]annotation_batch_window` seconds, are merged into a
+        single PATCH, made with the newest of their resource_versions. All
+        the callers get its result.
         """
+        with self._annotation_lock:
+            batches = self._annotation_batches.setdefault(path, [])
+            if batches and not batches[-1].sent:
+                batch = batches[-1]
+                previous = None
+                leader = False
+            else:
+                previous = batches[-1] if batches else None
+                batch = _AnnotationBatch()
+                batches.append(batch)
+                leader = True
+            batch.add(annotations, resource_version)
+        if not leader:
+            LOG.debug("Batching annotation of %(path)s: %(names)s", {
+                'path': path, 'names': list(annotations)})
+            return batch.wait()
+
+        result = None
+        error = None
+        try:
+            # Only one PATCH of the resource is made at a time
+            if previous:
+                previous.wait_done()
+            window = CONF.kubernetes.annotation_batch_window
+            if window:
+                time.sleep(window)
+            with self._annotation_lock:
+                batch.sent = True
+            result = self._annotate(path, batch.annotations,
+                                    batch.resource_version)
+            return result
+        except Exception as ex:
+            error = ex
+            raise
+        except BaseException:
+            # e.g. GreenletExit when the thread of the leader is killed, the
+            # followers must not wait forever nor get killed too
+            error = exc.K8sClientException(
+                "Annotation of %s interrupted" % path)
+            raise
+        finally:
+            with self._annotation_lock:
+                batch.sent = True
+                batches.remove(batch)
+                if not batches:
+                    del self._annotation_batches[path]
+            batch.finish(result, error)
+
+    def _annotate(self, path, annotations, resource_version):
         LOG.debug("Annotate %(path)s: %(names)s", {
             'path': path, 'names': list(annotations)})
 
@@ -232,9 +497,19 @@ class K8sClient(object):
                                           headers=header, cert=self.cert,
                                           verify=self.verify_server)
             if response.ok:
-                return response.json()['metadata']['annotations']
+                metadata = response.json()['metadata']
+                if metadata.get('uid'):
+                    self._set_annotated_resource_version(
+                        metadata['uid'], metadata.get('resourceVersion'))
+                return metadata['annotations']
             if response.status_code == requests.codes.conflict:
-                resource = self.get(path)
+                # The watch cache usually already got the newer version of
+                # the resource, saving a GET
+                resource = k8s_cache.get_for_link(path)
+                if resource is None or not _is_newer(
+                        resource['metadata'].get('resourceVersion'),
+                        resource_version):
+                    resource = self.get(path)
                 new_version = resource['metadata']['resourceVersion']
                 retrieved_annotations = resource['metadata'].get(
                     'annotations', {})
@@ -258,18 +533,71 @@ class K8sClient(object):
 
             self._raise_from_response(response)
 
-    def watch(self, path):
+    def get_annotated_resource_version(self, uid):
+        """Returns the resourceVersion resulting from the last annotation
+
+        :param uid: uid of the annotated resource
+        :returns: the resourceVersion of the resource right after this client
+                  annotated it or None if it was not annotated by this client
+        """
+        return self._annotated_versions.get(uid)
+
+    def forget_annotated_resource_version(self, uid, resource_version=None):
+        """Forgets the resourceVersion resulting from the last annotation
+
+        :param uid: uid of the annotated resource
+        :param resource_version: resourceVersion of the resource seen by the
+                                 caller. If passed, the annotated one is only
+                                 forgotten if it is not newer.
+        """
+        with self._annotation_lock:
+            annotated_version = self._annotated_versions.get(uid)
+            if annotated_version is None or (
+                    resource_version is not None and
+                    _is_newer(annotated_version, resource_version)):
+                return
+            del self._annotated_versions[uid]
+
+    def _set_annotated_resource_version(self, uid, resource_version):
+        with self._annotation_lock:
+            self._annotated_versions[uid] = resource_version
+            self._annotated_versions.move_to_end(uid)
+            while len(self._annotated_versions) > ANNOTATED_VERSIONS_MAX:
+                self._annotated_versions.popitem(last=False)
+
+    def watch(self, path, resource_version=None, timeout=None):
+        """Streams the events of the K8s resources under `path`
+
+        Watch bookmarks are requested so that the resourceVersion to
+        reconnect with is kept up to date even when no events are streamed,
+        but they are not yielded.
+
+        :param path: K8s resource URL path
+        :param resource_version: resourceVersion to start watching from. If
+                                 not set, the events of all the existing
+                                 resources are streamed first.
+        :param timeout: time (in seconds) after which the watch returns. If
+                        not set, the watch never ends.
+        :raises K8sResourceExpired: when the resourceVersion to watch from is
+                                    too old, which requires listing the
+                                    resources again.
+        """
         url = self._base_url + path
-        resource_version = None
         header = {}
         timeouts = (CONF.kubernetes.watch_connection_timeout,
                     CONF.kubernetes.watch_read_timeout)
         if self.token:
             header.update({'Authorization': 'Bearer %s' % self.token})
+        deadline = time.time() + timeout if timeout else None
 
         while True:
             try:
-                params = {'watch': 'true'}
+                params = {'watch': 'true', 'allowWatchBookmarks': 'true'}
+                if deadline:
+                    remaining = int(deadline - time.time())
+                    if remaining <= 0:
+                        return
+                    params['timeoutSeconds'] = remaining
                 if resource_version:
                     params['resourceVersion'] = resource_version
                 with contextlib.closing(
@@ -277,13 +605,20 @@ class K8sClient(object):
                             url, params=params, stream=True, cert=self.cert,
                             verify=self.verify_server, headers=header,
                             timeout=timeouts)) as response:
+                    if response.status_code == requests.codes.gone:
+                        raise exc.K8sResourceExpired(response.text)
                     if not response.ok:
                         raise exc.K8sClientException(response.text)
                     for line in response.iter_lines():
-                        line = line.decode('utf-8').strip()
-                        if line:
-                            line_dict = jsonutils.loads(line)
-                            yield line_dict
+                        # The JSON decoders accept bytes and whitespace around
+                        # the document, so lines are not decoded nor stripped.
+                        if line and not line.isspace():
+                            line_dict = self._json_loads(line)
+                            event_type = line_dict.get('type')
+                            if event_type == 'ERROR':
+                                self._raise_from_watch_error(line_dict)
+                            if event_type != 'BOOKMARK':
+                                yield line_dict
                             # Saving the resourceVersion in case of a restart.
                             # At this point it's safely passed to handler.
                             m = line_dict.get('object', {}).get('metadata', {})
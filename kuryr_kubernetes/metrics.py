@@ -0,0 +1,124 @@
+# Copyright 2020 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import re
+from urllib import parse
+import weakref
+
+from oslo_utils import uuidutils
+import prometheus_client
+from prometheus_client import core
+
+# Handling an event can take minutes when it waits for OpenStack resources,
+# e.g. for a load balancer to become ACTIVE.
+HANDLER_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+                   30.0, 60.0, 120.0, 300.0, float('inf'))
+
+CONTENT_TYPE = prometheus_client.CONTENT_TYPE_LATEST
+
+_VERSION = re.compile(r'^v\d+(\.\d+)?$')
+
+REGISTRY = prometheus_client.CollectorRegistry()
+
+EVENT_QUEUE_DEPTH = prometheus_client.Gauge(
+    'kuryr_event_queue_depth',
+    'Number of K8s objects having an event waiting to be handled',
+    ['kind'], registry=REGISTRY)
+
+HANDLER_DURATION = prometheus_client.Histogram(
+    'kuryr_handler_duration_seconds',
+    'Time spent by the handlers on a K8s event',
+    ['handler', 'event'], buckets=HANDLER_BUCKETS, registry=REGISTRY)
+
+HANDLER_RETRIES = prometheus_client.Counter(
+    'kuryr_handler_retries',
+    'Number of times the handling of a K8s event was retried',
+    ['handler', 'exception'], registry=REGISTRY)
+
+K8S_REQUEST_DURATION = prometheus_client.Histogram(
+    'kuryr_k8s_request_duration_seconds',
+    'Time until the response of K8s API was received',
+    ['method', 'resource'], registry=REGISTRY)
+
+OPENSTACK_REQUEST_DURATION = prometheus_client.Histogram(
+    'kuryr_openstack_request_duration_seconds',
+    'Duration of the requests to the OpenStack APIs',
+    ['service', 'method', 'operation'], registry=REGISTRY)
+
+
+def get_k8s_resource(url):
+    """Returns the K8s resource type a K8s API URL refers to.
+
+    e.g. 'pods' for '/api/v1/namespaces/default/pods/pod1/status'.
+    """
+    segments = [s for s in parse.urlparse(url).path.split('/') if s]
+    if segments[:1] == ['api']:
+        segments = segments[2:]
+    elif segments[:1] == ['apis']:
+        segments = segments[3:]
+    if len(segments) > 2 and segments[0] == 'namespaces':
+        segments = segments[2:]
+    return segments[0] if segments else ''
+
+
+def get_openstack_operation(url):
+    """Returns the OpenStack API URL stripped of the versions and IDs.
+
+    e.g. 'trunks/add_subports' for '/v2.0/trunks/<trunk_id>/add_subports'.
+    """
+    segments = [s for s in parse.urlparse(url).path.split('/')
+                if s and not _VERSION.match(s) and
+                not uuidutils.is_uuid_like(s)]
+    return '/'.join(segments)
+
+
+def observe_k8s_request(method, url, duration):
+    query = parse.parse_qs(parse.urlparse(url).query)
+    if query.get('watch') == ['true']:
+        method = 'WATCH'
+    K8S_REQUEST_DURATION.labels(method, get_k8s_resource(url)).observe(
+        duration)
+
+
+def observe_openstack_request(service, method, url, duration):
+    OPENSTACK_REQUEST_DURATION.labels(
+        service, method, get_openstack_operation(url)).observe(duration)
+
+
+class VIFPoolCollector(object):
+    """Collects the number of ports available in the pools of the drivers"""
+
+    def __init__(self):
+        self._drivers = weakref.WeakSet()
+
+    def add(self, driver):
+        self._drivers.add(driver)
+
+    def collect(self):
+        ports = core.GaugeMetricFamily(
+            'kuryr_vif_pool_ports', 'Number of ports available in the pool',
+            labels=['driver', 'host', 'project', 'network'])
+        for driver in list(self._drivers):
+            for pool_key, size in driver.get_pool_sizes().items():
+                ports.add_metric([type(driver).__name__] +
+                                 [str(k) for k in pool_key], size)
+        yield ports
+
+
+VIF_POOLS = VIFPoolCollector()
+REGISTRY.register(VIF_POOLS)
+
+
+def generate_latest():
+    return prometheus_client.generate_latest(REGISTRY)
@@ -13,9 +13,11 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import functools
 import munch
 from unittest import mock
 
+import eventlet
 from openstack import exceptions as os_exc
 from openstack.load_balancer.v2 import listener as o_lis
 from openstack.load_balancer.v2 import load_balancer as o_lb
@@ -68,6 +70,24 @@ class TestLBaaSv2Driver(test_base.TestCase):
         d.add_tags('loadbalancer', req)
         self.assertEqual({'tags': ['foo']}, req)
 
+    @mock.patch('kuryr_kubernetes.controller.drivers.lbaasv2.LBaaSv2Driver.'
+                'get_octavia_version', return_value=(2, 5))
+    def test_lb_monitor_tags(self, _m_get):
+        CONF.set_override('resource_tags', ['foo'], group='neutron_defaults')
+        self.addCleanup(CONF.clear_override, 'resource_tags',
+                        group='neutron_defaults')
+        d = d_lbaasv2.LBaaSv2Driver()
+        self.assertEqual(['foo'], d._lb_monitor._tags)
+
+    @mock.patch('kuryr_kubernetes.controller.drivers.lbaasv2.LBaaSv2Driver.'
+                'get_octavia_version', return_value=(2, 4))
+    def test_lb_monitor_no_tagging(self, _m_get):
+        CONF.set_override('resource_tags', ['foo'], group='neutron_defaults')
+        self.addCleanup(CONF.clear_override, 'resource_tags',
+                        group='neutron_defaults')
+        d = d_lbaasv2.LBaaSv2Driver()
+        self.assertIsNone(d._lb_monitor._tags)
+
     @mock.patch('kuryr_kubernetes.controller.drivers.lbaasv2.LBaaSv2Driver.'
                 'get_octavia_version', return_value=(2, 5))
     def test_add_tags_no_tag(self, _m_get):
@@ -290,6 +310,8 @@ class TestLBaaSv2Driver(test_base.TestCase):
         name = 'TEST_NAME'
         target_ref = {'namespace': namespace, 'name': name}
         m_driver._ensure_provisioned.return_value = expected_resp
+        m_driver._get_member.side_effect = functools.partial(
+            cls._get_member, m_driver)
 
         resp = cls.ensure_member(m_driver, loadbalancer, pool,
                                  subnet_id, ip, port,
@@ -307,6 +329,112 @@ class TestLBaaSv2Driver(test_base.TestCase):
         self.assertEqual(port, member.port)
         self.assertEqual(expected_resp, resp)
 
+    def _get_update_members_driver(self):
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver = mock.Mock(spec=d_lbaasv2.LBaaSv2Driver)
+        m_driver._get_member.side_effect = functools.partial(
+            cls._get_member, m_driver)
+        m_driver._provisioning_timer.return_value = [mock.sentinel.t0,
+                                                     mock.sentinel.t1]
+        loadbalancer = obj_lbaas.LBaaSLoadBalancer(
+            id='00EE9E11-91C2-41CF-8FD4-7970579E5C4C',
+            project_id='TEST_PROJECT')
+        pool = obj_lbaas.LBaaSPool(project_id='TEST_PROJECT',
+                                   id='D4F35594-27EB-4F4C-930C-31DD40F53B77')
+        member = obj_lbaas.LBaaSMember(
+            id='0D7BB9A8-2B3B-4F4B-A4E4-A0BE1C0E4F10', name='ns/pod1:8080',
+            project_id='TEST_PROJECT', pool_id=pool.id,
+            subnet_id='D3FA400A-F543-4B91-9CD3-047AF0CE42D1', ip='1.2.3.4',
+            port=8080)
+        new_member = {'subnet_id': 'D3FA400A-F543-4B91-9CD3-047AF0CE42D1',
+                      'ip': '1.2.3.5', 'port': 8080,
+                      'target_ref_namespace': 'ns',
+                      'target_ref_name': 'pod2', 'listener_port': 80}
+        return m_driver, loadbalancer, pool, member, new_member
+
+    def test_update_members(self):
+        lbaas = self.useFixture(k_fix.MockLBaaSClient()).client
+        lbaas.put.return_value.status_code = 202
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver, loadbalancer, pool, member, new_member = (
+            self._get_update_members_driver())
+        lbaas.members.return_value = iter([
+            o_mem.Member(id=member.id, address='1.2.3.4', protocol_port=8080),
+            o_mem.Member(id='new_id', address='1.2.3.5', protocol_port=8080)])
+
+        members = cls.update_members(m_driver, loadbalancer, pool, [member],
+                                     [new_member])
+
+        lbaas.put.assert_called_once_with(
+            'lbaas/pools/%s/members' % pool.id, json={'members': [
+                {'name': 'ns/pod1:8080', 'subnet_id': member.subnet_id,
+                 'address': '1.2.3.4', 'protocol_port': 8080},
+                {'name': 'ns/pod2:8080', 'subnet_id': member.subnet_id,
+                 'address': '1.2.3.5', 'protocol_port': 8080}]})
+        self.assertEqual(2, m_driver._wait_for_provisioning.call_count)
+        lbaas.members.assert_called_once_with(pool.id)
+        self.assertEqual([member.id, 'new_id'], [m.id for m in members])
+        self.assertEqual(pool.id, members[1].pool_id)
+        m_driver._apply_member_sg_rules.assert_called_once_with(
+            loadbalancer, pool, 8080, 80)
+
+    def test_update_members_remove_only(self):
+        lbaas = self.useFixture(k_fix.MockLBaaSClient()).client
+        lbaas.put.return_value.status_code = 202
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver, loadbalancer, pool, member, _ = (
+            self._get_update_members_driver())
+
+        members = cls.update_members(m_driver, loadbalancer, pool, [], [])
+
+        lbaas.put.assert_called_once_with(
+            'lbaas/pools/%s/members' % pool.id, json={'members': []})
+        lbaas.members.assert_not_called()
+        m_driver._apply_member_sg_rules.assert_not_called()
+        self.assertEqual([], members)
+
+    def test_update_members_conflict(self):
+        lbaas = self.useFixture(k_fix.MockLBaaSClient()).client
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver, loadbalancer, pool, member, _ = (
+            self._get_update_members_driver())
+        lbaas.put.side_effect = [
+            mock.Mock(status_code=409, headers={}),
+            mock.Mock(status_code=202, headers={})]
+
+        with mock.patch('openstack.exceptions.raise_from_response') as m_raise:
+            m_raise.side_effect = [os_exc.ConflictException(), None]
+            members = cls.update_members(m_driver, loadbalancer, pool,
+                                         [member], [])
+
+        self.assertEqual(2, lbaas.put.call_count)
+        self.assertEqual([member], members)
+
+    def test_update_members_not_ready(self):
+        self.useFixture(k_fix.MockLBaaSClient())
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver, loadbalancer, pool, member, _ = (
+            self._get_update_members_driver())
+
+        with mock.patch('openstack.exceptions.raise_from_response') as m_raise:
+            m_raise.side_effect = os_exc.ConflictException()
+            self.assertRaises(k_exc.ResourceNotReady, cls.update_members,
+                              m_driver, loadbalancer, pool, [member], [])
+
+    def test_update_members_member_not_found(self):
+        lbaas = self.useFixture(k_fix.MockLBaaSClient()).client
+        lbaas.put.return_value.status_code = 202
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver, loadbalancer, pool, member, new_member = (
+            self._get_update_members_driver())
+        lbaas.members.return_value = iter([
+            o_mem.Member(id=member.id, address='1.2.3.4', protocol_port=8080)])
+
+        members = cls.update_members(m_driver, loadbalancer, pool, [member],
+                                     [new_member])
+
+        self.assertEqual([member], members)
+
     def test_release_member(self):
         lbaas = self.useFixture(k_fix.MockLBaaSClient()).client
         cls = d_lbaasv2.LBaaSv2Driver
@@ -402,6 +530,127 @@ class TestLBaaSv2Driver(test_base.TestCase):
         lbaas.create_load_balancer.assert_called_once_with(**req)
         self.assertIsNone(ret)
 
+    def _get_loadbalancer_graph_driver(self):
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver = mock.Mock(spec=d_lbaasv2.LBaaSv2Driver)
+        m_driver._octavia_acls = False
+        for method in ('_get_listener_graph_request',
+                       '_get_loadbalancer_graph', '_get_member'):
+            getattr(m_driver, method).side_effect = functools.partial(
+                getattr(cls, method), m_driver)
+        m_driver._create_loadbalancer.side_effect = (
+            lambda lb, listeners: setattr(
+                lb, 'id', '00EE9E11-91C2-41CF-8FD4-7970579E5C4C') or lb)
+        listeners = [{'protocol': 'TCP', 'port': 80, 'members': [
+            {'subnet_id': 'D3FA400A-F543-4B91-9CD3-047AF0CE42D1',
+             'ip': '1.2.3.5', 'port': 8080, 'target_ref_namespace': 'ns',
+             'target_ref_name': 'pod1'}]}]
+        return m_driver, listeners
+
+    def _create_loadbalancer_graph(self, m_driver, listeners):
+        return d_lbaasv2.LBaaSv2Driver.create_loadbalancer_graph(
+            m_driver, 'ns/svc', 'TEST_PROJECT',
+            'D3FA400A-F543-4B91-9CD3-047AF0CE42D1', '1.2.3.4', listeners,
+            security_groups_ids=['5F4C9B4B-2B4E-4C63-A6F3-9C4D5B1F0E2A'])
+
+    def test_create_loadbalancer_graph(self):
+        lbaas = self.useFixture(k_fix.MockLBaaSClient()).client
+        m_driver, listeners = self._get_loadbalancer_graph_driver()
+        lbaas.listeners.return_value = iter([o_lis.Listener(
+            id='A57B7771-6050-4CA8-A63C-443493EC98AB', name='ns/svc:TCP:80',
+            protocol='TCP', protocol_port=80)])
+        lbaas.pools.return_value = iter([o_pool.Pool(
+            id='D4F35594-27EB-4F4C-930C-31DD40F53B77', name='ns/svc:TCP:80',
+            protocol='TCP',
+            listeners=[{'id': 'A57B7771-6050-4CA8-A63C-443493EC98AB'}])])
+        lbaas.members.return_value = iter([o_mem.Member(
+            id='0D7BB9A8-2B3B-4F4B-A4E4-A0BE1C0E4F10', address='1.2.3.5',
+            protocol_port=8080)])
+
+        state = self._create_loadbalancer_graph(m_driver, listeners)
+
+        loadbalancer = state.loadbalancer
+        m_driver._create_loadbalancer.assert_called_once_with(
+            loadbalancer, [{
+                'name': 'ns/svc:TCP:80', 'protocol': 'TCP',
+                'protocol_port': 80, 'default_pool': {
+                    'name': 'ns/svc:TCP:80', 'protocol': 'TCP',
+                    'lb_algorithm': 'ROUND_ROBIN', 'members': [{
+                        'name': 'ns/pod1:8080',
+                        'subnet_id': 'D3FA400A-F543-4B91-9CD3-047AF0CE42D1',
+                        'address': '1.2.3.5', 'protocol_port': 8080}]}}])
+        m_driver._wait_for_provisioning.assert_called_once_with(
+            loadbalancer, mock.ANY)
+        self.assertEqual(['A57B7771-6050-4CA8-A63C-443493EC98AB'],
+                         [l.id for l in state.listeners])
+        self.assertEqual([80], [l.port for l in state.listeners])
+        self.assertEqual(['A57B7771-6050-4CA8-A63C-443493EC98AB'],
+                         [p.listener_id for p in state.pools])
+        self.assertEqual(['0D7BB9A8-2B3B-4F4B-A4E4-A0BE1C0E4F10'],
+                         [m.id for m in state.members])
+        self.assertEqual('ns/pod1:8080', state.members[0].name)
+        self.assertEqual('D4F35594-27EB-4F4C-930C-31DD40F53B77',
+                         state.members[0].pool_id)
+        lbaas.members.assert_called_once_with(
+            'D4F35594-27EB-4F4C-930C-31DD40F53B77')
+        m_driver._apply_member_sg_rules.assert_called_once_with(
+            loadbalancer, state.pools[0], 8080, 80)
+
+    def test_create_loadbalancer_graph_rejected(self):
+        lbaas = self.useFixture(k_fix.MockLBaaSClient()).client
+        m_driver, listeners = self._get_loadbalancer_graph_driver()
+        m_driver._create_loadbalancer.side_effect = (
+            os_exc.BadRequestException())
+
+        state = self._create_loadbalancer_graph(m_driver, listeners)
+
+        self.assertIsNone(state)
+        m_driver._wait_for_provisioning.assert_not_called()
+        lbaas.listeners.assert_not_called()
+
+    def test_create_loadbalancer_graph_provider_mismatch(self):
+        self.useFixture(k_fix.MockLBaaSClient())
+        m_driver, listeners = self._get_loadbalancer_graph_driver()
+        m_driver._create_loadbalancer.side_effect = None
+        m_driver._create_loadbalancer.return_value = None
+
+        self.assertRaises(k_exc.ResourceNotReady,
+                          self._create_loadbalancer_graph, m_driver,
+                          listeners)
+
+    def test_get_listener_graph_request_acls(self):
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver, listeners = self._get_loadbalancer_graph_driver()
+        m_driver._octavia_acls = True
+        m_driver._enforce_member_sg_rules.return_value = True
+        m_driver._get_listener_allowed_cidrs.return_value = []
+        loadbalancer = obj_lbaas.LBaaSLoadBalancer(
+            name='ns/svc', security_groups=[
+                '5F4C9B4B-2B4E-4C63-A6F3-9C4D5B1F0E2A'])
+
+        request = cls._get_listener_graph_request(m_driver, loadbalancer,
+                                                  listeners[0])
+
+        m_driver._get_listener_allowed_cidrs.assert_called_once_with(
+            loadbalancer.security_groups, None, 8080, 'TCP')
+        self.assertEqual([], request['allowed_cidrs'])
+        self.assertFalse(request['admin_state_up'])
+
+    def test_get_listener_graph_request_acls_default(self):
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver, listeners = self._get_loadbalancer_graph_driver()
+        m_driver._octavia_acls = True
+        m_driver._enforce_member_sg_rules.return_value = True
+        m_driver._get_listener_allowed_cidrs.return_value = None
+        loadbalancer = obj_lbaas.LBaaSLoadBalancer(name='ns/svc',
+                                                   security_groups=[])
+
+        request = cls._get_listener_graph_request(m_driver, loadbalancer,
+                                                  listeners[0])
+
+        self.assertNotIn('allowed_cidrs', request)
+        self.assertNotIn('admin_state_up', request)
+
     def test_find_loadbalancer(self):
         lbaas = self.useFixture(k_fix.MockLBaaSClient()).client
         cls = d_lbaasv2.LBaaSv2Driver
@@ -782,8 +1031,7 @@ class TestLBaaSv2Driver(test_base.TestCase):
                           loadbalancer, obj, create, find)
 
         m_driver._wait_for_provisioning.assert_has_calls(
-            [mock.call(loadbalancer, t, d_lbaasv2._LB_STS_POLL_FAST_INTERVAL)
-             for t in timer])
+            [mock.call(loadbalancer, t) for t in timer])
         m_driver._ensure.assert_has_calls(
             [mock.call(obj, create, find) for _ in timer])
 
@@ -803,8 +1051,7 @@ class TestLBaaSv2Driver(test_base.TestCase):
                           loadbalancer, obj, create, find)
 
         m_driver._wait_for_provisioning.assert_has_calls(
-            [mock.call(loadbalancer, t, d_lbaasv2._LB_STS_POLL_FAST_INTERVAL)
-             for t in timer])
+            [mock.call(loadbalancer, t) for t in timer])
         m_driver._ensure.assert_has_calls(
             [mock.call(obj, create, find) for _ in timer])
 
@@ -872,36 +1119,139 @@ class TestLBaaSv2Driver(test_base.TestCase):
         self.assertEqual(call_count, m_delete.call_count)
 
     def test_wait_for_provisioning(self):
-        lbaas = self.useFixture(k_fix.MockLBaaSClient()).client
         cls = d_lbaasv2.LBaaSv2Driver
         m_driver = mock.Mock(spec=d_lbaasv2.LBaaSv2Driver)
+        m_driver._lb_monitor = mock.Mock(spec=d_lbaasv2.LBStatusMonitor)
+        m_driver._lb_monitor.wait.return_value = 'ACTIVE'
         loadbalancer = mock.Mock()
         timeout = mock.sentinel.timeout
-        timer = [mock.sentinel.t0, mock.sentinel.t1]
-        m_driver._provisioning_timer.return_value = timer
-        resp = o_lb.LoadBalancer(provisioning_status='ACTIVE')
-        lbaas.get_load_balancer.return_value = resp
 
         cls._wait_for_provisioning(m_driver, loadbalancer, timeout)
 
-        lbaas.get_load_balancer.assert_called_once_with(loadbalancer.id)
+        m_driver._lb_monitor.wait.assert_called_once_with(loadbalancer.id,
+                                                          timeout)
+        m_driver.release_loadbalancer.assert_not_called()
 
     def test_wait_for_provisioning_not_ready(self):
-        lbaas = self.useFixture(k_fix.MockLBaaSClient()).client
         cls = d_lbaasv2.LBaaSv2Driver
         m_driver = mock.Mock(spec=d_lbaasv2.LBaaSv2Driver)
+        m_driver._lb_monitor = mock.Mock(spec=d_lbaasv2.LBStatusMonitor)
+        m_driver._lb_monitor.wait.return_value = None
         loadbalancer = mock.Mock()
         timeout = mock.sentinel.timeout
-        timer = [mock.sentinel.t0, mock.sentinel.t1]
-        m_driver._provisioning_timer.return_value = timer
-        resp = o_lb.LoadBalancer(provisioning_status='NOT_ACTIVE')
-        lbaas.get_load_balancer.return_value = resp
 
         self.assertRaises(k_exc.ResourceNotReady, cls._wait_for_provisioning,
                           m_driver, loadbalancer, timeout)
 
-        self.assertEqual(len(timer), lbaas.get_load_balancer.call_count)
+        m_driver.release_loadbalancer.assert_not_called()
+
+    def test_wait_for_provisioning_error(self):
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver = mock.Mock(spec=d_lbaasv2.LBaaSv2Driver)
+        m_driver._lb_monitor = mock.Mock(spec=d_lbaasv2.LBStatusMonitor)
+        m_driver._lb_monitor.wait.return_value = 'ERROR'
+        loadbalancer = mock.Mock()
+
+        self.assertRaises(k_exc.ResourceNotReady, cls._wait_for_provisioning,
+                          m_driver, loadbalancer, mock.sentinel.timeout)
+
+        m_driver.release_loadbalancer.assert_called_once_with(loadbalancer)
 
     def test_provisioning_timer(self):
         # REVISIT(ivc): add test if _provisioning_timer is to stay
         self.skipTest("not implemented")
+
+
+class TestLBStatusMonitor(test_base.TestCase):
+
+    def setUp(self):
+        super(TestLBStatusMonitor, self).setUp()
+        self.lbaas = self.useFixture(k_fix.MockLBaaSClient()).client
+
+    def _get_lb(self, lb_id, status):
+        return o_lb.LoadBalancer(id=lb_id, provisioning_status=status)
+
+    def _add_waiter(self, monitor, lb_id):
+        event = mock.Mock()
+        event.ready.return_value = False
+        monitor._waiters[lb_id].append(event)
+        return event
+
+    def test_poll(self):
+        monitor = d_lbaasv2.LBStatusMonitor(tags=['kuryr'])
+        active = self._add_waiter(monitor, 'lb1')
+        pending = self._add_waiter(monitor, 'lb2')
+        error = self._add_waiter(monitor, 'lb3')
+        deleted = self._add_waiter(monitor, 'lb4')
+        self.lbaas.load_balancers.return_value = [
+            self._get_lb('lb1', 'ACTIVE'),
+            self._get_lb('lb2', 'PENDING_UPDATE'),
+            self._get_lb('lb5', 'ACTIVE')]
+
+        def get_load_balancer(lb_id):
+            if lb_id == 'lb4':
+                raise os_exc.NotFoundException()
+            return self._get_lb(lb_id, 'ERROR')
+
+        self.lbaas.get_load_balancer.side_effect = get_load_balancer
+
+        monitor._poll()
+
+        self.lbaas.load_balancers.assert_called_once_with(tags=['kuryr'])
+        self.lbaas.get_load_balancer.assert_has_calls(
+            [mock.call('lb3'), mock.call('lb4')], any_order=True)
+        active.send.assert_called_once_with('ACTIVE')
+        pending.send.assert_not_called()
+        error.send.assert_called_once_with('ERROR')
+        deleted.send.assert_called_once_with('DELETED')
+
+    def test_poll_no_tags(self):
+        monitor = d_lbaasv2.LBStatusMonitor()
+        first = self._add_waiter(monitor, 'lb1')
+        second = self._add_waiter(monitor, 'lb1')
+        self.lbaas.get_load_balancer.return_value = self._get_lb('lb1',
+                                                                 'ACTIVE')
+
+        monitor._poll()
+
+        self.lbaas.load_balancers.assert_not_called()
+        self.lbaas.get_load_balancer.assert_called_once_with('lb1')
+        first.send.assert_called_once_with('ACTIVE')
+        second.send.assert_called_once_with('ACTIVE')
+
+    def test_wait(self):
+        monitor = d_lbaasv2.LBStatusMonitor(interval=0)
+        self.lbaas.get_load_balancer.side_effect = [
+            self._get_lb('lb1', 'PENDING_UPDATE'),
+            self._get_lb('lb1', 'ACTIVE')]
+
+        self.assertEqual('ACTIVE', monitor.wait('lb1', 5))
+
+        self.assertEqual(2, self.lbaas.get_load_balancer.call_count)
+        self.assertEqual({}, monitor._waiters)
+
+    def test_wait_shared(self):
+        monitor = d_lbaasv2.LBStatusMonitor(interval=0)
+        self.lbaas.get_load_balancer.return_value = self._get_lb('lb1',
+                                                                 'ACTIVE')
+
+        waiters = [eventlet.spawn(monitor.wait, 'lb1', 5) for _ in range(3)]
+
+        self.assertEqual(['ACTIVE'] * 3, [w.wait() for w in waiters])
+        self.lbaas.get_load_balancer.assert_called_once_with('lb1')
+
+    def test_wait_timeout(self):
+        monitor = d_lbaasv2.LBStatusMonitor(interval=0.01)
+        self.lbaas.get_load_balancer.return_value = self._get_lb(
+            'lb1', 'PENDING_UPDATE')
+
+        self.assertIsNone(monitor.wait('lb1', 0.05))
+
+        self.assertEqual({}, monitor._waiters)
+
+    def test_wait_poll_error(self):
+        monitor = d_lbaasv2.LBStatusMonitor(interval=0)
+        self.lbaas.get_load_balancer.side_effect = [
+            os_exc.SDKException(), self._get_lb('lb1', 'ACTIVE')]
+
+        self.assertEqual('ACTIVE', monitor.wait('lb1', 5))
@@ -96,3 +96,50 @@ class TestNestedPodVIFDriver(test_base.TestCase):
         fixed_ips = ['subnet_id=%s' % str(node_subnet_id),
                      'ip_address=%s' % str(node_fixed_ip)]
         os_net.ports.assert_called_once_with(fixed_ips=fixed_ips)
+
+    def test_get_parent_port_by_host_ip_cached(self):
+        cls = nested_vif.NestedPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        os_net = self.useFixture(k_fix.MockNetworkClient()).client
+        oslo_cfg.CONF.set_override('enabled_handlers', ['vif', 'node'],
+                                   group='kubernetes')
+        self.addCleanup(oslo_cfg.CONF.clear_override, 'enabled_handlers',
+                        group='kubernetes')
+        oslo_cfg.CONF.set_override('worker_nodes_subnet',
+                                   mock.sentinel.node_subnet_id,
+                                   group='pod_vif_nested')
+        self.addCleanup(nested_vif.PARENT_PORTS.clear)
+
+        node_fixed_ip = mock.sentinel.node_fixed_ip
+        port = mock.sentinel.port
+        os_net.ports.return_value = iter([port])
+
+        self.assertEqual(port, cls._get_parent_port_by_host_ip(
+            m_driver, node_fixed_ip))
+        self.assertEqual(port, cls._get_parent_port_by_host_ip(
+            m_driver, node_fixed_ip))
+        os_net.ports.assert_called_once()
+
+        nested_vif.PARENT_PORTS.invalidate(node_fixed_ip)
+        os_net.ports.return_value = iter([port])
+        self.assertEqual(port, cls._get_parent_port_by_host_ip(
+            m_driver, node_fixed_ip))
+        self.assertEqual(2, os_net.ports.call_count)
+
+    def test_get_parent_port_by_host_ip_not_cached(self):
+        cls = nested_vif.NestedPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        os_net = self.useFixture(k_fix.MockNetworkClient()).client
+        oslo_cfg.CONF.set_override('worker_nodes_subnet',
+                                   mock.sentinel.node_subnet_id,
+                                   group='pod_vif_nested')
+        self.addCleanup(nested_vif.PARENT_PORTS.clear)
+
+        node_fixed_ip = mock.sentinel.node_fixed_ip
+        port = mock.sentinel.port
+        os_net.ports.side_effect = lambda **kw: iter([port])
+
+        cls._get_parent_port_by_host_ip(m_driver, node_fixed_ip)
+        cls._get_parent_port_by_host_ip(m_driver, node_fixed_ip)
+        self.assertEqual(2, os_net.ports.call_count)
+        self.assertIsNone(nested_vif.PARENT_PORTS.get(node_fixed_ip))
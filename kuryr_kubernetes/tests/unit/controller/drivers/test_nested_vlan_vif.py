@@ -10,6 +10,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import fixtures
 import munch
 from unittest import mock
 
@@ -25,6 +26,39 @@ from kuryr_kubernetes.tests import base as test_base
 from kuryr_kubernetes.tests.unit import kuryr_fixtures as k_fix
 
 
+class TestVlanIdAllocator(test_base.TestCase):
+
+    def test_allocate(self):
+        vlan_allocator = nested_vlan_vif.VlanIdAllocator([1, 2, 4])
+
+        self.assertEqual(3, vlan_allocator.allocate())
+        self.assertEqual(5, vlan_allocator.allocate())
+        self.assertIn(3, vlan_allocator)
+
+    def test_allocate_released(self):
+        vlan_allocator = nested_vlan_vif.VlanIdAllocator([1, 2, 3])
+
+        vlan_allocator.release(2)
+
+        self.assertNotIn(2, vlan_allocator)
+        self.assertEqual(2, vlan_allocator.allocate())
+        self.assertEqual(4, vlan_allocator.allocate())
+
+    def test_allocate_exhausted(self):
+        vlan_allocator = nested_vlan_vif.VlanIdAllocator(
+            range(kl_const.MIN_VLAN_TAG, kl_const.MAX_VLAN_TAG))
+
+        self.assertEqual(kl_const.MAX_VLAN_TAG, vlan_allocator.allocate())
+        self.assertRaises(kl_exc.SegmentationIdAllocationFailure,
+                          vlan_allocator.allocate)
+
+    def test_seed_from_strings(self):
+        vlan_allocator = nested_vlan_vif.VlanIdAllocator(['1', '2'])
+
+        self.assertIn(2, vlan_allocator)
+        self.assertEqual(3, vlan_allocator.allocate())
+
+
 class TestNestedVlanPodVIFDriver(test_base.TestCase):
 
     @mock.patch(
@@ -192,6 +226,8 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
             pod, project_id, subnets, security_groups,
             trunk_id, num_ports, unbound=True)
         os_net.create_ports.assert_called_once_with(bulk_rq)
+        m_driver._release_vlan_ids.assert_called_once_with(trunk_id,
+                                                           subports_info)
 
     def test_request_vifs_trunk_subports_conflict(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
@@ -236,6 +272,7 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         os_net.add_trunk_subports.assert_called_once_with(trunk_id,
                                                           subports_info)
         os_net.delete_port.assert_called_with(port['id'])
+        m_driver._resync_vlan_allocator.assert_called_once_with(trunk_id)
 
     def test_request_vifs_trunk_subports_exception(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
@@ -280,6 +317,8 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         os_net.add_trunk_subports.assert_called_once_with(trunk_id,
                                                           subports_info)
         os_net.delete_port.assert_called_with(port['id'])
+        m_driver._release_vlan_ids.assert_called_once_with(trunk_id,
+                                                           subports_info)
 
     def test_release_vif(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
@@ -395,8 +434,7 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
                                     m_get_network_id, m_get_port_name,
                                     unbound=True)
 
-    @mock.patch('kuryr.lib.segmentation_type_drivers.allocate_segmentation_id')
-    def test__create_subports_info(self, m_allocate_seg_id):
+    def test__create_subports_info(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
 
@@ -413,9 +451,9 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
                           'segmentation_type': 'vlan'}
                          for i in range(num_ports)]
 
-        m_driver._get_in_use_vlan_ids_set.return_value = in_use_vlan
+        vlan_allocator = nested_vlan_vif.VlanIdAllocator(in_use_vlan)
+        m_driver._get_vlan_allocator.return_value = vlan_allocator
         m_driver._get_port_request.return_value = port
-        m_allocate_seg_id.side_effect = [2, 3]
 
         port_res, subports_res = cls._create_subports_info(
             m_driver, pod, project_id, subnets, security_groups, trunk_id,
@@ -424,13 +462,13 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         self.assertEqual(port_res, port)
         self.assertEqual(subports_res, subports_info)
 
-        m_driver._get_in_use_vlan_ids_set.assert_called_once_with(trunk_id)
+        m_driver._get_vlan_allocator.assert_called_once_with(trunk_id)
         m_driver._get_port_request.assert_called_once_with(
             pod, project_id, subnets, security_groups, False)
-        self.assertEqual(m_allocate_seg_id.call_count, 2)
+        self.assertIn(2, vlan_allocator)
+        self.assertIn(3, vlan_allocator)
 
-    @mock.patch('kuryr.lib.segmentation_type_drivers.allocate_segmentation_id')
-    def test__create_subports_info_not_enough_vlans(self, m_allocate_seg_id):
+    def test__create_subports_info_not_enough_vlans(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
 
@@ -440,17 +478,17 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         security_groups = mock.sentinel.security_groups
         trunk_id = mock.sentinel.trunk_id
         num_ports = 2
-        in_use_vlan = set([1])
         port = mock.sentinel.port
         subports_info = [{'segmentation_id': 2,
                           'port_id': '',
                           'segmentation_type': 'vlan'}]
 
-        m_driver._get_in_use_vlan_ids_set.return_value = in_use_vlan
-        m_driver._get_port_request.return_value = port
-        m_allocate_seg_id.side_effect = [
+        vlan_allocator = mock.Mock(spec=nested_vlan_vif.VlanIdAllocator)
+        vlan_allocator.allocate.side_effect = [
             2, kl_exc.SegmentationIdAllocationFailure
         ]
+        m_driver._get_vlan_allocator.return_value = vlan_allocator
+        m_driver._get_port_request.return_value = port
 
         port_res, subports_res = cls._create_subports_info(
             m_driver, pod, project_id, subnets, security_groups, trunk_id,
@@ -459,13 +497,12 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         self.assertEqual(port_res, port)
         self.assertEqual(subports_res, subports_info)
 
-        m_driver._get_in_use_vlan_ids_set.assert_called_once_with(trunk_id)
+        m_driver._get_vlan_allocator.assert_called_once_with(trunk_id)
         m_driver._get_port_request.assert_called_once_with(
             pod, project_id, subnets, security_groups, False)
-        self.assertEqual(m_allocate_seg_id.call_count, 2)
+        self.assertEqual(vlan_allocator.allocate.call_count, 2)
 
-    @mock.patch('kuryr.lib.segmentation_type_drivers.allocate_segmentation_id')
-    def test__create_subports_info_no_vlans(self, m_allocate_seg_id):
+    def test__create_subports_info_no_vlans(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
 
@@ -475,12 +512,12 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         security_groups = mock.sentinel.security_groups
         trunk_id = mock.sentinel.trunk_id
         num_ports = 2
-        in_use_vlan = set([1])
+        in_use_vlan = range(kl_const.MIN_VLAN_TAG, kl_const.MAX_VLAN_TAG + 1)
         port = mock.sentinel.port
 
-        m_driver._get_in_use_vlan_ids_set.return_value = in_use_vlan
+        m_driver._get_vlan_allocator.return_value = (
+            nested_vlan_vif.VlanIdAllocator(in_use_vlan))
         m_driver._get_port_request.return_value = port
-        m_allocate_seg_id.side_effect = kl_exc.SegmentationIdAllocationFailure
 
         port_res, subports_res = cls._create_subports_info(
             m_driver, pod, project_id, subnets, security_groups, trunk_id,
@@ -489,10 +526,9 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         self.assertEqual(port_res, port)
         self.assertEqual(subports_res, [])
 
-        m_driver._get_in_use_vlan_ids_set.assert_called_once_with(trunk_id)
+        m_driver._get_vlan_allocator.assert_called_once_with(trunk_id)
         m_driver._get_port_request.assert_called_once_with(
             pod, project_id, subnets, security_groups, False)
-        self.assertEqual(m_allocate_seg_id.call_count, 1)
 
     def test_get_trunk_id(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
@@ -560,6 +596,40 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         os_net.add_trunk_subports.assert_called_once_with(trunk_id,
                                                           subport_dict)
 
+    def test_add_subport_with_vlan_id_conflict_retry(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        os_net = self.useFixture(k_fix.MockNetworkClient()).client
+        trunk_id = mock.sentinel.trunk_id
+        subport = mock.sentinel.subport
+        m_driver._get_vlan_id.side_effect = [1, 2]
+        os_net.add_trunk_subports.side_effect = [os_exc.ConflictException,
+                                                 None]
+        self.useFixture(fixtures.MockPatchObject(
+            nested_vlan_vif, 'DEFAULT_MAX_RETRY_COUNT', 3))
+
+        self.assertEqual(2, cls._add_subport(m_driver, trunk_id, subport))
+
+        m_driver._resync_vlan_allocator.assert_called_once_with(trunk_id)
+        os_net.add_trunk_subports.assert_called_with(
+            trunk_id, [{'segmentation_id': 2,
+                        'port_id': subport,
+                        'segmentation_type': 'vlan'}])
+
+    def test_add_subport_failure_releases_vlan_id(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        os_net = self.useFixture(k_fix.MockNetworkClient()).client
+        trunk_id = mock.sentinel.trunk_id
+        subport = mock.sentinel.subport
+        m_driver._get_vlan_id.return_value = 1
+        os_net.add_trunk_subports.side_effect = os_exc.SDKException
+
+        self.assertRaises(os_exc.SDKException, cls._add_subport, m_driver,
+                          trunk_id, subport)
+
+        m_driver._release_vlan_id.assert_called_once_with(trunk_id, 1)
+
     def test__remove_subports(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
@@ -584,38 +654,100 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         os_net.delete_trunk_subports.assert_called_once_with(trunk_id,
                                                              subportid_dict)
 
-    @mock.patch('kuryr.lib.segmentation_type_drivers.allocate_segmentation_id')
-    def test_get_vlan_id(self, mock_alloc_seg_id):
+    def test_get_vlan_id(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
-        vlanid_set = mock.sentinel.vlanid_set
         trunk_id = mock.sentinel.trunk_id
-        m_driver._get_in_use_vlan_ids_set.return_value = vlanid_set
-        cls._get_vlan_id(m_driver, trunk_id)
+        m_driver._get_vlan_allocator.return_value = (
+            nested_vlan_vif.VlanIdAllocator([1, 2]))
+
+        self.assertEqual(3, cls._get_vlan_id(m_driver, trunk_id))
 
-        mock_alloc_seg_id.assert_called_once_with(vlanid_set)
+        m_driver._get_vlan_allocator.assert_called_once_with(trunk_id)
+        m_driver._resync_vlan_allocator.assert_not_called()
 
-    @mock.patch('kuryr.lib.segmentation_type_drivers.allocate_segmentation_id')
-    def test_get_vlan_id_exhausted(self, mock_alloc_seg_id):
+    def test_get_vlan_id_resync(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
-        vlanid_set = mock.sentinel.vlanid_set
         trunk_id = mock.sentinel.trunk_id
-        m_driver._get_in_use_vlan_ids_set.return_value = vlanid_set
-        mock_alloc_seg_id.side_effect = kl_exc.SegmentationIdAllocationFailure
+        all_vlan_ids = range(kl_const.MIN_VLAN_TAG, kl_const.MAX_VLAN_TAG + 1)
+        m_driver._get_vlan_allocator.return_value = (
+            nested_vlan_vif.VlanIdAllocator(all_vlan_ids))
+        m_driver._resync_vlan_allocator.return_value = (
+            nested_vlan_vif.VlanIdAllocator([1]))
+
+        self.assertEqual(2, cls._get_vlan_id(m_driver, trunk_id))
+
+        m_driver._resync_vlan_allocator.assert_called_once_with(trunk_id)
+
+    def test_get_vlan_id_exhausted(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        trunk_id = mock.sentinel.trunk_id
+        all_vlan_ids = range(kl_const.MIN_VLAN_TAG, kl_const.MAX_VLAN_TAG + 1)
+        m_driver._get_vlan_allocator.return_value = (
+            nested_vlan_vif.VlanIdAllocator(all_vlan_ids))
+        m_driver._resync_vlan_allocator.return_value = (
+            nested_vlan_vif.VlanIdAllocator(all_vlan_ids))
         self.assertRaises(kl_exc.SegmentationIdAllocationFailure,
                           cls._get_vlan_id, m_driver, trunk_id)
 
-        mock_alloc_seg_id.assert_called_once_with(vlanid_set)
+        m_driver._resync_vlan_allocator.assert_called_once_with(trunk_id)
+
+    def test_get_vlan_allocator(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        trunk_id = mock.sentinel.trunk_id
+        vlan_allocator = mock.sentinel.vlan_allocator
+        m_driver._vlan_allocators = {trunk_id: vlan_allocator}
+
+        self.assertEqual(vlan_allocator,
+                         cls._get_vlan_allocator(m_driver, trunk_id))
+        m_driver._resync_vlan_allocator.assert_not_called()
+
+    def test_get_vlan_allocator_seed(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        trunk_id = mock.sentinel.trunk_id
+        m_driver._vlan_allocators = {}
+
+        self.assertEqual(m_driver._resync_vlan_allocator.return_value,
+                         cls._get_vlan_allocator(m_driver, trunk_id))
+        m_driver._resync_vlan_allocator.assert_called_once_with(trunk_id)
+
+    def test_resync_vlan_allocator(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        trunk_id = mock.sentinel.trunk_id
+        m_driver._vlan_allocators = {}
+        m_driver._get_in_use_vlan_ids_set.return_value = {1, 3}
+
+        vlan_allocator = cls._resync_vlan_allocator(m_driver, trunk_id)
+
+        self.assertEqual({trunk_id: vlan_allocator},
+                         m_driver._vlan_allocators)
+        self.assertIn(3, vlan_allocator)
+        self.assertNotIn(2, vlan_allocator)
+        m_driver._get_in_use_vlan_ids_set.assert_called_once_with(trunk_id)
+
+    def test_release_vlan_id(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        trunk_id = mock.sentinel.trunk_id
+        vlan_allocator = nested_vlan_vif.VlanIdAllocator([1, 2])
+        m_driver._vlan_allocators = {trunk_id: vlan_allocator}
+
+        cls._release_vlan_id(m_driver, trunk_id, 1)
+
+        self.assertNotIn(1, vlan_allocator)
+        self.assertIn(2, vlan_allocator)
 
-    @mock.patch('kuryr.lib.segmentation_type_drivers.release_segmentation_id')
-    def test_release_vlan_id(self, mock_rel_seg_id):
+    def test_release_vlan_id_unknown_trunk(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
-        vlanid = mock.sentinel.vlanid
-        cls._release_vlan_id(m_driver, vlanid)
+        m_driver._vlan_allocators = {}
 
-        mock_rel_seg_id.assert_called_once_with(vlanid)
+        cls._release_vlan_id(m_driver, mock.sentinel.trunk_id, 1)
 
     def test_get_in_use_vlan_ids_set(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
@@ -224,7 +224,9 @@ class TestNetworkPolicyDriver(test_base.TestCase):
         m_namespaced.assert_not_called()
 
     @mock.patch.object(network_policy.NetworkPolicyDriver,
-                       '_add_default_np_rules')
+                       '_reconcile_sg_rules')
+    @mock.patch.object(network_policy.NetworkPolicyDriver,
+                       '_get_default_np_rules', return_value=[])
     @mock.patch.object(network_policy.NetworkPolicyDriver,
                        'get_kuryrnetpolicy_crd')
     @mock.patch.object(network_policy.NetworkPolicyDriver,
@@ -236,7 +238,8 @@ class TestNetworkPolicyDriver(test_base.TestCase):
                                                              m_parse,
                                                              m_add_crd,
                                                              m_get_crd,
-                                                             m_add_default):
+                                                             m_add_default,
+                                                             m_reconcile):
         self._driver.os_net.create_security_group.return_value = (
             munch.Munch({'id': mock.sentinel.id,
                          'security_group_rules': []}))
@@ -249,9 +252,14 @@ class TestNetworkPolicyDriver(test_base.TestCase):
         m_get_crd.assert_called_once()
         m_add_crd.assert_called_once()
         m_add_default.assert_called_once()
+        m_reconcile.assert_called_once_with(
+            self._policy, mock.sentinel.id, self._i_rules + self._e_rules,
+            existing_sg_rules=[])
 
     @mock.patch.object(network_policy.NetworkPolicyDriver,
-                       '_add_default_np_rules')
+                       '_reconcile_sg_rules')
+    @mock.patch.object(network_policy.NetworkPolicyDriver,
+                       '_get_default_np_rules', return_value=[])
     @mock.patch.object(network_policy.NetworkPolicyDriver,
                        'get_kuryrnetpolicy_crd')
     @mock.patch.object(network_policy.NetworkPolicyDriver,
@@ -261,7 +269,8 @@ class TestNetworkPolicyDriver(test_base.TestCase):
     @mock.patch.object(utils, 'get_subnet_cidr')
     def test_create_security_group_rules_with_k8s_exc(self, m_utils, m_parse,
                                                       m_add_crd, m_get_crd,
-                                                      m_add_default):
+                                                      m_add_default,
+                                                      m_reconcile):
         self._driver.os_net.create_security_group.return_value = (
             munch.Munch({'id': mock.sentinel.id,
                          'security_group_rules': []}))
@@ -278,7 +287,9 @@ class TestNetworkPolicyDriver(test_base.TestCase):
         m_add_default.assert_called_once()
 
     @mock.patch.object(network_policy.NetworkPolicyDriver,
-                       '_add_default_np_rules')
+                       '_reconcile_sg_rules')
+    @mock.patch.object(network_policy.NetworkPolicyDriver,
+                       '_get_default_np_rules', return_value=[])
     @mock.patch.object(network_policy.NetworkPolicyDriver,
                        'get_kuryrnetpolicy_crd')
     @mock.patch.object(network_policy.NetworkPolicyDriver,
@@ -288,7 +299,8 @@ class TestNetworkPolicyDriver(test_base.TestCase):
     @mock.patch.object(utils, 'get_subnet_cidr')
     def test_create_security_group_rules_error_add_crd(self, m_utils, m_parse,
                                                        m_add_crd, m_get_crd,
-                                                       m_add_default):
+                                                       m_add_default,
+                                                       m_reconcile):
         self._driver.os_net.create_security_group.return_value = (
             munch.Munch({'id': mock.sentinel.id,
                          'security_group_rules': []}))
@@ -312,14 +324,16 @@ class TestNetworkPolicyDriver(test_base.TestCase):
             self._driver.create_security_group_rules_from_network_policy,
             self._policy, self._project_id)
 
-    @mock.patch('kuryr_kubernetes.controller.drivers.utils.'
-                'create_security_group_rule')
+    @mock.patch.object(network_policy.NetworkPolicyDriver,
+                       '_reconcile_sg_rules')
+    @mock.patch.object(network_policy.NetworkPolicyDriver,
+                       '_get_default_np_rules', return_value=[])
     @mock.patch.object(network_policy.NetworkPolicyDriver,
                        'get_kuryrnetpolicy_crd')
     @mock.patch.object(network_policy.NetworkPolicyDriver,
                        'parse_network_policy_rules')
     def test_update_security_group_rules(self, m_parse, m_get_crd,
-                                         m_create_sgr):
+                                         m_get_default, m_reconcile):
         policy = self._policy.copy()
         policy['spec']['podSelector'] = {'matchLabels': {'test': 'test'}}
         m_get_crd.return_value = self._crd
@@ -327,15 +341,20 @@ class TestNetworkPolicyDriver(test_base.TestCase):
         self._driver.update_security_group_rules_from_network_policy(
             policy)
         m_parse.assert_called_with(policy, self._sg_id)
+        m_reconcile.assert_called_once_with(
+            policy, self._sg_id, self._i_rules + self._e_rules)
 
-    @mock.patch('kuryr_kubernetes.controller.drivers.utils.'
-                'create_security_group_rule')
+    @mock.patch.object(network_policy.NetworkPolicyDriver,
+                       '_reconcile_sg_rules')
+    @mock.patch.object(network_policy.NetworkPolicyDriver,
+                       '_get_default_np_rules', return_value=[])
     @mock.patch.object(network_policy.NetworkPolicyDriver,
                        'get_kuryrnetpolicy_crd')
     @mock.patch.object(network_policy.NetworkPolicyDriver,
                        'parse_network_policy_rules')
     def test_update_security_group_rules_with_k8s_exc(self, m_parse, m_get_crd,
-                                                      m_create_sgr):
+                                                      m_get_default,
+                                                      m_reconcile):
         self._driver.kubernetes.patch_crd.side_effect = (
             exceptions.K8sClientException())
         m_get_crd.return_value = self._crd
@@ -346,6 +365,66 @@ class TestNetworkPolicyDriver(test_base.TestCase):
             self._policy)
         m_parse.assert_called_with(self._policy, self._sg_id)
 
+    @mock.patch('kuryr_kubernetes.controller.drivers.utils.'
+                'delete_security_group_rules')
+    @mock.patch('kuryr_kubernetes.controller.drivers.utils.'
+                'create_security_group_rules')
+    def test_reconcile_sg_rules(self, m_create, m_delete):
+        kept = {'security_group_rule': {
+            'ethertype': 'IPv4', 'security_group_id': self._sg_id,
+            'direction': 'ingress', 'protocol': 'TCP',
+            'port_range_min': 8080, 'port_range_max': 8080,
+            'remote_ip_prefix': '10.0.0.1'}}
+        new = {'security_group_rule': {
+            'ethertype': 'IPv4', 'security_group_id': self._sg_id,
+            'direction': 'egress', 'description': 'first'}}
+        new_dup = {'security_group_rule': {
+            'ethertype': 'IPv4', 'security_group_id': self._sg_id,
+            'direction': 'egress', 'description': 'second'}}
+        existing = [
+            munch.Munch({'id': 'kept-id', 'direction': 'ingress',
+                         'ether_type': 'IPv4', 'protocol': 'tcp',
+                         'port_range_min': 8080, 'port_range_max': 8080,
+                         'remote_ip_prefix': '10.0.0.1/32',
+                         'remote_group_id': None}),
+            munch.Munch({'id': 'stale-id', 'direction': 'egress',
+                         'ether_type': 'IPv6', 'protocol': None,
+                         'port_range_min': None, 'port_range_max': None,
+                         'remote_ip_prefix': None,
+                         'remote_group_id': None})]
+        self._driver.os_net.security_group_rules.return_value = existing
+        m_create.return_value = ['new-id']
+
+        self._driver._reconcile_sg_rules(self._policy, self._sg_id,
+                                         [kept, new, new_dup])
+
+        self._driver.os_net.security_group_rules.assert_called_once_with(
+            security_group_id=self._sg_id)
+        m_create.assert_called_once_with([new])
+        m_delete.assert_called_once_with(['stale-id'])
+        self.assertEqual('kept-id', kept['security_group_rule']['id'])
+        self.assertEqual('new-id', new['security_group_rule']['id'])
+        self.assertEqual('new-id', new_dup['security_group_rule']['id'])
+
+    @mock.patch('kuryr_kubernetes.controller.drivers.utils.'
+                'delete_security_group_rules')
+    @mock.patch('kuryr_kubernetes.controller.drivers.utils.'
+                'create_security_group_rules')
+    def test_reconcile_sg_rules_existing(self, m_create, m_delete):
+        existing = [{'id': 'default-egress-v4', 'direction': 'egress',
+                     'ethertype': 'IPv4'},
+                    {'id': 'default-egress-v6', 'direction': 'egress',
+                     'ethertype': 'IPv6'}]
+        m_create.return_value = []
+
+        self._driver._reconcile_sg_rules(self._policy, self._sg_id, [],
+                                         existing_sg_rules=existing)
+
+        self._driver.os_net.security_group_rules.assert_not_called()
+        m_create.assert_called_once_with([])
+        m_delete.assert_called_once_with(['default-egress-v4',
+                                          'default-egress-v6'])
+
     def test_get_namespaces(self):
         namespace_selector = {'namespaceSelector': {
                               'matchLabels': {'project': 'myproject'}}}
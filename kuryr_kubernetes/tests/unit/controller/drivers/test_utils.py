@@ -13,10 +13,14 @@
 # limitations under the License.
 from unittest import mock
 
+from openstack import exceptions as os_exc
+from openstack.network.v2 import security_group_rule as os_sgr
+
 from kuryr_kubernetes.controller.drivers import utils
 
 from kuryr_kubernetes import constants
 from kuryr_kubernetes import exceptions
+from kuryr_kubernetes import k8s_cache
 from kuryr_kubernetes.tests import base as test_base
 from kuryr_kubernetes.tests.unit import kuryr_fixtures as k_fix
 
@@ -35,6 +39,57 @@ class TestUtils(test_base.TestCase):
         kubernetes.get.assert_called_once_with('{}/namespaces/{}'.format(
             constants.K8S_API_BASE, namespace_name))
 
+    def test_get_namespace_cached(self):
+        kubernetes = self.useFixture(k_fix.MockK8sClient()).client
+        namespace = {'metadata': {'name': 'ns1'}}
+        self.addCleanup(k8s_cache.reset)
+        k8s_cache.register(constants.K8S_OBJ_NAMESPACE,
+                           constants.K8S_API_NAMESPACES).replace([namespace])
+
+        resp = utils.get_namespace('ns1')
+
+        self.assertIs(namespace, resp)
+        kubernetes.get.assert_not_called()
+
+    def test_get_pods_cached(self):
+        kubernetes = self.useFixture(k_fix.MockK8sClient()).client
+        pod1 = {'metadata': {'name': 'pod1', 'namespace': 'ns1',
+                             'labels': {'app': 'a', 'tier': 'web'}}}
+        pod2 = {'metadata': {'name': 'pod2', 'namespace': 'ns1',
+                             'labels': {'app': 'b'}}}
+        pod3 = {'metadata': {'name': 'pod3', 'namespace': 'ns1'}}
+        pod4 = {'metadata': {'name': 'pod4', 'namespace': 'ns2',
+                             'labels': {'app': 'a'}}}
+        self.addCleanup(k8s_cache.reset)
+        k8s_cache.register(constants.K8S_OBJ_POD, '/api/v1/pods').replace(
+            [pod1, pod2, pod3, pod4])
+
+        self.assertCountEqual(
+            [pod1, pod4], utils.get_pods({'selector': {'app': 'a'}})['items'])
+        self.assertEqual(
+            [pod1],
+            utils.get_pods({'matchLabels': {'app': 'a'}}, 'ns1')['items'])
+        self.assertCountEqual(
+            [pod2, pod3],
+            utils.get_pods({'matchExpressions': [
+                {'key': 'app', 'operator': 'NotIn', 'values': ['a']}]},
+                'ns1')['items'])
+        self.assertCountEqual(
+            [pod1, pod2, pod3], utils.get_pods({}, 'ns1')['items'])
+        kubernetes.get.assert_not_called()
+
+    def test_get_label_filter(self):
+        label_filter = utils.get_label_filter(
+            {'matchLabels': {'app': 'a'},
+             'matchExpressions': [{'key': 'tier', 'operator': 'NotIn',
+                                   'values': ['db']}]})
+
+        self.assertTrue(label_filter({'app': 'a'}))
+        self.assertTrue(label_filter({'app': 'a', 'tier': 'web'}))
+        self.assertFalse(label_filter({'app': 'a', 'tier': 'db'}))
+        self.assertFalse(label_filter({'app': 'b'}))
+        self.assertFalse(label_filter(None))
+
     def test_get_network_id(self):
         id_a = mock.sentinel.id_a
         net1 = mock.Mock()
@@ -63,3 +118,76 @@ class TestUtils(test_base.TestCase):
 
     def test_get_network_id_empty(self):
         self.assertRaises(exceptions.IntegrityError, utils.get_network_id, {})
+
+    def test_create_security_group_rules(self):
+        os_net = self.useFixture(k_fix.MockNetworkClient()).client
+        sgr_1 = mock.Mock(id=mock.sentinel.id_1)
+        sgr_2 = mock.Mock(id=mock.sentinel.id_2)
+        os_net.create_security_group_rules.return_value = iter([sgr_1, sgr_2])
+        bodies = [{'security_group_rule': {'id': '', 'direction': 'ingress'}},
+                  {'security_group_rule': {'direction': 'egress'}}]
+
+        ret = utils.create_security_group_rules(bodies)
+
+        self.assertEqual([mock.sentinel.id_1, mock.sentinel.id_2], ret)
+        os_net.create_security_group_rules.assert_called_once_with(
+            {'security_group_rules': [{'direction': 'ingress'},
+                                      {'direction': 'egress'}]})
+        os_net.create_security_group_rule.assert_not_called()
+
+    def test_create_security_group_rules_conflict(self):
+        os_net = self.useFixture(k_fix.MockNetworkClient()).client
+        os_net.create_security_group_rules.side_effect = (
+            os_exc.ConflictException)
+        os_net.create_security_group_rule.side_effect = [
+            mock.Mock(id=mock.sentinel.id_1),
+            os_exc.ConflictException(
+                message='Security group rule already exists. Rule id is '
+                        'existing-id.')]
+        bodies = [{'security_group_rule': {'direction': 'ingress'}},
+                  {'security_group_rule': {'direction': 'egress'}}]
+
+        ret = utils.create_security_group_rules(bodies)
+
+        self.assertEqual([mock.sentinel.id_1, 'existing-id'], ret)
+        self.assertEqual(2, os_net.create_security_group_rule.call_count)
+
+    def test_create_security_group_rules_empty(self):
+        os_net = self.useFixture(k_fix.MockNetworkClient()).client
+
+        self.assertEqual([], utils.create_security_group_rules([]))
+        os_net.create_security_group_rules.assert_not_called()
+
+    def test_delete_security_group_rules(self):
+        os_net = self.useFixture(k_fix.MockNetworkClient()).client
+
+        utils.delete_security_group_rules([mock.sentinel.id_1,
+                                           mock.sentinel.id_2])
+
+        os_net.delete_security_group_rule.assert_has_calls(
+            [mock.call(mock.sentinel.id_1), mock.call(mock.sentinel.id_2)],
+            any_order=True)
+
+    def test_delete_security_group_rules_error(self):
+        os_net = self.useFixture(k_fix.MockNetworkClient()).client
+        os_net.delete_security_group_rule.side_effect = [
+            os_exc.SDKException, None]
+
+        self.assertRaises(os_exc.SDKException,
+                          utils.delete_security_group_rules,
+                          [mock.sentinel.id_1, mock.sentinel.id_2])
+        self.assertEqual(2, os_net.delete_security_group_rule.call_count)
+
+    def test_get_security_group_rule_key(self):
+        body = {'direction': 'ingress', 'protocol': 'TCP',
+                'port_range_min': 1, 'port_range_max': 65535,
+                'remote_ip_prefix': '10.0.0.1'}
+        sg_rule = os_sgr.SecurityGroupRule(
+            id=mock.sentinel.id, direction='ingress', ethertype='IPv4',
+            protocol='tcp', remote_ip_prefix='10.0.0.1/32')
+
+        self.assertEqual(utils.get_security_group_rule_key(body),
+                         utils.get_security_group_rule_key(sg_rule))
+        body['port_range_max'] = 80
+        self.assertNotEqual(utils.get_security_group_rule_key(body),
+                            utils.get_security_group_rule_key(sg_rule))
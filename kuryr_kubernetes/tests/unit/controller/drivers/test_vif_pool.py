@@ -13,14 +13,18 @@
 # limitations under the License.
 
 import collections
+import functools
+import time
 from unittest import mock
 import uuid
 
 import ddt
+from eventlet import queue
 import munch
 from openstack import exceptions as os_exc
 from oslo_config import cfg as oslo_cfg
 from oslo_serialization import jsonutils
+from testtools import content
 
 from os_vif.objects import vif as osv_vif
 
@@ -64,6 +68,17 @@ def get_pod_obj():
         }}
 
 
+def get_pools(pools=None):
+    """Returns the PortsPools with the ports of {pool_key: {sgs: ports}}"""
+    result = collections.defaultdict(vif_pool.PortsPool)
+    for pool_key, sg_ports in (pools or {}).items():
+        result[pool_key] = vif_pool.PortsPool()
+        for security_groups, ports in sg_ports.items():
+            for port_id in ports:
+                result[pool_key].add(port_id, security_groups)
+    return result
+
+
 def get_pod_name(pod):
     return "%(namespace)s/%(name)s" % pod['metadata']
 
@@ -140,42 +155,93 @@ class BaseVIFPool(test_base.TestCase):
         self.assertIsNone(resp)
 
     @mock.patch('time.time', return_value=50)
-    @ddt.data((neutron_vif.NeutronPodVIFDriver),
-              (nested_vlan_vif.NestedVlanPodVIFDriver))
-    def test__populate_pool(self, m_vif_driver, m_time):
+    def test__populate_pool(self, m_time):
         cls = vif_pool.BaseVIFPool
         m_driver = mock.MagicMock(spec=cls)
 
-        cls_vif_driver = m_vif_driver
-        vif_driver = mock.MagicMock(spec=cls_vif_driver)
-        m_driver._drv_vif = vif_driver
-
         pod = mock.sentinel.pod
         project_id = str(uuid.uuid4())
         subnets = mock.sentinel.subnets
-        security_groups = 'test-sg'
+        security_groups = ('test-sg',)
         pool_key = (mock.sentinel.host_addr, project_id)
-        vif = osv_vif.VIFOpenVSwitch(id='0fa0e837-d34e-4580-a6c4-04f5f607d93e')
-        vifs = [vif]
 
-        m_driver._existing_vifs = {}
-        m_driver._available_ports_pools = {}
-        m_driver._last_update = {pool_key: {tuple(security_groups): 1}}
+        m_driver._last_update = {pool_key: {security_groups: 1,
+                                            ('other-sg',): 40}}
         m_driver._recovered_pools = True
 
         oslo_cfg.CONF.set_override('ports_pool_min',
                                    5,
                                    group='vif_pool')
+        oslo_cfg.CONF.set_override('ports_pool_batch',
+                                   2,
+                                   group='vif_pool')
         oslo_cfg.CONF.set_override('ports_pool_update_frequency',
                                    15,
                                    group='vif_pool')
         m_driver._get_pool_size.return_value = 2
-        vif_driver.request_vifs.return_value = vifs
+        m_driver._create_pool_ports.return_value = [mock.sentinel.vif]
+
+        cls._populate_pool(m_driver, pool_key, pod, subnets, security_groups)
 
-        cls._populate_pool(m_driver, pool_key, pod, subnets,
-                           tuple(security_groups))
         m_driver._get_pool_size.assert_called_once()
-        m_driver._drv_vif.request_vifs.assert_called_once()
+        m_driver._create_pool_ports.assert_called_once_with(
+            pool_key, pod, subnets, security_groups, 3)
+        self.assertEqual({pool_key: {security_groups: 50, ('other-sg',): 40}},
+                         m_driver._last_update)
+
+    @mock.patch('time.time', return_value=50)
+    def test__populate_pool_no_ports(self, m_time):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+
+        pod = mock.sentinel.pod
+        project_id = str(uuid.uuid4())
+        subnets = mock.sentinel.subnets
+        security_groups = ('test-sg',)
+        pool_key = (mock.sentinel.host_addr, project_id)
+
+        m_driver._last_update = {}
+        m_driver._recovered_pools = True
+        m_driver._get_pool_size.return_value = 0
+        m_driver._create_pool_ports.return_value = []
+
+        cls._populate_pool(m_driver, pool_key, pod, subnets, security_groups)
+
+        m_driver._create_pool_ports.assert_called_once()
+        # The pool is populated again on the next request
+        self.assertEqual({pool_key: {security_groups: 0}},
+                         m_driver._last_update)
+
+    @ddt.data((neutron_vif.NeutronPodVIFDriver),
+              (nested_vlan_vif.NestedVlanPodVIFDriver))
+    def test__create_pool_ports(self, m_vif_driver):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+
+        vif_driver = mock.MagicMock(spec=m_vif_driver)
+        m_driver._drv_vif = vif_driver
+
+        pod = mock.sentinel.pod
+        project_id = str(uuid.uuid4())
+        subnets = mock.sentinel.subnets
+        security_groups = ('test-sg',)
+        pool_key = (mock.sentinel.host_addr, project_id)
+        vif = osv_vif.VIFOpenVSwitch(id='0fa0e837-d34e-4580-a6c4-04f5f607d93e')
+
+        m_driver._existing_vifs = {}
+        m_driver._available_ports_pools = get_pools()
+        vif_driver.request_vifs.return_value = [vif]
+
+        self.assertEqual([vif], cls._create_pool_ports(
+            m_driver, pool_key, pod, subnets, security_groups, 3))
+
+        vif_driver.request_vifs.assert_called_once_with(
+            pod=pod, project_id=project_id, subnets=subnets,
+            security_groups=security_groups, num_ports=3)
+        self.assertEqual({vif.id: vif}, m_driver._existing_vifs)
+        self.assertEqual({security_groups: [vif.id]},
+                         dict(m_driver._available_ports_pools[pool_key]
+                              .items()))
 
     @ddt.data((neutron_vif.NeutronPodVIFDriver),
               (nested_vlan_vif.NestedVlanPodVIFDriver))
@@ -250,13 +316,14 @@ class BaseVIFPool(test_base.TestCase):
         cls._populate_pool(m_driver, pool_key, pod, subnets,
                            tuple(security_groups))
         m_driver._get_pool_size.assert_called_once()
-        m_driver._drv_vif.request_vifs.assert_not_called()
+        m_driver._create_pool_ports.assert_not_called()
 
     def test_release_vif(self):
         cls = vif_pool.BaseVIFPool
         m_driver = mock.MagicMock(spec=cls)
         m_driver._recyclable_ports = {}
         m_driver._existing_vifs = {}
+        m_driver._released_ports = mock.Mock()
 
         pod = get_pod_obj()
         project_id = mock.sentinel.project_id
@@ -275,6 +342,259 @@ class BaseVIFPool(test_base.TestCase):
         cls.release_vif(m_driver, pod, vif, project_id, security_groups)
 
         m_driver._return_ports_to_pool.assert_not_called()
+        m_driver._released_ports.put.assert_called_once_with(vif.id)
+        self.assertEqual({vif.id: m_driver._get_pool_key.return_value},
+                         m_driver._recyclable_ports)
+
+    def test__wait_for_released_ports(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._released_ports = queue.LightQueue()
+        m_driver._released_ports.put('port1')
+        m_driver._released_ports.put('port2')
+
+        cls._wait_for_released_ports(m_driver)
+
+        self.assertTrue(m_driver._released_ports.empty())
+
+    def test__wait_for_released_ports_timeout(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._released_ports = mock.Mock()
+        m_driver._released_ports.get.side_effect = queue.Empty
+        oslo_cfg.CONF.set_override('ports_pool_update_frequency', 20,
+                                   group='vif_pool')
+
+        cls._wait_for_released_ports(m_driver)
+
+        m_driver._released_ports.get.assert_called_once_with(timeout=20)
+        m_driver._released_ports.get_nowait.assert_not_called()
+
+    def test__get_recyclable_sgs(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        os_net = self.useFixture(k_fix.MockNetworkClient()).client
+        m_driver._recyclable_ports = {'port1': mock.sentinel.pool_key}
+        m_driver._port_sgs = {'port1': ('sg1', 'sg2')}
+
+        self.assertEqual({'port1': ('sg1', 'sg2')},
+                         cls._get_recyclable_sgs(m_driver, 'owner'))
+        os_net.ports.assert_not_called()
+
+    @mock.patch('kuryr_kubernetes.controller.sharding.get_shard_manager')
+    def test__get_recyclable_sgs_sharded(self, m_get_shard_manager):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        os_net = self.useFixture(k_fix.MockNetworkClient()).client
+        oslo_cfg.CONF.set_override('port_debug', False, group='kubernetes')
+        oslo_cfg.CONF.set_override('resource_tags', [],
+                                   group='neutron_defaults')
+        m_driver._recyclable_ports = {'port1': mock.sentinel.pool_key}
+        m_driver._port_sgs = {'port1': ('sg1',)}
+        os_net.ports.return_value = [
+            munch.Munch({'id': 'port1', 'security_group_ids': ['sg2']})]
+
+        self.assertEqual({'port1': ('sg2',)},
+                         cls._get_recyclable_sgs(m_driver, 'owner'))
+        os_net.ports.assert_called_once_with(id=['port1'],
+                                             device_owner='owner')
+
+    def test__delete_ports(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        os_net = self.useFixture(k_fix.MockNetworkClient()).client
+        os_net.delete_port.side_effect = [None, os_exc.SDKException, None]
+
+        failed = cls._delete_ports(m_driver, ['p1', 'p2', 'p3'])
+
+        self.assertEqual(['p2'], failed)
+        os_net.delete_port.assert_has_calls([mock.call('p1'),
+                                             mock.call('p2'),
+                                             mock.call('p3')])
+
+    def test__retry_ports_deletion(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._ports_to_delete = {'p1', 'p2'}
+        m_driver._delete_ports.return_value = ['p2']
+
+        cls._retry_ports_deletion(m_driver)
+
+        m_driver._delete_ports.assert_called_once()
+        self.assertEqual({'p1', 'p2'},
+                         set(m_driver._delete_ports.call_args[0][0]))
+        self.assertEqual({'p2'}, m_driver._ports_to_delete)
+
+    def test__remove_sg_from_unowned_ports(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        os_net = self.useFixture(k_fix.MockNetworkClient()).client
+        m_driver._existing_vifs = {'port1': mock.sentinel.vif}
+        os_net.ports.return_value = [
+            munch.Munch({'id': 'port1', 'device_owner': 'trunk:subport'}),
+            munch.Munch({'id': 'port2', 'device_owner': 'trunk:subport'}),
+            munch.Munch({'id': 'port3', 'device_owner': 'compute:nova'})]
+
+        cls._remove_sg_from_unowned_ports(m_driver, 'sg1', 'net1')
+
+        os_net.ports.assert_called_once_with(
+            network_id='net1', status='DOWN', security_group_ids=['sg1'])
+        os_net.update_port.assert_called_once_with('port2',
+                                                   security_groups=None)
+
+    @mock.patch('kuryr_kubernetes.controller.sharding.get_shard_manager')
+    def test__is_owned_host(self, m_get_shard_manager):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_get_shard_manager.return_value = None
+
+        self.assertTrue(cls._is_owned_host(m_driver, 'node1'))
+
+        shard_manager = m_get_shard_manager.return_value = mock.Mock()
+        shard_manager.is_owner.return_value = False
+
+        self.assertFalse(cls._is_owned_host(m_driver, 'node1'))
+        m_driver._get_host_shard_key.assert_called_once_with('node1')
+        shard_manager.is_owner.assert_called_once_with(
+            m_driver._get_host_shard_key.return_value)
+
+    @mock.patch('kuryr_kubernetes.controller.sharding.get_shard_manager')
+    def test__is_gained_host(self, m_get_shard_manager):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._get_host_shard_key.return_value = 'node1'
+        shard_manager = m_get_shard_manager.return_value
+
+        self.assertEqual(shard_manager.is_gained_key.return_value,
+                         cls._is_gained_host(m_driver, '10.0.0.1',
+                                             mock.sentinel.ring))
+        m_driver._get_host_shard_key.assert_called_once_with('10.0.0.1')
+        shard_manager.is_gained_key.assert_called_once_with(
+            'node1', mock.sentinel.ring)
+
+    def test_handoff_pools(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._recovered_pools = True
+
+        cls.handoff_pools(m_driver, mock.sentinel.ring)
+
+        m_driver._trigger_return_to_pool.assert_called_once_with()
+        m_driver._handoff_pools.assert_called_once_with(mock.sentinel.ring)
+
+    def test_handoff_pools_not_recovered(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._recovered_pools = False
+
+        cls.handoff_pools(m_driver, mock.sentinel.ring)
+
+        m_driver._trigger_return_to_pool.assert_not_called()
+        m_driver._handoff_pools.assert_not_called()
+
+    def test__handoff_pools(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        kept = ('node1', 'project', 'net')
+        lost = ('node2', 'project', 'net')
+        m_driver._is_owned_host.side_effect = lambda host: host == 'node1'
+        m_driver._available_ports_pools = get_pools({
+            kept: {('sg1',): ['port1']},
+            lost: {('sg1',): ['port2']}})
+        m_driver._existing_vifs = {port_id: mock.sentinel.vif for port_id
+                                   in ('port1', 'port2', 'port3', 'port4',
+                                       'port5')}
+        m_driver._recyclable_ports = {'port3': kept, 'port4': lost}
+        m_driver._last_update = {kept: {('sg1',): 1}, lost: {('sg1',): 1}}
+        m_driver._pool_demand = {lost: mock.sentinel.demand}
+        m_driver._sg_demand = {lost: {('sg1',): 1}}
+        m_driver._checkpoint = mock.Mock()
+
+        cls._handoff_pools(m_driver, mock.sentinel.ring)
+
+        self.assertEqual([kept], list(m_driver._available_ports_pools))
+        # The ports in use (port5) are left known
+        self.assertEqual({'port1', 'port3', 'port5'},
+                         set(m_driver._existing_vifs))
+        self.assertEqual({'port3': kept}, m_driver._recyclable_ports)
+        self.assertEqual([kept], list(m_driver._last_update))
+        self.assertEqual({}, m_driver._pool_demand)
+        self.assertEqual({}, m_driver._sg_demand)
+        m_driver._checkpoint.forget.assert_called_once_with(lost)
+        host_filter = m_driver._recover_precreated_ports.call_args[0][0]
+        host_filter('node3')
+        m_driver._is_gained_host.assert_called_once_with(
+            'node3', previous_ring=mock.sentinel.ring)
+
+    @mock.patch('kuryr_kubernetes.controller.drivers.vif_pool.'
+                'PORTS_QUERY_BATCH', 2)
+    def test__get_recyclable_sgs_unknown(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        os_net = self.useFixture(k_fix.MockNetworkClient()).client
+        oslo_cfg.CONF.set_override('port_debug', False, group='kubernetes')
+        oslo_cfg.CONF.set_override('resource_tags', [],
+                                   group='neutron_defaults')
+        m_driver._recyclable_ports = {'port%d' % i: mock.sentinel.pool_key
+                                      for i in range(4)}
+        m_driver._port_sgs = {'port0': ('sg1',)}
+        os_net.ports.side_effect = [
+            [munch.Munch({'id': 'port1', 'security_group_ids': ['b', 'a']}),
+             munch.Munch({'id': 'port2', 'security_group_ids': []})],
+            [munch.Munch({'id': 'port3', 'security_group_ids': ['c']})]]
+
+        self.assertEqual({'port0': ('sg1',), 'port1': ('a', 'b'),
+                          'port2': (), 'port3': ('c',)},
+                         cls._get_recyclable_sgs(m_driver, 'owner'))
+        os_net.ports.assert_has_calls([
+            mock.call(id=['port1', 'port2'], device_owner='owner'),
+            mock.call(id=['port3'], device_owner='owner')])
+
+    def test__get_recyclable_sgs_port_debug(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        os_net = self.useFixture(k_fix.MockNetworkClient()).client
+        oslo_cfg.CONF.set_override('port_debug', True, group='kubernetes')
+        m_driver._recyclable_ports = {'port1': mock.sentinel.pool_key}
+        m_driver._port_sgs = {}
+
+        self.assertEqual({}, cls._get_recyclable_sgs(m_driver, 'owner'))
+        os_net.ports.assert_not_called()
+
+    def test_update_vif_sgs(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        port_id = str(uuid.uuid4())
+        pod = get_pod_obj()
+        state = vif.PodState(default_vif=osv_vif.VIFBase(id=port_id))
+        pod['metadata']['annotations'] = {
+            constants.K8S_ANNOTATION_VIF: jsonutils.dumps(
+                state.obj_to_primitive())}
+        m_driver._port_sgs = {port_id: ('sg1',)}
+        m_driver._drv_vif = mock.Mock()
+
+        cls.update_vif_sgs(m_driver, pod, ['sg3', 'sg2'])
+
+        m_driver._drv_vif.update_vif_sgs.assert_called_once_with(
+            pod, ['sg3', 'sg2'])
+        self.assertEqual({port_id: ('sg2', 'sg3')}, m_driver._port_sgs)
+
+    def test_update_vif_sgs_exception(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        port_id = str(uuid.uuid4())
+        pod = get_pod_obj()
+        state = vif.PodState(default_vif=osv_vif.VIFBase(id=port_id))
+        pod['metadata']['annotations'] = {
+            constants.K8S_ANNOTATION_VIF: jsonutils.dumps(
+                state.obj_to_primitive())}
+        m_driver._port_sgs = {port_id: ('sg1',)}
+        m_driver._drv_vif = mock.Mock()
+        m_driver._drv_vif.update_vif_sgs.side_effect = os_exc.SDKException
+
+        self.assertRaises(os_exc.SDKException, cls.update_vif_sgs, m_driver,
+                          pod, ['sg2'])
+        self.assertEqual({}, m_driver._port_sgs)
 
     def test__get_in_use_ports(self):
         cls = vif_pool.BaseVIFPool
@@ -444,6 +764,598 @@ class BaseVIFPool(test_base.TestCase):
         os_net.networks.assert_not_called()
         os_net.delete_port.assert_called_once_with(port.id)
 
+    @mock.patch('time.time', return_value=1000)
+    def test__get_pool_target(self, m_time):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        pool_key = ('node_ip', 'project_id', 'net_id')
+        demand = vif_pool.PoolDemand(300, 0)
+        for t in range(985, 1000):
+            demand.add(t, mock.sentinel.pod, mock.sentinel.subnets, ('sg',))
+        m_driver._pool_demand = {pool_key: demand}
+        oslo_cfg.CONF.set_override('ports_pool_min', 2, group='vif_pool')
+        oslo_cfg.CONF.set_override('ports_pool_max', 0, group='vif_pool')
+        oslo_cfg.CONF.set_override('ports_pool_update_frequency', 20,
+                                   group='vif_pool')
+
+        # 15 requests over the last 20 seconds
+        self.assertEqual(15, cls._get_pool_target(m_driver, pool_key))
+
+        oslo_cfg.CONF.set_override('ports_pool_max', 10, group='vif_pool')
+        self.assertEqual(10, cls._get_pool_target(m_driver, pool_key))
+
+        self.assertEqual(2, cls._get_pool_target(m_driver, pool_key,
+                                                 now=2000))
+
+    def test__get_pool_target_no_demand(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._pool_demand = {}
+        oslo_cfg.CONF.set_override('ports_pool_min', 3, group='vif_pool')
+
+        self.assertEqual(3, cls._get_pool_target(m_driver, 'pool_key'))
+
+    @mock.patch('time.time', return_value=1000)
+    def test__scale_pools_up(self, m_time):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        pool_key = ('node_ip', 'project_id', 'net_id')
+        security_groups = ('sg',)
+        demand = vif_pool.PoolDemand(300, 990)
+        demand.add(990, mock.sentinel.pod, mock.sentinel.subnets,
+                   security_groups)
+        m_driver._recovered_pools = True
+        m_driver._available_ports_pools = get_pools({pool_key: {}})
+        m_driver._pool_demand = {pool_key: demand}
+        m_driver._last_update = {}
+        m_driver._get_pool_size.return_value = 1
+        m_driver._get_pool_target.return_value = 5
+
+        cls._scale_pools(m_driver)
+
+        m_driver._create_pool_ports.assert_called_once_with(
+            pool_key, mock.sentinel.pod, mock.sentinel.subnets,
+            security_groups, 4)
+        m_driver._shrink_pool.assert_not_called()
+        self.assertEqual({pool_key: {security_groups: 1000}},
+                         m_driver._last_update)
+
+    @mock.patch('time.time', return_value=1000)
+    def test__scale_pools_down(self, m_time):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        idle_key = ('node1', 'project_id', 'net_id')
+        busy_key = ('node2', 'project_id', 'net_id')
+        m_driver._recovered_pools = True
+        m_driver._available_ports_pools = get_pools({busy_key: {}})
+        m_driver._pool_demand = {idle_key: vif_pool.PoolDemand(300, 100),
+                                 busy_key: vif_pool.PoolDemand(300, 900)}
+        m_driver._get_pool_size.return_value = 10
+        m_driver._get_pool_target.return_value = 2
+        oslo_cfg.CONF.set_override('ports_pool_min', 2, group='vif_pool')
+        oslo_cfg.CONF.set_override('ports_pool_idle_timeout', 600,
+                                   group='vif_pool')
+
+        cls._scale_pools(m_driver)
+
+        m_driver._shrink_pool.assert_called_once_with(idle_key, 8)
+        m_driver._create_pool_ports.assert_not_called()
+
+    def test__scale_pools_not_recovered(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._recovered_pools = False
+
+        cls._scale_pools(m_driver)
+
+        m_driver._get_pool_size.assert_not_called()
+
+    def test__shrink_pool(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        pool_key = ('node_ip', 'project_id', 'net_id')
+        m_driver._available_ports_pools = get_pools({pool_key: {
+            ('sg1',): ['p1', 'p2', 'p3'], ('sg2',): ['p4']}})
+        m_driver._delete_pool_ports.return_value = ['p2']
+
+        cls._shrink_pool(m_driver, pool_key, 3)
+
+        m_driver._delete_pool_ports.assert_called_once_with(
+            pool_key, ['p3', 'p2', 'p1'])
+        self.assertEqual([(('sg1',), ['p2']), (('sg2',), ['p4'])],
+                         m_driver._available_ports_pools[pool_key].items())
+
+    @mock.patch('time.time', return_value=1000)
+    def test_request_vif_sg_demand(self, m_time):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._sg_demand = collections.defaultdict(dict)
+        pool_key = ('node_ip', 'project_id', 'net_id')
+        m_driver._get_pool_key.return_value = pool_key
+        oslo_cfg.CONF.set_override('ports_pool_sg_buffer', 2,
+                                   group='vif_pool')
+        self.addCleanup(oslo_cfg.CONF.clear_override, 'ports_pool_sg_buffer',
+                        group='vif_pool')
+
+        cls.request_vif(m_driver, get_pod_obj(), 'project_id',
+                        mock.sentinel.subnets, ['sg2', 'sg1'])
+
+        self.assertEqual({pool_key: {('sg1', 'sg2'): 1000}},
+                         m_driver._sg_demand)
+
+    def test__get_demanded_sgs(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        pool_key = ('node_ip', 'project_id', 'net_id')
+        m_driver._sg_demand = {pool_key: {('sg1',): 900, ('sg2',): 950,
+                                          ('sg3',): 500}}
+        oslo_cfg.CONF.set_override('ports_pool_demand_window', 300,
+                                   group='vif_pool')
+
+        self.assertEqual([('sg2',), ('sg1',)],
+                         cls._get_demanded_sgs(m_driver, pool_key, 1000))
+        self.assertEqual([], cls._get_demanded_sgs(m_driver, pool_key, 2000))
+        self.assertEqual({}, m_driver._sg_demand)
+
+    @mock.patch('eventlet.spawn')
+    def test__check_sg_buffer(self, m_eventlet):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        pool_key = ('node_ip', 'project_id', 'net_id')
+        m_driver._refilling_pools = set()
+        m_driver._available_ports_pools = get_pools({pool_key: {
+            ('sg1',): ['p1'], ('sg2',): ['p2', 'p3']}})
+        oslo_cfg.CONF.set_override('ports_pool_sg_buffer', 2,
+                                   group='vif_pool')
+        self.addCleanup(oslo_cfg.CONF.clear_override, 'ports_pool_sg_buffer',
+                        group='vif_pool')
+
+        cls._check_sg_buffer(m_driver, pool_key, ('sg2',))
+        m_eventlet.assert_not_called()
+
+        cls._check_sg_buffer(m_driver, pool_key, ('sg1',))
+        m_eventlet.assert_called_once_with(m_driver._refill_sg_buffers,
+                                           pool_key)
+
+    @mock.patch('time.time', return_value=1000)
+    def test__refill_sg_buffers(self, m_time):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        os_net = self.useFixture(k_fix.MockNetworkClient()).client
+        pool_key = ('node_ip', 'project_id', 'net_id')
+        m_driver._refilling_pools = set()
+        m_driver._available_ports_pools = get_pools({pool_key: {
+            ('sg1',): ['p1'], ('sg2',): ['p2', 'p3'], ('sg3',): ['p4']}})
+        m_driver._get_demanded_sgs.return_value = [('sg1',), ('sg2',)]
+        oslo_cfg.CONF.set_override('ports_pool_sg_buffer', 3,
+                                   group='vif_pool')
+        self.addCleanup(oslo_cfg.CONF.clear_override, 'ports_pool_sg_buffer',
+                        group='vif_pool')
+
+        cls._refill_sg_buffers(m_driver, pool_key)
+
+        # Only the port of the security groups not in demand is moved
+        os_net.update_port.assert_called_once_with('p4',
+                                                   security_groups=['sg1'])
+        pool_ports = m_driver._available_ports_pools[pool_key]
+        self.assertEqual(['p1', 'p4'], pool_ports.ports(('sg1',)))
+        self.assertEqual(['p2', 'p3'], pool_ports.ports(('sg2',)))
+        self.assertEqual(set(), m_driver._refilling_pools)
+
+    @mock.patch('time.time', return_value=1000)
+    def test__refill_sg_buffers_exception(self, m_time):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        os_net = self.useFixture(k_fix.MockNetworkClient()).client
+        os_net.update_port.side_effect = os_exc.SDKException
+        pool_key = ('node_ip', 'project_id', 'net_id')
+        m_driver._refilling_pools = set()
+        m_driver._available_ports_pools = get_pools({pool_key: {
+            ('sg1',): ['p1'], ('sg3',): ['p3', 'p4']}})
+        m_driver._get_demanded_sgs.return_value = [('sg1',)]
+        oslo_cfg.CONF.set_override('ports_pool_sg_buffer', 3,
+                                   group='vif_pool')
+        self.addCleanup(oslo_cfg.CONF.clear_override, 'ports_pool_sg_buffer',
+                        group='vif_pool')
+
+        cls._refill_sg_buffers(m_driver, pool_key)
+
+        os_net.update_port.assert_called_once_with('p4',
+                                                   security_groups=['sg1'])
+        pool_ports = m_driver._available_ports_pools[pool_key]
+        self.assertEqual([(('sg3',), ['p3', 'p4']), (('sg1',), ['p1'])],
+                         pool_ports.items())
+
+    def test__load_checkpoint(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._checkpoint = mock.MagicMock(spec=vif_pool.PoolCheckpoint)
+        oslo_cfg.CONF.set_override('ports_pool_checkpoint', True,
+                                   group='vif_pool')
+        m_driver._available_ports_pools = get_pools()
+        m_driver._existing_vifs = {}
+        m_driver._recyclable_ports = {}
+        pool_key = ('node_ip', 'project_id', 'net_id')
+        vifs = {port_id: osv_vif.VIFOpenVSwitch(id=port_id)
+                for port_id in ('p1', 'p2', 'p3', 'p4')}
+        m_driver._checkpoint.load.return_value = {pool_key: {
+            'availablePorts': [
+                {'id': 'p1', 'securityGroups': ['sg1'],
+                 'vif': vifs['p1'].obj_to_primitive()},
+                {'id': 'p2', 'vif': vifs['p2'].obj_to_primitive()},
+                {'id': 'p3', 'securityGroups': ['sg1'],
+                 'vif': vifs['p3'].obj_to_primitive()}],
+            'recyclablePorts': [
+                {'id': 'p4', 'vif': vifs['p4'].obj_to_primitive()}]}}
+        m_driver._get_in_use_ports.return_value = ['p3']
+
+        self.assertTrue(cls._load_checkpoint(m_driver))
+
+        self.assertEqual([(('sg1',), ['p1']), (None, ['p2'])],
+                         m_driver._available_ports_pools[pool_key].items())
+        self.assertEqual({'p4': pool_key}, m_driver._recyclable_ports)
+        self.assertEqual({port_id: vifs[port_id]
+                          for port_id in ('p1', 'p2', 'p4')},
+                         m_driver._existing_vifs)
+        m_driver._create_healthcheck_file.assert_called_once()
+
+    def test__load_checkpoint_disabled(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._checkpoint = mock.MagicMock(spec=vif_pool.PoolCheckpoint)
+        oslo_cfg.CONF.set_override('ports_pool_checkpoint', False,
+                                   group='vif_pool')
+
+        self.assertFalse(cls._load_checkpoint(m_driver))
+
+        m_driver._checkpoint.load.assert_not_called()
+
+    def test__load_checkpoint_empty(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._checkpoint = mock.MagicMock(spec=vif_pool.PoolCheckpoint)
+        oslo_cfg.CONF.set_override('ports_pool_checkpoint', True,
+                                   group='vif_pool')
+        m_driver._checkpoint.load.return_value = {}
+
+        self.assertFalse(cls._load_checkpoint(m_driver))
+
+        m_driver._create_healthcheck_file.assert_not_called()
+
+    def test__load_checkpoint_exception(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._checkpoint = mock.MagicMock(spec=vif_pool.PoolCheckpoint)
+        oslo_cfg.CONF.set_override('ports_pool_checkpoint', True,
+                                   group='vif_pool')
+        m_driver._checkpoint.load.side_effect = (
+            exceptions.K8sResourceNotFound('kuryrpools'))
+
+        self.assertFalse(cls._load_checkpoint(m_driver))
+
+        m_driver._create_healthcheck_file.assert_not_called()
+
+    def test__validate_checkpoint(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        os_net = self.useFixture(k_fix.MockNetworkClient()).client
+        pool_key = ('node_ip', 'project_id', 'net_id')
+        m_driver._available_ports_pools = get_pools({pool_key: {
+            ('sg1',): ['p1', 'p2']}})
+        m_driver._existing_vifs = {'p1': mock.sentinel.vif1,
+                                   'p2': mock.sentinel.vif2}
+        os_net.ports.return_value = [munch.Munch({'id': 'p1'})]
+
+        cls._validate_checkpoint(m_driver)
+
+        os_net.ports.assert_called_once_with(id=['p1', 'p2'])
+        self.assertEqual([(('sg1',), ['p1'])],
+                         m_driver._available_ports_pools[pool_key].items())
+        self.assertEqual({'p1': mock.sentinel.vif1}, m_driver._existing_vifs)
+        m_driver._recover_precreated_ports.assert_called_once()
+
+    def test__checkpoint_pools(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._checkpoint = mock.MagicMock(spec=vif_pool.PoolCheckpoint)
+        m_driver._recovered_pools = True
+        m_driver._available_ports_pools = get_pools()
+        m_driver._recyclable_ports = {}
+        m_driver._existing_vifs = {}
+        m_driver._checkpoint.write.side_effect = (
+            exceptions.K8sClientException)
+
+        cls._checkpoint_pools(m_driver)
+
+        m_driver._checkpoint.write.assert_called_once_with(
+            m_driver._available_ports_pools, m_driver._recyclable_ports,
+            m_driver._existing_vifs)
+
+    def test__checkpoint_pools_not_recovered(self):
+        cls = vif_pool.BaseVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._checkpoint = mock.MagicMock(spec=vif_pool.PoolCheckpoint)
+        m_driver._recovered_pools = False
+
+        cls._checkpoint_pools(m_driver)
+
+        m_driver._checkpoint.write.assert_not_called()
+
+
+class TestPoolCheckpoint(test_base.TestCase):
+
+    def setUp(self):
+        super(TestPoolCheckpoint, self).setUp()
+        self.k8s = self.useFixture(k_fix.MockK8sClient()).client
+        self.checkpoint = vif_pool.PoolCheckpoint('NestedVIFPool')
+        self.pool_key = ('10.0.0.5', 'project_id', 'net_id')
+        self.vifs = {port_id: osv_vif.VIFOpenVSwitch(id=port_id)
+                     for port_id in ('p1', 'p2', 'p3')}
+        self.path = '%s/%s' % (constants.K8S_API_CRD_KURYRPOOLS,
+                               self.checkpoint.get_name(self.pool_key))
+
+    def test_get_name(self):
+        name = self.checkpoint.get_name(self.pool_key)
+
+        self.assertTrue(name.startswith('nestedvifpool-'))
+        self.assertEqual(name, self.checkpoint.get_name(self.pool_key))
+        self.assertNotEqual(name, self.checkpoint.get_name(
+            ('10.0.0.6', 'project_id', 'net_id')))
+        self.assertNotEqual(name, vif_pool.PoolCheckpoint(
+            'NeutronVIFPool').get_name(self.pool_key))
+
+    def test_write(self):
+        pools = get_pools({self.pool_key: {('sg1',): ['p1'],
+                                           None: ['p2']}})
+        recyclable_ports = {'p3': self.pool_key}
+
+        self.checkpoint.write(pools, recyclable_ports, self.vifs)
+
+        self.k8s.patch_crd.assert_called_once_with('spec', self.path, {
+            'availablePorts': [
+                {'id': 'p1', 'securityGroups': ['sg1'],
+                 'vif': self.vifs['p1'].obj_to_primitive()},
+                {'id': 'p2', 'vif': self.vifs['p2'].obj_to_primitive()}],
+            'recyclablePorts': [
+                {'id': 'p3', 'vif': self.vifs['p3'].obj_to_primitive()}]})
+        self.k8s.post.assert_not_called()
+
+        # Unchanged pools are not written again
+        self.k8s.patch_crd.reset_mock()
+        self.checkpoint.write(pools, recyclable_ports, self.vifs)
+        self.k8s.patch_crd.assert_not_called()
+
+    def test_write_create(self):
+        pools = get_pools({self.pool_key: {('sg1',): ['p1']}})
+        self.k8s.patch_crd.side_effect = exceptions.K8sResourceNotFound(
+            self.path)
+
+        self.checkpoint.write(pools, {}, self.vifs)
+
+        self.k8s.post.assert_called_once_with(
+            constants.K8S_API_CRD_KURYRPOOLS, {
+                'apiVersion': 'openstack.org/v1',
+                'kind': 'KuryrPool',
+                'metadata': {'name': self.checkpoint.get_name(self.pool_key)},
+                'spec': {
+                    'driver': 'NestedVIFPool',
+                    'host': '10.0.0.5',
+                    'projectId': 'project_id',
+                    'networkId': 'net_id',
+                    'availablePorts': [
+                        {'id': 'p1', 'securityGroups': ['sg1'],
+                         'vif': self.vifs['p1'].obj_to_primitive()}],
+                    'recyclablePorts': []}})
+
+    def test_write_delete_empty(self):
+        pools = get_pools({self.pool_key: {('sg1',): ['p1']}})
+        self.checkpoint.write(pools, {}, self.vifs)
+
+        pools[self.pool_key].remove('p1')
+        self.checkpoint.write(pools, {}, self.vifs)
+
+        self.k8s.delete.assert_called_once_with(self.path)
+
+        # Deleted pools are not deleted again
+        self.k8s.delete.reset_mock()
+        self.checkpoint.write(pools, {}, self.vifs)
+        self.k8s.delete.assert_not_called()
+
+    def test_forget(self):
+        pools = get_pools({self.pool_key: {('sg1',): ['p1']}})
+        self.checkpoint.write(pools, {}, self.vifs)
+
+        # The pools handed over are left to their new owner
+        self.checkpoint.forget(self.pool_key)
+        self.checkpoint.write(get_pools(), {}, self.vifs)
+
+        self.k8s.delete.assert_not_called()
+
+    def test_write_exception(self):
+        pools = get_pools({self.pool_key: {('sg1',): ['p1']}})
+        self.k8s.patch_crd.side_effect = exceptions.K8sClientException
+
+        self.assertRaises(exceptions.K8sClientException,
+                          self.checkpoint.write, pools, {}, self.vifs)
+
+        # The pool is written on the next attempt
+        self.k8s.patch_crd.side_effect = None
+        self.checkpoint.write(pools, {}, self.vifs)
+        self.assertEqual(2, self.k8s.patch_crd.call_count)
+
+    def test_load(self):
+        spec = {'driver': 'NestedVIFPool',
+                'host': '10.0.0.5',
+                'projectId': 'project_id',
+                'networkId': 'net_id',
+                'availablePorts': [
+                    {'id': 'p1', 'securityGroups': ['sg1'],
+                     'vif': self.vifs['p1'].obj_to_primitive()}],
+                'recyclablePorts': []}
+        other_spec = dict(spec, driver='NeutronVIFPool')
+        self.k8s.get.return_value = {'items': [{'spec': spec},
+                                               {'spec': other_spec}]}
+
+        self.assertEqual({self.pool_key: spec}, self.checkpoint.load())
+        self.k8s.get.assert_called_once_with(
+            constants.K8S_API_CRD_KURYRPOOLS)
+
+        # The loaded pools are only written once they change
+        pools = get_pools({self.pool_key: {('sg1',): ['p1']}})
+        self.checkpoint.write(pools, {}, self.vifs)
+        self.k8s.patch_crd.assert_not_called()
+
+    def test_load_not_owned(self):
+        spec = {'driver': 'NestedVIFPool',
+                'host': '10.0.0.5',
+                'projectId': 'project_id',
+                'networkId': 'net_id',
+                'availablePorts': [],
+                'recyclablePorts': []}
+        owned_spec = dict(spec, host='10.0.0.6')
+        self.k8s.get.return_value = {'items': [{'spec': spec},
+                                               {'spec': owned_spec}]}
+
+        pools = self.checkpoint.load(lambda host: host == '10.0.0.6')
+
+        self.assertEqual({('10.0.0.6', 'project_id', 'net_id'): owned_spec},
+                         pools)
+
+
+class TestPoolDemand(test_base.TestCase):
+
+    def test_forecast(self):
+        demand = vif_pool.PoolDemand(100, 0)
+        for t in range(0, 100, 10):
+            demand.add(t, None, None, None)
+
+        # 10 requests over 100 seconds and 2 over the last 20 ones
+        self.assertEqual(2, demand.forecast(100, 20))
+        # Only the requests of the last 100 seconds are taken into account
+        self.assertEqual(1, demand.forecast(150, 20))
+        self.assertEqual(0, demand.forecast(200, 20))
+
+    def test_forecast_burst(self):
+        demand = vif_pool.PoolDemand(300, 0)
+        for _ in range(30):
+            demand.add(295, None, None, None)
+
+        self.assertEqual(30, demand.forecast(300, 20))
+
+    def test_is_idle(self):
+        demand = vif_pool.PoolDemand(300, 0)
+        demand.add(100, None, None, None)
+
+        self.assertFalse(demand.is_idle(200, 600))
+        self.assertTrue(demand.is_idle(700, 600))
+        self.assertFalse(demand.is_idle(700, 0))
+
+
+class TestPortsPool(test_base.TestCase):
+
+    def test_add_pop(self):
+        pool = vif_pool.PortsPool()
+        pool.add('p1', ('sg1',))
+        pool.add('p2', ('sg1',))
+        pool.add('p3', ('sg2',))
+
+        self.assertEqual(3, len(pool))
+        self.assertIn('p1', pool)
+        self.assertEqual('p2', pool.pop(('sg1',)))
+        self.assertEqual('p1', pool.pop(('sg1',)))
+        self.assertRaises(KeyError, pool.pop, ('sg1',))
+        self.assertEqual([(('sg2',), ['p3'])], pool.items())
+        self.assertEqual(1, len(pool))
+
+    def test_pop_lru(self):
+        pool = vif_pool.PortsPool()
+        pool.add('p1', ('sg1',))
+        pool.add('p2', ('sg2',))
+        pool.add('p3', ('sg1',))
+        pool.add('p4', ('sg3',), last=False)
+
+        self.assertEqual(('p4', ('sg3',)), pool.pop_lru())
+        # sg1 was updated after sg2
+        self.assertEqual(('p2', ('sg2',)), pool.pop_lru())
+        self.assertEqual(('p3', ('sg1',)), pool.pop_lru())
+        self.assertEqual(('p1', ('sg1',)), pool.pop_lru())
+        self.assertRaises(KeyError, pool.pop_lru)
+
+    def test_pop_lru_exclude(self):
+        pool = vif_pool.PortsPool()
+        pool.add('p1', ('sg1',))
+        pool.add('p2', ('sg2',))
+
+        self.assertEqual(('p2', ('sg2',)), pool.pop_lru(exclude=[('sg1',)]))
+        self.assertRaises(KeyError, pool.pop_lru, exclude=[('sg1',)])
+        self.assertEqual(1, pool.count(('sg1',)))
+        self.assertEqual(0, pool.count(('sg2',)))
+
+    def test_remove(self):
+        pool = vif_pool.PortsPool()
+        pool.add('p1', ('sg1',))
+        pool.add('p2', ('sg2',))
+        pool.add('p2', ('sg1',))
+
+        pool.remove('p1')
+
+        self.assertEqual([(('sg1',), ['p2'])], pool.items())
+        self.assertRaises(KeyError, pool.remove, 'p1')
+        self.assertEqual(['p2'], list(pool))
+
+    def test_pop_group(self):
+        pool = vif_pool.PortsPool()
+        pool.add('p1', ('sg1',))
+        pool.add('p2', ('sg1',))
+        pool.add('p3', ('sg2',))
+
+        self.assertEqual(['p1', 'p2'], pool.pop_group(('sg1',)))
+        self.assertEqual([], pool.pop_group(('sg1',)))
+        self.assertEqual(['p3'], list(pool))
+
+    @mock.patch('eventlet.spawn')
+    def test_benchmark(self, m_eventlet):
+        """Measures the pool operations/s with 10k ports in 1k pools"""
+        self.useFixture(k_fix.MockNetworkClient())
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._get_pool_size = functools.partial(cls._get_pool_size,
+                                                    m_driver)
+        oslo_cfg.CONF.set_override('ports_pool_min', 0, group='vif_pool')
+        pod = get_pod_obj()
+        num_pools = 1000
+        pool_keys = [('node%d' % i, 'project_id', 'net_id')
+                     for i in range(num_pools)]
+        pools = {}
+        for pool_key in pool_keys:
+            pools[pool_key] = {('sg%d' % i,): ['%s-%d-%d' % (pool_key[0], i, j)
+                                               for j in range(2)]
+                               for i in range(5)}
+        m_driver._available_ports_pools = get_pools(pools)
+        m_driver._existing_vifs = {port_id: port_id
+                                   for pool in pools.values()
+                                   for ports in pool.values()
+                                   for port_id in ports}
+        self.assertEqual(10000, len(m_driver._existing_vifs))
+        m_driver._port_sgs = {}
+
+        start = time.time()
+        for pool_key in pool_keys:
+            for _ in range(10):
+                # Half of the requests reuse ports of other SGs
+                for sgs in (('sg0',), ('sg-new',)):
+                    port_id = cls._get_port_from_pool(m_driver, pool_key, pod,
+                                                      None, sgs)
+                    m_driver._available_ports_pools[pool_key].add(port_id,
+                                                                  sgs)
+                    cls._get_pool_size(m_driver, pool_key)
+        elapsed = max(time.time() - start, 1e-6)
+
+        self.assertEqual(10000, sum(
+            len(pool) for pool in m_driver._available_ports_pools.values()))
+        self.addDetail('pool_requests_per_second', content.text_content(
+            '%d requests/s' % (num_pools * 20 / elapsed)))
+
 
 @ddt.ddt
 class NeutronVIFPool(test_base.TestCase):
@@ -464,9 +1376,10 @@ class NeutronVIFPool(test_base.TestCase):
 
         pod = get_pod_obj()
 
-        m_driver._available_ports_pools = {
-            pool_key: {tuple(security_groups): collections.deque([port_id])}}
+        m_driver._available_ports_pools = get_pools({
+            pool_key: {tuple(security_groups): [port_id]}})
         m_driver._existing_vifs = {port_id: port}
+        m_driver._port_sgs = {}
         m_get_port_name.return_value = get_pod_name(pod)
 
         oslo_cfg.CONF.set_override('ports_pool_min',
@@ -505,9 +1418,10 @@ class NeutronVIFPool(test_base.TestCase):
 
         pod = get_pod_obj()
 
-        m_driver._available_ports_pools = {
-            pool_key: {tuple(security_groups): collections.deque([port_id])}}
+        m_driver._available_ports_pools = get_pools({
+            pool_key: {tuple(security_groups): [port_id]}})
         m_driver._existing_vifs = {port_id: port}
+        m_driver._port_sgs = {}
         m_get_port_name.return_value = get_pod_name(pod)
 
         oslo_cfg.CONF.set_override('ports_pool_min',
@@ -537,8 +1451,8 @@ class NeutronVIFPool(test_base.TestCase):
         subnets = mock.sentinel.subnets
         security_groups = 'test-sg'
 
-        m_driver._available_ports_pools = {
-            pool_key: {tuple(security_groups): collections.deque([])}}
+        m_driver._available_ports_pools = get_pools({
+            pool_key: {tuple(security_groups): []}})
         m_driver._last_update = {pool_key: {tuple(security_groups): 1}}
 
         self.assertRaises(exceptions.ResourceNotReady, cls._get_port_from_pool,
@@ -568,12 +1482,13 @@ class NeutronVIFPool(test_base.TestCase):
         pool_length = 5
         m_driver._get_pool_size.return_value = pool_length
 
-        m_driver._available_ports_pools = {
-            pool_key: {tuple(security_groups): collections.deque([]),
-                       tuple(security_groups_2): collections.deque([port_id])}}
+        m_driver._available_ports_pools = get_pools({
+            pool_key: {tuple(security_groups): [],
+                       tuple(security_groups_2): [port_id]}})
         m_driver._last_update = {pool_key: {tuple(security_groups): 1,
                                             tuple(security_groups_2): 0}}
         m_driver._existing_vifs = {port_id: port}
+        m_driver._port_sgs = {}
 
         self.assertEqual(port, cls._get_port_from_pool(
             m_driver, pool_key, pod, subnets, tuple(security_groups)))
@@ -581,6 +1496,8 @@ class NeutronVIFPool(test_base.TestCase):
         os_net.update_port.assert_called_once_with(
             port_id, security_groups=list(security_groups))
         m_eventlet.assert_not_called()
+        self.assertEqual({port_id: tuple(security_groups)},
+                         m_driver._port_sgs)
 
     @mock.patch('eventlet.spawn')
     def test__get_port_from_pool_empty_pool_reuse_no_update_info(self,
@@ -604,11 +1521,12 @@ class NeutronVIFPool(test_base.TestCase):
         pool_length = 5
         m_driver._get_pool_size.return_value = pool_length
 
-        m_driver._available_ports_pools = {
-            pool_key: {tuple(security_groups): collections.deque([]),
-                       tuple(security_groups_2): collections.deque([port_id])}}
+        m_driver._available_ports_pools = get_pools({
+            pool_key: {tuple(security_groups): [],
+                       tuple(security_groups_2): [port_id]}})
         m_driver._last_update = {}
         m_driver._existing_vifs = {port_id: port}
+        m_driver._port_sgs = {}
 
         self.assertEqual(port, cls._get_port_from_pool(
             m_driver, pool_key, pod, subnets, tuple(security_groups)))
@@ -616,6 +1534,8 @@ class NeutronVIFPool(test_base.TestCase):
         os_net.update_port.assert_called_once_with(
             port_id, security_groups=list(security_groups))
         m_eventlet.assert_not_called()
+        self.assertEqual({port_id: tuple(security_groups)},
+                         m_driver._port_sgs)
 
     def test__get_port_from_pool_empty_pool_reuse_no_ports(self):
         cls = vif_pool.NeutronVIFPool
@@ -637,11 +1557,12 @@ class NeutronVIFPool(test_base.TestCase):
         pool_length = 5
         m_driver._get_pool_size.return_value = pool_length
 
-        m_driver._available_ports_pools = {
-            pool_key: {tuple(security_groups): collections.deque([]),
-                       tuple(security_groups_2): collections.deque([])}}
+        m_driver._available_ports_pools = get_pools({
+            pool_key: {tuple(security_groups): [],
+                       tuple(security_groups_2): []}})
         m_driver._last_update = {}
         m_driver._existing_vifs = {port_id: port}
+        m_driver._port_sgs = {}
 
         self.assertRaises(exceptions.ResourceNotReady, cls._get_port_from_pool,
                           m_driver, pool_key, pod, subnets, tuple(
@@ -661,7 +1582,8 @@ class NeutronVIFPool(test_base.TestCase):
         pool_length = 5
 
         m_driver._recyclable_ports = {port_id: pool_key}
-        m_driver._available_ports_pools = {}
+        m_driver._port_sgs = {}
+        m_driver._available_ports_pools = get_pools()
         oslo_cfg.CONF.set_override('ports_pool_max',
                                    max_pool,
                                    group='vif_pool')
@@ -691,7 +1613,8 @@ class NeutronVIFPool(test_base.TestCase):
         pool_length = 5
 
         m_driver._recyclable_ports = {port_id: pool_key}
-        m_driver._available_ports_pools = {}
+        m_driver._port_sgs = {}
+        m_driver._available_ports_pools = get_pools()
         oslo_cfg.CONF.set_override('ports_pool_max',
                                    max_pool,
                                    group='vif_pool')
@@ -721,7 +1644,8 @@ class NeutronVIFPool(test_base.TestCase):
         vif = mock.sentinel.vif
 
         m_driver._recyclable_ports = {port_id: pool_key}
-        m_driver._available_ports_pools = {}
+        m_driver._port_sgs = {}
+        m_driver._available_ports_pools = get_pools()
         m_driver._existing_vifs = {port_id: vif}
         oslo_cfg.CONF.set_override('ports_pool_max',
                                    10,
@@ -747,7 +1671,8 @@ class NeutronVIFPool(test_base.TestCase):
         pool_length = 5
 
         m_driver._recyclable_ports = {port_id: pool_key}
-        m_driver._available_ports_pools = {}
+        m_driver._port_sgs = {}
+        m_driver._available_ports_pools = get_pools()
         oslo_cfg.CONF.set_override('ports_pool_max',
                                    0,
                                    group='vif_pool')
@@ -781,7 +1706,8 @@ class NeutronVIFPool(test_base.TestCase):
         vif = mock.sentinel.vif
 
         m_driver._recyclable_ports = {port_id: pool_key}
-        m_driver._available_ports_pools = {}
+        m_driver._port_sgs = {}
+        m_driver._available_ports_pools = get_pools()
         m_driver._existing_vifs = {port_id: vif}
         oslo_cfg.CONF.set_override('ports_pool_max',
                                    5,
@@ -807,7 +1733,8 @@ class NeutronVIFPool(test_base.TestCase):
         pool_length = 10
 
         m_driver._recyclable_ports = {port_id: pool_key}
-        m_driver._available_ports_pools = {}
+        m_driver._port_sgs = {}
+        m_driver._available_ports_pools = get_pools()
         m_driver._existing_vifs = {}
         oslo_cfg.CONF.set_override('ports_pool_max',
                                    5,
@@ -834,7 +1761,7 @@ class NeutronVIFPool(test_base.TestCase):
         m_driver._drv_vif = vif_driver
 
         m_driver._existing_vifs = {}
-        m_driver._available_ports_pools = {}
+        m_driver._available_ports_pools = get_pools()
 
         port_id = str(uuid.uuid4())
         port = fake.get_port_obj(port_id=port_id)
@@ -870,9 +1797,61 @@ class NeutronVIFPool(test_base.TestCase):
         m_to_osvif.assert_called_once_with(vif_plugin, port, subnet)
 
         self.assertEqual(m_driver._existing_vifs[port_id], vif)
-        self.assertEqual(m_driver._available_ports_pools[pool_key],
+        self.assertEqual(dict(
+                         m_driver._available_ports_pools[pool_key].items()),
                          {tuple(port.security_group_ids): [port_id]})
 
+    @mock.patch('kuryr_kubernetes.os_vif_util.neutron_to_osvif_vif')
+    @mock.patch('kuryr_kubernetes.utils.get_subnet')
+    def test__recover_precreated_ports_not_owned(self, m_get_subnet,
+                                                 m_to_osvif):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        os_net = self.useFixture(k_fix.MockNetworkClient()).client
+        m_driver._existing_vifs = {}
+        m_driver._available_ports_pools = get_pools()
+        m_driver._is_owned_host.return_value = False
+        m_driver._get_trunks_info.return_value = ({}, {}, {})
+        port = fake.get_port_obj(port_id=str(uuid.uuid4()))
+        port.binding_vif_type = mock.sentinel.plugin
+        os_net.ports.return_value = [port]
+        oslo_cfg.CONF.set_override('port_debug',
+                                   False,
+                                   group='kubernetes')
+
+        cls._recover_precreated_ports(m_driver)
+
+        m_driver._is_owned_host.assert_called_once_with(
+            port.binding_host_id)
+        m_to_osvif.assert_not_called()
+        os_net.delete_port.assert_not_called()
+        self.assertEqual({}, m_driver._available_ports_pools)
+
+    @mock.patch('kuryr_kubernetes.os_vif_util.neutron_to_osvif_vif')
+    @mock.patch('kuryr_kubernetes.utils.get_subnet')
+    def test__recover_precreated_ports_host_filter(self, m_get_subnet,
+                                                   m_to_osvif):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        os_net = self.useFixture(k_fix.MockNetworkClient()).client
+        m_driver._existing_vifs = {}
+        m_driver._available_ports_pools = get_pools()
+        m_driver._get_trunks_info.return_value = ({}, {}, {})
+        port = fake.get_port_obj(port_id=str(uuid.uuid4()))
+        port.binding_vif_type = mock.sentinel.plugin
+        os_net.ports.return_value = [port]
+        host_filter = mock.Mock(return_value=False)
+        oslo_cfg.CONF.set_override('port_debug',
+                                   False,
+                                   group='kubernetes')
+
+        cls._recover_precreated_ports(m_driver, host_filter)
+
+        host_filter.assert_called_once_with(port.binding_host_id)
+        m_driver._is_owned_host.assert_not_called()
+        m_to_osvif.assert_not_called()
+        self.assertEqual({}, m_driver._available_ports_pools)
+
     @mock.patch('kuryr_kubernetes.os_vif_util.neutron_to_osvif_vif')
     @mock.patch('kuryr_kubernetes.utils.get_subnet')
     def test__recover_precreated_ports_empty(self, m_get_subnet, m_to_osvif):
@@ -903,8 +1882,8 @@ class NeutronVIFPool(test_base.TestCase):
         net_id = mock.sentinel.net_id
         pool_key = ('node_ip', 'project_id')
         port_id = str(uuid.uuid4())
-        m_driver._available_ports_pools = {pool_key: {
-            tuple(['security_group']): [port_id]}}
+        m_driver._available_ports_pools = get_pools({pool_key: {
+            tuple(['security_group']): [port_id]}})
         m_driver._existing_vifs = {port_id: mock.sentinel.vif}
         m_driver._recovered_pools = True
 
@@ -940,8 +1919,8 @@ class NeutronVIFPool(test_base.TestCase):
         net_id = mock.sentinel.net_id
         pool_key = ('node_ip', 'project_id')
         port_id = str(uuid.uuid4())
-        m_driver._available_ports_pools = {pool_key: {
-            tuple(['security_group']): [port_id]}}
+        m_driver._available_ports_pools = get_pools({pool_key: {
+            tuple(['security_group']): [port_id]}})
         m_driver._existing_vifs = {}
         m_driver._recovered_pools = True
 
@@ -953,6 +1932,19 @@ class NeutronVIFPool(test_base.TestCase):
         m_driver._get_pool_key_net.assert_called_once()
         os_net.delete_port.assert_called_once_with(port_id)
 
+    def test__delete_pool_ports(self):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._existing_vifs = {'p1': mock.sentinel.vif1,
+                                   'p2': mock.sentinel.vif2}
+        m_driver._delete_ports.return_value = ['p2']
+
+        failed = cls._delete_pool_ports(m_driver, 'pool_key', ['p1', 'p2'])
+
+        self.assertEqual(['p2'], failed)
+        m_driver._delete_ports.assert_called_once_with(['p1', 'p2'])
+        self.assertEqual({'p2': mock.sentinel.vif2}, m_driver._existing_vifs)
+
 
 @ddt.ddt
 class NestedVIFPool(test_base.TestCase):
@@ -1008,9 +2000,10 @@ class NestedVIFPool(test_base.TestCase):
 
         pod = get_pod_obj()
 
-        m_driver._available_ports_pools = {
-            pool_key: {tuple(security_groups): collections.deque([port_id])}}
+        m_driver._available_ports_pools = get_pools({
+            pool_key: {tuple(security_groups): [port_id]}})
         m_driver._existing_vifs = {port_id: port}
+        m_driver._port_sgs = {}
         m_get_port_name.return_value = get_pod_name(pod)
 
         oslo_cfg.CONF.set_override('ports_pool_min',
@@ -1046,9 +2039,10 @@ class NestedVIFPool(test_base.TestCase):
 
         pod = get_pod_obj()
 
-        m_driver._available_ports_pools = {
-            pool_key: {tuple(security_groups): collections.deque([port_id])}}
+        m_driver._available_ports_pools = get_pools({
+            pool_key: {tuple(security_groups): [port_id]}})
         m_driver._existing_vifs = {port_id: port}
+        m_driver._port_sgs = {}
         m_get_port_name.return_value = get_pod_name(pod)
 
         oslo_cfg.CONF.set_override('ports_pool_min',
@@ -1078,8 +2072,8 @@ class NestedVIFPool(test_base.TestCase):
         subnets = mock.sentinel.subnets
         security_groups = 'test-sg'
 
-        m_driver._available_ports_pools = {
-            pool_key: {tuple(security_groups): collections.deque([])}}
+        m_driver._available_ports_pools = get_pools({
+            pool_key: {tuple(security_groups): []}})
         m_driver._last_update = {pool_key: {tuple(security_groups): 1}}
 
         self.assertRaises(exceptions.ResourceNotReady, cls._get_port_from_pool,
@@ -1109,12 +2103,13 @@ class NestedVIFPool(test_base.TestCase):
         pool_length = 5
         m_driver._get_pool_size.return_value = pool_length
 
-        m_driver._available_ports_pools = {
-            pool_key: {tuple(security_groups): collections.deque([]),
-                       tuple(security_groups_2): collections.deque([port_id])}}
+        m_driver._available_ports_pools = get_pools({
+            pool_key: {tuple(security_groups): [],
+                       tuple(security_groups_2): [port_id]}})
         m_driver._last_update = {pool_key: {tuple(security_groups): 1,
                                             tuple(security_groups_2): 0}}
         m_driver._existing_vifs = {port_id: port}
+        m_driver._port_sgs = {}
 
         self.assertEqual(port, cls._get_port_from_pool(
             m_driver, pool_key, pod, subnets, tuple(security_groups)))
@@ -1122,6 +2117,8 @@ class NestedVIFPool(test_base.TestCase):
         os_net.update_port.assert_called_once_with(
             port_id, security_groups=list(security_groups))
         m_eventlet.assert_not_called()
+        self.assertEqual({port_id: tuple(security_groups)},
+                         m_driver._port_sgs)
 
     @mock.patch('eventlet.spawn')
     def test__get_port_from_pool_empty_pool_reuse_no_update_info(self,
@@ -1145,11 +2142,12 @@ class NestedVIFPool(test_base.TestCase):
         pool_length = 5
         m_driver._get_pool_size.return_value = pool_length
 
-        m_driver._available_ports_pools = {
-            pool_key: {tuple(security_groups): collections.deque([]),
-                       tuple(security_groups_2): collections.deque([port_id])}}
+        m_driver._available_ports_pools = get_pools({
+            pool_key: {tuple(security_groups): [],
+                       tuple(security_groups_2): [port_id]}})
         m_driver._last_update = {}
         m_driver._existing_vifs = {port_id: port}
+        m_driver._port_sgs = {}
 
         self.assertEqual(port, cls._get_port_from_pool(
             m_driver, pool_key, pod, subnets, tuple(security_groups)))
@@ -1157,6 +2155,8 @@ class NestedVIFPool(test_base.TestCase):
         os_net.update_port.assert_called_once_with(
             port_id, security_groups=list(security_groups))
         m_eventlet.assert_not_called()
+        self.assertEqual({port_id: tuple(security_groups)},
+                         m_driver._port_sgs)
 
     def test__get_port_from_pool_empty_pool_reuse_no_ports(self):
         cls = vif_pool.NestedVIFPool
@@ -1178,11 +2178,12 @@ class NestedVIFPool(test_base.TestCase):
         pool_length = 5
         m_driver._get_pool_size.return_value = pool_length
 
-        m_driver._available_ports_pools = {
-            pool_key: {tuple(security_groups): collections.deque([]),
-                       tuple(security_groups_2): collections.deque([])}}
+        m_driver._available_ports_pools = get_pools({
+            pool_key: {tuple(security_groups): [],
+                       tuple(security_groups_2): []}})
         m_driver._last_update = {}
         m_driver._existing_vifs = {port_id: port}
+        m_driver._port_sgs = {}
 
         self.assertRaises(exceptions.ResourceNotReady, cls._get_port_from_pool,
                           m_driver, pool_key, pod, subnets, tuple(
@@ -1202,7 +2203,8 @@ class NestedVIFPool(test_base.TestCase):
         pool_length = 5
 
         m_driver._recyclable_ports = {port_id: pool_key}
-        m_driver._available_ports_pools = {}
+        m_driver._port_sgs = {}
+        m_driver._available_ports_pools = get_pools()
         oslo_cfg.CONF.set_override('ports_pool_max',
                                    max_pool,
                                    group='vif_pool')
@@ -1233,7 +2235,8 @@ class NestedVIFPool(test_base.TestCase):
         pool_length = 5
 
         m_driver._recyclable_ports = {port_id: pool_key}
-        m_driver._available_ports_pools = {}
+        m_driver._port_sgs = {}
+        m_driver._available_ports_pools = get_pools()
         oslo_cfg.CONF.set_override('ports_pool_max',
                                    max_pool,
                                    group='vif_pool')
@@ -1256,20 +2259,13 @@ class NestedVIFPool(test_base.TestCase):
 
         os_net = self.useFixture(k_fix.MockNetworkClient()).client
 
-        cls_vif_driver = nested_vlan_vif.NestedVlanPodVIFDriver
-        vif_driver = mock.MagicMock(spec=cls_vif_driver)
-        m_driver._drv_vif = vif_driver
-
         pool_key = ('node_ip', 'project_id')
         port_id = str(uuid.uuid4())
         pool_length = 10
-        vif = mock.MagicMock()
-        vif.vlan_id = mock.sentinel.vlan_id
-        trunk_id = str(uuid.uuid4())
 
         m_driver._recyclable_ports = {port_id: pool_key}
-        m_driver._available_ports_pools = {}
-        m_driver._existing_vifs = {port_id: vif}
+        m_driver._port_sgs = {port_id: ('sg1',)}
+        m_driver._available_ports_pools = get_pools()
         oslo_cfg.CONF.set_override('ports_pool_max',
                                    10,
                                    group='vif_pool')
@@ -1277,16 +2273,15 @@ class NestedVIFPool(test_base.TestCase):
         port.security_group_ids = ['security_group_modified']
         os_net.ports.return_value = [port]
         m_driver._get_pool_size.return_value = pool_length
-        m_driver._get_trunk_id.return_value = trunk_id
-        m_driver._known_trunk_ids = {}
+        m_driver._delete_pool_ports.return_value = []
 
         cls._trigger_return_to_pool(m_driver)
 
         os_net.update_port.assert_not_called()
-        os_net.delete_port.assert_called_once_with(port_id)
-        m_driver._get_trunk_id.assert_called_once()
-        m_driver._drv_vif._remove_subport.assert_called_once_with(trunk_id,
-                                                                  port_id)
+        m_driver._delete_pool_ports.assert_called_once_with(pool_key,
+                                                            [port_id])
+        self.assertEqual({}, m_driver._recyclable_ports)
+        self.assertEqual({}, m_driver._port_sgs)
 
     def test__trigger_return_to_pool_update_exception(self):
         cls = vif_pool.NestedVIFPool
@@ -1299,7 +2294,8 @@ class NestedVIFPool(test_base.TestCase):
         pool_length = 5
 
         m_driver._recyclable_ports = {port_id: pool_key}
-        m_driver._available_ports_pools = {}
+        m_driver._port_sgs = {}
+        m_driver._available_ports_pools = get_pools()
         oslo_cfg.CONF.set_override('ports_pool_max',
                                    0,
                                    group='vif_pool')
@@ -1322,20 +2318,14 @@ class NestedVIFPool(test_base.TestCase):
         cls = vif_pool.NestedVIFPool
         m_driver = mock.MagicMock(spec=cls)
         os_net = self.useFixture(k_fix.MockNetworkClient()).client
-        cls_vif_driver = nested_vlan_vif.NestedVlanPodVIFDriver
-        vif_driver = mock.MagicMock(spec=cls_vif_driver)
-        m_driver._drv_vif = vif_driver
 
         pool_key = ('node_ip', 'project_id')
         port_id = str(uuid.uuid4())
         pool_length = 10
-        vif = mock.MagicMock()
-        vif.vlan_id = mock.sentinel.vlan_id
-        trunk_id = str(uuid.uuid4())
 
         m_driver._recyclable_ports = {port_id: pool_key}
-        m_driver._available_ports_pools = {}
-        m_driver._existing_vifs = {port_id: vif}
+        m_driver._port_sgs = {}
+        m_driver._available_ports_pools = get_pools()
         oslo_cfg.CONF.set_override('ports_pool_max',
                                    5,
                                    group='vif_pool')
@@ -1343,50 +2333,78 @@ class NestedVIFPool(test_base.TestCase):
         port.security_group_ids = ['security_group_modified']
         os_net.ports.return_value = [port]
         m_driver._get_pool_size.return_value = pool_length
-        m_driver._get_trunk_id.return_value = trunk_id
-        m_driver._known_trunk_ids = {}
+        m_driver._delete_pool_ports.return_value = [port_id]
 
         cls._trigger_return_to_pool(m_driver)
 
         os_net.update_port.assert_not_called()
-        m_driver._get_trunk_id.assert_called_once()
-        m_driver._drv_vif._remove_subport.assert_called_once_with(trunk_id,
-                                                                  port_id)
-        os_net.delete_port.assert_called_once_with(port_id)
+        m_driver._delete_pool_ports.assert_called_once_with(pool_key,
+                                                            [port_id])
+        # The port is retried on the next pass
+        self.assertEqual({port_id: pool_key}, m_driver._recyclable_ports)
 
-    def test__trigger_return_to_pool_delete_key_error(self):
+    @mock.patch('kuryr_kubernetes.controller.sharding.get_shard_manager')
+    def test__get_host_shard_key(self, m_get_shard_manager):
         cls = vif_pool.NestedVIFPool
         m_driver = mock.MagicMock(spec=cls)
-        os_net = self.useFixture(k_fix.MockNetworkClient()).client
-        cls_vif_driver = nested_vlan_vif.NestedVlanPodVIFDriver
-        vif_driver = mock.MagicMock(spec=cls_vif_driver)
+        shard_manager = m_get_shard_manager.return_value
+        shard_manager.get_node_name.return_value = 'node1'
+
+        self.assertEqual('node1',
+                         cls._get_host_shard_key(m_driver, '10.0.0.1'))
+        shard_manager.get_node_name.assert_called_once_with('10.0.0.1')
+
+    def test_populate_pool_not_owned(self):
+        cls = vif_pool.NestedVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._recovered_pools = True
+        m_driver._is_owned_host.return_value = False
+
+        cls.populate_pool(m_driver, '10.0.0.1', 'project', {}, ['sg1'])
+
+        m_driver._is_owned_host.assert_called_once_with('10.0.0.1')
+        m_driver.force_populate_pool.assert_not_called()
+
+    def test__get_trunk_id(self):
+        cls = vif_pool.NestedVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._known_trunk_ids = {}
+        vif_driver = mock.MagicMock(
+            spec=nested_vlan_vif.NestedVlanPodVIFDriver)
         m_driver._drv_vif = vif_driver
+        pool_key = ('node_ip', 'project', 'net')
+        vif_driver._get_trunk_id.return_value = mock.sentinel.trunk_id
 
-        pool_key = ('node_ip', 'project_id')
-        port_id = str(uuid.uuid4())
-        pool_length = 10
-        trunk_id = str(uuid.uuid4())
+        self.assertEqual(mock.sentinel.trunk_id,
+                         cls._get_trunk_id(m_driver, pool_key))
+        self.assertEqual(mock.sentinel.trunk_id,
+                         cls._get_trunk_id(m_driver, pool_key))
 
-        m_driver._recyclable_ports = {port_id: pool_key}
-        m_driver._available_ports_pools = {}
-        m_driver._existing_vifs = {}
-        oslo_cfg.CONF.set_override('ports_pool_max',
-                                   5,
-                                   group='vif_pool')
-        port = fake.get_port_obj(port_id=port_id)
-        port.security_group_ids = ['security_group_modified']
-        os_net.ports.return_value = [port]
-        m_driver._get_pool_size.return_value = pool_length
+        vif_driver._get_parent_port_by_host_ip.assert_called_once_with(
+            'node_ip')
+        self.assertEqual({pool_key: mock.sentinel.trunk_id},
+                         m_driver._known_trunk_ids)
+
+    def test__get_trunk_id_parent_ports_cache(self):
+        cls = vif_pool.NestedVIFPool
+        m_driver = mock.MagicMock(spec=cls)
         m_driver._known_trunk_ids = {}
-        m_driver._get_trunk_id.return_value = trunk_id
+        vif_driver = mock.MagicMock(
+            spec=nested_vlan_vif.NestedVlanPodVIFDriver)
+        m_driver._drv_vif = vif_driver
+        pool_key = ('node_ip', 'project', 'net')
+        vif_driver._get_trunk_id.return_value = mock.sentinel.trunk_id
+        oslo_cfg.CONF.set_override('enabled_handlers', ['vif', 'node'],
+                                   group='kubernetes')
+        self.addCleanup(oslo_cfg.CONF.clear_override, 'enabled_handlers',
+                        group='kubernetes')
 
-        cls._trigger_return_to_pool(m_driver)
+        self.assertEqual(mock.sentinel.trunk_id,
+                         cls._get_trunk_id(m_driver, pool_key))
 
-        os_net.update_port.assert_not_called()
-        m_driver._get_trunk_id.assert_called_once()
-        m_driver._drv_vif._remove_subport.assert_called_once_with(trunk_id,
-                                                                  port_id)
-        os_net.delete_port.assert_not_called()
+        vif_driver._get_parent_port_by_host_ip.assert_called_once_with(
+            'node_ip')
+        self.assertEqual({}, m_driver._known_trunk_ids)
 
     def test__get_parent_port_ip(self):
         cls = vif_pool.NestedVIFPool
@@ -1479,7 +2497,7 @@ class NestedVIFPool(test_base.TestCase):
 
         os_net = self.useFixture(k_fix.MockNetworkClient()).client
 
-        m_driver._available_ports_pools = {}
+        m_driver._available_ports_pools = get_pools()
         m_driver._existing_vifs = {}
 
         oslo_cfg.CONF.set_override('port_debug',
@@ -1513,10 +2531,37 @@ class NestedVIFPool(test_base.TestCase):
 
         m_driver._get_trunks_info.assert_called_once()
         self.assertEqual(m_driver._existing_vifs[port_id], vif)
-        self.assertEqual(m_driver._available_ports_pools[pool_key],
+        self.assertEqual(dict(
+                         m_driver._available_ports_pools[pool_key].items()),
                          {tuple(port.security_group_ids): [port_id]})
         os_net.delete_port.assert_not_called()
 
+    @mock.patch('kuryr_kubernetes.os_vif_util.'
+                'neutron_to_osvif_vif_nested_vlan')
+    def test__precreated_ports_recover_not_owned(self, m_to_osvif):
+        cls = vif_pool.NestedVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        os_net = self.useFixture(k_fix.MockNetworkClient()).client
+        m_driver._available_ports_pools = get_pools()
+        m_driver._existing_vifs = {}
+        m_driver._is_owned_host.return_value = False
+
+        port_id = str(uuid.uuid4())
+        trunk_id = str(uuid.uuid4())
+        trunk_obj = self._get_trunk_obj(port_id=trunk_id, subport_id=port_id)
+        port = fake.get_port_obj(port_id=port_id, device_owner='trunk:subport')
+        p_ports = self._get_parent_ports([trunk_obj])
+        m_driver._get_trunks_info.return_value = (p_ports, {port_id: port},
+                                                  {})
+
+        cls._precreated_ports(m_driver, 'recover')
+
+        m_driver._is_owned_host.assert_called_once_with('kuryr-devstack')
+        m_to_osvif.assert_not_called()
+        self.assertEqual({}, m_driver._existing_vifs)
+        self.assertEqual({}, m_driver._available_ports_pools)
+        os_net.delete_port.assert_not_called()
+
     @mock.patch('kuryr_kubernetes.os_vif_util.'
                 'neutron_to_osvif_vif_nested_vlan')
     def test__precreated_ports_recover_plus_port_cleanup(self, m_to_osvif):
@@ -1524,7 +2569,7 @@ class NestedVIFPool(test_base.TestCase):
         m_driver = mock.MagicMock(spec=cls)
         os_net = self.useFixture(k_fix.MockNetworkClient()).client
 
-        m_driver._available_ports_pools = {}
+        m_driver._available_ports_pools = get_pools()
         m_driver._existing_vifs = {}
 
         oslo_cfg.CONF.set_override('port_debug',
@@ -1562,17 +2607,15 @@ class NestedVIFPool(test_base.TestCase):
 
         m_driver._get_trunks_info.assert_called_once()
         self.assertEqual(m_driver._existing_vifs[port_id], vif)
-        self.assertEqual(m_driver._available_ports_pools[pool_key],
+        self.assertEqual(dict(
+                         m_driver._available_ports_pools[pool_key].items()),
                          {tuple(port.security_group_ids): [port_id]})
         os_net.delete_port.assert_called_with(port_to_delete_id)
 
     def test__precreated_ports_free(self):
         cls = vif_pool.NestedVIFPool
         m_driver = mock.MagicMock(spec=cls)
-        os_net = self.useFixture(k_fix.MockNetworkClient()).client
-        cls_vif_driver = nested_vlan_vif.NestedVlanPodVIFDriver
-        vif_driver = mock.MagicMock(spec=cls_vif_driver)
-        m_driver._drv_vif = vif_driver
+        self.useFixture(k_fix.MockNetworkClient())
 
         oslo_cfg.CONF.set_override('port_debug',
                                    True,
@@ -1599,20 +2642,84 @@ class NestedVIFPool(test_base.TestCase):
 
         pool_key = (port.binding_host_id, port.project_id, net_id)
         m_driver._get_pool_key.return_value = pool_key
-        m_driver._available_ports_pools = {
-            pool_key: {tuple(port.security_group_ids): [port_id]}}
-        m_driver._existing_vifs = {port_id: mock.sentinel.vif}
+        m_driver._available_ports_pools = get_pools({
+            pool_key: {tuple(port.security_group_ids): [port_id]}})
+        m_driver._delete_subports.return_value = []
 
-        cls._precreated_ports(m_driver, 'free')
+        freed = cls._precreated_ports(m_driver, 'free')
 
         m_driver._get_trunks_info.assert_called_once()
-        m_driver._drv_vif._remove_subport.assert_called_once()
-        os_net.delete_port.assert_called_once()
-        m_driver._drv_vif._release_vlan_id.assert_called_once()
+        m_driver._delete_subports.assert_called_once_with(
+            trunk_obj['id'], {port_id: 4056})
+        self.assertEqual({'kuryr-devstack': (1, 1)}, freed)
+        self.assertEqual(m_driver._available_ports_pools[pool_key].ports(
+            tuple(port.security_group_ids)), [])
 
-        self.assertEqual(m_driver._existing_vifs, {})
-        self.assertEqual(m_driver._available_ports_pools[pool_key][tuple(
-            port.security_group_ids)], [])
+    def test__precreated_ports_free_detach_error(self):
+        cls = vif_pool.NestedVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        self.useFixture(k_fix.MockNetworkClient())
+
+        port_id = str(uuid.uuid4())
+        trunk_id = str(uuid.uuid4())
+        trunk_obj = self._get_trunk_obj(port_id=trunk_id, subport_id=port_id)
+        port = fake.get_port_obj(port_id=port_id,
+                                 device_owner='trunk:subport')
+        p_ports = self._get_parent_ports([trunk_obj])
+        subnet_id = port.fixed_ips[0]['subnet_id']
+        subnets = {subnet_id: {subnet_id: mock.Mock(id='net_id')}}
+        m_driver._get_trunks_info.return_value = (p_ports, {port_id: port},
+                                                  subnets)
+        pool_key = (port.binding_host_id, port.project_id, 'net_id')
+        m_driver._get_pool_key.return_value = pool_key
+        m_driver._available_ports_pools = get_pools({
+            pool_key: {tuple(port.security_group_ids): [port_id]}})
+        m_driver._delete_subports.return_value = [port_id]
+
+        freed = cls._precreated_ports(m_driver, 'free')
+
+        self.assertEqual({'kuryr-devstack': (0, 1)}, freed)
+        self.assertEqual(m_driver._available_ports_pools[pool_key].ports(
+            tuple(port.security_group_ids)), [port_id])
+
+    def test__precreated_ports_free_progress(self):
+        cls = vif_pool.NestedVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        self.useFixture(k_fix.MockNetworkClient())
+
+        port_id1 = str(uuid.uuid4())
+        port_id2 = str(uuid.uuid4())
+        trunk_obj1 = self._get_trunk_obj(port_id=str(uuid.uuid4()),
+                                         subport_id=port_id1)
+        trunk_obj2 = self._get_trunk_obj(port_id=str(uuid.uuid4()),
+                                         subport_id=port_id2,
+                                         trunk_id=str(uuid.uuid4()))
+        port1 = fake.get_port_obj(port_id=port_id1,
+                                  device_owner='trunk:subport')
+        port2 = fake.get_port_obj(port_id=port_id2,
+                                  device_owner='trunk:subport')
+        p_ports = {
+            trunk_obj1['id']: {'ip': '10.0.0.1',
+                               'subports': trunk_obj1['sub_ports']},
+            trunk_obj2['id']: {'ip': '10.0.0.2',
+                               'subports': trunk_obj2['sub_ports']}}
+        subnet_id = port1.fixed_ips[0]['subnet_id']
+        subnets = {subnet_id: {subnet_id: mock.Mock(id='net_id')}}
+        m_driver._get_trunks_info.return_value = (
+            p_ports, {port_id1: port1, port_id2: port2}, subnets)
+        m_driver._get_pool_key.return_value = (
+            port1.binding_host_id, port1.project_id, 'net_id')
+        m_driver._available_ports_pools = get_pools()
+        m_driver._delete_subports.return_value = []
+        progress = mock.Mock(return_value=False)
+
+        freed = cls._precreated_ports(m_driver, 'free', progress=progress)
+
+        # Freeing stops after the first trunk when progress returns False
+        self.assertEqual(1, len(freed))
+        trunk_ip, (done, total) = list(freed.items())[0]
+        progress.assert_called_once_with(trunk_ip, 1, 1)
+        m_driver._delete_subports.assert_called_once()
 
     @mock.patch('kuryr_kubernetes.os_vif_util.'
                 'neutron_to_osvif_vif_nested_vlan')
@@ -1622,7 +2729,7 @@ class NestedVIFPool(test_base.TestCase):
 
         os_net = self.useFixture(k_fix.MockNetworkClient()).client
 
-        m_driver._available_ports_pools = {}
+        m_driver._available_ports_pools = get_pools()
         m_driver._existing_vifs = {}
 
         oslo_cfg.CONF.set_override('port_debug',
@@ -1677,7 +2784,7 @@ class NestedVIFPool(test_base.TestCase):
 
         os_net = self.useFixture(k_fix.MockNetworkClient()).client
 
-        m_driver._available_ports_pools = {}
+        m_driver._available_ports_pools = get_pools()
         m_driver._existing_vifs = {}
 
         oslo_cfg.CONF.set_override('port_debug',
@@ -1721,7 +2828,8 @@ class NestedVIFPool(test_base.TestCase):
         m_driver._get_trunks_info.assert_called_once()
         self.assertEqual(m_driver._existing_vifs, {port_id1: vif,
                                                    port_id2: vif})
-        self.assertEqual(m_driver._available_ports_pools[pool_key],
+        self.assertEqual(dict(
+                         m_driver._available_ports_pools[pool_key].items()),
                          {tuple(port1.security_group_ids): [port_id1,
                                                             port_id2]})
         os_net.delete_port.assert_not_called()
@@ -1736,7 +2844,7 @@ class NestedVIFPool(test_base.TestCase):
         oslo_cfg.CONF.set_override('port_debug',
                                    True,
                                    group='kubernetes')
-        m_driver._available_ports_pools = {}
+        m_driver._available_ports_pools = get_pools()
         m_driver._existing_vifs = {}
 
         port_id = mock.sentinel.port_id
@@ -1763,7 +2871,7 @@ class NestedVIFPool(test_base.TestCase):
 
         os_net = self.useFixture(k_fix.MockNetworkClient()).client
 
-        m_driver._available_ports_pools = {}
+        m_driver._available_ports_pools = get_pools()
         m_driver._existing_vifs = {}
         oslo_cfg.CONF.set_override('port_debug',
                                    True,
@@ -1789,36 +2897,24 @@ class NestedVIFPool(test_base.TestCase):
     def test_delete_network_pools(self):
         cls = vif_pool.NestedVIFPool
         m_driver = mock.MagicMock(spec=cls)
-        cls_vif_driver = nested_vlan_vif.NestedVlanPodVIFDriver
-        vif_driver = mock.MagicMock(spec=cls_vif_driver)
-        m_driver._drv_vif = vif_driver
-
-        os_net = self.useFixture(k_fix.MockNetworkClient()).client
 
         net_id = mock.sentinel.net_id
         pool_key = ('node_ip', 'project_id')
         port_id = str(uuid.uuid4())
-        trunk_id = str(uuid.uuid4())
-        vif = mock.MagicMock()
-        vlan_id = mock.sentinel.vlan_id
-        vif.vlan_id = vlan_id
-        m_driver._available_ports_pools = {pool_key: {
-            tuple(['security_group']): [port_id]}}
-        m_driver._existing_vifs = {port_id: vif}
+        m_driver._available_ports_pools = get_pools({pool_key: {
+            tuple(['security_group']): [port_id]}})
         m_driver._recovered_pools = True
 
-        m_driver._get_trunk_id.return_value = trunk_id
         m_driver._get_pool_key_net.return_value = net_id
+        m_driver._delete_pool_ports.return_value = []
 
         cls.delete_network_pools(m_driver, net_id)
 
         m_driver._trigger_return_to_pool.assert_called_once()
         m_driver._get_pool_key_net.assert_called_once()
-        m_driver._get_trunk_id.assert_called_once_with(pool_key)
-        m_driver._drv_vif._remove_subports.assert_called_once_with(trunk_id,
-                                                                   [port_id])
-        m_driver._drv_vif._release_vlan_id.assert_called_once_with(vlan_id)
-        os_net.delete_port.assert_called_once_with(port_id)
+        m_driver._delete_pool_ports.assert_called_once_with(pool_key,
+                                                            [port_id])
+        self.assertEqual(0, len(m_driver._available_ports_pools[pool_key]))
 
     def test_delete_network_pools_not_ready(self):
         cls = vif_pool.NestedVIFPool
@@ -1843,68 +2939,73 @@ class NestedVIFPool(test_base.TestCase):
     def test_delete_network_pools_exception(self):
         cls = vif_pool.NestedVIFPool
         m_driver = mock.MagicMock(spec=cls)
-        cls_vif_driver = nested_vlan_vif.NestedVlanPodVIFDriver
-        vif_driver = mock.MagicMock(spec=cls_vif_driver)
-        m_driver._drv_vif = vif_driver
-
-        os_net = self.useFixture(k_fix.MockNetworkClient()).client
 
         net_id = mock.sentinel.net_id
         pool_key = ('node_ip', 'project_id')
-        port_id = str(uuid.uuid4())
-        trunk_id = str(uuid.uuid4())
-        vif = mock.MagicMock()
-        vlan_id = mock.sentinel.vlan_id
-        vif.vlan_id = vlan_id
-        m_driver._available_ports_pools = {pool_key: {
-            tuple(['security_group']): [port_id]}}
-        m_driver._existing_vifs = {port_id: vif}
+        m_driver._available_ports_pools = get_pools({pool_key: {
+            tuple(['security_group']): ['p1', 'p2']}})
         m_driver._recovered_pools = True
 
-        m_driver._get_trunk_id.return_value = trunk_id
         m_driver._get_pool_key_net.return_value = net_id
-        m_driver._drv_vif._remove_subports.side_effect = os_exc.SDKException
+        m_driver._delete_pool_ports.return_value = ['p2']
 
         cls.delete_network_pools(m_driver, net_id)
 
-        m_driver._trigger_return_to_pool.assert_called_once()
-        m_driver._get_pool_key_net.assert_called_once()
-        m_driver._get_trunk_id.assert_called_once_with(pool_key)
-        m_driver._drv_vif._remove_subports.assert_called_once_with(trunk_id,
-                                                                   [port_id])
-        m_driver._drv_vif._release_vlan_id.assert_not_called()
-        os_net.delete_port.assert_not_called()
+        m_driver._delete_pool_ports.assert_called_once_with(pool_key,
+                                                            ['p1', 'p2'])
+        # Only the ports not removed are kept in the pool
+        self.assertEqual([(('security_group',), ['p2'])],
+                         m_driver._available_ports_pools[pool_key].items())
 
-    def test_delete_network_pools_missing_port(self):
+    def test__delete_pool_ports(self):
         cls = vif_pool.NestedVIFPool
         m_driver = mock.MagicMock(spec=cls)
-        cls_vif_driver = nested_vlan_vif.NestedVlanPodVIFDriver
-        vif_driver = mock.MagicMock(spec=cls_vif_driver)
-        m_driver._drv_vif = vif_driver
+        vif = mock.MagicMock()
+        vif.vlan_id = mock.sentinel.vlan_id
+        m_driver._existing_vifs = {'p1': vif}
+        m_driver._get_trunk_id.return_value = mock.sentinel.trunk_id
 
-        os_net = self.useFixture(k_fix.MockNetworkClient()).client
+        failed = cls._delete_pool_ports(m_driver, 'pool_key', ['p1', 'p2'])
 
-        net_id = mock.sentinel.net_id
-        pool_key = ('node_ip', 'project_id')
-        port_id = str(uuid.uuid4())
-        trunk_id = str(uuid.uuid4())
-        vif = mock.MagicMock()
-        vlan_id = mock.sentinel.vlan_id
-        vif.vlan_id = vlan_id
-        m_driver._available_ports_pools = {pool_key: {
-            tuple(['security_group']): [port_id]}}
-        m_driver._existing_vifs = {}
-        m_driver._recovered_pools = True
+        self.assertEqual(m_driver._delete_subports.return_value, failed)
+        m_driver._delete_subports.assert_called_once_with(
+            mock.sentinel.trunk_id,
+            {'p1': mock.sentinel.vlan_id, 'p2': None})
 
-        m_driver._get_trunk_id.return_value = trunk_id
-        m_driver._get_pool_key_net.return_value = net_id
+    def test__delete_pool_ports_trunk_error(self):
+        cls = vif_pool.NestedVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._get_trunk_id.side_effect = os_exc.SDKException
 
-        cls.delete_network_pools(m_driver, net_id)
+        failed = cls._delete_pool_ports(m_driver, 'pool_key', ['p1'])
 
-        m_driver._trigger_return_to_pool.assert_called_once()
-        m_driver._get_pool_key_net.assert_called_once()
-        m_driver._get_trunk_id.assert_called_once_with(pool_key)
-        m_driver._drv_vif._remove_subports.assert_called_once_with(trunk_id,
-                                                                   [port_id])
-        m_driver._drv_vif._release_vlan_id.assert_not_called()
-        os_net.delete_port.assert_called_once_with(port_id)
+        self.assertEqual(['p1'], failed)
+        m_driver._delete_subports.assert_not_called()
+
+    @mock.patch('kuryr_kubernetes.controller.drivers.vif_pool.'
+                'SUBPORTS_DETACH_BATCH', 2)
+    def test__delete_subports(self):
+        cls = vif_pool.NestedVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        vif_driver = mock.MagicMock(
+            spec=nested_vlan_vif.NestedVlanPodVIFDriver)
+        m_driver._drv_vif = vif_driver
+        m_driver._existing_vifs = {'p1': mock.sentinel.vif1,
+                                   'p3': mock.sentinel.vif3}
+        m_driver._ports_to_delete = set()
+        vif_driver._remove_subports.side_effect = [None,
+                                                   os_exc.SDKException]
+        m_driver._delete_ports.return_value = ['p2']
+
+        failed = cls._delete_subports(
+            m_driver, mock.sentinel.trunk_id, {'p1': 1, 'p2': None, 'p3': 3})
+
+        self.assertEqual(['p3'], failed)
+        vif_driver._remove_subports.assert_has_calls([
+            mock.call(mock.sentinel.trunk_id, ['p1', 'p2']),
+            mock.call(mock.sentinel.trunk_id, ['p3'])])
+        vif_driver._release_vlan_id.assert_called_once_with(
+            mock.sentinel.trunk_id, 1)
+        m_driver._delete_ports.assert_called_once_with(['p1', 'p2'])
+        self.assertEqual({'p2'}, m_driver._ports_to_delete)
+        self.assertEqual({'p3': mock.sentinel.vif3}, m_driver._existing_vifs)
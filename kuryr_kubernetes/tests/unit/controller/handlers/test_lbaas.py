@@ -13,12 +13,16 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import functools
 import itertools
 from unittest import mock
 import uuid
 
+import fixtures
 import os_vif.objects.network as osv_network
 import os_vif.objects.subnet as osv_subnet
+from oslo_config import cfg as oslo_cfg
+from oslo_serialization import jsonutils
 
 from kuryr_kubernetes import constants as k_const
 from kuryr_kubernetes.controller.drivers import base as drv_base
@@ -26,6 +30,7 @@ from kuryr_kubernetes.controller.handlers import lbaas as h_lbaas
 from kuryr_kubernetes import exceptions as k_exc
 from kuryr_kubernetes.objects import lbaas as obj_lbaas
 from kuryr_kubernetes.tests import base as test_base
+from kuryr_kubernetes.tests.unit import kuryr_fixtures as k_fix
 
 _SUPPORTED_LISTENER_PROT = ('HTTP', 'HTTPS', 'TCP')
 
@@ -338,6 +343,31 @@ class FakeLBaaSDriver(drv_base.LBaaSDriver):
                                      port=port,
                                      id=str(uuid.uuid4()))
 
+    def update_members(self, loadbalancer, pool, members, new_members):
+        return members + [
+            self.ensure_member(loadbalancer, pool, **member_args)
+            for member_args in new_members]
+
+    def create_loadbalancer_graph(self, name, project_id, subnet_id, ip,
+                                  listeners, security_groups_ids,
+                                  service_type, provider=None):
+        lb = self.ensure_loadbalancer(name, project_id, subnet_id, ip,
+                                      security_groups_ids, service_type,
+                                      provider)
+        state = obj_lbaas.LBaaSState(loadbalancer=lb)
+        for listener_args in listeners:
+            listener = self.ensure_listener(lb, listener_args['protocol'],
+                                            listener_args['port'])
+            if listener is None:
+                return None
+            pool = self.ensure_pool(lb, listener)
+            state.listeners.append(listener)
+            state.pools.append(pool)
+            state.members.extend(
+                self.ensure_member(lb, pool, **member_args)
+                for member_args in listener_args['members'])
+        return state
+
     def release_loadbalancer(self, loadbalancer):
         pass
 
@@ -508,6 +538,8 @@ class TestLoadBalancerHandler(test_base.TestCase):
         m_handler._should_ignore.return_value = False
         m_get_lbaas_state.return_value = lbaas_state
         m_handler._sync_lbaas_members = self._fake_sync_lbaas_members
+        m_handler._sync_lbaas_pub_ip.side_effect = functools.partial(
+            h_lbaas.LoadBalancerHandler._sync_lbaas_pub_ip, m_handler)
         m_handler._drv_service_pub_ip = m_drv_service_pub_ip
 
         h_lbaas.LoadBalancerHandler.on_present(m_handler, endpoints)
@@ -858,6 +890,212 @@ class TestLoadBalancerHandler(test_base.TestCase):
         self.assertEqual(expected_ip, str(state.loadbalancer.ip))
         m_drv_lbaas.release_pool.assert_called_once()
 
+    @mock.patch('kuryr_kubernetes.controller.handlers.lbaas'
+                '.LoadBalancerHandler._cleanup_leftover_lbaas')
+    @mock.patch('kuryr_kubernetes.controller.handlers.lbaas.'
+                'LoadBalancerHandler._sync_lbaas_sgs')
+    @mock.patch('kuryr_kubernetes.controller.drivers.base.'
+                'ServiceSecurityGroupsDriver.get_instance')
+    @mock.patch('kuryr_kubernetes.controller.drivers.base.'
+                'ServiceProjectDriver.get_instance')
+    @mock.patch('kuryr_kubernetes.controller.drivers.base'
+                '.ServicePubIpDriver.get_instance')
+    @mock.patch('kuryr_kubernetes.controller.drivers.base'
+                '.PodSubnetsDriver.get_instance')
+    @mock.patch('kuryr_kubernetes.controller.drivers.base'
+                '.PodProjectDriver.get_instance')
+    @mock.patch('kuryr_kubernetes.controller.drivers.base'
+                '.LBaaSDriver.get_instance')
+    def _sync_lbaas_members_batch_impl(self, current_targets,
+                                       expected_targets, m_get_drv_lbaas,
+                                       *args):
+        oslo_cfg.CONF.set_override('batch_member_updates', True,
+                                   group='octavia_defaults')
+        self.addCleanup(oslo_cfg.CONF.clear_override, 'batch_member_updates',
+                        group='octavia_defaults')
+        project_id = str(uuid.uuid4())
+        subnet_id = str(uuid.uuid4())
+        endpoints = self._generate_endpoints(expected_targets)
+        state = self._generate_lbaas_state(
+            '1.1.1.1', current_targets, project_id, subnet_id)
+        for member in state.members:
+            # Name the members after their pods, as the driver does
+            member.name = 'default/%s:%s' % (member.ip, member.port)
+        spec = self._generate_lbaas_spec('1.1.1.1', expected_targets,
+                                         project_id, subnet_id)
+        m_drv_lbaas = mock.Mock(wraps=FakeLBaaSDriver())
+        m_get_drv_lbaas.return_value = m_drv_lbaas
+
+        handler = h_lbaas.LoadBalancerHandler()
+        with mock.patch.object(handler, '_get_pod_subnet') as m_get_pod_subnet:
+            m_get_pod_subnet.return_value = subnet_id
+            changed = handler._sync_lbaas_members(endpoints, state, spec)
+
+        m_drv_lbaas.ensure_member.assert_not_called()
+        m_drv_lbaas.release_member.assert_not_called()
+        lsnrs = {lsnr.id: lsnr for lsnr in state.listeners}
+        pools = {pool.id: pool for pool in state.pools}
+        observed_targets = sorted(
+            (str(member.ip), (
+                lsnrs[pools[member.pool_id].listener_id].port,
+                member.port))
+            for member in state.members)
+        return m_drv_lbaas, state, changed, observed_targets
+
+    def test_sync_lbaas_members_batch(self):
+        current_targets = {
+            '1.1.1.101': (1001, 10001),
+            '1.1.1.111': (1001, 10001),
+            '1.1.1.201': (2001, 20001)}
+        expected_targets = {
+            '1.1.1.101': (1001, 10001),
+            '1.1.1.121': (1001, 10001),
+            '1.1.1.201': (2001, 20001)}
+
+        m_drv_lbaas, state, changed, observed_targets = (
+            self._sync_lbaas_members_batch_impl(current_targets,
+                                                expected_targets))
+
+        self.assertTrue(changed)
+        self.assertEqual(sorted(expected_targets.items()), observed_targets)
+        # Only the pool of port 1001 changed
+        m_drv_lbaas.update_members.assert_called_once()
+        _, pool, kept, new_members = (
+            m_drv_lbaas.update_members.call_args[0])
+        self.assertEqual(['1.1.1.101'], [str(m.ip) for m in kept])
+        self.assertEqual(['1.1.1.121'], [m['ip'] for m in new_members])
+        self.assertIsNone(new_members[0]['listener_port'])
+
+    def test_sync_lbaas_members_batch_new_pool(self):
+        current_targets = {'1.1.1.101': (1001, 10001)}
+        expected_targets = {
+            '1.1.1.101': (1001, 10001),
+            '1.1.1.201': (2001, 20001),
+            '1.1.1.211': (2001, 20001)}
+
+        m_drv_lbaas, state, changed, observed_targets = (
+            self._sync_lbaas_members_batch_impl(current_targets,
+                                                expected_targets))
+
+        self.assertTrue(changed)
+        self.assertEqual(sorted(expected_targets.items()), observed_targets)
+        m_drv_lbaas.ensure_pool.assert_called_once()
+        _, pool, kept, new_members = (
+            m_drv_lbaas.update_members.call_args[0])
+        self.assertEqual([], kept)
+        self.assertEqual(2, len(new_members))
+        # The first member of the pool gets the SG rules applied
+        self.assertEqual(2001, new_members[0]['listener_port'])
+
+    def test_sync_lbaas_members_batch_no_changes(self):
+        targets = {'1.1.1.101': (1001, 10001)}
+
+        m_drv_lbaas, state, changed, observed_targets = (
+            self._sync_lbaas_members_batch_impl(targets, targets))
+
+        self.assertFalse(changed)
+        m_drv_lbaas.update_members.assert_not_called()
+
+    @mock.patch('kuryr_kubernetes.controller.handlers.lbaas'
+                '.LoadBalancerHandler._cleanup_leftover_lbaas')
+    @mock.patch('kuryr_kubernetes.controller.handlers.lbaas.'
+                'LoadBalancerHandler._get_lbaas_sgs')
+    @mock.patch('kuryr_kubernetes.controller.drivers.base.'
+                'ServiceSecurityGroupsDriver.get_instance')
+    @mock.patch('kuryr_kubernetes.controller.drivers.base.'
+                'ServiceProjectDriver.get_instance')
+    @mock.patch('kuryr_kubernetes.controller.drivers.base'
+                '.ServicePubIpDriver.get_instance')
+    @mock.patch('kuryr_kubernetes.controller.drivers.base'
+                '.PodSubnetsDriver.get_instance')
+    @mock.patch('kuryr_kubernetes.controller.drivers.base'
+                '.PodProjectDriver.get_instance')
+    @mock.patch('kuryr_kubernetes.controller.drivers.base'
+                '.LBaaSDriver.get_instance')
+    def _sync_lbaas_members_graph_impl(self, state, targets, prot,
+                                       m_get_drv_lbaas, m_get_drv_project,
+                                       m_get_drv_subnets, m_get_drv_pub_ip,
+                                       m_get_drv_svc_project,
+                                       m_get_drv_svc_sg, m_get_lbaas_sgs,
+                                       m_cleanup_leftover_lbaas):
+        oslo_cfg.CONF.set_override('fully_populated_create', True,
+                                   group='octavia_defaults')
+        self.addCleanup(oslo_cfg.CONF.clear_override,
+                        'fully_populated_create', group='octavia_defaults')
+        project_id = str(uuid.uuid4())
+        subnet_id = str(uuid.uuid4())
+        m_get_lbaas_sgs.return_value = [str(uuid.uuid4())]
+        endpoints = self._generate_endpoints(targets)
+        spec = self._generate_lbaas_spec('1.1.1.1', targets, project_id,
+                                         subnet_id, prot)
+        m_drv_lbaas = mock.Mock(wraps=FakeLBaaSDriver())
+        m_get_drv_lbaas.return_value = m_drv_lbaas
+
+        handler = h_lbaas.LoadBalancerHandler()
+        with mock.patch.object(handler, '_get_pod_subnet') as m_get_pod_subnet:
+            m_get_pod_subnet.return_value = subnet_id
+            with mock.patch.object(handler, '_sync_lbaas_sgs'):
+                changed = handler._sync_lbaas_members(endpoints, state,
+                                                      spec)
+
+        lsnrs = {lsnr.id: lsnr for lsnr in state.listeners}
+        pools = {pool.id: pool for pool in state.pools}
+        observed_targets = sorted(
+            (str(member.ip), (
+                lsnrs[pools[member.pool_id].listener_id].port,
+                member.port))
+            for member in state.members)
+        return m_drv_lbaas, changed, observed_targets
+
+    def test_sync_lbaas_members_graph(self):
+        targets = {
+            '1.1.1.101': (1001, 10001),
+            '1.1.1.111': (1001, 10001),
+            '1.1.1.201': (2001, 20001)}
+        state = obj_lbaas.LBaaSState()
+
+        m_drv_lbaas, changed, observed_targets = (
+            self._sync_lbaas_members_graph_impl(state, targets, 'TCP'))
+
+        self.assertTrue(changed)
+        self.assertEqual(sorted(targets.items()), observed_targets)
+        m_drv_lbaas.create_loadbalancer_graph.assert_called_once()
+        listeners = m_drv_lbaas.create_loadbalancer_graph.call_args[1][
+            'listeners']
+        self.assertEqual([('TCP', 1001, 2), ('TCP', 2001, 1)], sorted(
+            (l['protocol'], l['port'], len(l['members']))
+            for l in listeners))
+        m_drv_lbaas.ensure_loadbalancer.assert_not_called()
+        m_drv_lbaas.ensure_listener.assert_not_called()
+        m_drv_lbaas.ensure_pool.assert_not_called()
+        m_drv_lbaas.ensure_member.assert_not_called()
+
+    def test_sync_lbaas_members_graph_rejected(self):
+        targets = {'1.1.1.101': (1001, 10001)}
+        state = obj_lbaas.LBaaSState()
+
+        m_drv_lbaas, changed, observed_targets = (
+            self._sync_lbaas_members_graph_impl(state, targets, 'UDP'))
+
+        # The load balancer is created incrementally instead
+        self.assertTrue(changed)
+        m_drv_lbaas.create_loadbalancer_graph.assert_called_once()
+        m_drv_lbaas.ensure_loadbalancer.assert_called_once()
+        self.assertEqual([], observed_targets)
+
+    def test_sync_lbaas_members_graph_existing_lb(self):
+        targets = {'1.1.1.101': (1001, 10001)}
+        state = self._generate_lbaas_state('1.1.1.1', {}, str(uuid.uuid4()),
+                                           str(uuid.uuid4()))
+
+        m_drv_lbaas, changed, observed_targets = (
+            self._sync_lbaas_members_graph_impl(state, targets, 'TCP'))
+
+        self.assertTrue(changed)
+        self.assertEqual(sorted(targets.items()), observed_targets)
+        m_drv_lbaas.create_loadbalancer_graph.assert_not_called()
+        m_drv_lbaas.ensure_member.assert_called_once()
+
     def test_get_lbaas_spec(self):
         self.skipTest("skipping until generalised annotation handling is "
                       "implemented")
@@ -916,3 +1154,262 @@ class TestLoadBalancerHandler(test_base.TestCase):
 
         self.assertEqual(member_added, False)
         m_drv_lbaas.ensure_member.assert_not_called()
+
+
+class TestEndpointSliceHandler(test_base.TestCase):
+
+    SVC_LINK = '/api/v1/namespaces/default/services/svc'
+
+    def setUp(self):
+        super(TestEndpointSliceHandler, self).setUp()
+        self.k8s = self.useFixture(k_fix.MockK8sClient()).client
+        self.project_id = str(uuid.uuid4())
+        self.subnet_id = str(uuid.uuid4())
+        self.sg_id = str(uuid.uuid4())
+        self.m_drv_lbaas = mock.Mock(wraps=FakeLBaaSDriver())
+        self.m_drv_lbaas.ensure_loadbalancer.side_effect = (
+            self._ensure_loadbalancer)
+        self.useFixture(fixtures.MockPatch(
+            'kuryr_kubernetes.controller.drivers.base.LBaaSDriver.'
+            'get_instance', return_value=self.m_drv_lbaas))
+        for driver in ('PodProjectDriver', 'PodSubnetsDriver',
+                       'ServicePubIpDriver', 'ServiceProjectDriver',
+                       'ServiceSecurityGroupsDriver'):
+            self.useFixture(fixtures.MockPatch(
+                'kuryr_kubernetes.controller.drivers.base.%s.get_instance'
+                % driver))
+        self.useFixture(fixtures.MockPatch(
+            'kuryr_kubernetes.controller.handlers.lbaas.LoadBalancerHandler.'
+            '_cleanup_leftover_lbaas'))
+
+        self.handler = h_lbaas.EndpointSliceHandler()
+        self.handler._drv_sg.get_security_groups.return_value = [self.sg_id]
+        self.handler._drv_service_pub_ip.acquire_service_pub_ip_info.\
+            return_value = None
+
+    def _ensure_loadbalancer(self, *args, **kwargs):
+        lb = FakeLBaaSDriver().ensure_loadbalancer(*args, **kwargs)
+        lb.port_id = str(uuid.uuid4())
+        return lb
+
+    def _annotate(self, obj, annotation, value):
+        obj['metadata'].setdefault('annotations', {})[annotation] = (
+            jsonutils.dumps(value.obj_to_primitive()))
+        return obj
+
+    def _get_lbaas_state(self):
+        drv = FakeLBaaSDriver()
+        lb = self._ensure_loadbalancer('default/svc', self.project_id,
+                                       self.subnet_id, '10.0.0.10', None,
+                                       'ClusterIP')
+        lb.security_groups = [self.sg_id]
+        listener = drv.ensure_listener(lb, 'TCP', 80)
+        pool = drv.ensure_pool(lb, listener)
+        return obj_lbaas.LBaaSState(loadbalancer=lb, listeners=[listener],
+                                    pools=[pool])
+
+    def _get_member(self, lbaas_state, ip):
+        member = FakeLBaaSDriver().ensure_member(
+            lbaas_state.loadbalancer, lbaas_state.pools[0], self.subnet_id,
+            ip, 8080, 'default', ip)
+        # Name the members after their pods, as the driver does
+        member.name = 'default/%s:8080' % ip
+        return member
+
+    def _get_service(self, lbaas_state=None, cluster_ip='10.0.0.10'):
+        service = {
+            'metadata': {'name': 'svc', 'namespace': 'default',
+                         'selfLink': self.SVC_LINK,
+                         'resourceVersion': '1'},
+            'spec': {'selector': {'app': 'svc'},
+                     'clusterIP': cluster_ip,
+                     'type': 'ClusterIP',
+                     'ports': [{'name': 'http', 'protocol': 'TCP',
+                                'port': 80, 'targetPort': 8080}]}}
+        lbaas_spec = obj_lbaas.LBaaSServiceSpec(
+            ip='10.0.0.10', project_id=self.project_id,
+            subnet_id=self.subnet_id, security_groups_ids=[self.sg_id],
+            type='ClusterIP',
+            ports=[obj_lbaas.LBaaSPortSpec(name='http', protocol='TCP',
+                                           port=80, targetPort='8080')])
+        self._annotate(service, k_const.K8S_ANNOTATION_LBAAS_SPEC,
+                       lbaas_spec)
+        if lbaas_state:
+            self._annotate(service, k_const.K8S_ANNOTATION_LBAAS_STATE,
+                           lbaas_state)
+        return service
+
+    def _get_endpoint_slice(self, name, ips, not_ready_ips=(),
+                            lbaas_state=None):
+        endpoint_slice = {
+            'metadata': {
+                'name': name, 'namespace': 'default',
+                'selfLink': '/apis/discovery.k8s.io/v1beta1/namespaces/'
+                            'default/endpointslices/%s' % name,
+                'resourceVersion': '1',
+                'labels': {k_const.K8S_LABEL_SERVICE_NAME: 'svc'}},
+            'addressType': 'IPv4',
+            'endpoints': [
+                {'addresses': [ip],
+                 'conditions': {'ready': ip not in not_ready_ips},
+                 'targetRef': {'kind': k_const.K8S_OBJ_POD, 'name': ip,
+                               'namespace': 'default'}}
+                for ip in ips],
+            'ports': [{'name': 'http', 'protocol': 'TCP', 'port': 8080}]}
+        if lbaas_state:
+            self._annotate(endpoint_slice, k_const.K8S_ANNOTATION_LBAAS_STATE,
+                           lbaas_state)
+        return endpoint_slice
+
+    def _get_annotated_states(self):
+        states = {}
+        for call in self.k8s.annotate.call_args_list:
+            annotation = call[0][1][k_const.K8S_ANNOTATION_LBAAS_STATE]
+            states[call[0][0].split('/')[-1]] = (
+                obj_lbaas.LBaaSState.obj_from_primitive(
+                    jsonutils.loads(annotation)))
+        return states
+
+    def test_on_present_new_loadbalancer(self):
+        endpoint_slice = self._get_endpoint_slice(
+            'svc-1', ['10.1.0.1', '10.1.0.2'])
+        other_slice = self._get_endpoint_slice('svc-2', ['10.1.0.3'])
+        self.k8s.get.side_effect = [
+            self._get_service(),
+            {'items': [endpoint_slice, other_slice]}]
+
+        self.handler.on_present(endpoint_slice)
+
+        self.m_drv_lbaas.ensure_loadbalancer.assert_called_once()
+        self.assertEqual(3, self.m_drv_lbaas.ensure_member.call_count)
+        self.k8s.get.assert_called_with(
+            '/apis/discovery.k8s.io/v1beta1/namespaces/default/'
+            'endpointslices?labelSelector=kubernetes.io/service-name=svc')
+        states = self._get_annotated_states()
+        self.assertEqual({'svc', 'svc-1', 'svc-2'}, set(states))
+        lb = states['svc'].loadbalancer
+        self.assertEqual([self.sg_id], lb.security_groups)
+        self.assertEqual(1, len(states['svc'].pools))
+        self.assertEqual([], states['svc'].members)
+        self.assertEqual(lb.id, states['svc-1'].loadbalancer.id)
+        self.assertEqual(['10.1.0.1', '10.1.0.2'], sorted(
+            str(m.ip) for m in states['svc-1'].members))
+        self.assertEqual(['10.1.0.3'],
+                         [str(m.ip) for m in states['svc-2'].members])
+
+    def test_on_present_slice_changed(self):
+        lbaas_state = self._get_lbaas_state()
+        slice_state = obj_lbaas.LBaaSState(
+            loadbalancer=lbaas_state.loadbalancer,
+            members=[self._get_member(lbaas_state, '10.1.0.1'),
+                     self._get_member(lbaas_state, '10.1.0.2')])
+        endpoint_slice = self._get_endpoint_slice(
+            'svc-1', ['10.1.0.1', '10.1.0.2', '10.1.0.3'],
+            not_ready_ips=['10.1.0.1'], lbaas_state=slice_state)
+        self.k8s.get.return_value = self._get_service(lbaas_state)
+
+        self.handler.on_present(endpoint_slice)
+
+        # Only the slice is read and updated
+        self.k8s.get.assert_called_once_with(self.SVC_LINK)
+        self.m_drv_lbaas.ensure_loadbalancer.assert_not_called()
+        self.m_drv_lbaas.release_member.assert_called_once()
+        self.assertEqual(slice_state.members[0].id,
+                         self.m_drv_lbaas.release_member.call_args[0][1].id)
+        self.m_drv_lbaas.ensure_member.assert_called_once()
+        states = self._get_annotated_states()
+        self.assertEqual(['svc-1'], list(states))
+        self.assertEqual(['10.1.0.2', '10.1.0.3'], sorted(
+            str(m.ip) for m in states['svc-1'].members))
+
+    def test_on_present_no_changes(self):
+        lbaas_state = self._get_lbaas_state()
+        slice_state = obj_lbaas.LBaaSState(
+            loadbalancer=lbaas_state.loadbalancer,
+            members=[self._get_member(lbaas_state, '10.1.0.1')])
+        endpoint_slice = self._get_endpoint_slice(
+            'svc-1', ['10.1.0.1'], lbaas_state=slice_state)
+        self.k8s.get.return_value = self._get_service(lbaas_state)
+
+        self.handler.on_present(endpoint_slice)
+
+        self.m_drv_lbaas.release_member.assert_not_called()
+        self.m_drv_lbaas.ensure_member.assert_not_called()
+        self.k8s.annotate.assert_not_called()
+
+    def test_on_present_no_spec(self):
+        service = self._get_service()
+        del service['metadata']['annotations']
+        self.k8s.get.return_value = service
+
+        # The slice gets an event once annotated with the spec
+        self.handler.on_present(
+            self._get_endpoint_slice('svc-1', ['10.1.0.1']))
+
+        self.m_drv_lbaas.ensure_loadbalancer.assert_not_called()
+        self.k8s.annotate.assert_not_called()
+
+    def test_on_present_outdated_service(self):
+        service = self._get_service()
+        endpoint_slice = self._get_endpoint_slice('svc-1', ['10.1.0.1'])
+        endpoint_slice['metadata']['annotations'] = dict(
+            service['metadata'].pop('annotations'))
+        self.k8s.get.return_value = service
+
+        self.assertRaises(k_exc.ResourceNotReady, self.handler.on_present,
+                          endpoint_slice)
+
+    def test_on_present_headless_service(self):
+        self.k8s.get.return_value = self._get_service(cluster_ip='None')
+
+        self.handler.on_present(
+            self._get_endpoint_slice('svc-1', ['10.1.0.1']))
+
+        self.m_drv_lbaas.ensure_loadbalancer.assert_not_called()
+        self.k8s.annotate.assert_not_called()
+
+    def test_on_deleted(self):
+        lbaas_state = self._get_lbaas_state()
+        slice_state = obj_lbaas.LBaaSState(
+            loadbalancer=lbaas_state.loadbalancer,
+            members=[self._get_member(lbaas_state, '10.1.0.1')])
+        self.k8s.get.return_value = self._get_service(lbaas_state)
+
+        self.handler.on_deleted(self._get_endpoint_slice(
+            'svc-1', ['10.1.0.1'], lbaas_state=slice_state))
+
+        self.m_drv_lbaas.release_member.assert_called_once()
+        self.assertEqual(slice_state.members[0].id,
+                         self.m_drv_lbaas.release_member.call_args[0][1].id)
+        self.m_drv_lbaas.release_loadbalancer.assert_not_called()
+
+    def test_on_deleted_service_deleted(self):
+        lbaas_state = self._get_lbaas_state()
+        slice_state = obj_lbaas.LBaaSState(
+            loadbalancer=lbaas_state.loadbalancer,
+            members=[self._get_member(lbaas_state, '10.1.0.1')])
+        self.k8s.get.side_effect = k_exc.K8sResourceNotFound('svc')
+
+        self.handler.on_deleted(self._get_endpoint_slice(
+            'svc-1', ['10.1.0.1'], lbaas_state=slice_state))
+
+        self.m_drv_lbaas.release_loadbalancer.assert_called_once()
+        self.assertEqual(slice_state.loadbalancer.id,
+                         self.m_drv_lbaas.release_loadbalancer.call_args[1][
+                             'loadbalancer'].id)
+        self.m_drv_lbaas.release_member.assert_not_called()
+
+    def test_get_pod_targets(self):
+        endpoint_slice = self._get_endpoint_slice(
+            'svc-1', ['10.1.0.1', '10.1.0.2'], not_ready_ips=['10.1.0.2'])
+        endpoint_slice['ports'][0]['name'] = ''
+
+        self.assertEqual(
+            [('10.1.0.1', 'default', None, 8080)],
+            [(ip, target_ref['namespace'], port_name, port)
+             for ip, target_ref, port_name, port in
+             self.handler._get_pod_targets(endpoint_slice)])
+
+        endpoint_slice['addressType'] = 'FQDN'
+        self.assertEqual([], list(
+            self.handler._get_pod_targets(endpoint_slice)))
@@ -0,0 +1,74 @@
+# Copyright 2020 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from unittest import mock
+
+from oslo_config import cfg as oslo_cfg
+
+from kuryr_kubernetes.controller.drivers import nested_vif
+from kuryr_kubernetes.controller.handlers import node
+from kuryr_kubernetes.tests import base as test_base
+
+
+def _get_node(name, *ips):
+    return {'metadata': {'name': name},
+            'status': {'addresses': [{'type': 'InternalIP', 'address': ip}
+                                     for ip in ips]}}
+
+
+class TestNodeHandler(test_base.TestCase):
+
+    def setUp(self):
+        super(TestNodeHandler, self).setUp()
+        oslo_cfg.CONF.set_override('enabled_handlers', ['vif', 'node'],
+                                   group='kubernetes')
+        self.addCleanup(oslo_cfg.CONF.clear_override, 'enabled_handlers',
+                        group='kubernetes')
+        self.addCleanup(nested_vif.PARENT_PORTS.clear)
+        self._handler = node.NodeHandler()
+        for ip in ('10.0.0.1', '10.0.0.2', '10.0.0.3'):
+            nested_vif.PARENT_PORTS.add(ip, mock.sentinel.port)
+
+    def _cached_ips(self):
+        return {ip for ip in ('10.0.0.1', '10.0.0.2', '10.0.0.3')
+                if nested_vif.PARENT_PORTS.get(ip) is not None}
+
+    def test_on_present_new_node(self):
+        self._handler.on_present(_get_node('node1', '10.0.0.1'))
+
+        self.assertEqual({'10.0.0.2', '10.0.0.3'}, self._cached_ips())
+
+    def test_on_present_unchanged(self):
+        self._handler._node_ips['node1'] = {'10.0.0.1'}
+
+        self._handler.on_present(_get_node('node1', '10.0.0.1'))
+
+        self.assertEqual({'10.0.0.1', '10.0.0.2', '10.0.0.3'},
+                         self._cached_ips())
+
+    def test_on_present_address_changed(self):
+        self._handler._node_ips['node1'] = {'10.0.0.1'}
+
+        self._handler.on_present(_get_node('node1', '10.0.0.2'))
+
+        self.assertEqual({'10.0.0.3'}, self._cached_ips())
+        self.assertEqual({'10.0.0.2'}, self._handler._node_ips['node1'])
+
+    def test_on_deleted(self):
+        self._handler._node_ips['node1'] = {'10.0.0.1'}
+
+        self._handler.on_deleted(_get_node('node1', '10.0.0.2'))
+
+        self.assertEqual({'10.0.0.3'}, self._cached_ips())
+        self.assertNotIn('node1', self._handler._node_ips)
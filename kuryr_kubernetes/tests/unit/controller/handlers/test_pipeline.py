@@ -15,6 +15,9 @@
 
 from unittest import mock
 
+from oslo_config import cfg
+
+from kuryr_kubernetes import constants
 from kuryr_kubernetes.controller.handlers import pipeline as h_pipeline
 from kuryr_kubernetes.handlers import dispatch as h_dis
 from kuryr_kubernetes.handlers import k8s_base as h_k8s
@@ -40,6 +43,42 @@ class TestControllerPipeline(test_base.TestCase):
         m_logging_type.assert_called_with(retry_handler)
         m_retry_type.assert_called_with(consumer, exceptions=mock.ANY)
 
+    @mock.patch('kuryr_kubernetes.controller.sharding.ShardFilter')
+    @mock.patch('kuryr_kubernetes.handlers.logging.LogExceptions')
+    @mock.patch('kuryr_kubernetes.handlers.retry.Retry')
+    def test_wrap_consumer_sharded(self, m_retry_type, m_logging_type,
+                                   m_filter_type):
+        consumer = mock.Mock(SHARDING=constants.SHARDING_BY_NODE)
+        shard_manager = mock.sentinel.shard_manager
+        shard_filter = mock.sentinel.shard_filter
+        m_filter_type.return_value = shard_filter
+        thread_group = mock.sentinel.thread_group
+
+        with mock.patch.object(h_dis.EventPipeline, '__init__'):
+            pipeline = h_pipeline.ControllerPipeline(thread_group,
+                                                     shard_manager)
+            pipeline._wrap_consumer(consumer)
+
+        m_filter_type.assert_called_once_with(
+            consumer, shard_manager, constants.SHARDING_BY_NODE)
+        m_retry_type.assert_called_with(shard_filter, exceptions=mock.ANY)
+
+    @mock.patch('kuryr_kubernetes.controller.sharding.ShardFilter')
+    @mock.patch('kuryr_kubernetes.handlers.logging.LogExceptions')
+    @mock.patch('kuryr_kubernetes.handlers.retry.Retry')
+    def test_wrap_consumer_sharded_all(self, m_retry_type, m_logging_type,
+                                       m_filter_type):
+        consumer = mock.Mock(SHARDING=constants.SHARDING_ALL)
+        thread_group = mock.sentinel.thread_group
+
+        with mock.patch.object(h_dis.EventPipeline, '__init__'):
+            pipeline = h_pipeline.ControllerPipeline(
+                thread_group, mock.sentinel.shard_manager)
+            pipeline._wrap_consumer(consumer)
+
+        m_filter_type.assert_not_called()
+        m_retry_type.assert_called_with(consumer, exceptions=mock.ANY)
+
     @mock.patch('kuryr_kubernetes.handlers.logging.LogExceptions')
     @mock.patch('kuryr_kubernetes.handlers.asynchronous.Async')
     def test_wrap_dispatcher(self, m_async_type, m_logging_type):
@@ -56,5 +95,71 @@ class TestControllerPipeline(test_base.TestCase):
 
         self.assertEqual(logging_handler, ret)
         m_logging_type.assert_called_with(async_handler)
-        m_async_type.assert_called_with(dispatcher, thread_group,
-                                        h_k8s.object_uid)
+        m_async_type.assert_called_with(
+            dispatcher, thread_group, h_k8s.object_uid, workers=100,
+            quota_by=h_k8s.object_kind,
+            quotas={'Pod': 30, 'Endpoints': 20, 'EndpointSlice': 20,
+                    'NetworkPolicy': 10},
+            prioritize=h_pipeline._get_event_priority,
+            debounce_by=h_pipeline._get_event_debounce,
+            serialize_by=h_pipeline._get_event_serial_group)
+
+    @mock.patch.object(h_pipeline, 'LOG')
+    @mock.patch('kuryr_kubernetes.handlers.logging.LogExceptions')
+    @mock.patch('kuryr_kubernetes.handlers.asynchronous.Async')
+    def test_wrap_dispatcher_quotas(self, m_async_type, m_logging_type,
+                                    m_log):
+        thread_group = mock.sentinel.thread_group
+
+        with mock.patch.object(h_dis.EventPipeline, '__init__'):
+            pipeline = h_pipeline.ControllerPipeline(thread_group)
+            pipeline._wrap_dispatcher(mock.sentinel.dispatcher)
+            m_log.warning.assert_not_called()
+
+            cfg.CONF.set_override('event_workers', 60, group='kubernetes')
+            self.addCleanup(cfg.CONF.clear_override, 'event_workers',
+                            group='kubernetes')
+            pipeline._wrap_dispatcher(mock.sentinel.dispatcher)
+
+        m_log.warning.assert_called_once()
+
+    def test_get_event_priority(self):
+        self.assertLess(h_pipeline._get_event_priority({'type': 'ADDED'}),
+                        h_pipeline._get_event_priority({'type': 'MODIFIED'}))
+
+    def test_get_event_debounce(self):
+        cfg.CONF.set_override('endpoints_quiet_period', 2,
+                              group='kubernetes')
+        self.addCleanup(cfg.CONF.clear_override, 'endpoints_quiet_period',
+                        group='kubernetes')
+        endpoints = {'kind': constants.K8S_OBJ_ENDPOINTS}
+
+        self.assertEqual((2, 10), h_pipeline._get_event_debounce(
+            {'type': 'MODIFIED', 'object': endpoints}))
+        self.assertEqual((2, 10), h_pipeline._get_event_debounce(
+            {'type': 'MODIFIED',
+             'object': {'kind': constants.K8S_OBJ_ENDPOINTSLICE}}))
+        self.assertIsNone(h_pipeline._get_event_debounce(
+            {'type': 'ADDED', 'object': endpoints}))
+        self.assertIsNone(h_pipeline._get_event_debounce(
+            {'type': 'MODIFIED', 'object': {'kind': 'Pod'}}))
+
+    def test_get_event_serial_group(self):
+        endpoint_slice = {
+            'kind': constants.K8S_OBJ_ENDPOINTSLICE,
+            'metadata': {'uid': 'a2b4c6d8', 'namespace': 'ns',
+                         'labels': {constants.K8S_LABEL_SERVICE_NAME: 'svc'}}}
+
+        self.assertEqual(
+            (constants.K8S_OBJ_SERVICE, 'ns', 'svc'),
+            h_pipeline._get_event_serial_group({'object': endpoint_slice}))
+        del endpoint_slice['metadata']['labels']
+        self.assertEqual('a2b4c6d8', h_pipeline._get_event_serial_group(
+            {'object': endpoint_slice}))
+        self.assertEqual('b1', h_pipeline._get_event_serial_group(
+            {'object': {'kind': 'Pod', 'metadata': {'uid': 'b1'}}}))
+
+    def test_get_event_debounce_disabled(self):
+        self.assertIsNone(h_pipeline._get_event_debounce(
+            {'type': 'MODIFIED',
+             'object': {'kind': constants.K8S_OBJ_ENDPOINTS}}))
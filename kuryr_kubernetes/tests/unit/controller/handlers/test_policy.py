@@ -245,3 +245,19 @@ class TestPolicyHandler(test_base.TestCase):
         self._update_vif_sgs.assert_called_once_with(match_pod, sg1)
         self._update_lbaas_sg.assert_not_called()
         self._remove_sg.assert_called_once()
+
+    def test_is_service_affected(self):
+        service = {'metadata': {'name': 'service-test',
+                                'namespace': 'default'},
+                   'spec': {'selector': {'app': 'a'}}}
+        pod1 = {'metadata': {'name': 'pod1', 'namespace': 'default',
+                             'labels': {'app': 'b'}}}
+        pod2 = {'metadata': {'name': 'pod2', 'namespace': 'other',
+                             'labels': {'app': 'a'}}}
+        pod3 = {'metadata': {'name': 'pod3', 'namespace': 'default',
+                             'labels': {'app': 'a', 'tier': 'web'}}}
+
+        self.assertFalse(policy.NetworkPolicyHandler._is_service_affected(
+            self._handler, service, [pod1, pod2]))
+        self.assertTrue(policy.NetworkPolicyHandler._is_service_affected(
+            self._handler, service, [pod1, pod2, pod3]))
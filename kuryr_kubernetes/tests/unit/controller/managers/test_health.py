@@ -14,6 +14,7 @@
 
 from kuryr_kubernetes.controller.managers import health
 from kuryr_kubernetes.handlers import health as h_health
+from kuryr_kubernetes import metrics
 from kuryr_kubernetes.tests import base
 from kuryr_kubernetes.tests.unit import kuryr_fixtures as k_fix
 from unittest import mock
@@ -223,3 +224,13 @@ class TestHealthServer(base.TestCase):
 
         m_status.assert_called_once()
         self.assertEqual(500, resp.status_code)
+
+    def test_metrics(self):
+        metrics.HANDLER_RETRIES.labels('TestHandler', 'ResourceNotReady').inc()
+
+        resp = self.test_client.get('/metrics')
+
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(metrics.CONTENT_TYPE, resp.headers['Content-Type'])
+        self.assertIn(b'kuryr_handler_retries_total{exception="'
+                      b'ResourceNotReady",handler="TestHandler"}', resp.data)
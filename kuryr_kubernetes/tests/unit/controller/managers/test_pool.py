@@ -15,6 +15,8 @@ from unittest import mock
 
 from http.server import BaseHTTPRequestHandler
 
+from openstack import exceptions as os_exc
+from oslo_config import cfg as oslo_cfg
 from oslo_serialization import jsonutils
 
 from kuryr_kubernetes.controller.managers import pool as m_pool
@@ -36,7 +38,8 @@ class TestRequestHandler(test_base.TestCase):
         self._req_handler.wfile = mock.Mock()
 
     def _do_POST_helper(self, method, path, headers, body, expected_resp,
-                        trigger_exception, trunk_ips, num_ports=None):
+                        trigger_exception, trunk_ips, num_ports=None,
+                        freed=None):
         self._req_handler.headers = headers
         self._req_handler.path = path
 
@@ -46,6 +49,7 @@ class TestRequestHandler(test_base.TestCase):
             mock.patch.object(self._req_handler,
                               '_delete_subports') as m_delete:
             m_read.return_value = body
+            m_delete.return_value = freed
             if trigger_exception:
                 m_create.side_effect = Exception
                 m_delete.side_effect = Exception
@@ -172,11 +176,32 @@ class TestRequestHandler(test_base.TestCase):
         headers['Content-Length'] = len(body)
         trigger_exception = False
 
-        expected_resp = ('Ports pool belonging to {0} was freed.'
+        freed = {'10.0.0.6': (2, 2)}
+
+        expected_resp = ('Ports pool belonging to {0} was freed:\n'
+                         '10.0.0.6: 2/2 ports freed'
                          .format(trunk_ips)).encode()
 
         self._do_POST_helper(method, path, headers, body, expected_resp,
-                             trigger_exception, trunk_ips)
+                             trigger_exception, trunk_ips, freed=freed)
+
+    def test_do_POST_free_partial(self):
+        method = 'delete'
+        path = "http://localhost/freePool"
+        trunk_ips = ["10.0.0.6", "10.0.0.7"]
+        body = jsonutils.dumps({"trunks": trunk_ips})
+        headers = {'Content-Type': 'application/json', 'Connection': 'close'}
+        headers['Content-Length'] = len(body)
+        trigger_exception = False
+        freed = {'10.0.0.7': (1, 3), '10.0.0.6': (2, 2)}
+
+        expected_resp = ('Ports pool belonging to {0} was partially freed:\n'
+                         '10.0.0.6: 2/2 ports freed\n'
+                         '10.0.0.7: 1/3 ports freed'
+                         .format(trunk_ips)).encode()
+
+        self._do_POST_helper(method, path, headers, body, expected_resp,
+                             trigger_exception, trunk_ips, freed=freed)
 
     def test_do_POST_free_exception(self):
         method = 'delete'
@@ -354,3 +379,268 @@ class TestRequestHandler(test_base.TestCase):
 
         self._do_GET_helper(method, method_resp, path, headers, body,
                             expected_resp, trigger_exception)
+
+    def _do_job_request(self, do_method, path, params):
+        body = jsonutils.dumps(params)
+        self._req_handler.headers = {'Content-Length': len(body)}
+        self._req_handler.path = path
+        self._req_handler.rfile.read.return_value = body
+
+        with mock.patch.object(self._req_handler, 'send_header'),\
+                mock.patch.object(self._req_handler, 'end_headers'):
+            do_method()
+
+        self._req_handler.wfile.write.assert_called_once()
+        return self._req_handler.wfile.write.call_args[0][0].decode()
+
+    @mock.patch('kuryr_kubernetes.controller.managers.pool.start_job')
+    def test_do_POST_job(self, m_start_job):
+        job = m_pool.PoolJob('populate', ['10.0.0.6'], 3)
+        m_start_job.return_value = job
+
+        resp = self._do_job_request(
+            self._req_handler.do_POST, 'http://localhost/poolJobs',
+            {'action': 'populate', 'trunks': ['10.0.0.6'], 'num_ports': 3})
+
+        m_start_job.assert_called_once_with('populate', ['10.0.0.6'], 3)
+        self.assertEqual(job.to_dict(), jsonutils.loads(resp))
+
+    @mock.patch('kuryr_kubernetes.controller.managers.pool.start_job')
+    def test_do_POST_job_free_all(self, m_start_job):
+        m_start_job.return_value = m_pool.PoolJob('free')
+
+        self._do_job_request(self._req_handler.do_POST,
+                             'http://localhost/poolJobs', {'action': 'free'})
+
+        m_start_job.assert_called_once_with('free', None, 1)
+
+    @mock.patch('kuryr_kubernetes.controller.managers.pool.start_job')
+    def test_do_POST_job_populate_no_trunks(self, m_start_job):
+        resp = self._do_job_request(
+            self._req_handler.do_POST, 'http://localhost/poolJobs',
+            {'action': 'populate', 'trunks': []})
+
+        m_start_job.assert_not_called()
+        self.assertEqual('Trunk port IP(s) missing.', resp)
+
+    @mock.patch('kuryr_kubernetes.controller.managers.pool.start_job')
+    def test_do_POST_job_wrong_action(self, m_start_job):
+        resp = self._do_job_request(
+            self._req_handler.do_POST, 'http://localhost/poolJobs',
+            {'action': 'fake'})
+
+        m_start_job.assert_not_called()
+        self.assertEqual('Invalid job action: fake.', resp)
+
+    @mock.patch('kuryr_kubernetes.controller.managers.pool.get_job')
+    def test_do_POST_cancel(self, m_get_job):
+        job = m_pool.PoolJob('populate', ['10.0.0.6'])
+        m_get_job.return_value = job
+
+        resp = self._do_job_request(
+            self._req_handler.do_POST, 'http://localhost/cancelPoolJob',
+            {'job_id': job.id})
+
+        m_get_job.assert_called_once_with(job.id)
+        self.assertTrue(job._cancelled)
+        self.assertEqual(job.id, jsonutils.loads(resp)['id'])
+
+    @mock.patch('kuryr_kubernetes.controller.managers.pool.get_job')
+    def test_do_POST_cancel_not_found(self, m_get_job):
+        m_get_job.return_value = None
+
+        resp = self._do_job_request(
+            self._req_handler.do_POST, 'http://localhost/cancelPoolJob',
+            {'job_id': 'job1'})
+
+        self.assertEqual('Job not found: job1.', resp)
+
+    @mock.patch('kuryr_kubernetes.controller.managers.pool.list_jobs')
+    def test_do_GET_jobs(self, m_list_jobs):
+        jobs = [m_pool.PoolJob('populate', ['10.0.0.6']),
+                m_pool.PoolJob('free')]
+        m_list_jobs.return_value = jobs
+
+        resp = self._do_job_request(self._req_handler.do_GET,
+                                    'http://localhost/poolJobs', {})
+
+        self.assertEqual([job.to_dict() for job in jobs],
+                         jsonutils.loads(resp))
+
+    @mock.patch('kuryr_kubernetes.controller.managers.pool.get_job')
+    def test_do_GET_job(self, m_get_job):
+        job = m_pool.PoolJob('populate', ['10.0.0.6'])
+        m_get_job.return_value = job
+
+        resp = self._do_job_request(self._req_handler.do_GET,
+                                    'http://localhost/poolJobs',
+                                    {'job_id': job.id})
+
+        m_get_job.assert_called_once_with(job.id)
+        self.assertEqual(job.to_dict(), jsonutils.loads(resp))
+
+    @mock.patch('kuryr_kubernetes.controller.managers.pool.get_job')
+    def test_do_GET_job_not_found(self, m_get_job):
+        m_get_job.return_value = None
+
+        resp = self._do_job_request(self._req_handler.do_GET,
+                                    'http://localhost/poolJobs',
+                                    {'job_id': 'job1'})
+
+        self.assertEqual('Job not found: job1.', resp)
+
+
+class TestPoolJob(test_base.TestCase):
+
+    def setUp(self):
+        super(TestPoolJob, self).setUp()
+        self.addCleanup(m_pool._jobs.clear)
+        self.m_vif_pool = mock.Mock()
+        get_args = mock.patch(
+            'kuryr_kubernetes.controller.managers.pool._get_populate_args',
+            return_value=(self.m_vif_pool, 'project', 'subnets', ['sg']))
+        get_args.start()
+        self.addCleanup(get_args.stop)
+        get_driver = mock.patch(
+            'kuryr_kubernetes.controller.managers.pool._get_vif_pool_driver',
+            return_value=self.m_vif_pool)
+        get_driver.start()
+        self.addCleanup(get_driver.stop)
+
+    def test_run_populate(self):
+        job = m_pool.PoolJob('populate', ['10.0.0.6', '10.0.0.7'], 3)
+
+        job.run()
+
+        self.assertEqual('done', job.status)
+        self.assertEqual({'10.0.0.6': {'status': 'done', 'ports': 3},
+                          '10.0.0.7': {'status': 'done', 'ports': 3}},
+                         job.trunks)
+        self.m_vif_pool.force_populate_pool.assert_has_calls([
+            mock.call('10.0.0.6', 'project', 'subnets', ['sg'], 3),
+            mock.call('10.0.0.7', 'project', 'subnets', ['sg'], 3)],
+            any_order=True)
+
+    def test_run_populate_error(self):
+        job = m_pool.PoolJob('populate', ['10.0.0.6', '10.0.0.7'], 3)
+        self.m_vif_pool.force_populate_pool.side_effect = [
+            os_exc.ConflictException('VLAN conflict'), None]
+
+        job.run()
+
+        self.assertEqual('failed', job.status)
+        statuses = sorted(trunk['status'] for trunk in job.trunks.values())
+        self.assertEqual(['done', 'failed'], statuses)
+        self.assertIn('VLAN conflict', [trunk.get('error')
+                                        for trunk in job.trunks.values()])
+
+    def test_run_populate_cancelled(self):
+        job = m_pool.PoolJob('populate', ['10.0.0.6', '10.0.0.7'])
+        job.cancel()
+
+        job.run()
+
+        self.assertEqual('cancelled', job.status)
+        self.assertEqual({'10.0.0.6': {'status': 'cancelled'},
+                          '10.0.0.7': {'status': 'cancelled'}}, job.trunks)
+        self.m_vif_pool.force_populate_pool.assert_not_called()
+
+    def test_run_populate_workers(self):
+        oslo_cfg.CONF.set_override('job_workers', 1, group='pool_manager')
+        self.addCleanup(oslo_cfg.CONF.clear_override, 'job_workers',
+                        group='pool_manager')
+        job = m_pool.PoolJob('populate', ['10.0.0.6', '10.0.0.7'])
+        # Cancelling while the first trunk is populated skips the second one
+        self.m_vif_pool.force_populate_pool.side_effect = (
+            lambda *args: job.cancel())
+
+        job.run()
+
+        self.assertEqual('cancelled', job.status)
+        self.m_vif_pool.force_populate_pool.assert_called_once()
+        statuses = sorted(trunk['status'] for trunk in job.trunks.values())
+        self.assertEqual(['cancelled', 'done'], statuses)
+
+    def test_run_populate_drivers_error(self):
+        job = m_pool.PoolJob('populate', ['10.0.0.6'])
+        m_pool._get_populate_args.side_effect = TypeError
+
+        job.run()
+
+        self.assertEqual('failed', job.status)
+
+    def test_run_free(self):
+        job = m_pool.PoolJob('free', ['10.0.0.6', '10.0.0.7'])
+
+        def free_pool(trunk_ips, progress):
+            self.assertTrue(progress('10.0.0.6', 2, 2))
+            return {'10.0.0.6': (2, 2)}
+
+        self.m_vif_pool.free_pool.side_effect = free_pool
+
+        job.run()
+
+        self.m_vif_pool.free_pool.assert_called_once_with(
+            ['10.0.0.6', '10.0.0.7'], progress=job._free_progress)
+        self.assertEqual('done', job.status)
+        self.assertEqual({
+            '10.0.0.6': {'status': 'done', 'ports': 2, 'total': 2},
+            '10.0.0.7': {'status': 'done'}}, job.trunks)
+
+    def test_run_free_partial(self):
+        job = m_pool.PoolJob('free')
+        self.m_vif_pool.free_pool.side_effect = (
+            lambda trunk_ips, progress: progress('10.0.0.6', 1, 2))
+
+        job.run()
+
+        self.assertEqual('failed', job.status)
+        self.assertEqual(
+            {'10.0.0.6': {'status': 'failed', 'ports': 1, 'total': 2}},
+            job.trunks)
+
+    def test_run_free_cancelled(self):
+        job = m_pool.PoolJob('free', ['10.0.0.6', '10.0.0.7'])
+
+        def free_pool(trunk_ips, progress):
+            job.cancel()
+            self.assertFalse(progress('10.0.0.6', 2, 2))
+
+        self.m_vif_pool.free_pool.side_effect = free_pool
+
+        job.run()
+
+        self.assertEqual('cancelled', job.status)
+        self.assertEqual('cancelled', job.trunks['10.0.0.7']['status'])
+
+    def test_cancel_finished(self):
+        job = m_pool.PoolJob('free')
+        job.status = 'done'
+
+        job.cancel()
+
+        self.assertFalse(job._cancelled)
+
+    @mock.patch('eventlet.spawn')
+    def test_start_job(self, m_spawn):
+        job = m_pool.start_job('populate', ['10.0.0.6'], 2)
+
+        m_spawn.assert_called_once_with(job.run)
+        self.assertEqual(job, m_pool.get_job(job.id))
+        self.assertEqual([job], m_pool.list_jobs())
+        self.assertEqual(2, job.num_ports)
+
+    @mock.patch('eventlet.spawn')
+    @mock.patch('kuryr_kubernetes.controller.managers.pool.'
+                'MAX_FINISHED_JOBS', 1)
+    def test_start_job_retention(self, m_spawn):
+        old_job = m_pool.start_job('free')
+        old_job.status = 'done'
+        finished_job = m_pool.start_job('free')
+        finished_job.status = 'failed'
+        running_job = m_pool.start_job('free')
+
+        job = m_pool.start_job('free')
+
+        self.assertEqual([finished_job, running_job, job],
+                         m_pool.list_jobs())
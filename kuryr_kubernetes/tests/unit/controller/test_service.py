@@ -57,3 +57,45 @@ class TestControllerService(test_base.TestCase):
                               group='kubernetes')
         service._load_kuryr_ctrlr_handlers()
         m_handler_not_found.assert_called()
+
+    def test_monitor_shards(self):
+        cfg.CONF.set_override('controller_sharding', True,
+                              group='kubernetes')
+        self.addCleanup(cfg.CONF.clear_override, 'controller_sharding',
+                        group='kubernetes')
+        m_svc = mock.Mock(spec=service.KuryrK8sService)
+        m_svc.shard_manager = mock.Mock()
+        m_svc.shard_manager.complete_handoff.return_value = None
+
+        service.KuryrK8sService.monitor_shards(m_svc, None)
+
+        m_svc.shard_manager.refresh.assert_called_once_with()
+        m_svc.on_shards_handoff.assert_not_called()
+
+        ring = mock.sentinel.ring
+        m_svc.shard_manager.complete_handoff.return_value = ring
+        service.KuryrK8sService.monitor_shards(m_svc, None)
+
+        m_svc.on_shards_handoff.assert_called_once_with(ring)
+
+    def test_on_shards_handoff(self):
+        m_svc = mock.Mock(spec=service.KuryrK8sService)
+        m_svc.node_name = 'ctrl-1'
+        m_svc.pool_driver = mock.Mock()
+        m_svc.shard_manager = mock.Mock()
+        m_svc.shard_manager.pop_deferred_deletions.return_value = [
+            mock.sentinel.event]
+        m_svc.watcher = mock.Mock()
+        m_svc.pipeline = mock.Mock()
+        ring = mock.sentinel.ring
+        obj = mock.sentinel.obj
+
+        service.KuryrK8sService.on_shards_handoff(m_svc, ring)
+
+        m_svc.pipeline.assert_called_once_with(mock.sentinel.event)
+
+        m_svc.pool_driver.handoff_pools.assert_called_once_with(ring)
+        predicate = m_svc.watcher.replay.call_args[0][0]
+        predicate(obj)
+        m_svc.shard_manager.is_gained.assert_called_once_with(
+            obj, previous_ring=ring)
@@ -0,0 +1,312 @@
+# Copyright 2020 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from unittest import mock
+
+from kuryr_kubernetes import constants
+from kuryr_kubernetes.controller import sharding
+from kuryr_kubernetes import exceptions
+from kuryr_kubernetes import k8s_cache
+from kuryr_kubernetes.tests import base as test_base
+from kuryr_kubernetes.tests.unit import kuryr_fixtures as k_fix
+
+NOW = 1600000000.0
+
+
+def _get_lease(name, renew_time, duration=15):
+    return {'metadata': {'name': name},
+            'spec': {'holderIdentity': name,
+                     'leaseDurationSeconds': duration,
+                     'renewTime': sharding._format_time(renew_time)}}
+
+
+def _get_node(name, node_ip):
+    return {'metadata': {'name': name},
+            'status': {'addresses': [{'address': node_ip}]}}
+
+
+def _get_pod(node_name):
+    return {'metadata': {'name': 'pod1', 'namespace': 'default'},
+            'spec': {'nodeName': node_name}}
+
+
+class TestHashRing(test_base.TestCase):
+
+    def test_get_member(self):
+        ring = sharding.HashRing(['ctrl-1', 'ctrl-2', 'ctrl-3'])
+        keys = ['node-%d' % i for i in range(100)]
+        owners = {key: ring.get_member(key) for key in keys}
+
+        self.assertEqual({'ctrl-1', 'ctrl-2', 'ctrl-3'}, set(owners.values()))
+        self.assertEqual(owners, {key: ring.get_member(key) for key in keys})
+
+    def test_get_member_empty(self):
+        self.assertIsNone(sharding.HashRing().get_member('node-1'))
+
+    def test_get_member_removed(self):
+        ring = sharding.HashRing(['ctrl-1', 'ctrl-2', 'ctrl-3'])
+        new_ring = sharding.HashRing(['ctrl-1', 'ctrl-2'])
+
+        for key in ('node-%d' % i for i in range(100)):
+            if ring.get_member(key) != 'ctrl-3':
+                # Only the keys of the removed member move
+                self.assertEqual(ring.get_member(key),
+                                 new_ring.get_member(key))
+
+
+class TestShardManager(test_base.TestCase):
+
+    def setUp(self):
+        super(TestShardManager, self).setUp()
+        self.k8s = self.useFixture(k_fix.MockK8sClient()).client
+        self.k8s.get.return_value = {'items': []}
+        self.manager = sharding.ShardManager('ctrl-1')
+
+    def _get_owned_key(self, ring, member):
+        return next(key for key in ('node-%d' % i for i in range(100))
+                    if ring.get_member(key) == member)
+
+    def test_refresh(self):
+        self.k8s.get.return_value = {'items': [
+            _get_lease('ctrl-1', NOW), _get_lease('ctrl-2', NOW - 5),
+            _get_lease('ctrl-3', NOW - 20)]}
+
+        self.assertTrue(self.manager.refresh(NOW))
+
+        self.k8s.patch.assert_called_once_with(
+            'spec', '/apis/coordination.k8s.io/v1/namespaces/kube-system/'
+                    'leases/ctrl-1', mock.ANY)
+        self.assertEqual({'ctrl-1', 'ctrl-2'}, self.manager._ring.members)
+        self.assertEqual(NOW + 15, self.manager._handoff_deadline)
+        self.assertFalse(self.manager.refresh(NOW + 1))
+
+    def test_refresh_create_lease(self):
+        self.k8s.patch.side_effect = exceptions.K8sResourceNotFound('lease')
+
+        self.manager.refresh(NOW)
+
+        self.k8s.post.assert_called_once()
+        lease = self.k8s.post.call_args[0][1]
+        self.assertEqual('ctrl-1', lease['metadata']['name'])
+        self.assertEqual(
+            {constants.K8S_LABEL_CONTROLLER_SHARD: 'true'},
+            lease['metadata']['labels'])
+        self.assertEqual({'ctrl-1'}, self.manager._ring.members)
+
+    def test_refresh_error(self):
+        self.manager.refresh(NOW)
+        self.k8s.patch.side_effect = exceptions.K8sClientException()
+
+        self.assertFalse(self.manager.refresh(NOW + 5))
+        self.assertEqual({'ctrl-1'}, self.manager._ring.members)
+
+        self.assertTrue(self.manager.refresh(NOW + 15))
+        self.assertEqual(set(), self.manager._ring.members)
+        self.assertFalse(self.manager.is_owner(sharding.LEADER_KEY))
+
+    def test_handoff(self):
+        self.k8s.get.return_value = {'items': [
+            _get_lease('ctrl-1', NOW), _get_lease('ctrl-2', NOW)]}
+        self.manager.refresh(NOW)
+        self.manager.complete_handoff(NOW + 15)
+        ring = self.manager._ring
+        kept = self._get_owned_key(ring, 'ctrl-1')
+        self.assertTrue(self.manager.is_owner(kept))
+
+        self.k8s.get.return_value = {'items': [_get_lease('ctrl-1', NOW)]}
+        self.manager.refresh(NOW + 5)
+        gained = self._get_owned_key(ring, 'ctrl-2')
+
+        # The keys of ctrl-2 are only taken over after the deadline
+        self.assertTrue(self.manager.is_owner(kept))
+        self.assertFalse(self.manager.is_owner(gained))
+        self.assertIsNone(self.manager.complete_handoff(NOW + 10))
+        self.assertEqual(ring, self.manager.complete_handoff(NOW + 20))
+        self.assertTrue(self.manager.is_owner(kept))
+        self.assertTrue(self.manager.is_owner(gained))
+
+        self.assertTrue(self.manager.is_gained(_get_pod(gained), ring))
+        self.assertTrue(self.manager.is_gained_key(gained, ring))
+        self.assertFalse(self.manager.is_gained_key(kept, ring))
+        self.assertFalse(self.manager.is_gained_key(None, ring))
+        # Every object is gained along with the leader key
+        self.assertEqual(ring.get_member(sharding.LEADER_KEY) == 'ctrl-2',
+                         self.manager.is_gained(_get_pod(kept), ring))
+
+    def test_handoff_start(self):
+        self.k8s.get.return_value = {'items': [
+            _get_lease('ctrl-1', NOW), _get_lease('ctrl-2', NOW)]}
+
+        self.manager.refresh(NOW)
+        gained = self._get_owned_key(self.manager._ring, 'ctrl-1')
+
+        # The keys are owned by ctrl-2 until it saw ctrl-1
+        self.assertFalse(self.manager.is_owner(gained))
+        self.assertTrue(self.manager.is_taking_over(gained))
+        previous_ring = self.manager.complete_handoff(NOW + 15)
+        self.assertEqual({'ctrl-2'}, previous_ring.members)
+        self.assertTrue(self.manager.is_owner(gained))
+        self.assertFalse(self.manager.is_taking_over(gained))
+        self.assertTrue(self.manager.is_gained(_get_pod(gained),
+                                               previous_ring))
+
+    def test_handoff_start_alone(self):
+        self.manager.refresh(NOW)
+
+        # No other controller owns the keys
+        self.assertTrue(self.manager.is_owner(sharding.LEADER_KEY))
+        self.assertFalse(self.manager.is_taking_over(sharding.LEADER_KEY))
+        self.assertIsNone(self.manager.complete_handoff(NOW + 15))
+
+    def test_handoff_lease_renewed(self):
+        self.manager.refresh(NOW)
+        self.k8s.patch.side_effect = exceptions.K8sClientException()
+        self.manager.refresh(NOW + 15)
+        self.manager.complete_handoff(NOW + 30)
+        self.k8s.patch.side_effect = None
+        self.k8s.get.return_value = {'items': [
+            _get_lease('ctrl-1', NOW + 35), _get_lease('ctrl-2', NOW + 35)]}
+
+        self.manager.refresh(NOW + 35)
+
+        # ctrl-2 took over the keys meanwhile
+        gained = self._get_owned_key(self.manager._ring, 'ctrl-1')
+        self.assertFalse(self.manager.is_owner(gained))
+        self.assertTrue(self.manager.is_taking_over(gained))
+
+    def test_handoff_lost(self):
+        self.manager.refresh(NOW)
+        self.manager.complete_handoff(NOW + 15)
+        self.assertTrue(self.manager.is_owner('node-1'))
+
+        self.k8s.get.return_value = {'items': [
+            _get_lease('ctrl-1', NOW), _get_lease('ctrl-2', NOW)]}
+        self.manager.refresh(NOW + 5)
+        lost = self._get_owned_key(self.manager._ring, 'ctrl-2')
+
+        # The keys moving to ctrl-2 are released right away
+        self.assertFalse(self.manager.is_owner(lost))
+
+    def test_is_owner_no_key(self):
+        self.manager.refresh(NOW)
+        self.manager.complete_handoff(NOW + 15)
+
+        self.assertFalse(self.manager.is_owner(None))
+        self.assertFalse(self.manager.is_taking_over(None))
+
+    def test_defer_deletion(self):
+        pod = _get_pod('node-1')
+        pod['metadata']['uid'] = 'a2b4c6d8'
+        event = {'type': 'DELETED', 'object': pod}
+
+        self.manager.defer_deletion(event)
+        self.manager.defer_deletion(event)
+
+        self.assertEqual([event], self.manager.pop_deferred_deletions())
+        self.assertEqual([], self.manager.pop_deferred_deletions())
+
+    def test_get_node_name(self):
+        self.k8s.get.return_value = {'items': [
+            _get_node('node-1', '10.0.0.1')]}
+
+        self.assertEqual('node-1',
+                         self.manager.get_node_name('10.0.0.1', NOW))
+        self.assertEqual('node-1',
+                         self.manager.get_node_name('10.0.0.1', NOW))
+        self.k8s.get.assert_called_once_with('/api/v1/nodes')
+
+        # Unknown IPs only list the nodes again after the refresh interval
+        self.assertIsNone(self.manager.get_node_name('10.0.0.2', NOW + 1))
+        self.assertIsNone(self.manager.get_node_name('10.0.0.3', NOW + 2))
+        self.k8s.get.assert_called_once()
+
+        self.k8s.get.return_value = {'items': [
+            _get_node('node-1', '10.0.0.1'), _get_node('node-2', '10.0.0.2')]}
+        self.assertEqual('node-2', self.manager.get_node_name(
+            '10.0.0.2', NOW + sharding.NODE_NAMES_REFRESH_INTERVAL))
+        self.assertEqual(2, self.k8s.get.call_count)
+
+    def test_get_node_name_cache(self):
+        self.addCleanup(k8s_cache.reset)
+        cache = k8s_cache.register(constants.K8S_OBJ_NODE, '/api/v1/nodes')
+        cache.replace([_get_node('node-1', '10.0.0.1')], '1')
+
+        self.assertEqual('node-1', self.manager.get_node_name('10.0.0.1'))
+        self.assertIsNone(self.manager.get_node_name('10.0.0.2'))
+
+        node = _get_node('node-2', '10.0.0.2')
+        node['metadata']['resourceVersion'] = '2'
+        cache.update({'type': 'ADDED', 'object': node})
+
+        self.assertEqual('node-2', self.manager.get_node_name('10.0.0.2'))
+        self.k8s.get.assert_not_called()
+
+    def test_release(self):
+        self.manager.refresh(NOW)
+
+        self.manager.release()
+
+        self.k8s.delete.assert_called_once_with(
+            '/apis/coordination.k8s.io/v1/namespaces/kube-system/leases/'
+            'ctrl-1')
+        self.assertFalse(self.manager.is_owner(sharding.LEADER_KEY))
+        self.assertEqual([], self.manager.pop_deferred_deletions())
+
+
+class TestShardFilter(test_base.TestCase):
+
+    def setUp(self):
+        super(TestShardFilter, self).setUp()
+        self.handler = mock.Mock()
+        self.manager = mock.Mock(spec=sharding.ShardManager)
+
+    def test_call_by_node(self):
+        shard_filter = sharding.ShardFilter(self.handler, self.manager,
+                                            constants.SHARDING_BY_NODE)
+        event = {'type': 'ADDED', 'object': _get_pod('node-1')}
+
+        shard_filter(event)
+
+        self.manager.is_owner.assert_called_once_with('node-1')
+        self.handler.assert_called_once_with(event)
+
+    def test_call_leader(self):
+        shard_filter = sharding.ShardFilter(self.handler, self.manager,
+                                            constants.SHARDING_LEADER)
+        self.manager.is_owner.return_value = False
+
+        shard_filter({'type': 'ADDED', 'object': _get_pod('node-1')})
+
+        self.manager.is_owner.assert_called_once_with(sharding.LEADER_KEY)
+        self.handler.assert_not_called()
+
+    def test_call_taking_over(self):
+        shard_filter = sharding.ShardFilter(self.handler, self.manager,
+                                            constants.SHARDING_BY_NODE)
+        self.manager.is_owner.return_value = False
+        self.manager.is_taking_over.return_value = True
+        event = {'type': 'DELETED', 'object': _get_pod('node-1')}
+
+        shard_filter({'type': 'MODIFIED', 'object': _get_pod('node-1')})
+        shard_filter(event)
+
+        self.handler.assert_not_called()
+        self.manager.defer_deletion.assert_called_once_with(event)
+
+    def test_getattr(self):
+        shard_filter = sharding.ShardFilter(self.handler, self.manager,
+                                            constants.SHARDING_LEADER)
+
+        self.assertEqual(self.handler.set_liveness,
+                         shard_filter.set_liveness)
@@ -13,123 +13,338 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import queue
 from unittest import mock
 
 from kuryr_kubernetes.handlers import asynchronous as h_async
 from kuryr_kubernetes.tests import base as test_base
+from kuryr_kubernetes.tests.unit import kuryr_fixtures as k_fix
+
+
+def get_event(event_type, resource_version, uid='a2b4c6d8', kind='Pod'):
+    return {'type': event_type,
+            'object': {'kind': kind,
+                       'metadata': {'uid': uid,
+                                    'resourceVersion': resource_version}}}
+
+
+def get_uid(event):
+    return event['object']['metadata']['uid']
+
+
+def get_kind(event):
+    return event['object']['kind']
+
+
+def get_priority(event):
+    return 0 if event['type'] == 'ADDED' else 1
+
+
+def get_debounce(event):
+    return (2, 10) if event['type'] == 'MODIFIED' else None
+
+
+def get_serial(event):
+    return event['object'].get('owner', get_uid(event))
 
 
 class TestAsyncHandler(test_base.TestCase):
 
+    def setUp(self):
+        super(TestAsyncHandler, self).setUp()
+        self.k8s = self.useFixture(k_fix.MockK8sClient()).client
+        self.k8s.get_annotated_resource_version.return_value = None
+
+    def _get_async_handler(self, m_handler=None, m_tg=None, **kwargs):
+        return h_async.Async(m_handler or mock.Mock(), m_tg or mock.Mock(),
+                             get_uid, quota_by=get_kind,
+                             prioritize=get_priority, **kwargs)
+
     def test_call(self):
-        event = mock.sentinel.event
-        group = mock.sentinel.group
-        m_queue = mock.Mock()
+        event = get_event('ADDED', '122')
         m_handler = mock.Mock()
-        m_group_by = mock.Mock(return_value=group)
-        async_handler = h_async.Async(m_handler, mock.Mock(), m_group_by)
-        async_handler._queues[group] = m_queue
+        m_tg = mock.Mock()
+        async_handler = self._get_async_handler(m_handler, m_tg, workers=3)
 
         async_handler(event)
+        async_handler(get_event('ADDED', '123', uid='b1'))
 
         m_handler.assert_not_called()
-        self.assertEqual({group: m_queue}, async_handler._queues)
-        m_queue.put.assert_called_once_with(event)
-
-    @mock.patch('queue.Queue')
-    def test_call_new(self, m_queue_type):
-        event = mock.sentinel.event
-        group = mock.sentinel.group
-        queue_depth = mock.sentinel.queue_depth
-        m_queue = mock.Mock()
-        m_queue_type.return_value = m_queue
-        m_handler = mock.Mock()
-        m_th = mock.Mock()
-        m_tg = mock.Mock()
-        m_tg.add_thread.return_value = m_th
-        m_group_by = mock.Mock(return_value=group)
-        async_handler = h_async.Async(m_handler, m_tg, m_group_by,
-                                      queue_depth=queue_depth)
+        self.assertEqual(3, m_tg.add_thread.call_count)
+        m_tg.add_thread.assert_called_with(async_handler._run)
+        self.assertEqual(event, async_handler._pending['a2b4c6d8'])
+        self.assertEqual(('Pod', 'a2b4c6d8'), async_handler._pop_ready())
+
+    def test_call_superseded(self):
+        event = get_event('MODIFIED', '123')
+        async_handler = self._get_async_handler()
 
+        async_handler(get_event('ADDED', '122'))
         async_handler(event)
 
-        m_handler.assert_not_called()
-        m_queue_type.assert_called_once_with(queue_depth)
-        self.assertEqual({group: m_queue}, async_handler._queues)
-        m_tg.add_thread.assert_called_once_with(async_handler._run, group,
-                                                m_queue)
-        m_th.link.assert_called_once_with(async_handler._done, group)
-        m_queue.put.assert_called_once_with(event)
+        self.assertEqual({'a2b4c6d8': event}, async_handler._pending)
+        self.assertEqual(('Pod', 'a2b4c6d8'), async_handler._pop_ready())
+        self.assertIsNone(async_handler._pop_ready())
+
+    def test_call_busy(self):
+        event = get_event('MODIFIED', '123')
+        async_handler = self._get_async_handler()
+        async_handler._busy.add('a2b4c6d8')
+
+        async_handler(event)
+
+        self.assertEqual({'a2b4c6d8': event}, async_handler._pending)
+        self.assertIsNone(async_handler._pop_ready())
+
+    def test_call_serialized(self):
+        events = [get_event('ADDED', '122', uid='a'),
+                  get_event('MODIFIED', '123', uid='b')]
+        for event in events:
+            event['object']['owner'] = 'svc'
+        async_handler = self._get_async_handler(serialize_by=get_serial)
+
+        for event in events:
+            async_handler(event)
+
+        self.assertEqual({'a': events[0], 'b': events[1]},
+                         async_handler._pending)
+        self.assertEqual(('Pod', 'svc'), async_handler._pop_ready())
+        self.assertIsNone(async_handler._pop_ready())
+
+    def test_pop_ready_priority(self):
+        async_handler = self._get_async_handler()
+
+        async_handler(get_event('MODIFIED', '122', uid='modified'))
+        async_handler(get_event('DELETED', '123', uid='deleted'))
+        async_handler(get_event('ADDED', '124', uid='added',
+                                kind='Endpoints'))
+
+        self.assertEqual(('Endpoints', 'added'), async_handler._pop_ready())
+        self.assertEqual(('Pod', 'modified'), async_handler._pop_ready())
+        self.assertEqual(('Pod', 'deleted'), async_handler._pop_ready())
+        self.assertIsNone(async_handler._pop_ready())
+
+    def test_pop_ready_quota(self):
+        async_handler = self._get_async_handler(quotas={'Endpoints': 1})
+        async_handler._running['Endpoints'] = 1
+
+        async_handler(get_event('ADDED', '122', uid='ep', kind='Endpoints'))
+        async_handler(get_event('MODIFIED', '123', uid='pod'))
+
+        self.assertEqual(('Pod', 'pod'), async_handler._pop_ready())
+        self.assertIsNone(async_handler._pop_ready())
+        async_handler._running['Endpoints'] = 0
+        self.assertEqual(('Endpoints', 'ep'), async_handler._pop_ready())
+
+    @mock.patch('time.monotonic')
+    def test_call_debounced(self, m_monotonic):
+        event = get_event('MODIFIED', '123')
+        async_handler = self._get_async_handler(debounce_by=get_debounce)
+        m_monotonic.return_value = 100
+
+        async_handler(event)
+
+        self.assertEqual({'a2b4c6d8': event}, async_handler._pending)
+        m_monotonic.return_value = 101.9
+        self.assertIsNone(async_handler._pop_ready())
+        self.assertAlmostEqual(0.1, async_handler._get_wait_timeout())
+        m_monotonic.return_value = 102
+        self.assertEqual(('Pod', 'a2b4c6d8'), async_handler._pop_ready())
+        self.assertFalse(async_handler._deferred)
+
+    @mock.patch('time.monotonic')
+    def test_call_debounced_superseded(self, m_monotonic):
+        async_handler = self._get_async_handler(debounce_by=get_debounce)
+
+        # The event is deferred by each newer one up to the max delay
+        for now in range(100, 110):
+            m_monotonic.return_value = now
+            async_handler(get_event('MODIFIED', str(now)))
+            self.assertIsNone(async_handler._pop_ready())
+
+        self.assertEqual((100, 110), async_handler._deferred['a2b4c6d8'])
+        m_monotonic.return_value = 110
+        self.assertEqual(('Pod', 'a2b4c6d8'), async_handler._pop_ready())
+        self.assertEqual('109', async_handler._pending['a2b4c6d8'][
+            'object']['metadata']['resourceVersion'])
+        self.assertIsNone(async_handler._pop_ready())
+
+    @mock.patch('time.monotonic')
+    def test_call_debounced_not_debounced_event(self, m_monotonic):
+        event = get_event('DELETED', '124')
+        async_handler = self._get_async_handler(debounce_by=get_debounce)
+        m_monotonic.return_value = 100
+
+        async_handler(get_event('MODIFIED', '123'))
+        async_handler(event)
+
+        self.assertEqual({'a2b4c6d8': event}, async_handler._pending)
+        self.assertEqual(('Pod', 'a2b4c6d8'), async_handler._pop_ready())
+        self.assertFalse(async_handler._deferred)
+
+    @mock.patch('time.monotonic')
+    def test_call_debounced_busy(self, m_monotonic):
+        async_handler = self._get_async_handler(debounce_by=get_debounce)
+        async_handler._busy.add('a2b4c6d8')
+        m_monotonic.return_value = 100
+
+        async_handler(get_event('MODIFIED', '123'))
+
+        m_monotonic.return_value = 102
+        self.assertIsNone(async_handler._pop_ready())
+        self.assertFalse(async_handler._deferred)
+        self.assertIn('a2b4c6d8', async_handler._pending)
+
+    def test_get_wait_timeout(self):
+        async_handler = self._get_async_handler(debounce_by=get_debounce)
+
+        self.assertIsNone(async_handler._get_wait_timeout())
+
+    @mock.patch('itertools.count')
+    @mock.patch('time.monotonic')
+    def test_run_debounced(self, m_monotonic, m_count):
+        events = [get_event('ADDED', '122'), get_event('MODIFIED', '123')]
+        async_handler = self._get_async_handler(debounce_by=get_debounce)
+        m_handler = mock.Mock()
+        m_handler.side_effect = lambda event: async_handler(events[1])
+        async_handler._handler = m_handler
+        m_count.return_value = [1]
+        m_monotonic.return_value = 100
+        async_handler(events[0])
+
+        async_handler._run()
+
+        # The event arrived while handling the previous one is deferred
+        m_handler.assert_called_once_with(events[0])
+        self.assertIsNone(async_handler._pop_ready())
+        m_monotonic.return_value = 102
+        self.assertEqual(('Pod', 'a2b4c6d8'), async_handler._pop_ready())
 
     @mock.patch('itertools.count')
     def test_run(self, m_count):
-        event = mock.sentinel.event
-        group = mock.sentinel.group
-        m_queue = mock.Mock()
-        m_queue.empty.return_value = True
-        m_queue.get.return_value = event
+        event = get_event('ADDED', '122')
         m_handler = mock.Mock()
         m_count.return_value = [1]
-        async_handler = h_async.Async(m_handler, mock.Mock(), mock.Mock(),
-                                      queue_depth=1)
+        async_handler = self._get_async_handler(m_handler)
+        async_handler(event)
 
-        with mock.patch('time.sleep'):
-            async_handler._run(group, m_queue)
+        async_handler._run()
 
         m_handler.assert_called_once_with(event)
+        self.assertFalse(async_handler._pending)
+        self.assertFalse(async_handler._busy)
+        self.assertEqual(0, async_handler._running['Pod'])
+
+    @mock.patch('itertools.count')
+    def test_run_pending(self, m_count):
+        events = [get_event('ADDED', '122'), get_event('MODIFIED', '123')]
+        async_handler = self._get_async_handler()
+        m_handler = mock.Mock()
+        m_handler.side_effect = lambda event: async_handler(events[1])
+        async_handler._handler = m_handler
+        m_count.return_value = list(range(2))
+        async_handler(events[0])
+
+        async_handler._run()
+
+        m_handler.assert_has_calls([mock.call(event) for event in events])
+        self.assertEqual(len(events), m_handler.call_count)
 
     @mock.patch('itertools.count')
-    def test_run_empty(self, m_count):
-        events = [mock.sentinel.event1, mock.sentinel.event2]
-        group = mock.sentinel.group
-        m_queue = mock.Mock()
-        m_queue.empty.return_value = True
-        m_queue.get.side_effect = events + [queue.Empty()]
+    def test_run_serialized(self, m_count):
+        events = [get_event('ADDED', '122', uid='a'),
+                  get_event('MODIFIED', '123', uid='b'),
+                  get_event('MODIFIED', '124', uid='a')]
+        for event in events:
+            event['object']['owner'] = 'svc'
+        async_handler = self._get_async_handler(serialize_by=get_serial)
         m_handler = mock.Mock()
-        m_count.return_value = list(range(5))
-        async_handler = h_async.Async(m_handler, mock.Mock(), mock.Mock())
 
-        with mock.patch('time.sleep'):
-            async_handler._run(group, m_queue)
+        def handle(event):
+            # The other events of the serial group wait for this one
+            self.assertIsNone(async_handler._pop_ready())
+            if m_handler.call_count == 1:
+                async_handler(events[2])
+
+        m_handler.side_effect = handle
+        async_handler._handler = m_handler
+        m_count.return_value = list(range(3))
+        async_handler(events[0])
+        async_handler(events[1])
+
+        async_handler._run()
 
         m_handler.assert_has_calls([mock.call(event) for event in events])
         self.assertEqual(len(events), m_handler.call_count)
+        self.assertFalse(async_handler._pending)
+        self.assertFalse(async_handler._queued)
+        self.assertFalse(async_handler._busy)
+
+    @mock.patch('itertools.count')
+    def test_run_exception(self, m_count):
+        m_handler = mock.Mock(side_effect=Exception)
+        m_count.return_value = [1]
+        async_handler = self._get_async_handler(m_handler)
+        async_handler(get_event('ADDED', '122'))
+
+        with mock.patch.object(h_async.LOG, 'exception') as m_exception:
+            async_handler._run()
+
+        m_exception.assert_called_once()
+        self.assertFalse(async_handler._busy)
+        self.assertEqual(0, async_handler._running['Pod'])
 
     @mock.patch('itertools.count')
     def test_run_stale(self, m_count):
-        events = [mock.sentinel.event1, mock.sentinel.event2]
-        group = mock.sentinel.group
-        m_queue = mock.Mock()
-        m_queue.empty.side_effect = [False, True, True]
-        m_queue.get.side_effect = events + [queue.Empty()]
         m_handler = mock.Mock()
-        m_count.return_value = list(range(5))
-        async_handler = h_async.Async(m_handler, mock.Mock(), mock.Mock())
+        m_count.return_value = [1]
+        self.k8s.get_annotated_resource_version.return_value = '124'
+        async_handler = self._get_async_handler(m_handler)
+        async_handler(get_event('MODIFIED', '122'))
+
+        async_handler._run()
+
+        m_handler.assert_not_called()
+        self.k8s.forget_annotated_resource_version.assert_not_called()
+
+    @mock.patch('itertools.count')
+    def test_run_annotated(self, m_count):
+        event = get_event('MODIFIED', '124')
+        m_handler = mock.Mock()
+        m_count.return_value = [1]
+        self.k8s.get_annotated_resource_version.return_value = '124'
+        async_handler = self._get_async_handler(m_handler)
+        async_handler(event)
 
-        with mock.patch('time.sleep'):
-            async_handler._run(group, m_queue)
+        async_handler._run()
 
-        m_handler.assert_called_once_with(mock.sentinel.event2)
+        m_handler.assert_called_once_with(event)
+        self.k8s.forget_annotated_resource_version.assert_called_once_with(
+            'a2b4c6d8', '124')
 
-    def test_done(self):
-        group = mock.sentinel.group
-        m_queue = mock.Mock()
-        async_handler = h_async.Async(mock.Mock(), mock.Mock(), mock.Mock())
-        async_handler._queues[group] = m_queue
+    @mock.patch('itertools.count')
+    def test_run_not_ordered(self, m_count):
+        event = get_event('MODIFIED', 'abc')
+        m_handler = mock.Mock()
+        m_count.return_value = [1]
+        self.k8s.get_annotated_resource_version.return_value = 'def'
+        async_handler = self._get_async_handler(m_handler)
+        async_handler(event)
 
-        async_handler._done(mock.Mock(), group)
+        async_handler._run()
 
-        self.assertFalse(async_handler._queues)
+        m_handler.assert_called_once_with(event)
 
-    @mock.patch('kuryr_kubernetes.handlers.asynchronous.LOG.critical')
-    def test_done_terminated(self, m_critical):
-        group = mock.sentinel.group
-        m_queue = mock.Mock()
-        m_queue.empty.return_value = False
-        async_handler = h_async.Async(mock.Mock(), mock.Mock(), mock.Mock())
-        async_handler._queues[group] = m_queue
+    @mock.patch('itertools.count')
+    def test_run_deleted(self, m_count):
+        event = get_event('DELETED', '122')
+        m_handler = mock.Mock()
+        m_count.return_value = [1]
+        self.k8s.get_annotated_resource_version.return_value = '124'
+        async_handler = self._get_async_handler(m_handler)
+        async_handler(event)
 
-        async_handler._done(mock.Mock(), group)
+        async_handler._run()
 
-        m_critical.assert_called_once()
+        m_handler.assert_called_once_with(event)
+        self.k8s.forget_annotated_resource_version.assert_called_once_with(
+            'a2b4c6d8')
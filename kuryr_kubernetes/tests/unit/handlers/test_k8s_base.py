@@ -16,6 +16,7 @@
 from unittest import mock
 
 from kuryr_kubernetes.handlers import k8s_base as h_k8s
+from kuryr_kubernetes import metrics
 from kuryr_kubernetes.tests import base as test_base
 
 
@@ -62,3 +63,15 @@ class TestResourceEventHandler(test_base.TestCase):
         handler(event)
 
         self.assertTrue(True)
+
+    @mock.patch.object(h_k8s.ResourceEventHandler, 'on_deleted')
+    def test_duration_observed(self, m_deleted):
+        labels = {'handler': 'ResourceEventHandler', 'event': 'DELETED'}
+        name = 'kuryr_handler_duration_seconds_count'
+        count = metrics.REGISTRY.get_sample_value(name, labels) or 0
+        handler = h_k8s.ResourceEventHandler()
+
+        handler({'type': 'DELETED', 'object': mock.sentinel.obj})
+
+        self.assertEqual(count + 1,
+                         metrics.REGISTRY.get_sample_value(name, labels))
@@ -20,6 +20,7 @@ import time
 
 from kuryr_kubernetes import exceptions
 from kuryr_kubernetes.handlers import retry as h_retry
+from kuryr_kubernetes import k8s_cache
 from kuryr_kubernetes.tests import base as test_base
 from kuryr_kubernetes.tests.unit import kuryr_fixtures as k_fix
 
@@ -118,6 +119,44 @@ class TestRetryHandler(test_base.TestCase):
         m_handler.assert_not_called()
         m_sleep.assert_not_called()
 
+    @mock.patch('itertools.count')
+    @mock.patch.object(h_retry.Retry, '_sleep')
+    def test_call_outdated_event_cached(self, m_sleep, m_count):
+        m_handler = mock.Mock()
+        m_count.return_value = list(range(1, 5))
+        self.addCleanup(k8s_cache.reset)
+        k8s_cache.register('Pod', '/api/v1/pods').replace([])
+        obj = {'kind': 'Pod',
+               'metadata': {'name': 'pod1', 'namespace': 'default',
+                            'selfLink': mock.sentinel.selflink}}
+        event = {'type': 'MODIFIED', 'object': obj}
+
+        retry = h_retry.Retry(m_handler)
+        retry(event)
+
+        self.k8s.get.assert_not_called()
+        m_handler.assert_not_called()
+        m_sleep.assert_not_called()
+
+    @mock.patch('itertools.count')
+    @mock.patch.object(h_retry.Retry, '_sleep')
+    def test_call_cached(self, m_sleep, m_count):
+        m_handler = mock.Mock()
+        m_count.return_value = list(range(1, 5))
+        obj = {'kind': 'Pod',
+               'metadata': {'name': 'pod1', 'namespace': 'default',
+                            'selfLink': mock.sentinel.selflink}}
+        self.addCleanup(k8s_cache.reset)
+        k8s_cache.register('Pod', '/api/v1/pods').replace([obj])
+        event = {'type': 'MODIFIED', 'object': obj}
+
+        retry = h_retry.Retry(m_handler)
+        retry(event)
+
+        self.k8s.get.assert_not_called()
+        m_handler.assert_called_once_with(event)
+        m_sleep.assert_not_called()
+
     @mock.patch('itertools.count')
     @mock.patch.object(h_retry.Retry, '_sleep')
     def test_call_retry(self, m_sleep, m_count):
@@ -0,0 +1,223 @@
+# Copyright 2020 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from kuryr_kubernetes import k8s_cache
+from kuryr_kubernetes.tests import base as test_base
+
+
+def _get_pod(name, namespace='default', labels=None, rv='1'):
+    return {'kind': 'Pod',
+            'metadata': {'name': name, 'namespace': namespace,
+                         'labels': labels or {}, 'resourceVersion': rv}}
+
+
+class TestResourceCache(test_base.TestCase):
+
+    def setUp(self):
+        super(TestResourceCache, self).setUp()
+        self.cache = k8s_cache.ResourceCache('Pod', '/api/v1/pods')
+
+    def test_replace(self):
+        self.cache.update({'type': 'ADDED', 'object': _get_pod('old')})
+        pod = {'metadata': {'name': 'pod1', 'namespace': 'ns1'}}
+
+        self.cache.replace([pod], '42')
+
+        self.assertTrue(self.cache.has_synced())
+        self.assertEqual('42', self.cache.resource_version)
+        self.assertEqual('Pod', self.cache.get('pod1', 'ns1')['kind'])
+        self.assertIsNone(self.cache.get('old', 'default'))
+
+    def test_resync(self):
+        kept = _get_pod('kept')
+        modified = _get_pod('modified')
+        deleted = _get_pod('deleted')
+        self.cache.replace([kept, modified, deleted], '1')
+        new_modified = _get_pod('modified', rv='2')
+        added = _get_pod('added', rv='3')
+
+        events = self.cache.resync([kept, new_modified, added], '3')
+
+        self.assertEqual([{'type': 'MODIFIED', 'object': new_modified},
+                          {'type': 'ADDED', 'object': added},
+                          {'type': 'DELETED', 'object': deleted}], events)
+        self.assertEqual('3', self.cache.resource_version)
+        self.assertIsNone(self.cache.get('deleted', 'default'))
+        self.assertIs(added, self.cache.get('added', 'default'))
+
+    def test_update(self):
+        pod = _get_pod('pod1')
+        new_pod = _get_pod('pod1', rv='2')
+
+        self.cache.update({'type': 'ADDED', 'object': pod})
+        self.assertIs(pod, self.cache.get('pod1', 'default'))
+
+        self.cache.update({'type': 'MODIFIED', 'object': new_pod})
+        self.assertIs(new_pod, self.cache.get('pod1', 'default'))
+        self.assertEqual('2', self.cache.resource_version)
+
+        self.cache.update({'type': 'DELETED', 'object': new_pod})
+        self.assertIsNone(self.cache.get('pod1', 'default'))
+        self.assertEqual([], self.cache.list())
+
+    def test_get_by_uid(self):
+        pod = _get_pod('pod1')
+        pod['metadata']['uid'] = 'uid1'
+        self.cache.update({'type': 'ADDED', 'object': pod})
+        self.assertIs(pod, self.cache.get_by_uid('uid1'))
+
+        # Recreated under the same name
+        new_pod = _get_pod('pod1', rv='2')
+        new_pod['metadata']['uid'] = 'uid2'
+        self.cache.resync([new_pod], '2')
+        self.assertIsNone(self.cache.get_by_uid('uid1'))
+        self.assertIs(new_pod, self.cache.get_by_uid('uid2'))
+
+        self.cache.update({'type': 'DELETED', 'object': new_pod})
+        self.assertIsNone(self.cache.get_by_uid('uid2'))
+
+    def test_update_error(self):
+        self.cache.update({'type': 'ERROR', 'object': {'code': 410}})
+
+        self.assertEqual([], self.cache.list())
+        self.assertIsNone(self.cache.resource_version)
+
+    def test_list(self):
+        pod1 = _get_pod('pod1', 'ns1', {'app': 'a'})
+        pod2 = _get_pod('pod2', 'ns2', {'app': 'b'})
+        pod3 = _get_pod('pod3', 'ns2', {'app': 'a'})
+        self.cache.replace([pod1, pod2, pod3])
+
+        self.assertCountEqual([pod1, pod2, pod3], self.cache.list())
+        self.assertCountEqual([pod2, pod3], self.cache.list('ns2'))
+        self.assertEqual([], self.cache.list('ns3'))
+        self.assertCountEqual(
+            [pod1, pod3],
+            self.cache.list(label_filter=lambda l: l.get('app') == 'a'))
+        self.assertEqual(
+            [pod3],
+            self.cache.list('ns2', lambda l: l.get('app') == 'a'))
+
+
+class TestCacheRegistry(test_base.TestCase):
+
+    def setUp(self):
+        super(TestCacheRegistry, self).setUp()
+        self.addCleanup(k8s_cache.reset)
+
+    def test_register(self):
+        cache = k8s_cache.register('Pod', '/api/v1/pods')
+
+        self.assertIs(cache, k8s_cache.register('Pod', '/api/v1/pods'))
+        self.assertIs(cache, k8s_cache.get_cache_for_path('/api/v1/pods'))
+        self.assertIsNone(k8s_cache.get_cache_for_path('/api/v1/services'))
+
+    def test_register_filtered(self):
+        cache = k8s_cache.register('Pod',
+                                   '/api/v1/pods?fieldSelector=spec.nodeName')
+
+        self.assertIsNone(cache)
+        self.assertIsNone(k8s_cache.get_cache_for_path(
+            '/api/v1/pods?fieldSelector=spec.nodeName'))
+
+    def test_get_cache(self):
+        cache = k8s_cache.register('Pod', '/api/v1/pods')
+        self.assertIsNone(k8s_cache.get_cache('Pod'))
+
+        cache.replace([])
+        self.assertIs(cache, k8s_cache.get_cache('Pod'))
+
+        cache.invalidate()
+        self.assertIsNone(k8s_cache.get_cache('Pod'))
+
+    def test_get_for_link(self):
+        pods = k8s_cache.register('Pod', '/api/v1/pods')
+        namespaces = k8s_cache.register('Namespace', '/api/v1/namespaces')
+        pod = _get_pod('pod1', 'ns1')
+        namespace = {'metadata': {'name': 'ns1'}}
+        link = '/api/v1/namespaces/ns1/pods/pod1'
+        self.assertIsNone(k8s_cache.get_for_link(link))
+
+        pods.replace([pod])
+        namespaces.replace([namespace])
+        self.assertIs(pod, k8s_cache.get_for_link(link))
+        self.assertIs(namespace,
+                      k8s_cache.get_for_link('/api/v1/namespaces/ns1'))
+        self.assertIsNone(k8s_cache.get_for_link(
+            '/api/v1/namespaces/ns1/pods/pod2'))
+        self.assertIsNone(k8s_cache.get_for_link(
+            '/api/v1/namespaces/ns1/services/svc1'))
+
+
+class TestLabelSelector(test_base.TestCase):
+
+    def setUp(self):
+        super(TestLabelSelector, self).setUp()
+        self.cache = k8s_cache.ResourceCache('Pod', '/api/v1/pods')
+        self.pod1 = _get_pod('pod1', 'ns1', {'app': 'a', 'tier': 'web'})
+        self.pod2 = _get_pod('pod2', 'ns1', {'app': 'b', 'tier': 'db'})
+        self.pod3 = _get_pod('pod3', 'ns2', {'app': 'a'})
+        self.pod4 = _get_pod('pod4', 'ns2')
+        self.cache.replace([self.pod1, self.pod2, self.pod3, self.pod4])
+
+    def _select(self, selector, namespace=None):
+        return self.cache.select(k8s_cache.LabelSelector.from_k8s(selector),
+                                 namespace)
+
+    def test_select_empty(self):
+        self.assertCountEqual([self.pod1, self.pod2, self.pod3, self.pod4],
+                              self._select({}))
+        self.assertCountEqual([self.pod3, self.pod4],
+                              self._select({}, 'ns2'))
+
+    def test_select_labels(self):
+        self.assertCountEqual([self.pod1, self.pod3],
+                              self._select({'matchLabels': {'app': 'a'}}))
+        self.assertEqual([self.pod1],
+                         self._select({'matchLabels': {'app': 'a',
+                                                       'tier': 'web'}}))
+        self.assertEqual([self.pod3],
+                         self._select({'selector': {'app': 'a'}}, 'ns2'))
+        self.assertEqual([], self._select({'matchLabels': {'app': 'c'}}))
+
+    def test_select_expressions(self):
+        self.assertCountEqual(
+            [self.pod1, self.pod2],
+            self._select({'matchExpressions': [
+                {'key': 'app', 'operator': 'In', 'values': ['a', 'b']},
+                {'key': 'tier', 'operator': 'Exists'}]}))
+        self.assertCountEqual(
+            [self.pod2, self.pod4],
+            self._select({'matchExpressions': [
+                {'key': 'app', 'operator': 'NotIn', 'values': ['a']}]}))
+        self.assertCountEqual(
+            [self.pod3, self.pod4],
+            self._select({'matchExpressions': [
+                {'key': 'tier', 'operator': 'DoesNotExist'}]}))
+        self.assertEqual(
+            [self.pod3],
+            self._select({'matchLabels': {'app': 'a'},
+                          'matchExpressions': [
+                              {'key': 'tier', 'operator': 'DoesNotExist'}]}))
+
+    def test_select_relabeled(self):
+        pod1 = _get_pod('pod1', 'ns1', {'app': 'b'})
+        self.cache.update({'type': 'MODIFIED', 'object': pod1})
+        self.cache.update({'type': 'DELETED', 'object': self.pod2})
+
+        self.assertEqual([self.pod3],
+                         self._select({'matchLabels': {'app': 'a'}}))
+        self.assertEqual([pod1], self._select({'matchLabels': {'app': 'b'}}))
+        self.assertEqual([], self._select({'matchExpressions': [
+            {'key': 'tier', 'operator': 'Exists'}]}))
@@ -12,11 +12,18 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
+import copy
+import gc
 import itertools
 import os
 import tempfile
+import threading
+import time
 from unittest import mock
 
+from testtools import content
+
+import httpx
 from oslo_serialization import jsonutils
 import requests
 
@@ -35,6 +42,8 @@ class TestK8sClient(test_base.TestCase):
         m_cfg.kubernetes.ssl_ca_crt_file = None
         m_cfg.kubernetes.token_file = None
         m_cfg.kubernetes.ssl_verify_server_crt = False
+        m_cfg.kubernetes.json_backend = 'auto'
+        m_cfg.kubernetes.use_http2 = False
         self.client = k8s_client.K8sClient(self.base_url)
         default_cert = (None, None)
         default_token = None
@@ -50,12 +59,39 @@ class TestK8sClient(test_base.TestCase):
         m_cfg.kubernetes.ssl_ca_crt_file = 'dummy_ca_file_path'
         m_cfg.kubernetes.token_file = None
         m_cfg.kubernetes.ssl_verify_server_crt = True
+        m_cfg.kubernetes.use_http2 = False
         m_exist.return_value = True
         test_client = k8s_client.K8sClient(self.base_url)
         cert = ('dummy_crt_file_path', 'dummy_key_file_path')
         self.assertEqual(cert, test_client.cert)
         self.assertEqual('dummy_ca_file_path', test_client.verify_server)
 
+    @mock.patch.object(k8s_client, 'HTTP2Session')
+    @mock.patch.object(k8s_client, 'httpx')
+    @mock.patch('kuryr_kubernetes.config.CONF')
+    def test_http2_client_init(self, m_cfg, m_httpx, m_session):
+        m_cfg.kubernetes.ssl_client_crt_file = None
+        m_cfg.kubernetes.ssl_client_key_file = None
+        m_cfg.kubernetes.token_file = None
+        m_cfg.kubernetes.ssl_verify_server_crt = False
+        m_cfg.kubernetes.use_http2 = True
+
+        test_client = k8s_client.K8sClient(self.base_url)
+
+        self.assertEqual(m_session.return_value, test_client.session)
+        m_session.assert_called_once_with((None, None), False)
+
+    @mock.patch.object(k8s_client, 'httpx', None)
+    @mock.patch('kuryr_kubernetes.config.CONF')
+    def test_http2_client_init_no_httpx(self, m_cfg):
+        m_cfg.kubernetes.ssl_client_crt_file = None
+        m_cfg.kubernetes.ssl_client_key_file = None
+        m_cfg.kubernetes.token_file = None
+        m_cfg.kubernetes.ssl_verify_server_crt = False
+        m_cfg.kubernetes.use_http2 = True
+
+        self.assertRaises(RuntimeError, k8s_client.K8sClient, self.base_url)
+
     @mock.patch('kuryr_kubernetes.config.CONF')
     def test_https_client_init_invalid_client_crt_path(self, m_cfg):
         m_cfg.kubernetes.ssl_client_crt_file = 'dummy_crt_file_path'
@@ -98,6 +134,7 @@ class TestK8sClient(test_base.TestCase):
             token_file.write(token_content)
             token_file.close()
             m_cfg.kubernetes.ssl_verify_server_crt = False
+            m_cfg.kubernetes.use_http2 = False
 
             path = '/test'
             client = k8s_client.K8sClient(self.base_url)
@@ -157,6 +194,50 @@ class TestK8sClient(test_base.TestCase):
                                         data=data, headers=mock.ANY,
                                         cert=(None, None), verify=False)
 
+    @mock.patch('itertools.count')
+    @mock.patch('requests.sessions.Session.patch')
+    def test_annotate_resource_version_feedback(self, m_patch, m_count):
+        m_count.return_value = list(range(1, 5))
+        path = '/test'
+        annotations = {'a1': 'v1'}
+        uid = 'a2b4c6d8'
+        m_resp = mock.MagicMock()
+        m_resp.ok = True
+        m_resp.json.return_value = {'metadata': {'annotations': annotations,
+                                                 'uid': uid,
+                                                 'resourceVersion': '124'}}
+        m_patch.return_value = m_resp
+
+        self.assertIsNone(self.client.get_annotated_resource_version(uid))
+        self.client.annotate(path, annotations, resource_version='123')
+        self.assertEqual('124',
+                         self.client.get_annotated_resource_version(uid))
+        # Only events at or past the annotation drop the version
+        self.client.forget_annotated_resource_version(uid, '123')
+        self.assertEqual('124',
+                         self.client.get_annotated_resource_version(uid))
+        self.client.forget_annotated_resource_version(uid, '124')
+        self.assertIsNone(self.client.get_annotated_resource_version(uid))
+
+        self.client.annotate(path, annotations, resource_version='123')
+        self.client.forget_annotated_resource_version(uid)
+        self.assertIsNone(self.client.get_annotated_resource_version(uid))
+
+    @mock.patch('kuryr_kubernetes.k8s_client.ANNOTATED_VERSIONS_MAX', 2)
+    def test_annotated_resource_versions_bounded(self):
+        for uid in ('uid1', 'uid2', 'uid3'):
+            self.client._set_annotated_resource_version(uid, '1')
+        self.client._set_annotated_resource_version('uid2', '2')
+        self.client._set_annotated_resource_version('uid4', '1')
+
+        # The least recently annotated resources are forgotten first
+        self.assertIsNone(self.client.get_annotated_resource_version('uid1'))
+        self.assertIsNone(self.client.get_annotated_resource_version('uid3'))
+        self.assertEqual('2',
+                         self.client.get_annotated_resource_version('uid2'))
+        self.assertEqual('1',
+                         self.client.get_annotated_resource_version('uid4'))
+
     @mock.patch('itertools.count')
     @mock.patch('requests.sessions.Session.patch')
     def test_annotate_exception(self, m_patch, m_count):
@@ -320,6 +401,174 @@ class TestK8sClient(test_base.TestCase):
                                         headers=mock.ANY,
                                         cert=(None, None), verify=False)
 
+    @mock.patch('kuryr_kubernetes.k8s_cache.get_for_link')
+    @mock.patch('itertools.count')
+    @mock.patch('requests.sessions.Session.patch')
+    def test_annotate_conflict_cached(self, m_patch, m_count, m_get_for_link):
+        m_count.return_value = list(range(1, 5))
+        path = '/api/v1/namespaces/default/pods/pod1'
+        annotations = {'a1': 'v1'}
+        cached_obj = {'metadata': {
+            'annotations': {'a1': 'v2'},
+            'resourceVersion': '456'}}
+        good_obj = {'metadata': {
+            'annotations': annotations,
+            'resourceVersion': '456'}}
+        m_get_for_link.return_value = cached_obj
+
+        m_resp_conflict = mock.MagicMock()
+        m_resp_conflict.ok = False
+        m_resp_conflict.status_code = requests.codes.conflict
+        m_resp_good = mock.MagicMock()
+        m_resp_good.ok = True
+        m_resp_good.json.return_value = good_obj
+        m_patch.side_effect = [m_resp_conflict, m_resp_good]
+
+        with mock.patch.object(self.client, 'get') as m_get:
+            self.assertEqual(annotations, self.client.annotate(
+                path, annotations, resource_version='123'))
+            m_get.assert_not_called()
+        m_get_for_link.assert_called_once_with(path)
+        m_patch.assert_called_with(
+            self.base_url + path,
+            data=jsonutils.dumps(good_obj, sort_keys=True),
+            headers=mock.ANY, cert=(None, None), verify=False)
+
+    @mock.patch('kuryr_kubernetes.k8s_cache.get_for_link')
+    @mock.patch('itertools.count')
+    @mock.patch('requests.sessions.Session.patch')
+    def test_annotate_conflict_stale_cache(self, m_patch, m_count,
+                                           m_get_for_link):
+        m_count.return_value = list(range(1, 5))
+        path = '/api/v1/namespaces/default/pods/pod1'
+        annotations = {'a1': 'v1'}
+        m_get_for_link.return_value = {'metadata': {
+            'annotations': {}, 'resourceVersion': '123'}}
+
+        m_resp_conflict = mock.MagicMock()
+        m_resp_conflict.ok = False
+        m_resp_conflict.status_code = requests.codes.conflict
+        m_patch.return_value = m_resp_conflict
+
+        with mock.patch.object(self.client, 'get') as m_get:
+            m_get.return_value = {'metadata': {
+                'annotations': annotations, 'resourceVersion': '456'}}
+            self.assertEqual(annotations, self.client.annotate(
+                path, annotations, resource_version='123'))
+            m_get.assert_called_once_with(path)
+        m_patch.assert_called_once()
+
+    @mock.patch('requests.sessions.Session.patch')
+    def test_annotate_batched(self, m_patch):
+        path = '/test'
+        patching = threading.Event()
+        release = threading.Event()
+        patched = []
+
+        def patch(url, data, **kwargs):
+            metadata = jsonutils.loads(data)['metadata']
+            patched.append(metadata)
+            patching.set()
+            release.wait()
+            m_resp = mock.MagicMock()
+            m_resp.ok = True
+            m_resp.json.return_value = {'metadata': metadata}
+            return m_resp
+        m_patch.side_effect = patch
+
+        results = {}
+
+        def annotate(annotations, resource_version):
+            results[tuple(annotations)] = self.client.annotate(
+                path, annotations, resource_version=resource_version)
+
+        threads = [threading.Thread(target=annotate, args=({'a1': 'v1'},
+                                                           '1'))]
+        threads[0].start()
+        patching.wait()
+        # Both are pushed while the first PATCH is in progress
+        threads.append(threading.Thread(target=annotate,
+                                        args=({'a2': 'v2'}, '3')))
+        threads.append(threading.Thread(target=annotate,
+                                        args=({'a3': 'v3'}, '2')))
+        for thread in threads[1:]:
+            thread.start()
+        for _ in range(500):
+            batches = self.client._annotation_batches[path]
+            if len(batches) == 2 and len(batches[1].annotations) == 2:
+                break
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(
+            [{'annotations': {'a1': 'v1'}, 'resourceVersion': '1'},
+             {'annotations': {'a2': 'v2', 'a3': 'v3'},
+              'resourceVersion': '3'}],
+            patched)
+        self.assertEqual({'a1': 'v1'}, results[('a1',)])
+        self.assertEqual({'a2': 'v2', 'a3': 'v3'}, results[('a2',)])
+        self.assertEqual({'a2': 'v2', 'a3': 'v3'}, results[('a3',)])
+        self.assertEqual({}, self.client._annotation_batches)
+
+    @mock.patch('requests.sessions.Session.patch')
+    def test_annotate_batched_exception(self, m_patch):
+        path = '/test'
+        previous = k8s_client._AnnotationBatch()
+        previous.sent = True
+        previous.finish()
+        self.client._annotation_batches[path] = [previous]
+        m_resp = mock.MagicMock()
+        m_resp.ok = False
+        m_resp.status_code = requests.codes.not_found
+        m_patch.return_value = m_resp
+
+        self.assertRaises(exc.K8sResourceNotFound, self.client.annotate,
+                          path, {'a1': 'v1'}, resource_version='1')
+        self.assertEqual([previous], self.client._annotation_batches[path])
+
+    @mock.patch('requests.sessions.Session.patch')
+    def test_annotate_batched_leader_killed(self, m_patch):
+        path = '/test'
+        patching = threading.Event()
+        release = threading.Event()
+
+        class Killed(BaseException):
+            pass
+
+        def patch(url, data, **kwargs):
+            patching.set()
+            release.wait()
+            raise Killed()
+        m_patch.side_effect = patch
+
+        errors = {}
+
+        def annotate(name):
+            try:
+                self.client.annotate(path, {name: 'v'})
+            except BaseException as ex:
+                errors[name] = ex
+
+        leader = threading.Thread(target=annotate, args=('a1',))
+        leader.start()
+        patching.wait()
+        self.client._annotation_batches[path][0].sent = False
+        follower = threading.Thread(target=annotate, args=('a2',))
+        follower.start()
+        for _ in range(500):
+            if 'a2' in self.client._annotation_batches[path][0].annotations:
+                break
+            time.sleep(0.01)
+        release.set()
+        leader.join()
+        follower.join()
+
+        self.assertIsInstance(errors['a1'], Killed)
+        self.assertIsInstance(errors['a2'], exc.K8sClientException)
+        self.assertEqual({}, self.client._annotation_batches)
+
     @mock.patch('requests.sessions.Session.get')
     def test_watch(self, m_get):
         path = '/test'
@@ -340,8 +589,10 @@ class TestK8sClient(test_base.TestCase):
         self.assertEqual(cycles, m_get.call_count)
         self.assertEqual(cycles, m_resp.close.call_count)
         m_get.assert_called_with(self.base_url + path, headers={}, stream=True,
-                                 params={'watch': 'true'}, cert=(None, None),
-                                 verify=False, timeout=(30, 60))
+                                 params={'watch': 'true',
+                                         'allowWatchBookmarks': 'true'},
+                                 cert=(None, None), verify=False,
+                                 timeout=(30, 60))
 
     @mock.patch('requests.sessions.Session.get')
     def test_watch_restart(self, m_get):
@@ -363,12 +614,100 @@ class TestK8sClient(test_base.TestCase):
         self.assertEqual(3, m_resp.close.call_count)
         m_get.assert_any_call(
             self.base_url + path, headers={}, stream=True,
-            params={"watch": "true"}, cert=(None, None), verify=False,
-            timeout=(30, 60))
+            params={"watch": "true", "allowWatchBookmarks": "true"},
+            cert=(None, None), verify=False, timeout=(30, 60))
         m_get.assert_any_call(
             self.base_url + path, headers={}, stream=True,
-            params={"watch": "true", "resourceVersion": 2}, cert=(None, None),
-            verify=False, timeout=(30, 60))
+            params={"watch": "true", "allowWatchBookmarks": "true",
+                    "resourceVersion": 2},
+            cert=(None, None), verify=False, timeout=(30, 60))
+
+    def test_get_json_loads(self):
+        with mock.patch.object(k8s_client, 'orjson') as m_orjson:
+            self.assertEqual(m_orjson.loads,
+                             k8s_client._get_json_loads('auto'))
+        with mock.patch.object(k8s_client, 'orjson', None), \
+                mock.patch.object(k8s_client, 'ujson') as m_ujson:
+            self.assertEqual(m_ujson.loads,
+                             k8s_client._get_json_loads('auto'))
+            self.assertEqual(jsonutils.loads,
+                             k8s_client._get_json_loads('json'))
+        with mock.patch.object(k8s_client, 'orjson', None), \
+                mock.patch.object(k8s_client, 'ujson', None):
+            self.assertEqual(jsonutils.loads,
+                             k8s_client._get_json_loads('auto'))
+            self.assertEqual(jsonutils.loads,
+                             k8s_client._get_json_loads('orjson'))
+
+    @mock.patch('requests.sessions.Session.get')
+    def test_watch_bookmark(self, m_get):
+        path = '/test'
+        event = {'type': 'ADDED',
+                 'object': {'metadata': {'name': 'obj',
+                                         'resourceVersion': '1'}}}
+        bookmark = {'type': 'BOOKMARK',
+                    'object': {'metadata': {'resourceVersion': '5'}}}
+        lines = [jsonutils.dump_as_bytes(i) for i in (event, bookmark)]
+
+        m_resp = mock.MagicMock()
+        m_resp.ok = True
+        m_resp.iter_lines.side_effect = [lines, [lines[0]]]
+        m_get.return_value = m_resp
+
+        self.assertEqual([event, event],
+                         list(itertools.islice(self.client.watch(path), 2)))
+        m_get.assert_called_with(
+            self.base_url + path, headers={}, stream=True,
+            params={"watch": "true", "allowWatchBookmarks": "true",
+                    "resourceVersion": "5"},
+            cert=(None, None), verify=False, timeout=(30, 60))
+
+    @mock.patch('requests.sessions.Session.get')
+    def test_watch_expired(self, m_get):
+        path = '/test'
+        error = {'type': 'ERROR',
+                 'object': {'kind': 'Status', 'code': 410,
+                            'message': 'too old resource version'}}
+
+        m_resp = mock.MagicMock()
+        m_resp.ok = True
+        m_resp.iter_lines.return_value = [jsonutils.dump_as_bytes(error)]
+        m_get.return_value = m_resp
+
+        self.assertRaises(exc.K8sResourceExpired, next,
+                          self.client.watch(path, resource_version='1'))
+
+    @mock.patch('requests.sessions.Session.get')
+    def test_watch_expired_response(self, m_get):
+        path = '/test'
+
+        m_resp = mock.MagicMock()
+        m_resp.ok = False
+        m_resp.status_code = 410
+        m_get.return_value = m_resp
+
+        self.assertRaises(exc.K8sResourceExpired, next,
+                          self.client.watch(path, resource_version='1'))
+
+    @mock.patch('time.time')
+    @mock.patch('requests.sessions.Session.get')
+    def test_watch_timeout(self, m_get, m_time):
+        path = '/test'
+        data = [{'obj': 'obj%s' % i} for i in range(3)]
+        lines = [jsonutils.dump_as_bytes(i) for i in data]
+        m_time.side_effect = [100, 100, 130]
+
+        m_resp = mock.MagicMock()
+        m_resp.ok = True
+        m_resp.iter_lines.return_value = lines
+        m_get.return_value = m_resp
+
+        self.assertEqual(data, list(self.client.watch(path, timeout=30)))
+        m_get.assert_called_once_with(
+            self.base_url + path, headers={}, stream=True,
+            params={"watch": "true", "allowWatchBookmarks": "true",
+                    "timeoutSeconds": 30},
+            cert=(None, None), verify=False, timeout=(30, 60))
 
     @mock.patch('requests.sessions.Session.get')
     def test_watch_exception(self, m_get):
@@ -381,6 +720,57 @@ class TestK8sClient(test_base.TestCase):
         self.assertRaises(exc.K8sClientException, next,
                           self.client.watch(path))
 
+    @mock.patch('requests.sessions.Session.get')
+    def test_watch_benchmark(self, m_get):
+        """Measures the events/s decoded by watch() with each JSON backend"""
+        path = '/api/v1/pods'
+        count = 2000
+        pod = {
+            'kind': 'Pod', 'apiVersion': 'v1',
+            'metadata': {
+                'name': 'pod', 'namespace': 'default', 'uid': 'uid',
+                'labels': {'app': 'demo', 'tier': 'backend'},
+                'annotations': {'openstack.org/kuryr-vif': 'x' * 1024},
+                'managedFields': [{'manager': 'kubelet',
+                                   'fieldsV1': {'f:status': {'.': {}}}}]},
+            'spec': {'nodeName': 'node', 'containers': [
+                {'name': 'c%d' % i, 'image': 'image',
+                 'ports': [{'containerPort': 8080}]} for i in range(3)]},
+            'status': {'phase': 'Running', 'podIP': '10.0.0.10',
+                       'conditions': [{'type': 'Ready'}] * 4}}
+        lines = []
+        for i in range(count):
+            event = {'type': 'MODIFIED', 'object': copy.deepcopy(pod)}
+            event['object']['metadata']['resourceVersion'] = str(i)
+            lines.append(jsonutils.dump_as_bytes(event))
+
+        m_resp = mock.MagicMock()
+        m_resp.ok = True
+        m_resp.iter_lines.return_value = lines
+        m_get.return_value = m_resp
+
+        backends = ['json']
+        backends.extend(b for b in ('orjson', 'ujson')
+                        if getattr(k8s_client, b))
+        rates = []
+        for backend in backends:
+            self.client._json_loads = k8s_client._get_json_loads(backend)
+            best = 0
+            for _ in range(3):
+                gc.collect()
+                start = time.time()
+                for event in itertools.islice(self.client.watch(path),
+                                              count):
+                    pass
+                elapsed = max(time.time() - start, 1e-6)
+                best = max(best, count / elapsed)
+                self.assertEqual(str(count - 1),
+                                 event['object']['metadata'][
+                                     'resourceVersion'])
+            rates.append('%s: %d events/s' % (backend, best))
+        self.addDetail('watch_events_per_second',
+                       content.text_content(', '.join(rates)))
+
     @mock.patch('requests.sessions.Session.post')
     def test_post(self, m_post):
         path = '/test'
@@ -454,3 +844,132 @@ class TestK8sClient(test_base.TestCase):
         m_resp.status_code = 500
         self.assertRaises(exc.K8sClientException,
                           self.client._raise_from_response, m_resp)
+
+
+class _HTTPXError(Exception):
+    pass
+
+
+class _HTTPXTransportError(_HTTPXError):
+    pass
+
+
+class _HTTPXTimeout(_HTTPXTransportError):
+    pass
+
+
+class _HTTPXConnectTimeout(_HTTPXTimeout):
+    pass
+
+
+class _HTTPXRemoteProtocolError(_HTTPXTransportError):
+    pass
+
+
+@mock.patch.object(k8s_client, 'httpx')
+class TestHTTP2Session(test_base.TestCase):
+
+    def _get_session(self, m_httpx):
+        m_httpx.TransportError = _HTTPXTransportError
+        m_httpx.TimeoutException = _HTTPXTimeout
+        m_httpx.ConnectTimeout = _HTTPXConnectTimeout
+        m_httpx.RemoteProtocolError = _HTTPXRemoteProtocolError
+        session = k8s_client.HTTP2Session(('crt', 'key'), 'ca')
+        m_httpx.Client.assert_called_once_with(
+            http2=True, cert=('crt', 'key'), verify='ca', timeout=None)
+        return session, m_httpx.Client.return_value
+
+    def test_request(self, m_httpx):
+        session, m_client = self._get_session(m_httpx)
+        m_client.send.return_value.status_code = 200
+
+        response = session.patch('http://k8s/test', data='{}',
+                                 headers={'a': 'b'}, cert=('crt', 'key'),
+                                 verify='ca')
+
+        m_client.build_request.assert_called_once_with(
+            'PATCH', 'http://k8s/test', params=None, content='{}', json=None,
+            headers={'a': 'b'}, timeout=None)
+        m_client.send.assert_called_once_with(
+            m_client.build_request.return_value, stream=False)
+        self.assertTrue(response.ok)
+
+    def test_request_stream(self, m_httpx):
+        session, m_client = self._get_session(m_httpx)
+        m_client.send.return_value.status_code = 410
+        m_client.send.return_value.iter_bytes.return_value = [
+            b'{"a": 1}\n{"b"', b': 2}\n', b'{"c": 3}']
+
+        response = session.get('http://k8s/test', params={'watch': 'true'},
+                               stream=True, timeout=(30, 60))
+
+        m_httpx.Timeout.assert_called_once_with(None, connect=30, read=60)
+        m_client.send.assert_called_once_with(
+            m_client.build_request.return_value, stream=True)
+        self.assertFalse(response.ok)
+        self.assertEqual(410, response.status_code)
+        self.assertEqual([b'{"a": 1}', b'{"b": 2}', b'{"c": 3}'],
+                         list(response.iter_lines()))
+        response.close()
+        m_client.send.return_value.close.assert_called_once_with()
+
+    def test_request_errors(self, m_httpx):
+        session, m_client = self._get_session(m_httpx)
+
+        for error, expected in (
+                (_HTTPXConnectTimeout, requests.ConnectTimeout),
+                (_HTTPXTimeout, requests.ReadTimeout),
+                (_HTTPXRemoteProtocolError,
+                 requests.exceptions.ChunkedEncodingError),
+                (_HTTPXTransportError, requests.ConnectionError)):
+            m_client.send.side_effect = error('error')
+            self.assertRaises(expected, session.get, 'http://k8s/test')
+
+    def test_iter_lines_error(self, m_httpx):
+        session, m_client = self._get_session(m_httpx)
+        m_client.send.return_value.iter_bytes.side_effect = _HTTPXTimeout
+
+        response = session.get('http://k8s/test', stream=True)
+
+        self.assertRaises(requests.ReadTimeout, list, response.iter_lines())
+
+
+class TestHTTP2Response(test_base.TestCase):
+
+    def _get_session(self, handler):
+        client = httpx.Client(transport=httpx.MockTransport(handler))
+        with mock.patch.object(httpx, 'Client', return_value=client):
+            return k8s_client.HTTP2Session((None, None), False)
+
+    def _get_stream(self, status_code, body):
+        # The body is streamed, so it is only read on demand
+        return self._get_session(lambda request: httpx.Response(
+            status_code, stream=httpx.ByteStream(body)))
+
+    def test_streamed_body(self):
+        session = self._get_stream(200, b'{"a": 1}')
+
+        response = session.get('http://k8s/test', stream=True)
+        self.assertEqual('{"a": 1}', response.text)
+        self.assertEqual({'a': 1}, response.json())
+        self.assertEqual(b'{"a": 1}', response.content)
+
+        response = session.get('http://k8s/test', stream=True)
+        self.assertEqual({'a': 1}, response.json())
+
+    @mock.patch('kuryr_kubernetes.config.CONF')
+    def test_watch_expired(self, m_cfg):
+        m_cfg.kubernetes.ssl_client_crt_file = None
+        m_cfg.kubernetes.ssl_client_key_file = None
+        m_cfg.kubernetes.token_file = None
+        m_cfg.kubernetes.ssl_verify_server_crt = False
+        m_cfg.kubernetes.json_backend = 'auto'
+        m_cfg.kubernetes.use_http2 = True
+        session = self._get_stream(
+            410, b'{"kind": "Status", "message": "too old"}')
+        with mock.patch.object(k8s_client, 'HTTP2Session',
+                               return_value=session):
+            client = k8s_client.K8sClient('http://127.0.0.1:12345')
+
+        self.assertRaises(exc.K8sResourceExpired, next,
+                          client.watch('/test'))
@@ -0,0 +1,88 @@
+# Copyright 2020 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from unittest import mock
+
+from kuryr_kubernetes import metrics
+from kuryr_kubernetes.tests import base as test_base
+
+
+class TestMetrics(test_base.TestCase):
+
+    def _get_sample(self, name, labels):
+        return metrics.REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_get_k8s_resource(self):
+        for url, resource in (
+                ('/api/v1/pods', 'pods'),
+                ('/api/v1/namespaces/ns1/pods/pod1', 'pods'),
+                ('/api/v1/namespaces/ns1/pods/pod1/status', 'pods'),
+                ('/api/v1/namespaces/ns1', 'namespaces'),
+                ('/apis/openstack.org/v1/namespaces/ns1/kuryrports/pod1',
+                 'kuryrports'),
+                ('https://127.0.0.1:6443/api/v1/services?watch=true',
+                 'services'),
+                ('/healthz', 'healthz')):
+            self.assertEqual(resource, metrics.get_k8s_resource(url))
+
+    def test_get_openstack_operation(self):
+        trunk_id = 'b1a9b7a4-1c5e-4a8a-9d3b-6f3f3c0d2b11'
+        for url, operation in (
+                ('/ports', 'ports'),
+                ('/v2.0/ports?device_owner=compute:kuryr', 'ports'),
+                ('/trunks/%s/add_subports' % trunk_id, 'trunks/add_subports'),
+                ('/v2/lbaas/pools/%s/members/%s' % (trunk_id, trunk_id),
+                 'lbaas/pools/members')):
+            self.assertEqual(operation,
+                             metrics.get_openstack_operation(url))
+
+    def test_observe_k8s_request(self):
+        labels = {'method': 'WATCH', 'resource': 'endpoints'}
+        count = self._get_sample('kuryr_k8s_request_duration_seconds_count',
+                                 labels)
+
+        metrics.observe_k8s_request(
+            'GET', '/api/v1/endpoints?watch=true&resourceVersion=1', 0.1)
+
+        self.assertEqual(count + 1, self._get_sample(
+            'kuryr_k8s_request_duration_seconds_count', labels))
+
+    def test_observe_openstack_request(self):
+        labels = {'service': 'network', 'method': 'PUT',
+                  'operation': 'trunks/add_subports'}
+        count = self._get_sample(
+            'kuryr_openstack_request_duration_seconds_count', labels)
+
+        metrics.observe_openstack_request(
+            'network', 'PUT',
+            '/trunks/b1a9b7a4-1c5e-4a8a-9d3b-6f3f3c0d2b11/add_subports', 0.1)
+
+        self.assertEqual(count + 1, self._get_sample(
+            'kuryr_openstack_request_duration_seconds_count', labels))
+
+    def test_vif_pool_collector(self):
+        collector = metrics.VIFPoolCollector()
+        driver = mock.Mock()
+        driver.get_pool_sizes.return_value = {
+            ('10.0.0.1', 'project1', 'net1'): 3}
+        collector.add(driver)
+
+        family, = collector.collect()
+
+        self.assertEqual('kuryr_vif_pool_ports', family.name)
+        sample, = family.samples
+        self.assertEqual({'driver': 'Mock', 'host': '10.0.0.1',
+                          'project': 'project1', 'network': 'net1'},
+                         sample.labels)
+        self.assertEqual(3, sample.value)
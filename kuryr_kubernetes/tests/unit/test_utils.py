@@ -171,6 +171,39 @@ class TestUtils(test_base.TestCase):
         expected_link = "/api/v1/namespaces/default/endpoints/test"
         self.assertEqual(expected_link, ret)
 
+    def test_set_lbaas_spec_endpoint_slices(self):
+        CONF.set_override('enabled_handlers', ['lbaasspec', 'lbslices'],
+                          group='kubernetes')
+        self.addCleanup(CONF.clear_override, 'enabled_handlers',
+                        group='kubernetes')
+        kubernetes = self.useFixture(k_fix.MockK8sClient()).client
+        slice_link = ('/apis/discovery.k8s.io/v1beta1/namespaces/default/'
+                      'endpointslices/test-%s')
+        kubernetes.get.return_value = {'items': [
+            {'metadata': {'name': 'test-%s' % i,
+                          'selfLink': slice_link % i}}
+            for i in range(2)]}
+        kubernetes.annotate.side_effect = [
+            None, None, k_exc.K8sResourceNotFound('test-0'), None]
+        service = {'metadata': {
+            'name': 'test', 'namespace': 'default', 'resourceVersion': '1',
+            'selfLink': "/api/v1/namespaces/default/services/test"}}
+        lbaas_spec = obj_lbaas.LBaaSServiceSpec(ip='10.0.0.10')
+
+        utils.set_lbaas_spec(service, lbaas_spec)
+
+        kubernetes.get.assert_called_once_with(
+            '/apis/discovery.k8s.io/v1beta1/namespaces/default/'
+            'endpointslices?labelSelector=kubernetes.io/service-name=test')
+        annotation = {k_const.K8S_ANNOTATION_LBAAS_SPEC: mock.ANY}
+        kubernetes.annotate.assert_has_calls([
+            mock.call("/api/v1/namespaces/default/endpoints/test",
+                      annotation),
+            mock.call("/api/v1/namespaces/default/services/test",
+                      annotation, resource_version='1'),
+            mock.call(slice_link % 0, annotation),
+            mock.call(slice_link % 1, annotation)])
+
     def test_get_service_ports(self):
         service = {'spec': {'ports': [
             {'port': 1, 'targetPort': 1},
@@ -14,8 +14,11 @@
 #    under the License.
 
 from eventlet import greenlet
+from oslo_config import cfg
 from unittest import mock
 
+from kuryr_kubernetes import exceptions as k_exc
+from kuryr_kubernetes import k8s_cache
 from kuryr_kubernetes.tests import base as test_base
 from kuryr_kubernetes.tests.unit import kuryr_fixtures as kuryr_fixtures
 from kuryr_kubernetes import watcher
@@ -27,6 +30,12 @@ class TestWatcher(test_base.TestCase):
         super(TestWatcher, self).setUp()
         mock_client = self.useFixture(kuryr_fixtures.MockK8sClient())
         self.client = mock_client.client
+        self.client.get.return_value = {'kind': 'PodList',
+                                        'metadata': {'resourceVersion': '1'},
+                                        'items': []}
+        cfg.CONF.set_override('watch_resync_period', 0, group='kubernetes')
+        self.addCleanup(cfg.CONF.clear_override, 'watch_resync_period',
+                        group='kubernetes')
 
     @mock.patch.object(watcher.Watcher, '_start_watch')
     def test_add(self, m_start_watch):
@@ -40,6 +49,34 @@ class TestWatcher(test_base.TestCase):
         self.assertEqual(set(paths), watcher_obj._resources)
         m_start_watch.assert_not_called()
 
+    def test_add_fields(self):
+        watcher_obj = watcher.Watcher(mock.Mock())
+
+        watcher_obj.add('/test1', ('metadata',))
+        watcher_obj.add('/test1', ('spec.nodeName',))
+        watcher_obj.add('/test2', ('metadata',))
+        watcher_obj.add('/test2')
+        watcher_obj.add('/test2', ('spec',))
+
+        self.assertEqual({'metadata', 'spec.nodeName'},
+                         watcher_obj._fields['/test1'])
+        self.assertIsNone(watcher_obj._fields['/test2'])
+
+    def test_project(self):
+        obj = {'kind': 'Pod', 'apiVersion': 'v1',
+               'metadata': {'name': 'pod', 'managedFields': [{}]},
+               'spec': {'nodeName': 'node', 'volumes': [{}]},
+               'status': {'phase': 'Running'}}
+
+        projected = watcher._project(obj, ('metadata', 'spec.nodeName',
+                                           'spec.hostNetwork', 'other.field'))
+
+        self.assertEqual({'kind': 'Pod', 'apiVersion': 'v1',
+                          'metadata': {'name': 'pod'},
+                          'spec': {'nodeName': 'node'}}, projected)
+        self.assertEqual(obj, watcher._project(obj, None))
+        self.assertNotIn('managedFields', obj['metadata'])
+
     @mock.patch.object(watcher.Watcher, '_start_watch')
     def test_add_running(self, m_start_watch):
         paths = ['/test%s' % i for i in range(3)]
@@ -202,7 +239,7 @@ class TestWatcher(test_base.TestCase):
         m_th.kill.assert_not_called()
 
     def _test_watch_mock_events(self, watcher_obj, events):
-        def client_watch(client_path):
+        def client_watch(client_path, resource_version=None, timeout=None):
             for e in events:
                 self.assertTrue(watcher_obj._idle[client_path])
                 yield e
@@ -342,3 +379,160 @@ class TestWatcher(test_base.TestCase):
         tg.add_thread = mock.Mock()  # Reset mock.
         w.start()
         tg.add_thread.assert_called_once_with(mock.ANY, '/test')
+
+    def test_replay(self):
+        path = '/test'
+        self.addCleanup(k8s_cache.reset)
+        cache = k8s_cache.register('Pod', path)
+        pod1 = {'metadata': {'name': 'pod1', 'namespace': 'default'}}
+        pod2 = {'metadata': {'name': 'pod2', 'namespace': 'default'}}
+        cache.replace([pod1, pod2])
+        m_handler = mock.Mock()
+        watcher_obj = watcher.Watcher(m_handler)
+        watcher_obj._watching[path] = mock.sentinel.thread
+        watcher_obj._watching['/unsynced'] = mock.sentinel.thread
+
+        watcher_obj.replay(lambda obj: obj['metadata']['name'] == 'pod2')
+
+        m_handler.assert_called_once_with({'type': 'ADDED', 'object': pod2})
+
+    @mock.patch('sys.exit')
+    def test_watch_cached(self, m_sys_exit):
+        path = '/test'
+        self.addCleanup(k8s_cache.reset)
+        cache = k8s_cache.register('Pod', path)
+        listed = {'metadata': {'name': 'pod1', 'namespace': 'default'}}
+        watched = {'kind': 'Pod',
+                   'metadata': {'name': 'pod2', 'namespace': 'default',
+                                'resourceVersion': '2'}}
+        events = [{'type': 'ADDED', 'object': watched}]
+        self.client.get.return_value = {'apiVersion': 'v1',
+                                        'metadata': {'resourceVersion': '1'},
+                                        'items': [listed]}
+
+        def handler(event):
+            name = event['object']['metadata']['name']
+            self.assertIs(event['object'], cache.get(name, 'default'))
+
+        m_handler = mock.Mock()
+        m_handler.side_effect = handler
+        watcher_obj = self._test_watch_create_watcher(path, m_handler)
+        self._test_watch_mock_events(watcher_obj, events)
+
+        watcher_obj._watch(path)
+
+        self.client.get.assert_called_once_with(path)
+        self.client.watch.assert_called_once_with(path, resource_version='1',
+                                                  timeout=0)
+        m_handler.assert_has_calls([
+            mock.call({'type': 'ADDED', 'object': listed}),
+            mock.call(events[0])])
+        self.assertEqual('Pod', listed['kind'])
+        self.assertEqual('v1', listed['apiVersion'])
+        # The watch loop exited, so the cache is no longer trusted.
+        self.assertFalse(cache.has_synced())
+        m_sys_exit.assert_called_once_with(1)
+
+    @staticmethod
+    def _get_pod(name, resource_version, uid=None):
+        return {'metadata': {'name': name, 'namespace': 'default',
+                             'uid': uid or name,
+                             'resourceVersion': resource_version}}
+
+    @mock.patch('sys.exit')
+    def test_watch_expired(self, m_sys_exit):
+        path = '/test'
+        unchanged = self._get_pod('unchanged', '1')
+        modified = self._get_pod('modified', '1')
+        deleted = self._get_pod('deleted', '1')
+        recreated = self._get_pod('recreated', '1')
+        new_modified = self._get_pod('modified', '3')
+        new_recreated = self._get_pod('recreated', '4', uid='recreated-2')
+        added = self._get_pod('added', '5')
+        self.client.get.side_effect = [
+            {'kind': 'PodList', 'metadata': {'resourceVersion': '1'},
+             'items': [unchanged, modified, deleted, recreated]},
+            {'kind': 'PodList', 'metadata': {'resourceVersion': '5'},
+             'items': [unchanged, new_modified, new_recreated, added]}]
+        self.client.watch.side_effect = [
+            k_exc.K8sResourceExpired('/test'), iter([])]
+
+        m_handler = mock.Mock()
+        watcher_obj = self._test_watch_create_watcher(path, m_handler)
+
+        watcher_obj._watch(path)
+
+        self.client.watch.assert_has_calls([
+            mock.call(path, resource_version='1', timeout=0),
+            mock.call(path, resource_version='5', timeout=0)])
+        m_handler.assert_has_calls([
+            mock.call({'type': 'ADDED', 'object': unchanged}),
+            mock.call({'type': 'ADDED', 'object': modified}),
+            mock.call({'type': 'ADDED', 'object': deleted}),
+            mock.call({'type': 'ADDED', 'object': recreated}),
+            mock.call({'type': 'MODIFIED', 'object': new_modified}),
+            mock.call({'type': 'DELETED', 'object': recreated}),
+            mock.call({'type': 'ADDED', 'object': new_recreated}),
+            mock.call({'type': 'ADDED', 'object': added}),
+            mock.call({'type': 'DELETED', 'object': deleted})])
+        self.assertEqual(9, m_handler.call_count)
+        self.assertEqual('Pod', added['kind'])
+        m_sys_exit.assert_called_once_with(1)
+
+    @mock.patch('sys.exit')
+    def test_watch_fields(self, m_sys_exit):
+        path = '/test'
+        listed = self._get_pod('listed', '1')
+        listed['spec'] = {'nodeName': 'node', 'volumes': []}
+        watched = self._get_pod('watched', '2')
+        watched['spec'] = {'nodeName': 'node', 'volumes': []}
+        self.client.get.return_value = {
+            'kind': 'PodList', 'metadata': {'resourceVersion': '1'},
+            'items': [listed]}
+        self.client.watch.side_effect = [
+            iter([{'type': 'ADDED', 'object': watched}])]
+
+        m_handler = mock.Mock()
+        watcher_obj = self._test_watch_create_watcher(path, m_handler)
+        watcher_obj._fields[path] = frozenset(['metadata', 'spec.nodeName'])
+
+        watcher_obj._watch(path)
+
+        for call, obj in zip(m_handler.call_args_list, (listed, watched)):
+            self.assertEqual({'kind': 'Pod', 'metadata': obj['metadata'],
+                              'spec': {'nodeName': 'node'}},
+                             call[0][0]['object'])
+        m_sys_exit.assert_called_once_with(1)
+
+    @mock.patch('sys.exit')
+    def test_watch_resync(self, m_sys_exit):
+        cfg.CONF.set_override('watch_resync_period', 600, group='kubernetes')
+        path = '/test'
+        pod = self._get_pod('pod', '1')
+        watched = self._get_pod('pod', '2')
+        self.client.get.side_effect = [
+            {'kind': 'PodList', 'metadata': {'resourceVersion': '1'},
+             'items': [pod]},
+            {'kind': 'PodList', 'metadata': {'resourceVersion': '2'},
+             'items': [watched]}]
+        self.client.watch.side_effect = [
+            iter([{'type': 'MODIFIED', 'object': watched}]),
+            iter([{'type': 'DELETED', 'object': watched}])]
+
+        def handler(event):
+            if event['type'] == 'DELETED':
+                watcher_obj._running = False
+
+        m_handler = mock.Mock(side_effect=handler)
+        watcher_obj = self._test_watch_create_watcher(path, m_handler)
+
+        watcher_obj._watch(path)
+
+        # The resync after the first watch ended found nothing new
+        m_handler.assert_has_calls([
+            mock.call({'type': 'ADDED', 'object': pod}),
+            mock.call({'type': 'MODIFIED', 'object': watched}),
+            mock.call({'type': 'DELETED', 'object': watched})])
+        self.assertEqual(3, m_handler.call_count)
+        self.client.watch.assert_called_with(path, resource_version='2',
+                                             timeout=600)
@@ -296,6 +296,27 @@ def set_lbaas_spec(service, lbaas_spec):
     except exceptions.K8sClientException:
         LOG.exception("Failed to annotate svc: %r", svc_link)
         raise
+    if 'lbslices' in CONF.kubernetes.enabled_handlers:
+        # NOTE: As with the endpoints, annotating the slices gets them an
+        # event, so that they are handled once the service is annotated
+        for endpoint_slice in get_endpoint_slices(
+                service['metadata']['namespace'],
+                service['metadata']['name']):
+            try:
+                k8s.annotate(endpoint_slice['metadata']['selfLink'],
+                             {constants.K8S_ANNOTATION_LBAAS_SPEC: annotation})
+            except exceptions.K8sResourceNotFound:
+                LOG.debug("Endpoint slice %s of svc %r deleted before its "
+                          "annotation", endpoint_slice['metadata']['name'],
+                          svc_link)
+
+
+def get_endpoint_slices(namespace, service_name):
+    k8s = clients.get_kubernetes_client()
+    slices = k8s.get("%s/namespaces/%s/endpointslices?labelSelector=%s=%s"
+                     % (constants.K8S_API_DISCOVERY, namespace,
+                        constants.K8S_LABEL_SERVICE_NAME, service_name))
+    return slices.get('items', [])
 
 
 def get_lbaas_state(endpoint):
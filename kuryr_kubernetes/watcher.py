@@ -17,7 +17,9 @@ import sys
 import time
 
 from kuryr_kubernetes import clients
+from kuryr_kubernetes import exceptions
 from kuryr_kubernetes.handlers import health
+from kuryr_kubernetes import k8s_cache
 from kuryr_kubernetes import utils
 from oslo_config import cfg
 from oslo_log import log as logging
@@ -26,6 +28,38 @@ LOG = logging.getLogger(__name__)
 CONF = cfg.CONF
 
 
+def _project(obj, fields):
+    """Returns the object with only the given fields.
+
+    The `managedFields` metadata, which Kuryr never uses and that makes up a
+    large part of the objects, is always dropped.
+
+    :param obj: K8s object
+    :param fields: fields to keep, as dotted paths. If None, the whole object
+                   is kept.
+    """
+    metadata = obj.get('metadata')
+    if metadata:
+        metadata.pop('managedFields', None)
+    if not fields:
+        return obj
+
+    projected = {key: obj[key] for key in ('kind', 'apiVersion') if key in obj}
+    for field in fields:
+        src = obj
+        dst = projected
+        keys = field.split('.')
+        for key in keys[:-1]:
+            src = src.get(key)
+            if not isinstance(src, dict):
+                break
+            dst = dst.setdefault(key, {})
+        else:
+            if keys[-1] in src:
+                dst[keys[-1]] = src[keys[-1]]
+    return projected
+
+
 class Watcher(health.HealthHandler):
     """Observes K8s resources' events using K8s '?watch=true' API.
 
@@ -54,6 +88,16 @@ class Watcher(health.HealthHandler):
     stopping any 'stuck' `handler` is not supported by the `Watcher` and
     should be handled externally (e.g. by using `thread_group.stop(
     graceful=False)` for asynchronous `Watcher`).
+
+    The `Watcher` lists each K8s resource first, loads the result into a
+    `k8s_cache.ResourceCache` (the one registered for the resource, if any)
+    and passes each listed object to the `handler` as an 'ADDED' event before
+    watching from the listed resourceVersion. The cache is then updated with
+    every observed event before the `handler` is invoked. Whenever the
+    resource is listed again, either because the resourceVersion the watch
+    would resume from has expired or every
+    `[kubernetes]watch_resync_period` seconds, the `handler` is only passed
+    the synthetic events turning the cached objects into the listed ones.
     """
 
     def __init__(self, handler, thread_group=None, timeout=None):
@@ -79,12 +123,15 @@ class Watcher(health.HealthHandler):
         self._resources = set()
         self._watching = {}
         self._idle = {}
+        # Caches of the resources without a registered cache
+        self._caches = {}
+        self._fields = {}
 
         if timeout is None:
             timeout = CONF.kubernetes.watch_retry_timeout
         self._timeout = timeout
 
-    def add(self, path):
+    def add(self, path, fields=None):
         """Adds ths K8s resource to the Watcher.
 
         Adding a resource to a running `Watcher` also ensures that the event
@@ -92,7 +139,16 @@ class Watcher(health.HealthHandler):
         for `Watcher`s operating in synchronous mode.
 
         :param path: K8s resource URL path
+        :param fields: fields of the objects needed by the handler, as dotted
+                       paths. If None, objects are passed whole. When a path
+                       is added several times, the union of the fields is
+                       kept.
         """
+        if path not in self._resources:
+            self._fields[path] = frozenset(fields) if fields else None
+        elif self._fields.get(path) is not None:
+            self._fields[path] = (self._fields[path].union(fields)
+                                  if fields else None)
         self._resources.add(path)
         if self._running and path not in self._watching:
             self._start_watch(path)
@@ -106,6 +162,8 @@ class Watcher(health.HealthHandler):
         :param path: K8s resource URL path
         """
         self._resources.discard(path)
+        self._fields.pop(path, None)
+        self._caches.pop(path, None)
         if path in self._watching:
             self._stop_watch(path)
 
@@ -131,6 +189,26 @@ class Watcher(health.HealthHandler):
         for path in list(self._watching):
             self._stop_watch(path)
 
+    def replay(self, predicate=None):
+        """Passes the cached objects to the handler again.
+
+        Each object of the watched resources is passed as an 'ADDED' event,
+        e.g. for the objects whose events were not handled so far to get
+        handled.
+
+        :param predicate: callable receiving an object and returning whether
+                          it should be replayed. If None, all the objects
+                          are replayed.
+        """
+        for path in list(self._watching):
+            cache = (k8s_cache.get_cache_for_path(path) or
+                     self._caches.get(path))
+            if cache is None or not cache.has_synced():
+                continue
+            for obj in cache.list():
+                if predicate is None or predicate(obj):
+                    self._handler({'type': 'ADDED', 'object': obj})
+
     def _start_watch(self, path):
         tg = self._thread_group
         self._idle[path] = True
@@ -141,6 +219,7 @@ class Watcher(health.HealthHandler):
             self._watch(path)
 
     def _stop_watch(self, path):
+        self._invalidate_cache(path)
         if self._idle.get(path):
             if self._thread_group and path in self._watching:
                 self._watching[path].stop()
@@ -149,7 +228,63 @@ class Watcher(health.HealthHandler):
                 self._watching.pop(path, None)
                 self._idle.pop(path, None)
 
+    def _invalidate_cache(self, path):
+        cache = k8s_cache.get_cache_for_path(path)
+        if cache:
+            cache.invalidate()
+
+    def _list(self, path):
+        resources = self._client.get(path)
+        resource_version = resources['metadata'].get('resourceVersion')
+        items = resources.get('items', [])
+
+        cache = k8s_cache.get_cache_for_path(path) or self._caches.get(path)
+        if cache is None:
+            kind = resources.get('kind')
+            if kind and kind.endswith('List'):
+                kind = kind[:-len('List')]
+            cache = self._caches[path] = k8s_cache.ResourceCache(kind, path)
+
+        api_version = resources.get('apiVersion')
+        fields = self._fields.get(path)
+        for i, item in enumerate(items):
+            # Items of a K8s list don't have kind and apiVersion set, but
+            # handlers are dispatched based on those.
+            item.setdefault('kind', cache.kind)
+            if api_version:
+                item.setdefault('apiVersion', api_version)
+            items[i] = _project(item, fields)
+        events = cache.resync(items, resource_version)
+        LOG.debug("Listed %(count)d object(s) from %(path)s, %(events)d of "
+                  "them changed", {'count': len(items), 'path': path,
+                                   'events': len(events)})
+        return cache, events
+
+    def _list_and_watch(self, path):
+        resync_period = CONF.kubernetes.watch_resync_period
+        fields = self._fields.get(path)
+        while True:
+            cache, events = self._list(path)
+            yield from events
+            try:
+                for event in self._client.watch(
+                        path, resource_version=cache.resource_version,
+                        timeout=resync_period):
+                    if 'object' in event:
+                        event['object'] = _project(event['object'], fields)
+                    cache.update(event)
+                    yield event
+            except exceptions.K8sResourceExpired:
+                LOG.info("Resource version %(rv)s of '%(path)s' expired, "
+                         "listing it again.",
+                         {'rv': cache.resource_version, 'path': path})
+            else:
+                if not resync_period:
+                    return
+                LOG.debug("Resyncing '%s'", path)
+
     def _graceful_watch_exit(self, path):
+        self._invalidate_cache(path)
         try:
             self._watching.pop(path, None)
             self._idle.pop(path, None)
@@ -178,7 +313,7 @@ class Watcher(health.HealthHandler):
                     return
 
                 LOG.info("Started watching '%s'", path)
-                for event in self._client.watch(path):
+                for event in self._list_and_watch(path):
                     # NOTE(esevan): Watcher retries watching for
                     # `self._timeout` duration with exponential backoff
                     # algorithm to tolerate against temporal exception such as